@@ -30,6 +30,9 @@ from .cascade import (
 from .cascade import merge_state as merge_state
 from .cascade import merge_state_in_place as merge_state_in_place
 from .cascade import merge_states as merge_states
+from .decode import (
+    BatchDecodeWithHeadwisePagedKVCacheWrapper as BatchDecodeWithHeadwisePagedKVCacheWrapper,
+)
 from .decode import (
     BatchDecodeWithPagedKVCacheWrapper as BatchDecodeWithPagedKVCacheWrapper,
 )
@@ -39,14 +42,35 @@ from .decode import (
 from .decode import single_decode_with_kv_cache as single_decode_with_kv_cache
 from .gemm import SegmentGEMMWrapper as SegmentGEMMWrapper
 from .gemm import bmm_fp8 as bmm_fp8
+from .mask import build_tree_attention_mask as build_tree_attention_mask
+from .mask import packed_mask_and as packed_mask_and
+from .mask import packed_mask_apply_window as packed_mask_apply_window
+from .mask import packed_mask_not as packed_mask_not
+from .mask import packed_mask_or as packed_mask_or
+from .mask import segment_packed_mask_apply_window as segment_packed_mask_apply_window
+from .mask import segment_packed_mask_not as segment_packed_mask_not
+from .metadata import BatchMetadata as BatchMetadata
 from .mla import BatchMLAPagedAttentionWrapper as BatchMLAPagedAttentionWrapper
 from .norm import fused_add_rmsnorm as fused_add_rmsnorm
 from .norm import gemma_fused_add_rmsnorm as gemma_fused_add_rmsnorm
 from .norm import gemma_rmsnorm as gemma_rmsnorm
 from .norm import rmsnorm as rmsnorm
+from .page import RunLengthPageIndices as RunLengthPageIndices
+from .page import allocate_paged_kv_cache_pool as allocate_paged_kv_cache_pool
 from .page import append_paged_kv_cache as append_paged_kv_cache
+from .page import append_paged_kv_cache_multi_layer as append_paged_kv_cache_multi_layer
+from .page import append_paged_kv_cache_quantized as append_paged_kv_cache_quantized
+from .page import (
+    append_paged_kv_cache_with_slot_mapping as append_paged_kv_cache_with_slot_mapping,
+)
+from .page import compute_page_key_summary as compute_page_key_summary
+from .page import evict_low_mass_pages as evict_low_mass_pages
 from .page import get_batch_indices_positions as get_batch_indices_positions
 from .page import get_seq_lens as get_seq_lens
+from .page import get_slot_mapping as get_slot_mapping
+from .page import reclaim_sliding_window_pages as reclaim_sliding_window_pages
+from .page import retain_sink_and_window_pages as retain_sink_and_window_pages
+from .page import select_top_k_pages as select_top_k_pages
 from .prefill import (
     BatchPrefillWithPagedKVCacheWrapper as BatchPrefillWithPagedKVCacheWrapper,
 )
@@ -85,4 +109,14 @@ from .sampling import (
 from .sampling import top_k_top_p_sampling_from_probs as top_k_top_p_sampling_from_probs
 from .sampling import top_p_renorm_probs as top_p_renorm_probs
 from .sampling import top_p_sampling_from_probs as top_p_sampling_from_probs
+from .snapshot import PagedKVCacheSnapshot as PagedKVCacheSnapshot
+from .snapshot import load_paged_kv_cache_snapshot as load_paged_kv_cache_snapshot
+from .snapshot import save_paged_kv_cache_snapshot as save_paged_kv_cache_snapshot
 from .sparse import BlockSparseAttentionWrapper as BlockSparseAttentionWrapper
+from .transfer import KVTransferChunk as KVTransferChunk
+from .transfer import export_request_kv as export_request_kv
+from .transfer import export_request_kv_chunked as export_request_kv_chunked
+from .transfer import import_request_kv as import_request_kv
+from .transfer import import_request_kv_chunked as import_request_kv_chunked
+from .transfer import read_kv_chunk as read_kv_chunk
+from .transfer import write_kv_chunk as write_kv_chunk
@@ -24,6 +24,7 @@ import torch
 from .jit import (
     gen_batch_decode_mla_module,
     gen_batch_decode_module,
+    gen_batch_decode_per_request_module,
     gen_customize_batch_decode_module,
     gen_customize_batch_prefill_module,
     gen_single_decode_module,
@@ -32,22 +33,36 @@ from .jit import (
     has_prebuilt_ops,
     prebuilt_ops_uri,
 )
-from .page import get_seq_lens
+from .metadata import BatchMetadata, _check_batch_metadata_page_size
+from .page import (
+    RunLengthPageIndices,
+    _check_attention_mass,
+    _check_page_scales,
+    _drop_unread_pages,
+    _expand_page_indices,
+    get_seq_lens,
+)
 from .prefill import (
     get_batch_prefill_jit_module,
     get_batch_prefill_module,
+    get_batch_prefill_per_request_module,
     get_single_prefill_module,
 )
+from .torch_attention import _batch_decode_torch
+from .triton.decode import batch_decode_with_paged_kv_cache, plan_split_kv
 from .utils import (
     MaskMode,
     PosEncodingMode,
     TensorLayout,
+    _canonicalize_per_request_param,
     _check_cached_qkv_data_type,
     _check_kv_layout,
     _check_pos_encoding_mode,
     _check_shape_dtype_device,
     _get_cache_alibi_slopes_buf,
     _get_cache_buf,
+    _get_kernel_window_left,
+    _get_per_request_param_buf,
     _get_range_buf,
     _unpack_paged_kv_cache,
     canonicalize_torch_dtype,
@@ -209,6 +224,16 @@ def get_batch_decode_jit_module(module_name: str, jit_module: Any):
     return _batch_decode_jit_modules[module_name]
 
 
+def get_batch_decode_per_request_module(*args):
+    # the module of the PerRequestAttention variant, which reads the window and the soft
+    # cap of each request from the request_window_left and request_logits_soft_cap
+    # buffers
+    uri = get_batch_decode_uri(*args) + "_per_request"
+    if uri in _batch_decode_jit_modules:
+        return _batch_decode_jit_modules[uri]
+    return get_batch_decode_jit_module(uri, gen_batch_decode_per_request_module(*args))
+
+
 def get_batch_decode_module(*args):
     global _batch_decode_modules
     if args not in _batch_decode_modules:
@@ -591,6 +616,7 @@ class BatchDecodeWithPagedKVCacheWrapper:
         paged_kv_indices_buffer: Optional[torch.Tensor] = None,
         paged_kv_last_page_len_buffer: Optional[torch.Tensor] = None,
         jit_args: Optional[List[Any]] = None,
+        backend: str = "auto",
     ) -> None:
         r"""Constructor of :class:`BatchDecodeWithPagedKVCacheWrapper`.
 
@@ -632,8 +658,29 @@ class BatchDecodeWithPagedKVCacheWrapper:
         jit_args : Optional[List[Any]]
             If provided, the wrapper will use the provided arguments to create the JIT module,
             otherwise, the wrapper will use default attention implementation.
+
+        backend : str
+            The implementation backend, could be ``auto`` (the CUDA kernels), ``torch``
+            (pure PyTorch, e.g. for CPU-only hosts, the requests are processed by a
+            thread pool) or ``triton`` (split-kv Triton kernels, e.g. for devices the
+            CUDA kernels are not tuned for, runs on CPU with ``TRITON_INTERPRET=1``).
+            The ``torch`` and ``triton`` backends do not support CUDAGraph and
+            :attr:`jit_args`. Defaults to ``auto``.
         """
         _check_kv_layout(kv_layout)
+        if backend not in ["auto", "torch", "triton"]:
+            raise KeyError(
+                "Invalid backend {}, expect auto, torch or triton for decode.".format(
+                    backend
+                )
+            )
+        if backend in ["torch", "triton"] and (use_cuda_graph or jit_args is not None):
+            raise ValueError(
+                "The {} backend does not support cuda graph and jit_args.".format(
+                    backend
+                )
+            )
+        self._backend = backend
 
         if jit_args is not None:
             if use_tensor_cores:
@@ -650,15 +697,20 @@ class BatchDecodeWithPagedKVCacheWrapper:
         self._kv_layout = kv_layout
         self._float_workspace_buffer = float_workspace_buffer
         self.device = float_workspace_buffer.device
-        self._int_workspace_buffer = torch.empty(
-            (8 * 1024 * 1024,), dtype=torch.uint8, device=self.device
-        )
-        self._pin_memory_int_workspace_buffer = torch.empty(
-            (8 * 1024 * 1024,),
-            dtype=torch.uint8,
-            pin_memory=True,
-            device="cpu",
-        )
+        if backend in ["torch", "triton"]:
+            # no scheduler workspace, the pinned host buffer also requires CUDA
+            self._int_workspace_buffer = None
+            self._pin_memory_int_workspace_buffer = None
+        else:
+            self._int_workspace_buffer = torch.empty(
+                (8 * 1024 * 1024,), dtype=torch.uint8, device=self.device
+            )
+            self._pin_memory_int_workspace_buffer = torch.empty(
+                (8 * 1024 * 1024,),
+                dtype=torch.uint8,
+                pin_memory=True,
+                device="cpu",
+            )
 
         if use_cuda_graph:
             if not torch.is_tensor(paged_kv_indptr_buffer):
@@ -686,6 +738,9 @@ class BatchDecodeWithPagedKVCacheWrapper:
         self._paged_kv_last_page_len_buf = paged_kv_last_page_len_buffer
         self._use_tensor_cores = use_tensor_cores
         self._use_cuda_graph = use_cuda_graph
+        self._use_per_request = False
+        self._window_left_buf: Optional[torch.Tensor] = None
+        self._logits_soft_cap_buf: Optional[torch.Tensor] = None
 
         if use_tensor_cores:
             if use_cuda_graph:
@@ -730,16 +785,16 @@ class BatchDecodeWithPagedKVCacheWrapper:
 
     def plan(
         self,
-        indptr: torch.Tensor,
-        indices: torch.Tensor,
-        last_page_len: torch.Tensor,
+        indptr: Optional[torch.Tensor],
+        indices: Union[torch.Tensor, RunLengthPageIndices],
+        last_page_len: Optional[torch.Tensor],
         num_qo_heads: int,
         num_kv_heads: int,
         head_dim: int,
         page_size: int,
         pos_encoding_mode: str = "NONE",
-        window_left: int = -1,
-        logits_soft_cap: Optional[float] = None,
+        window_left: Union[int, torch.Tensor] = -1,
+        logits_soft_cap: Optional[Union[float, torch.Tensor]] = None,
         q_data_type: Optional[Union[str, torch.dtype]] = "float16",
         kv_data_type: Optional[Union[str, torch.dtype]] = None,
         data_type: Optional[Union[str, torch.dtype]] = None,
@@ -747,18 +802,23 @@ class BatchDecodeWithPagedKVCacheWrapper:
         rope_scale: Optional[float] = None,
         rope_theta: Optional[float] = None,
         non_blocking: bool = False,
+        batch_metadata: Optional[BatchMetadata] = None,
+        chunk_size: int = 0,
     ) -> None:
         r"""Plan batch decode for given problem specification.
 
         Parameters
         ----------
-        indptr : torch.Tensor
-            The indptr of the paged kv cache, shape: ``[batch_size + 1]``
-        indices : torch.Tensor
-            The page indices of the paged kv cache, shape: ``[qo_indptr[-1]]``
-        last_page_len : torch.Tensor
+        indptr : Optional[torch.Tensor]
+            The indptr of the paged kv cache, shape: ``[batch_size + 1]``, can be ``None``
+            if :attr:`batch_metadata` is provided.
+        indices : Union[torch.Tensor, RunLengthPageIndices]
+            The page indices of the paged kv cache, shape: ``[qo_indptr[-1]]``, or their
+            run-length encoding (see :class:`flashinfer.page.RunLengthPageIndices`).
+        last_page_len : Optional[torch.Tensor]
             The number of entries in the last page of each request in the paged kv
-            cache, shape: ``[batch_size]``
+            cache, shape: ``[batch_size]``, can be ``None`` if :attr:`batch_metadata`
+            is provided.
         num_qo_heads : int
             The number of query/output heads
         num_kv_heads : int
@@ -771,15 +831,22 @@ class BatchDecodeWithPagedKVCacheWrapper:
             The position encoding applied inside attention kernels, could be
             ``NONE``/``ROPE_LLAMA`` (LLAMA style rotary embedding) /``ALIBI``.
             Defaults to ``NONE``.
-        window_left : int
+        window_left : Union[int, torch.Tensor]
             The left (inclusive) window size for the attention window, when set to ``-1``, the window
             size will be set to the full length of the sequence. Defaults to ``-1``.
-        logits_soft_cap : Optional[float]
+            Could also be an int32 tensor of per-request window sizes, shape: ``[batch_size]``,
+            read per request by all backends, the CUDA kernels read the windows through a
+            JIT-compiled attention variant, which is not available with :attr:`jit_args`.
+            The pages before the window of each request are never read.
+        logits_soft_cap : Optional[Union[float, torch.Tensor]]
             The attention logits soft capping value (used in Gemini, Grok and Gemma-2, etc.), if not
             provided, will be set to ``0``. If greater than 0, the logits will be capped according to
             formula:
             :math:`\texttt{logits_soft_cap} \times \mathrm{tanh}(x / \texttt{logits_soft_cap})`,
             where :math:`x` is the input logits.
+            Could also be a float32 tensor of per-request values, shape: ``[batch_size]``,
+            read per request as :attr:`window_left`, a value of ``0`` disables the soft
+            capping of its request.
         q_data_type : Optional[Union[str, torch.dtype]]
             The data type of the query tensor, defaults torch.float16.
         kv_data_type : Optional[Union[str, torch.dtype]]
@@ -791,6 +858,20 @@ class BatchDecodeWithPagedKVCacheWrapper:
         non_blocking : bool
             Whether to copy the input tensors to the device asynchronously, defaults to ``False``.
             If ``True``, user should synchronize before calling :meth:`run` or cuda graph replay.
+        batch_metadata : Optional[BatchMetadata]
+            The batch metadata of this step, if provided, :attr:`indptr` and
+            :attr:`last_page_len` are taken from its cached host and device tensors
+            instead of being copied between host and device.
+        chunk_size : int
+            The chunk size of chunked local attention (e.g. the local layers of
+            Llama 4), if greater than ``0``, the query at position ``p`` only attends to
+            the keys of its aligned chunk ``[p // chunk_size * chunk_size, p]``. The
+            pages before the chunk are dropped from the planned page table, so they are
+            never read. If :attr:`chunk_size` is not a multiple of :attr:`page_size`,
+            the head of the first retained page is masked with a per-request window
+            (see :attr:`window_left`), with :attr:`jit_args` only chunk sizes that are
+            multiples of :attr:`page_size` are supported and the others raise a
+            ``ValueError``. Defaults to ``0`` (disabled).
 
 
         Note
@@ -805,9 +886,99 @@ class BatchDecodeWithPagedKVCacheWrapper:
 
         The :meth:`plan` method cannot be used in Cuda Graph or in ``torch.compile``.
         """
+        if batch_metadata is not None:
+            _check_batch_metadata_page_size(batch_metadata, page_size)
+            names = ["kv_page_indptr", "kv_last_page_len"]
+            indptr, last_page_len = batch_metadata.get_tensors(names, self.device)
+            indptr_host, last_page_len_host = batch_metadata.get_tensors(names)
+        else:
+            indptr_host = indptr.to("cpu")
+            last_page_len_host = last_page_len.to("cpu")
         batch_size = len(last_page_len)
+        indices = _expand_page_indices(indices, indptr_host, self.device, non_blocking)
         if logits_soft_cap is None:
             logits_soft_cap = 0.0
+        logits_soft_cap = _canonicalize_per_request_param(
+            logits_soft_cap, batch_size, "logits_soft_cap"
+        )
+        if torch.is_tensor(logits_soft_cap) and self._jit_module is not None:
+            raise ValueError(
+                "Per-request logits_soft_cap is not supported with jit_args, the "
+                "attention variant of jit_args takes a single soft cap."
+            )
+        window_left = _canonicalize_per_request_param(
+            window_left, batch_size, "window_left"
+        )
+        if chunk_size < 0:
+            raise ValueError(
+                "chunk_size should be non-negative, got {}.".format(chunk_size)
+            )
+        if chunk_size > 0:
+            # the pages before the chunk of the query are never read, drop them from
+            # the page table, the window of the query is invariant
+            kv_lens_host = get_seq_lens(indptr_host, last_page_len_host, page_size)
+            indptr_device = indptr.device
+            indptr, indices, _ = _drop_unread_pages(
+                indptr_host, indices, last_page_len, page_size, chunk_size=chunk_size
+            )
+            indptr = indptr.to(indptr_device)
+            indptr_host = indptr.to("cpu")
+            if chunk_size % page_size != 0:
+                # the chunk begins inside the first retained page
+                chunk_window = ((kv_lens_host - 1) % chunk_size).int()
+                if torch.is_tensor(window_left) or window_left >= 0:
+                    chunk_window = torch.minimum(
+                        chunk_window,
+                        torch.as_tensor(window_left, dtype=torch.int32),
+                    )
+                window_left = _canonicalize_per_request_param(
+                    chunk_window, batch_size, "window_left"
+                )
+                if torch.is_tensor(window_left) and self._jit_module is not None:
+                    raise ValueError(
+                        "chunk_size {} is not a multiple of page_size {}, the chunks "
+                        "are masked with per-request windows, which are not supported "
+                        "with jit_args.".format(chunk_size, page_size)
+                    )
+        if torch.is_tensor(window_left) and self._backend not in ["torch", "triton"]:
+            if self._jit_module is not None:
+                raise ValueError(
+                    "Per-request window_left is not supported with jit_args, the "
+                    "attention variant of jit_args takes a single window."
+                )
+            # the kernels only attend to the windows, drop the pages before the window
+            # of each query
+            indptr_device = indptr.device
+            indptr, indices, _ = _drop_unread_pages(
+                indptr_host, indices, last_page_len, page_size, window_left=window_left
+            )
+            indptr = indptr.to(indptr_device)
+            indptr_host = indptr.to("cpu")
+        # the CUDA kernels read per-request windows and soft caps through the
+        # PerRequestAttention variant
+        self._use_per_request = self._backend not in ["torch", "triton"] and (
+            torch.is_tensor(window_left) or torch.is_tensor(logits_soft_cap)
+        )
+        if self._use_per_request:
+            window_left_buf = torch.as_tensor(window_left, dtype=torch.int32)
+            logits_soft_cap_buf = torch.as_tensor(logits_soft_cap, dtype=torch.float32)
+            window_left_buf = window_left_buf.expand(batch_size).contiguous()
+            logits_soft_cap_buf = logits_soft_cap_buf.expand(batch_size).contiguous()
+            if self.is_cuda_graph_enabled and self._window_left_buf is not None:
+                # the captured kernels read the buffers of the previous plans
+                self._window_left_buf.copy_(window_left_buf, non_blocking=non_blocking)
+                self._logits_soft_cap_buf.copy_(
+                    logits_soft_cap_buf, non_blocking=non_blocking
+                )
+            else:
+                self._window_left_buf = window_left_buf.to(
+                    self.device, non_blocking=non_blocking
+                )
+                self._logits_soft_cap_buf = logits_soft_cap_buf.to(
+                    self.device, non_blocking=non_blocking
+                )
+        use_sliding_window = torch.is_tensor(window_left) or window_left != -1
+        use_logits_soft_cap = bool((torch.as_tensor(logits_soft_cap) > 0).any())
 
         qo_indptr_host = _get_range_buf(batch_size + 1, "cpu")
         if self.is_cuda_graph_enabled:
@@ -843,9 +1014,6 @@ class BatchDecodeWithPagedKVCacheWrapper:
                 self.device, non_blocking=non_blocking
             )
 
-        indptr_host = indptr.to("cpu")
-        last_page_len_host = last_page_len.to("cpu")
-
         if data_type is not None:
             if q_data_type is None:
                 q_data_type = data_type
@@ -859,12 +1027,42 @@ class BatchDecodeWithPagedKVCacheWrapper:
 
         self._cached_q_data_type = q_data_type
         self._cached_kv_data_type = kv_data_type
-        if self.use_tensor_cores:
+        if self._backend == "torch":
+            # the torch backend reads the page table in run, nothing to schedule
+            self._cached_module = None
+        elif self._backend == "triton":
+            if pos_encoding_mode == "ROPE_LLAMA":
+                raise ValueError(
+                    "The triton backend does not support ROPE_LLAMA, please apply "
+                    "rotary embedding to query and key before attention."
+                )
+            self._cached_module = None
+            self._pages_per_split, self._max_num_splits = plan_split_kv(
+                indptr_host,
+                page_size,
+                num_qo_heads,
+                num_kv_heads,
+                head_dim,
+                self._float_workspace_buffer.numel(),
+                self.device,
+            )
+            # the kernel reads per-request window and soft cap
+            self._window_left_buf = _get_per_request_param_buf(
+                window_left, -1, batch_size, torch.int32, self.device
+            )
+            self._logits_soft_cap_buf = _get_per_request_param_buf(
+                logits_soft_cap, 0.0, batch_size, torch.float32, self.device
+            )
+        elif self.use_tensor_cores:
             kv_lens_arr_host = get_seq_lens(indptr_host, last_page_len_host, page_size)
             if self._jit_module is not None:
                 self._cached_module = self._jit_module
             else:
-                self._cached_module = get_batch_prefill_module("fa2")(
+                self._cached_module = (
+                    get_batch_prefill_per_request_module
+                    if self._use_per_request
+                    else get_batch_prefill_module("fa2")
+                )(
                     q_data_type,
                     kv_data_type,
                     q_data_type,
@@ -872,8 +1070,8 @@ class BatchDecodeWithPagedKVCacheWrapper:
                     head_dim,  # head_dim_qk
                     head_dim,  # head_dim_vo
                     PosEncodingMode[pos_encoding_mode].value,
-                    window_left != -1,  # use_sliding_window
-                    logits_soft_cap > 0,  # use_logits_soft_cap
+                    use_sliding_window,
+                    use_logits_soft_cap,
                     False,  # use_fp16_qk_reduction
                 )
             with self.device as device:
@@ -899,7 +1097,11 @@ class BatchDecodeWithPagedKVCacheWrapper:
             if self._jit_module is not None:
                 self._cached_module = self._jit_module
             else:
-                self._cached_module = get_batch_decode_module(
+                self._cached_module = (
+                    get_batch_decode_per_request_module
+                    if self._use_per_request
+                    else get_batch_decode_module
+                )(
                     q_data_type,
                     kv_data_type,
                     q_data_type,
@@ -907,8 +1109,8 @@ class BatchDecodeWithPagedKVCacheWrapper:
                     head_dim,  # head_dim_qk
                     head_dim,  # head_dim_vo
                     PosEncodingMode[pos_encoding_mode].value,
-                    window_left != -1,  # use_sliding_window
-                    logits_soft_cap > 0,  # use_logits_soft_cap
+                    use_sliding_window,
+                    use_logits_soft_cap,
                 )
             with self.device as device:
                 self._plan_info = self._cached_module.plan(
@@ -921,8 +1123,8 @@ class BatchDecodeWithPagedKVCacheWrapper:
                     num_kv_heads,
                     page_size,
                     self.is_cuda_graph_enabled,
-                    window_left,
-                    logits_soft_cap,
+                    _get_kernel_window_left(window_left),
+                    0.0 if self._use_per_request else logits_soft_cap,
                     head_dim,
                     head_dim,
                     torch.empty(0, dtype=q_data_type),
@@ -971,10 +1173,11 @@ class BatchDecodeWithPagedKVCacheWrapper:
         paged_kv_cache: Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]],
         *args,
         q_scale: Optional[float] = None,
-        k_scale: Optional[float] = None,
-        v_scale: Optional[float] = None,
+        k_scale: Optional[Union[float, torch.Tensor]] = None,
+        v_scale: Optional[Union[float, torch.Tensor]] = None,
         out: Optional[torch.Tensor] = None,
         lse: Optional[torch.Tensor] = None,
+        attention_mass: Optional[torch.Tensor] = None,
         return_lse: Literal[False] = False,
     ) -> torch.Tensor: ...
 
@@ -985,10 +1188,11 @@ class BatchDecodeWithPagedKVCacheWrapper:
         paged_kv_cache: Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]],
         *args,
         q_scale: Optional[float] = None,
-        k_scale: Optional[float] = None,
-        v_scale: Optional[float] = None,
+        k_scale: Optional[Union[float, torch.Tensor]] = None,
+        v_scale: Optional[Union[float, torch.Tensor]] = None,
         out: Optional[torch.Tensor] = None,
         lse: Optional[torch.Tensor] = None,
+        attention_mass: Optional[torch.Tensor] = None,
         return_lse: Literal[True] = True,
     ) -> Tuple[torch.Tensor, torch.Tensor]: ...
 
@@ -998,10 +1202,11 @@ class BatchDecodeWithPagedKVCacheWrapper:
         paged_kv_cache: Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]],
         *args,
         q_scale: Optional[float] = None,
-        k_scale: Optional[float] = None,
-        v_scale: Optional[float] = None,
+        k_scale: Optional[Union[float, torch.Tensor]] = None,
+        v_scale: Optional[Union[float, torch.Tensor]] = None,
         out: Optional[torch.Tensor] = None,
         lse: Optional[torch.Tensor] = None,
+        attention_mass: Optional[torch.Tensor] = None,
         return_lse: bool = False,
     ) -> Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]]:
         r"""Compute batch decode attention between query and paged kv cache.
@@ -1027,14 +1232,27 @@ class BatchDecodeWithPagedKVCacheWrapper:
             Additional arguments for the custom kernel.
         q_scale : Optional[float]
             The calibration scale of query for fp8 input, if not provided, will be set to ``1.0``.
-        k_scale : Optional[float]
+        k_scale : Optional[Union[float, torch.Tensor]]
             The calibration scale of key for fp8 input, if not provided, will be set to ``1.0``.
-        v_scale : Optional[float]
+            Could also be a float32 tensor of per-page (``[max_num_pages]``) or
+            per-page-per-head (``[max_num_pages, num_kv_heads]``) scales maintained by
+            :func:`flashinfer.page.append_paged_kv_cache_quantized`, only supported by the
+            ``torch`` and ``triton`` backends.
+        v_scale : Optional[Union[float, torch.Tensor]]
             The calibration scale of value for fp8 input, if not provided, will be set to ``1.0``.
+            Could also be a float32 tensor of per-page (or per-page-per-head) scales, in which
+            case :attr:`k_scale` should be a tensor of the same shape.
         out : Optional[torch.Tensor]
             The output tensor, if not provided, will be allocated internally.
         lse : Optional[torch.Tensor]
             The log-sum-exp of attention logits, if not provided, will be allocated internally.
+        attention_mass : Optional[torch.Tensor]
+            If provided, the softmax mass of the attention is accumulated (added) into this
+            float32 buffer, per page with shape ``[max_num_pages, num_kv_heads]`` or per
+            token with shape ``[max_num_pages, page_size, num_kv_heads]``, summed over the
+            query heads of each kv head group. Used by heavy-hitter kv eviction policies,
+            see :func:`flashinfer.page.evict_low_mass_pages`. Only supported by the
+            ``torch`` and ``triton`` backends.
         return_lse : bool
             Whether to return the logsumexp of attention scores, defaults to ``False``.
 
@@ -1046,14 +1264,46 @@ class BatchDecodeWithPagedKVCacheWrapper:
 
             * attention output, shape: ``[batch_size, num_qo_heads, head_dim]``
             * logsumexp of attention scores, shape: ``[batch_size, num_qo_heads]``.
+
+        Note
+        ----
+        When per-page scale tensors are provided, the ``torch`` and ``triton`` backends
+        dequantize the pages as the attention reads them, the wrapper is planned with the
+        quantized ``kv_data_type``. The other backends take scalar scales only and raise
+        a ``ValueError``. Per-page scales are not compatible with CUDAGraph.
+
+        The attention mass is accumulated inside the attention from the probabilities
+        normalized with the final logsumexp, the ``triton`` backend does not split the kv
+        of the requests in this case. It is not compatible with CUDAGraph.
         """
+        if attention_mass is not None:
+            _check_attention_mass(attention_mass, self._backend)
+            if self.is_cuda_graph_enabled:
+                raise ValueError("attention_mass is not supported in cuda graph mode.")
         k_cache, v_cache = _unpack_paged_kv_cache(paged_kv_cache, self._kv_layout)
+        paged_kv_indices = self._paged_kv_indices_buf
+        page_k_scale = page_v_scale = None
+        if torch.is_tensor(k_scale) or torch.is_tensor(v_scale):
+            if self.is_cuda_graph_enabled:
+                raise ValueError(
+                    "Per-page kv scales are not supported in cuda graph mode."
+                )
+            if self._backend not in ["torch", "triton"]:
+                raise ValueError(
+                    "Per-page kv scales are only supported by the torch and triton "
+                    "backends, the CUDA kernels take float k_scale and v_scale, got "
+                    "backend {}.".format(self._backend)
+                )
+            # the pages are dequantized as the attention reads them
+            _check_page_scales(k_scale, v_scale, k_cache, v_cache, self._kv_layout)
+            page_k_scale, page_v_scale = k_scale, v_scale
+            k_scale = v_scale = None
         _check_cached_qkv_data_type(
             q, k_cache, self._cached_q_data_type, self._cached_kv_data_type
         )
 
         pos_encoding_mode = self._pos_encoding_mode
-        window_left = self._window_left
+        window_left = _get_kernel_window_left(self._window_left)
         logits_soft_cap = self._logits_soft_cap
         sm_scale = self._sm_scale
         rope_scale = self._rope_scale
@@ -1088,7 +1338,54 @@ class BatchDecodeWithPagedKVCacheWrapper:
         else:
             _check_shape_dtype_device(out, q.shape, q.dtype, q.device, "out")
 
-        if self.use_tensor_cores:
+        if self._backend == "torch":
+            _batch_decode_torch(
+                q,
+                k_cache,
+                v_cache,
+                self._paged_kv_indptr_buf,
+                paged_kv_indices,
+                self._paged_kv_last_page_len_buf,
+                self._kv_layout,
+                pos_encoding_mode,
+                self._window_left,
+                logits_soft_cap,
+                sm_scale,
+                rope_scale,
+                rope_theta,
+                out,
+                lse,
+                k_scale=page_k_scale,
+                v_scale=page_v_scale,
+                attention_mass=attention_mass,
+            )
+        elif self._backend == "triton":
+            batch_decode_with_paged_kv_cache(
+                q,
+                k_cache,
+                v_cache,
+                self._paged_kv_indptr_buf,
+                paged_kv_indices,
+                self._paged_kv_last_page_len_buf,
+                self._kv_layout,
+                self._pages_per_split,
+                self._max_num_splits,
+                sm_scale,
+                window_left=self._window_left_buf,
+                logits_soft_cap=self._logits_soft_cap_buf,
+                alibi_slopes=(
+                    _get_cache_alibi_slopes_buf(q.shape[1], q.device)
+                    if pos_encoding_mode == "ALIBI"
+                    else None
+                ),
+                k_scale=page_k_scale,
+                v_scale=page_v_scale,
+                workspace_buffer=self._float_workspace_buffer,
+                out=out,
+                lse=lse,
+                attention_mass=attention_mass,
+            )
+        elif self.use_tensor_cores:
             run_args = [
                 self._float_workspace_buffer,
                 self._int_workspace_buffer,
@@ -1098,7 +1395,7 @@ class BatchDecodeWithPagedKVCacheWrapper:
                 v_cache,
                 self._qo_indptr_buf,
                 self._paged_kv_indptr_buf,
-                self._paged_kv_indices_buf,
+                paged_kv_indices,
                 self._paged_kv_last_page_len_buf,
                 out,
                 lse,
@@ -1109,10 +1406,22 @@ class BatchDecodeWithPagedKVCacheWrapper:
 
             if self._jit_module is not None:
                 run_args.extend(list(args))
+            elif self._use_per_request:
+                run_args += [
+                    None,  # maybe_custom_mask
+                    None,  # maybe_mask_indptr
+                    _get_cache_alibi_slopes_buf(q.shape[1], q.device),
+                    self._window_left_buf,
+                    self._logits_soft_cap_buf,
+                    0.0,  # logits_soft_cap, read per request
+                    sm_scale,
+                    1.0 / rope_scale,  # rope_rcp_scale
+                    1.0 / rope_theta,  # rope_rcp_theta
+                ]
             else:
                 run_args += [
-                    None,  # packed_custom_mask
-                    None,  # mask_indptr_buf
+                    None,  # maybe_custom_mask
+                    None,  # maybe_mask_indptr
                     _get_cache_alibi_slopes_buf(q.shape[1], q.device),
                     logits_soft_cap,
                     sm_scale,
@@ -1130,7 +1439,7 @@ class BatchDecodeWithPagedKVCacheWrapper:
                 k_cache,
                 v_cache,
                 self._paged_kv_indptr_buf,
-                self._paged_kv_indices_buf,
+                paged_kv_indices,
                 self._paged_kv_last_page_len_buf,
                 out,
                 lse,
@@ -1140,6 +1449,16 @@ class BatchDecodeWithPagedKVCacheWrapper:
 
             if self._jit_module is not None:
                 run_args.extend(list(args))
+            elif self._use_per_request:
+                run_args += [
+                    _get_cache_alibi_slopes_buf(q.shape[1], q.device),
+                    self._window_left_buf,
+                    self._logits_soft_cap_buf,
+                    0.0,  # logits_soft_cap, read per request
+                    sm_scale,
+                    1.0 / rope_scale,  # rope_rcp_scale
+                    1.0 / rope_theta,  # rope_rcp_theta
+                ]
             else:
                 run_args += [
                     _get_cache_alibi_slopes_buf(q.shape[1], q.device),
@@ -1262,6 +1581,213 @@ class CUDAGraphBatchDecodeWithPagedKVCacheWrapper(BatchDecodeWithPagedKVCacheWra
         )
 
 
+class BatchDecodeWithHeadwisePagedKVCacheWrapper(BatchDecodeWithPagedKVCacheWrapper):
+    r"""Wrapper class for decode attention with a head-wise paged kv-cache, where each
+    ``(request, kv_head)`` pair has its own page list and kv length, for head-wise kv
+    compression methods that retain a different set of tokens for each kv head.
+
+    The page table is indexed by ``request * num_kv_heads + kv_head``, and the pages
+    hold a single kv head, i.e. the paged kv-cache has the regular layout with
+    ``num_kv_heads = 1``, e.g. ``[max_num_pages, 2, page_size, 1, head_dim]`` for
+    ``NHD``. Each ``(request, kv_head)`` pair is scheduled as a request with one kv head
+    and the query heads of its group, so the whole batch runs in a single launch and
+    no head is padded to the longest one.
+
+    Examples
+    --------
+    >>> import torch
+    >>> import flashinfer
+    >>> num_qo_heads, num_kv_heads, head_dim, page_size = 32, 8, 128, 16
+    >>> workspace_buffer = torch.empty(128 * 1024 * 1024, dtype=torch.uint8, device="cuda:0")
+    >>> wrapper = flashinfer.BatchDecodeWithHeadwisePagedKVCacheWrapper(workspace_buffer)
+    >>> # kv lengths of shape [batch_size, num_kv_heads] after head-wise compression
+    >>> kv_lens = torch.randint(1, 512, (4, num_kv_heads), dtype=torch.int32)
+    >>> num_pages = (kv_lens.view(-1) + page_size - 1) // page_size
+    >>> kv_indptr = torch.cat([torch.zeros(1, dtype=torch.int32), num_pages.cumsum(0)]).int()
+    >>> kv_indices = torch.arange(kv_indptr[-1].item(), dtype=torch.int32)
+    >>> kv_last_page_len = ((kv_lens.view(-1) - 1) % page_size + 1).int()
+    >>> kv_cache = torch.randn(
+    ...     kv_indptr[-1].item(), 2, page_size, 1, head_dim, dtype=torch.float16, device="cuda:0"
+    ... )
+    >>> wrapper.plan(
+    ...     kv_indptr.to(0), kv_indices.to(0), kv_last_page_len.to(0),
+    ...     num_qo_heads, num_kv_heads, head_dim, page_size,
+    ... )
+    >>> q = torch.randn(4, num_qo_heads, head_dim, dtype=torch.float16, device="cuda:0")
+    >>> wrapper.run(q, kv_cache).shape
+    torch.Size([4, 32, 128])
+
+    Note
+    ----
+    The kernels index the keys of a head by their order in its page list, so the keys
+    should be stored with RoPE already applied, only ``pos_encoding_mode="NONE"`` is
+    supported.
+
+    See Also
+    --------
+    :class:`BatchDecodeWithPagedKVCacheWrapper`
+    """
+
+    def plan(
+        self,
+        indptr: torch.Tensor,
+        indices: Union[torch.Tensor, RunLengthPageIndices],
+        last_page_len: torch.Tensor,
+        num_qo_heads: int,
+        num_kv_heads: int,
+        head_dim: int,
+        page_size: int,
+        pos_encoding_mode: str = "NONE",
+        window_left: Union[int, torch.Tensor] = -1,
+        logits_soft_cap: Optional[Union[float, torch.Tensor]] = None,
+        q_data_type: Optional[Union[str, torch.dtype]] = "float16",
+        kv_data_type: Optional[Union[str, torch.dtype]] = None,
+        sm_scale: Optional[float] = None,
+        non_blocking: bool = False,
+    ) -> None:
+        r"""Plan head-wise batch decode for given problem specification.
+
+        Parameters
+        ----------
+        indptr : torch.Tensor
+            The indptr of the head-wise page table, shape: ``[batch_size * num_kv_heads + 1]``.
+        indices : Union[torch.Tensor, RunLengthPageIndices]
+            The page indices of the head-wise page table, shape: ``[indptr[-1]]``.
+        last_page_len : torch.Tensor
+            The number of entries in the last page of each ``(request, kv_head)`` pair,
+            shape: ``[batch_size * num_kv_heads]``.
+        num_qo_heads : int
+            The number of query/output heads.
+        num_kv_heads : int
+            The number of key/value heads.
+        head_dim : int
+            The dimension of the heads.
+        page_size : int
+            The page size of the paged kv cache.
+        pos_encoding_mode : str
+            Only ``NONE`` is supported.
+        window_left : Union[int, torch.Tensor]
+            The left (inclusive) window size, could be a tensor of per-request window
+            sizes, shape: ``[batch_size]``, see :meth:`BatchDecodeWithPagedKVCacheWrapper.plan`.
+        logits_soft_cap : Optional[Union[float, torch.Tensor]]
+            The attention logits soft capping value, see
+            :meth:`BatchDecodeWithPagedKVCacheWrapper.plan`.
+        q_data_type : Optional[Union[str, torch.dtype]]
+            The data type of the query tensor, defaults torch.float16.
+        kv_data_type : Optional[Union[str, torch.dtype]]
+            The data type of the key/value tensor. If None, will be set to ``q_data_type``.
+        sm_scale : Optional[float]
+            The scale used in softmax, if not provided, will be set to ``1.0 / sqrt(head_dim)``.
+        non_blocking : bool
+            Whether to copy the input tensors to the device asynchronously, defaults to ``False``.
+        """
+        if pos_encoding_mode != "NONE":
+            raise ValueError(
+                "Head-wise paged kv-cache only supports pos_encoding_mode NONE, got {}.".format(
+                    pos_encoding_mode
+                )
+            )
+        if num_qo_heads % num_kv_heads != 0:
+            raise ValueError(
+                "num_qo_heads {} should be a multiple of num_kv_heads {}.".format(
+                    num_qo_heads, num_kv_heads
+                )
+            )
+        if len(last_page_len) % num_kv_heads != 0:
+            raise ValueError(
+                "The length of last_page_len {} should be batch_size * num_kv_heads.".format(
+                    len(last_page_len)
+                )
+            )
+        # per-request parameters apply to all kv heads of the request
+        if torch.is_tensor(window_left):
+            window_left = window_left.repeat_interleave(num_kv_heads)
+        if torch.is_tensor(logits_soft_cap):
+            logits_soft_cap = logits_soft_cap.repeat_interleave(num_kv_heads)
+        self._num_kv_heads_headwise = num_kv_heads
+        super().plan(
+            indptr,
+            indices,
+            last_page_len,
+            num_qo_heads // num_kv_heads,
+            1,  # num_kv_heads of each (request, kv_head) pair
+            head_dim,
+            page_size,
+            pos_encoding_mode=pos_encoding_mode,
+            window_left=window_left,
+            logits_soft_cap=logits_soft_cap,
+            q_data_type=q_data_type,
+            kv_data_type=kv_data_type,
+            sm_scale=sm_scale,
+            non_blocking=non_blocking,
+        )
+
+    begin_forward = plan
+
+    def run(
+        self,
+        q: torch.Tensor,
+        paged_kv_cache: Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]],
+        *args,
+        q_scale: Optional[float] = None,
+        k_scale: Optional[Union[float, torch.Tensor]] = None,
+        v_scale: Optional[Union[float, torch.Tensor]] = None,
+        out: Optional[torch.Tensor] = None,
+        lse: Optional[torch.Tensor] = None,
+        attention_mass: Optional[torch.Tensor] = None,
+        return_lse: bool = False,
+    ) -> Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]]:
+        r"""Compute head-wise batch decode attention between query and paged kv cache.
+
+        Parameters
+        ----------
+        q : torch.Tensor
+            The query tensor, shape: ``[batch_size, num_qo_heads, head_dim]``.
+        paged_kv_cache : Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]]
+            The head-wise paged kv-cache, with the layout of
+            :meth:`BatchDecodeWithPagedKVCacheWrapper.run` and ``num_kv_heads = 1``.
+        *args
+            Additional arguments for the custom kernel.
+        q_scale, k_scale, v_scale, out, lse, attention_mass, return_lse
+            See :meth:`BatchDecodeWithPagedKVCacheWrapper.run`, :attr:`out` and
+            :attr:`lse` have shape ``[batch_size, num_qo_heads, head_dim]`` and
+            ``[batch_size, num_qo_heads]``.
+
+        Returns
+        -------
+        Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]]
+            The attention output, shape: ``[batch_size, num_qo_heads, head_dim]``, and the
+            logsumexp of attention scores, shape: ``[batch_size, num_qo_heads]``, if
+            :attr:`return_lse` is ``True``.
+        """
+        batch_size, num_qo_heads, head_dim = q.shape
+        num_kv_heads = self._num_kv_heads_headwise
+        # [batch_size, num_qo_heads, head_dim] -> [batch_size * num_kv_heads, group_size, head_dim]
+        headwise_shape = (batch_size * num_kv_heads, num_qo_heads // num_kv_heads)
+        if out is not None:
+            _check_shape_dtype_device(out, q.shape, q.dtype, q.device, "out")
+            out = out.view(headwise_shape + (head_dim,))
+        if lse is not None:
+            _check_shape_dtype_device(lse, q.shape[:2], torch.float32, q.device, "lse")
+            lse = lse.view(headwise_shape)
+        o, lse = super().run(
+            q.reshape(headwise_shape + (head_dim,)),
+            paged_kv_cache,
+            *args,
+            q_scale=q_scale,
+            k_scale=k_scale,
+            v_scale=v_scale,
+            out=out,
+            lse=lse,
+            attention_mass=attention_mass,
+            return_lse=True,
+        )
+        o = o.view(batch_size, num_qo_heads, -1)
+        return (o, lse.view(batch_size, num_qo_heads)) if return_lse else o
+
+    run_return_lse = functools.partialmethod(run, return_lse=True)
+
+
 class BatchDecodeMlaWithPagedKVCacheWrapper:
     r"""Warning: this class is deprecated and will be removed in a future release.
     Please use :class:`flashinfer.mla.BatchMLAPagedAttentionWrapper` instead, which provides
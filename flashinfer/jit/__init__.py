@@ -19,8 +19,17 @@ from .activation import gen_act_and_mul_module as gen_act_and_mul_module
 from .activation import get_act_and_mul_cu_str as get_act_and_mul_cu_str
 from .attention import gen_batch_decode_mla_module as gen_batch_decode_mla_module
 from .attention import gen_batch_decode_module as gen_batch_decode_module
+from .attention import (
+    gen_batch_decode_per_request_module as gen_batch_decode_per_request_module,
+)
 from .attention import gen_batch_mla_module as gen_batch_mla_module
 from .attention import gen_batch_prefill_module as gen_batch_prefill_module
+from .attention import (
+    gen_batch_prefill_per_request_module as gen_batch_prefill_per_request_module,
+)
+from .attention import (
+    gen_batch_prefill_segment_module as gen_batch_prefill_segment_module,
+)
 from .attention import (
     gen_customize_batch_decode_module as gen_customize_batch_decode_module,
 )
@@ -604,6 +604,194 @@ def gen_batch_prefill_module(
     )
 
 
+def gen_batch_prefill_segment_module(
+    dtype_q: torch.dtype,
+    dtype_kv: torch.dtype,
+    dtype_o: torch.dtype,
+    dtype_idx: torch.dtype,
+    head_dim_qk: int,
+    head_dim_vo: int,
+    pos_encoding_mode: int,
+    use_sliding_window: bool,
+    use_logits_soft_cap: bool,
+    use_fp16_qk_reduction: bool,
+):
+    # fa2 batch prefill with the segment mask of SegmentAttention, the hopper variants
+    # have no logits mask
+    uri = (
+        get_batch_prefill_uri(
+            "fa2",
+            dtype_q,
+            dtype_kv,
+            dtype_o,
+            dtype_idx,
+            head_dim_qk,
+            head_dim_vo,
+            pos_encoding_mode,
+            use_sliding_window,
+            use_logits_soft_cap,
+            use_fp16_qk_reduction,
+        )
+        + "_segment"
+    )
+    return gen_customize_batch_prefill_module(
+        "fa2",
+        uri,
+        dtype_q,
+        dtype_kv,
+        dtype_o,
+        dtype_idx,
+        head_dim_qk,
+        head_dim_vo,
+        [
+            "maybe_custom_mask",
+            "maybe_mask_indptr",
+            "maybe_alibi_slopes",
+            "qo_segment_ids",
+            "kv_segment_ids",
+            "kv_segment_indptr",
+        ],  # additional_tensor_names
+        [
+            "uint8_t",
+            "int32_t",
+            "float",
+            "int32_t",
+            "int32_t",
+            "int32_t",
+        ],  # additional_tensor_dtypes
+        [
+            "logits_soft_cap",
+            "sm_scale",
+            "rope_rcp_scale",
+            "rope_rcp_theta",
+        ],  # additional_scalar_names
+        ["double", "double", "double", "double"],  # additional_scalar_dtypes
+        f"SegmentAttention<use_custom_mask, {str(use_sliding_window).lower()}, {str(use_logits_soft_cap).lower()}, {str(pos_encoding_mode == 2).lower()}>",  # variant_name
+        "#include<flashinfer/attention/variants.cuh>",  # variant_decl
+        pos_encoding_mode=pos_encoding_mode,
+        use_sliding_window=use_sliding_window,
+        use_logits_soft_cap=use_logits_soft_cap,
+        use_fp16_qk_reduction=use_fp16_qk_reduction,
+    )
+
+
+def gen_batch_decode_per_request_module(
+    dtype_q: torch.dtype,
+    dtype_kv: torch.dtype,
+    dtype_o: torch.dtype,
+    dtype_idx: torch.dtype,
+    head_dim_qk: int,
+    head_dim_vo: int,
+    pos_encoding_mode: int,
+    use_sliding_window: bool,
+    use_logits_soft_cap: bool,
+):
+    # batch decode with the per-request window and soft cap of PerRequestAttention
+    uri = (
+        get_batch_decode_uri(
+            dtype_q,
+            dtype_kv,
+            dtype_o,
+            dtype_idx,
+            head_dim_qk,
+            head_dim_vo,
+            pos_encoding_mode,
+            use_sliding_window,
+            use_logits_soft_cap,
+        )
+        + "_per_request"
+    )
+    return gen_customize_batch_decode_module(
+        uri,
+        dtype_q,
+        dtype_kv,
+        dtype_o,
+        dtype_idx,
+        head_dim_qk,
+        head_dim_vo,
+        [
+            "maybe_alibi_slopes",
+            "request_window_left",
+            "request_logits_soft_cap",
+        ],  # additional_tensor_names
+        ["float", "int32_t", "float"],  # additional_tensor_dtypes
+        [
+            "logits_soft_cap",
+            "sm_scale",
+            "rope_rcp_scale",
+            "rope_rcp_theta",
+        ],  # additional_scalar_names
+        ["double", "double", "double", "double"],  # additional_scalar_dtypes
+        f"PerRequestAttention<false, {str(use_sliding_window).lower()}, {str(use_logits_soft_cap).lower()}, {str(pos_encoding_mode == 2).lower()}>",  # variant_name
+        "#include<flashinfer/attention/variants.cuh>",  # variant_decl
+        pos_encoding_mode=pos_encoding_mode,
+        use_sliding_window=use_sliding_window,
+        use_logits_soft_cap=use_logits_soft_cap,
+    )
+
+
+def gen_batch_prefill_per_request_module(
+    dtype_q: torch.dtype,
+    dtype_kv: torch.dtype,
+    dtype_o: torch.dtype,
+    dtype_idx: torch.dtype,
+    head_dim_qk: int,
+    head_dim_vo: int,
+    pos_encoding_mode: int,
+    use_sliding_window: bool,
+    use_logits_soft_cap: bool,
+    use_fp16_qk_reduction: bool,
+):
+    # fa2 batch prefill with the per-request window and soft cap of PerRequestAttention
+    uri = (
+        get_batch_prefill_uri(
+            "fa2",
+            dtype_q,
+            dtype_kv,
+            dtype_o,
+            dtype_idx,
+            head_dim_qk,
+            head_dim_vo,
+            pos_encoding_mode,
+            use_sliding_window,
+            use_logits_soft_cap,
+            use_fp16_qk_reduction,
+        )
+        + "_per_request"
+    )
+    return gen_customize_batch_prefill_module(
+        "fa2",
+        uri,
+        dtype_q,
+        dtype_kv,
+        dtype_o,
+        dtype_idx,
+        head_dim_qk,
+        head_dim_vo,
+        [
+            "maybe_custom_mask",
+            "maybe_mask_indptr",
+            "maybe_alibi_slopes",
+            "request_window_left",
+            "request_logits_soft_cap",
+        ],  # additional_tensor_names
+        ["uint8_t", "int32_t", "float", "int32_t", "float"],  # additional_tensor_dtypes
+        [
+            "logits_soft_cap",
+            "sm_scale",
+            "rope_rcp_scale",
+            "rope_rcp_theta",
+        ],  # additional_scalar_names
+        ["double", "double", "double", "double"],  # additional_scalar_dtypes
+        f"PerRequestAttention<use_custom_mask, {str(use_sliding_window).lower()}, {str(use_logits_soft_cap).lower()}, {str(pos_encoding_mode == 2).lower()}>",  # variant_name
+        "#include<flashinfer/attention/variants.cuh>",  # variant_decl
+        pos_encoding_mode=pos_encoding_mode,
+        use_sliding_window=use_sliding_window,
+        use_logits_soft_cap=use_logits_soft_cap,
+        use_fp16_qk_reduction=use_fp16_qk_reduction,
+    )
+
+
 def gen_customize_single_decode_module(
     uri: str,
     dtype_q: torch.dtype,
@@ -0,0 +1,480 @@
+"""
+Copyright (c) 2025 by FlashInfer team.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from typing import Tuple, Union
+
+import torch
+
+from .quantization import segment_packbits
+from .torch_attention import _segment_packbits_torch
+from .triton.mask import segment_packed_mask_apply_window as _apply_window_triton
+from .utils import _canonicalize_per_request_param
+
+
+def _segment_packbits(
+    x: torch.Tensor, indptr: torch.Tensor
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    # little bitorder packing of the flattened masks, as consumed by the kernels
+    if x.device.type == "cuda":
+        return segment_packbits(x, indptr, bitorder="little")
+    return _segment_packbits_torch(x, indptr, bitorder="little")
+
+
+def build_tree_attention_mask(
+    parents: torch.Tensor,
+    parents_indptr: torch.Tensor,
+    prefix_lens: torch.Tensor,
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    r"""Build the packed custom mask of speculative decoding token trees, for the
+    verification step of tree-based speculative decoding (e.g. Medusa, EAGLE).
+
+    The draft tokens of each request are the queries, they are appended to the kv of
+    the request after its ``prefix_len`` verified tokens. A draft token attends to the
+    whole prefix, to its ancestors in the tree and to itself.
+
+    Parameters
+    ----------
+    parents : torch.Tensor
+        The int32 index of the parent of each draft token within the tree of its
+        request, ``-1`` for the children of the last verified token, concatenated over
+        the requests, shape: ``[parents_indptr[-1]]``.
+    parents_indptr : torch.Tensor
+        The indptr of :attr:`parents`, shape: ``[batch_size + 1]``, it is the
+        ``qo_indptr`` of the verification step.
+    prefix_lens : torch.Tensor
+        The number of kv tokens before the draft tokens of each request, shape:
+        ``[batch_size]``. The kv length of request ``i`` is
+        ``prefix_lens[i] + parents_indptr[i + 1] - parents_indptr[i]``.
+
+    Returns
+    -------
+    packed_custom_mask : torch.Tensor
+        The flattened ``[num_drafts, kv_len]`` masks of the requests, packed in little
+        bitorder, on the device of :attr:`parents`.
+    mask_indptr : torch.Tensor
+        The byte indptr of :attr:`packed_custom_mask`, shape: ``[batch_size + 1]``.
+
+    Examples
+    --------
+
+    >>> import torch
+    >>> import flashinfer
+    >>> # request 0: drafts 0 and 1 follow the prefix, 2 follows 0
+    >>> # request 1: a chain of two drafts
+    >>> parents = torch.tensor([-1, -1, 0, -1, 0], dtype=torch.int32)
+    >>> parents_indptr = torch.tensor([0, 3, 5], dtype=torch.int32)
+    >>> prefix_lens = torch.tensor([2, 1], dtype=torch.int32)
+    >>> packed_mask, mask_indptr = flashinfer.build_tree_attention_mask(
+    ...     parents, parents_indptr, prefix_lens
+    ... )
+    >>> mask_indptr
+    tensor([0, 2, 3], dtype=torch.int32)
+
+    The outputs are passed to the ``plan`` methods of
+    :class:`flashinfer.BatchPrefillWithPagedKVCacheWrapper` and
+    :class:`flashinfer.BatchPrefillWithRaggedKVCacheWrapper` with
+    ``qo_indptr=parents_indptr``, ``packed_custom_mask=packed_mask`` and
+    ``mask_indptr=mask_indptr``.
+
+    Note
+    ----
+    The mask is built with tensor operations on the device of :attr:`parents`, the
+    ancestors are resolved by following the parents of all draft tokens in parallel,
+    so the number of steps is the depth of the deepest tree.
+    """
+    device = parents.device
+    parents_indptr = parents_indptr.to(device, torch.int64)
+    prefix_lens = prefix_lens.to(device, torch.int64)
+    num_drafts = parents_indptr[1:] - parents_indptr[:-1]
+    total = parents.numel()
+    batch_size = len(num_drafts)
+    if prefix_lens.shape != (batch_size,):
+        raise ValueError(
+            "prefix_lens should have shape [batch_size] = [{}], got {}.".format(
+                batch_size, tuple(prefix_lens.shape)
+            )
+        )
+    parents = parents.to(torch.int64)
+    request = torch.repeat_interleave(
+        torch.arange(batch_size, device=device), num_drafts, output_size=total
+    )
+    if bool(((parents < -1) | (parents >= num_drafts[request])).any()):
+        raise ValueError("The parents should be in [-1, number of drafts).")
+    global_parents = torch.where(parents >= 0, parents + parents_indptr[request], -1)
+
+    kv_lens = prefix_lens + num_drafts
+    max_kv_len = int(kv_lens.max()) if batch_size > 0 else 0
+    cols = torch.arange(max_kv_len, device=device)
+    # the padded [total, max_kv_len] masks, the prefix is visible to all drafts
+    mask = cols[None, :] < prefix_lens[request][:, None]
+    rows = torch.arange(total, device=device)
+    ancestors = rows
+    for _ in range(int(num_drafts.max()) if batch_size > 0 else 0):
+        valid = ancestors >= 0
+        if not bool(valid.any()):
+            break
+        mask[
+            rows[valid],
+            prefix_lens[request[valid]]
+            + ancestors[valid]
+            - parents_indptr[request[valid]],
+        ] = True
+        ancestors = torch.where(valid, global_parents[ancestors.clamp(min=0)], -1)
+    else:
+        if bool((ancestors >= 0).any()):
+            raise ValueError("The parents should form trees, found a cycle.")
+
+    # row-major selection of the unpadded masks flattens them request by request
+    mask = mask[cols[None, :] < kv_lens[request][:, None]]
+    bit_indptr = torch.zeros(batch_size + 1, dtype=torch.int32, device=device)
+    bit_indptr[1:] = torch.cumsum(num_drafts * kv_lens, 0)
+    return _segment_packbits(mask, bit_indptr)
+
+
+def _get_single_indptr(
+    packed_mask: torch.Tensor, qo_len: int, kv_len: int
+) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    # the segment layout of the packed mask of a single request
+    device = packed_mask.device
+    mask_indptr = torch.tensor([0, len(packed_mask)], dtype=torch.int32, device=device)
+    qo_lens = torch.tensor([qo_len], dtype=torch.int32, device=device)
+    kv_lens = torch.tensor([kv_len], dtype=torch.int32, device=device)
+    return mask_indptr, qo_lens, kv_lens
+
+
+def _check_packed_mask_layout(
+    packed_mask: torch.Tensor,
+    mask_indptr: torch.Tensor,
+    qo_lens: torch.Tensor,
+    kv_lens: torch.Tensor,
+) -> None:
+    if packed_mask.dtype != torch.uint8 or packed_mask.dim() != 1:
+        raise ValueError(
+            "The packed mask should be a 1D uint8 tensor, got {} of shape {}.".format(
+                packed_mask.dtype, tuple(packed_mask.shape)
+            )
+        )
+    batch_size = len(mask_indptr) - 1
+    if qo_lens.shape != (batch_size,) or kv_lens.shape != (batch_size,):
+        raise ValueError(
+            "qo_lens and kv_lens should have shape [batch_size] = [{}], got {} and "
+            "{}.".format(batch_size, tuple(qo_lens.shape), tuple(kv_lens.shape))
+        )
+    num_bytes = (qo_lens.to(torch.int64) * kv_lens.to(torch.int64) + 7) // 8
+    if not torch.equal(
+        (mask_indptr[1:] - mask_indptr[:-1]).to("cpu", torch.int64),
+        num_bytes.to("cpu"),
+    ):
+        raise ValueError(
+            "The mask_indptr does not match the packed [qo_len, kv_len] masks of the "
+            "requests."
+        )
+
+
+def _check_same_layout(x: torch.Tensor, y: torch.Tensor) -> None:
+    if x.dtype != torch.uint8 or y.dtype != torch.uint8:
+        raise ValueError(
+            "The packed masks should be uint8 tensors, got {} and {}.".format(
+                x.dtype, y.dtype
+            )
+        )
+    if x.shape != y.shape:
+        raise ValueError(
+            "The packed masks should have the same shape, got {} and {}.".format(
+                tuple(x.shape), tuple(y.shape)
+            )
+        )
+
+
+def packed_mask_and(x: torch.Tensor, y: torch.Tensor) -> torch.Tensor:
+    r"""Intersection of two packed masks of the same layout.
+
+    Parameters
+    ----------
+    x : torch.Tensor
+        The first packed mask, an uint8 tensor.
+    y : torch.Tensor
+        The second packed mask, of the same shape as :attr:`x`.
+
+    Returns
+    -------
+    torch.Tensor
+        The packed mask of the positions visible in both masks.
+
+    Note
+    ----
+    The operation is bytewise, it applies to masks packed with
+    :func:`flashinfer.quantization.packbits` as well as to the concatenated masks
+    packed with :func:`flashinfer.quantization.segment_packbits`, whatever the bitorder,
+    as long as both masks share the layout.
+    """
+    _check_same_layout(x, y)
+    return torch.bitwise_and(x, y)
+
+
+def packed_mask_or(x: torch.Tensor, y: torch.Tensor) -> torch.Tensor:
+    r"""Union of two packed masks of the same layout.
+
+    Parameters
+    ----------
+    x : torch.Tensor
+        The first packed mask, an uint8 tensor.
+    y : torch.Tensor
+        The second packed mask, of the same shape as :attr:`x`.
+
+    Returns
+    -------
+    torch.Tensor
+        The packed mask of the positions visible in either mask.
+
+    Note
+    ----
+    The operation is bytewise, see :func:`packed_mask_and`.
+    """
+    _check_same_layout(x, y)
+    return torch.bitwise_or(x, y)
+
+
+def segment_packed_mask_not(
+    packed_mask: torch.Tensor,
+    mask_indptr: torch.Tensor,
+    qo_lens: torch.Tensor,
+    kv_lens: torch.Tensor,
+) -> torch.Tensor:
+    r"""Complement of the packed custom masks of a batch of requests.
+
+    Parameters
+    ----------
+    packed_mask : torch.Tensor
+        The flattened ``[qo_len, kv_len]`` masks of the requests, each packed
+        separately in little bitorder, e.g. by
+        :func:`flashinfer.quantization.segment_packbits` or
+        :func:`build_tree_attention_mask`.
+    mask_indptr : torch.Tensor
+        The byte indptr of :attr:`packed_mask`, shape: ``[batch_size + 1]``.
+    qo_lens : torch.Tensor
+        The query length of each request, shape: ``[batch_size]``.
+    kv_lens : torch.Tensor
+        The kv length of each request, shape: ``[batch_size]``.
+
+    Returns
+    -------
+    torch.Tensor
+        The packed complement masks, of the same layout as :attr:`packed_mask`, the
+        padding bits of the last byte of each request stay cleared.
+    """
+    device = packed_mask.device
+    _check_packed_mask_layout(packed_mask, mask_indptr, qo_lens, kv_lens)
+    out = torch.bitwise_not(packed_mask)
+    # clear the padding bits of the last byte of each request
+    num_tail_bits = (qo_lens.to(device, torch.int32) * kv_lens.to(device)) % 8
+    last_byte = mask_indptr[1:].to(device, torch.int64) - 1
+    has_tail = num_tail_bits > 0
+    out[last_byte[has_tail]] &= ((1 << num_tail_bits[has_tail]) - 1).to(torch.uint8)
+    return out
+
+
+def packed_mask_not(
+    packed_mask: torch.Tensor, qo_len: int, kv_len: int
+) -> torch.Tensor:
+    r"""Complement of a packed custom mask.
+
+    Parameters
+    ----------
+    packed_mask : torch.Tensor
+        The flattened ``[qo_len, kv_len]`` mask packed in little bitorder, e.g. by
+        :func:`flashinfer.quantization.packbits`.
+    qo_len : int
+        The query length.
+    kv_len : int
+        The kv length.
+
+    Returns
+    -------
+    torch.Tensor
+        The packed complement mask, the padding bits of the last byte stay cleared.
+    """
+    return segment_packed_mask_not(
+        packed_mask, *_get_single_indptr(packed_mask, qo_len, kv_len)
+    )
+
+
+def _segment_packed_mask_apply_window_torch(
+    packed_mask: torch.Tensor,
+    mask_indptr: torch.Tensor,
+    qo_lens: torch.Tensor,
+    kv_lens: torch.Tensor,
+    window_left: torch.Tensor,
+    causal: bool,
+) -> torch.Tensor:
+    # torch implementation of the byte-parallel triton kernel, the bits of the bytes
+    # are expanded in [num_bytes, 8] int64 tensors
+    device = packed_mask.device
+    mask_indptr = mask_indptr.to(device, torch.int64)
+    num_bytes = mask_indptr[1:] - mask_indptr[:-1]
+    total = int(num_bytes.sum())
+    request = torch.repeat_interleave(
+        torch.arange(len(num_bytes), device=device), num_bytes, output_size=total
+    )
+    qo_len = qo_lens.to(device, torch.int64)[request][:, None]
+    kv_len = kv_lens.to(device, torch.int64)[request][:, None]
+    window_left = window_left.to(device, torch.int64)[request][:, None]
+    byte_idx = torch.arange(total, device=device) - (
+        mask_indptr[request] - mask_indptr[0]
+    )
+    offs_bit = torch.arange(8, device=device)
+    bit = byte_idx[:, None] * 8 + offs_bit[None, :]
+    col = bit % kv_len
+    q_pos = kv_len - qo_len + bit // kv_len
+    keep = bit < qo_len * kv_len
+    if causal:
+        keep &= col <= q_pos
+    keep &= (window_left < 0) | (col >= q_pos - window_left)
+    keep_byte = (keep.to(torch.int32) << offs_bit[None, :]).sum(dim=1)
+    out = packed_mask.clone()
+    out[mask_indptr[0] : mask_indptr[-1]] &= keep_byte.to(torch.uint8)
+    return out
+
+
+def segment_packed_mask_apply_window(
+    packed_mask: torch.Tensor,
+    mask_indptr: torch.Tensor,
+    qo_lens: torch.Tensor,
+    kv_lens: torch.Tensor,
+    window_left: Union[int, torch.Tensor] = -1,
+    causal: bool = True,
+) -> torch.Tensor:
+    r"""Apply the causal and sliding window masks to the packed custom masks of a batch
+    of requests, without unpacking them.
+
+    Parameters
+    ----------
+    packed_mask : torch.Tensor
+        The flattened ``[qo_len, kv_len]`` masks of the requests, each packed
+        separately in little bitorder, e.g. by
+        :func:`flashinfer.quantization.segment_packbits` or
+        :func:`build_tree_attention_mask`.
+    mask_indptr : torch.Tensor
+        The byte indptr of :attr:`packed_mask`, shape: ``[batch_size + 1]``.
+    qo_lens : torch.Tensor
+        The query length of each request, shape: ``[batch_size]``.
+    kv_lens : torch.Tensor
+        The kv length of each request, shape: ``[batch_size]``. The queries of a
+        request are its last ``qo_len`` kv tokens.
+    window_left : Union[int, torch.Tensor]
+        The left (inclusive) window size of the attention, or a tensor of shape
+        ``[batch_size]`` with the window size of each request, ``-1`` means no window.
+        Defaults to ``-1``.
+    causal : bool
+        Whether to apply the causal mask, defaults to ``True``.
+
+    Returns
+    -------
+    torch.Tensor
+        The packed masks, of the same layout as :attr:`packed_mask`, with the
+        positions outside the causal and window masks cleared.
+
+    Note
+    ----
+    On CUDA devices, a Triton kernel expands the bits of each byte in registers only,
+    so the op reads and writes the packed bytes once. The other devices use a torch
+    implementation.
+    """
+    device = packed_mask.device
+    _check_packed_mask_layout(packed_mask, mask_indptr, qo_lens, kv_lens)
+    batch_size = len(mask_indptr) - 1
+    window_left = _canonicalize_per_request_param(
+        window_left, batch_size, "window_left"
+    )
+    if not causal and not torch.is_tensor(window_left) and window_left < 0:
+        return packed_mask.clone()
+    qo_lens = qo_lens.to(device, torch.int32)
+    kv_lens = kv_lens.to(device, torch.int32)
+    if device.type == "cuda":
+        window_left_buf = None
+        if torch.is_tensor(window_left) or window_left >= 0:
+            window_left_buf = (
+                torch.as_tensor(window_left, dtype=torch.int32)
+                .expand(batch_size)
+                .to(device)
+            )
+        return _apply_window_triton(
+            packed_mask,
+            mask_indptr.to(device, torch.int32),
+            qo_lens,
+            kv_lens,
+            window_left_buf,
+            causal,
+        )
+    return _segment_packed_mask_apply_window_torch(
+        packed_mask,
+        mask_indptr,
+        qo_lens,
+        kv_lens,
+        torch.as_tensor(window_left).expand(batch_size),
+        causal,
+    )
+
+
+def packed_mask_apply_window(
+    packed_mask: torch.Tensor,
+    qo_len: int,
+    kv_len: int,
+    window_left: int = -1,
+    causal: bool = True,
+) -> torch.Tensor:
+    r"""Apply the causal and sliding window masks to a packed custom mask, without
+    unpacking it.
+
+    Parameters
+    ----------
+    packed_mask : torch.Tensor
+        The flattened ``[qo_len, kv_len]`` mask packed in little bitorder, e.g. by
+        :func:`flashinfer.quantization.packbits`.
+    qo_len : int
+        The query length.
+    kv_len : int
+        The kv length, the queries are the last ``qo_len`` kv tokens.
+    window_left : int
+        The left (inclusive) window size of the attention, ``-1`` means no window.
+        Defaults to ``-1``.
+    causal : bool
+        Whether to apply the causal mask, defaults to ``True``.
+
+    Returns
+    -------
+    torch.Tensor
+        The packed mask with the positions outside the causal and window masks
+        cleared.
+
+    Examples
+    --------
+
+    >>> import torch
+    >>> import flashinfer
+    >>> mask = torch.ones(2, 4, dtype=torch.bool, device="cuda")
+    >>> packed = flashinfer.packbits(mask.flatten(), bitorder="little")
+    >>> packed
+    tensor([255], device='cuda:0', dtype=torch.uint8)
+    >>> flashinfer.packed_mask_apply_window(packed, 2, 4, window_left=1)
+    tensor([198], device='cuda:0', dtype=torch.uint8)
+    """
+    return segment_packed_mask_apply_window(
+        packed_mask,
+        *_get_single_indptr(packed_mask, qo_len, kv_len),
+        window_left=window_left,
+        causal=causal,
+    )
@@ -0,0 +1,265 @@
+"""
+Copyright (c) 2025 by FlashInfer team.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from typing import Dict, List, Sequence, Tuple, Union
+
+import torch
+
+from .page import get_batch_indices_positions
+
+# The derived tensors of shape ``[batch_size]`` or ``[batch_size + 1]``, they are
+# packed into a single buffer and copied to the device together.
+_BATCH_TENSOR_NAMES = (
+    "qo_lens",
+    "kv_lens",
+    "qo_indptr",
+    "kv_indptr",
+    "kv_page_indptr",
+    "kv_last_page_len",
+    "mask_indptr",
+)
+
+
+def _as_int32_cpu(x: Union[torch.Tensor, Sequence[int]]) -> torch.Tensor:
+    if torch.is_tensor(x):
+        return x.to("cpu", torch.int32)
+    return torch.tensor(x, dtype=torch.int32)
+
+
+def _canonicalize_device(device: Union[str, torch.device]) -> torch.device:
+    device = torch.device(device)
+    if device.type == "cuda" and device.index is None:
+        device = torch.device("cuda", torch.cuda.current_device())
+    return device
+
+
+def _exclusive_cumsum(x: torch.Tensor) -> torch.Tensor:
+    ret = torch.zeros(x.shape[0] + 1, dtype=torch.int32)
+    torch.cumsum(x, 0, dtype=torch.int32, out=ret[1:])
+    return ret
+
+
+class BatchMetadata:
+    r"""Per-step batch metadata, the index tensors used by the attention wrappers and
+    the kv-cache append functions are derived from per-request query and kv lengths.
+
+    Every derived tensor is computed on host on first access and cached. On the first
+    request for a device, all batch-sized tensors (see :meth:`get`) are packed and
+    copied to the device with a single host-to-device copy, and the device tensors
+    are cached as well, so the metadata of a step is built once and shared by all
+    layers and wrappers.
+
+    Example
+    -------
+    >>> import torch
+    >>> import flashinfer
+    >>> metadata = flashinfer.BatchMetadata([3, 1], [7, 17], page_size=4)
+    >>> metadata.get("kv_page_indptr")
+    tensor([0, 2, 7], dtype=torch.int32)
+    >>> metadata.get("kv_last_page_len")
+    tensor([3, 1], dtype=torch.int32)
+    >>> metadata.get("mask_indptr")
+    tensor([ 0, 21, 38], dtype=torch.int32)
+    >>> batch_indices, positions = metadata.batch_indices_positions()
+    >>> positions
+    tensor([ 4,  5,  6, 16], dtype=torch.int32)
+    >>> wrapper = flashinfer.BatchPrefillWithPagedKVCacheWrapper(
+    ...     torch.empty(128 * 1024 * 1024, dtype=torch.uint8, device="cuda:0")
+    ... )
+    >>> wrapper.plan(
+    ...     None, None, kv_page_indices, None,
+    ...     num_qo_heads, num_kv_heads, head_dim, 4,
+    ...     batch_metadata=metadata,
+    ... )
+
+    Note
+    ----
+    The kv lengths include the query tokens of the current step, i.e. the query of
+    request ``i`` is located at positions ``[kv_lens[i] - qo_lens[i], kv_lens[i])``.
+    """
+
+    def __init__(
+        self,
+        qo_lens: Union[torch.Tensor, Sequence[int]],
+        kv_lens: Union[torch.Tensor, Sequence[int]],
+        page_size: int = 1,
+    ) -> None:
+        r"""Constructor of :class:`BatchMetadata`.
+
+        Parameters
+        ----------
+        qo_lens : Union[torch.Tensor, Sequence[int]]
+            The query length of each request, shape: ``[batch_size]``.
+        kv_lens : Union[torch.Tensor, Sequence[int]]
+            The kv length of each request (including the query tokens appended in
+            this step), shape: ``[batch_size]``.
+        page_size : int
+            The page size of the paged kv-cache, defaults to ``1``.
+        """
+        qo_lens = _as_int32_cpu(qo_lens)
+        kv_lens = _as_int32_cpu(kv_lens)
+        if qo_lens.shape != kv_lens.shape or qo_lens.dim() != 1:
+            raise ValueError(
+                "qo_lens and kv_lens should be 1-D tensors of the same shape, got {} and {}.".format(
+                    tuple(qo_lens.shape), tuple(kv_lens.shape)
+                )
+            )
+        if page_size <= 0:
+            raise ValueError("page_size should be positive, got {}.".format(page_size))
+        self._page_size = page_size
+        self._host: Dict[str, torch.Tensor] = {"qo_lens": qo_lens, "kv_lens": kv_lens}
+        self._device: Dict[Tuple[str, torch.device], torch.Tensor] = {}
+        self._batch_indices_positions: Dict[
+            torch.device, Tuple[torch.Tensor, torch.Tensor]
+        ] = {}
+
+    @property
+    def batch_size(self) -> int:
+        return len(self._host["qo_lens"])
+
+    @property
+    def page_size(self) -> int:
+        return self._page_size
+
+    @property
+    def nnz_qo(self) -> int:
+        r"""The total number of query tokens."""
+        return int(self.get("qo_indptr")[-1])
+
+    @property
+    def num_pages(self) -> int:
+        r"""The total number of pages used by the batch."""
+        return int(self.get("kv_page_indptr")[-1])
+
+    def _compute(self, name: str) -> torch.Tensor:
+        if name == "qo_indptr":
+            return _exclusive_cumsum(self.get("qo_lens"))
+        if name == "kv_indptr":
+            return _exclusive_cumsum(self.get("kv_lens"))
+        if name == "kv_page_indptr":
+            num_pages = torch.div(
+                self.get("kv_lens") + self._page_size - 1,
+                self._page_size,
+                rounding_mode="floor",
+            )
+            return _exclusive_cumsum(num_pages)
+        if name == "kv_last_page_len":
+            kv_lens = self.get("kv_lens")
+            return torch.where(
+                kv_lens > 0, (kv_lens - 1) % self._page_size + 1, kv_lens
+            )
+        if name == "mask_indptr":
+            return _exclusive_cumsum(self.get("qo_lens") * self.get("kv_lens"))
+        raise KeyError(
+            "Unrecognized batch metadata {}, expect one of {}.".format(
+                name, _BATCH_TENSOR_NAMES
+            )
+        )
+
+    def _copy_to_device(self, device: torch.device) -> None:
+        host = [self.get(name) for name in _BATCH_TENSOR_NAMES]
+        packed = torch.cat(host)
+        if device.type == "cuda":
+            packed = packed.pin_memory()
+        packed = packed.to(device, non_blocking=True)
+        for name, x in zip(_BATCH_TENSOR_NAMES, packed.split([len(x) for x in host])):
+            self._device[(name, device)] = x
+
+    def get(self, name: str, device: Union[str, torch.device] = "cpu") -> torch.Tensor:
+        r"""Return a derived int32 tensor, computing and caching it on first access.
+
+        Parameters
+        ----------
+        name : str
+            The name of the tensor, one of:
+
+            * ``qo_lens``, ``kv_lens``: the per-request lengths, shape: ``[batch_size]``.
+            * ``qo_indptr``, ``kv_indptr``: the indptr of the ragged query and kv
+              tensors, shape: ``[batch_size + 1]``.
+            * ``kv_page_indptr``, ``kv_last_page_len``: the page indptr and the last page
+              length of the paged kv-cache, shape: ``[batch_size + 1]`` and ``[batch_size]``.
+            * ``mask_indptr``: the indptr of the flattened custom mask,
+              shape: ``[batch_size + 1]``.
+        device : Union[str, torch.device]
+            The device of the returned tensor, defaults to ``cpu``.
+
+        Returns
+        -------
+        torch.Tensor
+            The requested tensor, callers should not modify it in-place.
+        """
+        device = _canonicalize_device(device)
+        if device.type == "cpu":
+            x = self._host.get(name)
+            if x is None:
+                x = self._compute(name)
+                self._host[name] = x
+            return x
+        if name not in _BATCH_TENSOR_NAMES:
+            raise KeyError(
+                "Unrecognized batch metadata {}, expect one of {}.".format(
+                    name, _BATCH_TENSOR_NAMES
+                )
+            )
+        key = (name, device)
+        if key not in self._device:
+            self._copy_to_device(device)
+        return self._device[key]
+
+    def get_tensors(
+        self, names: List[str], device: Union[str, torch.device] = "cpu"
+    ) -> Tuple[torch.Tensor, ...]:
+        r"""Return multiple derived tensors, see :meth:`get`."""
+        return tuple(self.get(name, device) for name in names)
+
+    def batch_indices_positions(
+        self, device: Union[str, torch.device] = "cpu"
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        r"""Return the batch index and the position of each query token, used by
+        :func:`flashinfer.page.append_paged_kv_cache` to append the kv of the query
+        tokens to the paged kv-cache.
+
+        Parameters
+        ----------
+        device : Union[str, torch.device]
+            The device of the returned tensors, defaults to ``cpu``.
+
+        Returns
+        -------
+        batch_indices : torch.Tensor
+            The batch index of each query token, shape: ``[nnz_qo]``.
+        positions : torch.Tensor
+            The position of each query token, shape: ``[nnz_qo]``.
+
+        See Also
+        --------
+        flashinfer.page.get_batch_indices_positions
+        """
+        device = _canonicalize_device(device)
+        if device not in self._batch_indices_positions:
+            self._batch_indices_positions[device] = get_batch_indices_positions(
+                *self.get_tensors(["qo_indptr", "kv_lens"], device), self.nnz_qo
+            )
+        return self._batch_indices_positions[device]
+
+
+def _check_batch_metadata_page_size(batch_metadata: BatchMetadata, page_size: int):
+    if batch_metadata.page_size != page_size:
+        raise ValueError(
+            "The page size of batch_metadata {} mismatches the page size {}.".format(
+                batch_metadata.page_size, page_size
+            )
+        )
@@ -14,7 +14,7 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
-from typing import Optional, Tuple, Union
+from typing import List, NamedTuple, Optional, Tuple, Union
 
 import torch
 import triton
@@ -51,6 +51,125 @@ def get_page_module():
     return _page_module
 
 
+class RunLengthPageIndices(NamedTuple):
+    r"""Run-length encoded page indices of a paged kv-cache.
+
+    The flattened page indices (``kv_indices``) of all requests are stored as runs of
+    consecutive page ids, the ``i``-th run stands for pages
+    ``starts[i], starts[i] + 1, ..., starts[i] + lengths[i] - 1``. The runs are
+    concatenated in the same order as ``kv_indices``, so the page indptr
+    (``kv_indptr``) is unchanged and a run may span multiple requests.
+
+    For requests that own long contiguous page runs, the metadata is proportional to
+    the number of runs instead of the number of pages. :class:`RunLengthPageIndices`
+    can be passed wherever ``kv_indices`` is accepted by :func:`append_paged_kv_cache`
+    and friends, and by the ``plan`` methods of
+    :class:`flashinfer.decode.BatchDecodeWithPagedKVCacheWrapper` and
+    :class:`flashinfer.prefill.BatchPrefillWithPagedKVCacheWrapper`.
+
+    Attributes
+    ----------
+    starts : torch.Tensor
+        The first page id of each run, shape: ``[num_runs]``.
+    lengths : torch.Tensor
+        The number of pages of each run, shape: ``[num_runs]``.
+    """
+
+    starts: torch.Tensor
+    lengths: torch.Tensor
+
+    @staticmethod
+    def encode(kv_indices: torch.Tensor) -> "RunLengthPageIndices":
+        r"""Run-length encode flattened page indices.
+
+        Parameters
+        ----------
+        kv_indices : torch.Tensor
+            The page indices of the paged kv-cache, shape: ``[kv_indptr[-1]]``.
+
+        Returns
+        -------
+        RunLengthPageIndices
+            The run-length encoded page indices, on the same device as :attr:`kv_indices`.
+        """
+        kv_indices = kv_indices.to(torch.int32)
+        is_run_start = torch.ones_like(kv_indices, dtype=torch.bool)
+        is_run_start[1:] = kv_indices[1:] != kv_indices[:-1] + 1
+        run_offsets = torch.nonzero(is_run_start).view(-1)
+        lengths = torch.diff(
+            run_offsets,
+            append=torch.tensor([len(kv_indices)], device=kv_indices.device),
+        )
+        return RunLengthPageIndices(kv_indices[run_offsets], lengths.to(torch.int32))
+
+    @property
+    def num_pages(self) -> int:
+        return int(self.lengths.sum().item())
+
+    def to(self, *args, **kwargs) -> "RunLengthPageIndices":
+        return RunLengthPageIndices(
+            self.starts.to(*args, **kwargs), self.lengths.to(*args, **kwargs)
+        )
+
+    def expand(self, num_pages: Optional[int] = None) -> torch.Tensor:
+        r"""Expand the runs to flattened page indices.
+
+        Parameters
+        ----------
+        num_pages : Optional[int]
+            The total number of pages (``kv_indptr[-1]``), providing it avoids a
+            device-to-host synchronization.
+
+        Returns
+        -------
+        torch.Tensor
+            The int32 flattened page indices, shape: ``[num_pages]``.
+        """
+        if num_pages is None:
+            num_pages = self.num_pages
+        lengths = self.lengths.long()
+        run_begin = torch.cumsum(lengths, 0) - lengths
+        return (
+            torch.arange(num_pages, device=self.starts.device)
+            + torch.repeat_interleave(
+                self.starts.long() - run_begin, lengths, output_size=num_pages
+            )
+        ).to(torch.int32)
+
+    def lookup(self, offsets: torch.Tensor) -> torch.Tensor:
+        r"""Return ``kv_indices[offsets]`` without expanding the runs.
+
+        Parameters
+        ----------
+        offsets : torch.Tensor
+            The offsets into the flattened page indices.
+
+        Returns
+        -------
+        torch.Tensor
+            The int64 page ids at :attr:`offsets`.
+        """
+        lengths = self.lengths.long()
+        run_end = torch.cumsum(lengths, 0)
+        runs = torch.searchsorted(run_end, offsets.long(), right=True)
+        return self.starts.long()[runs] + offsets.long() - (run_end - lengths)[runs]
+
+
+def _expand_page_indices(
+    kv_indices: Union[torch.Tensor, RunLengthPageIndices],
+    kv_indptr: torch.Tensor,
+    device: torch.device,
+    non_blocking: bool = False,
+) -> torch.Tensor:
+    # NOTE: only the runs are copied to the device, the flattened page indices
+    # consumed by the kernels are materialized there.
+    if not isinstance(kv_indices, RunLengthPageIndices):
+        return kv_indices
+    return kv_indices.to(device, non_blocking=non_blocking).expand(
+        int(kv_indptr[-1].item())
+    )
+
+
 def block_sparse_indices_to_vector_sparse_offsets(
     block_sparse_indices: torch.Tensor,
     block_sparse_indptr: torch.Tensor,
@@ -142,6 +261,60 @@ def _fake_append_paged_kv_cache_kernel(
     pass
 
 
+def _get_page_entry_ids(
+    batch_indices: torch.Tensor,
+    positions: torch.Tensor,
+    kv_indices: Union[torch.Tensor, RunLengthPageIndices],
+    kv_indptr: torch.Tensor,
+    page_size: int,
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    # map (batch index, position) of each appended entry to (page id, entry in page)
+    positions = positions.long()
+    offsets = kv_indptr.long()[batch_indices.long()] + positions // page_size
+    if isinstance(kv_indices, RunLengthPageIndices):
+        page_ids = kv_indices.lookup(offsets)
+    else:
+        page_ids = kv_indices.long()[offsets]
+    return page_ids, positions % page_size
+
+
+def _scatter_page_entries(
+    cache: torch.Tensor,
+    page_ids: torch.Tensor,
+    entry_ids: torch.Tensor,
+    x: torch.Tensor,
+    kv_layout: str,
+) -> None:
+    # cache[page_ids[i], entry_ids[i]] = x[i]
+    if kv_layout == "NHD":
+        cache[page_ids, entry_ids] = x.to(cache.dtype)
+    else:
+        cache[page_ids, :, entry_ids] = x.to(cache.dtype)
+
+
+def _append_paged_kv_cache_torch(
+    append_key: torch.Tensor,
+    append_value: torch.Tensor,
+    batch_indices: torch.Tensor,
+    positions: torch.Tensor,
+    paged_k_cache: torch.Tensor,
+    paged_v_cache: torch.Tensor,
+    kv_indices: Union[torch.Tensor, RunLengthPageIndices],
+    kv_indptr: torch.Tensor,
+    kv_last_page_len: torch.Tensor,
+    layout: int,
+) -> None:
+    # NOTE: vectorized torch implementation of append_paged_kv_cache, used on
+    # devices without the cuda kernel (e.g. cpu).
+    page_size = paged_k_cache.shape[1 if layout == TensorLayout.NHD.value else 2]
+    page_ids, entry_ids = _get_page_entry_ids(
+        batch_indices, positions, kv_indices, kv_indptr, page_size
+    )
+    kv_layout = TensorLayout(layout).name
+    _scatter_page_entries(paged_k_cache, page_ids, entry_ids, append_key, kv_layout)
+    _scatter_page_entries(paged_v_cache, page_ids, entry_ids, append_value, kv_layout)
+
+
 @triton.jit
 def get_batch_indices_positions_kernel(
     append_indptr,
@@ -203,11 +376,16 @@ def get_batch_indices_positions(
     conversion in cuSPARSE library, with the difference that we are converting from a ragged
     tensor (which don't require a column indices array) to a COO format.
 
+    If :attr:`append_indptr` is on cpu, a vectorized PyTorch implementation is used
+    instead of the triton kernel.
+
     See Also
     --------
     append_paged_kv_cache
     """
     batch_size = append_indptr.size(0) - 1
+    if append_indptr.device.type == "cpu":
+        return _get_batch_indices_positions_torch(append_indptr, seq_lens, nnz)
     batch_indices = torch.empty((nnz,), device=append_indptr.device, dtype=torch.int32)
     positions = torch.empty((nnz,), device=append_indptr.device, dtype=torch.int32)
     get_batch_indices_positions_kernel[(batch_size,)](
@@ -216,6 +394,33 @@ def get_batch_indices_positions(
     return batch_indices, positions
 
 
+def _get_batch_indices_positions_torch(
+    append_indptr: torch.Tensor, seq_lens: torch.Tensor, nnz: int
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    # NOTE: vectorized torch implementation of get_batch_indices_positions, used on
+    # devices without triton support (e.g. cpu).
+    device = append_indptr.device
+    batch_size = append_indptr.size(0) - 1
+    append_indptr = append_indptr.to(device, torch.int64)
+    seq_lens = seq_lens.to(device, torch.int64)
+    total = int(append_indptr[-1].item())
+    batch_indices = torch.empty((nnz,), device=device, dtype=torch.int32)
+    positions = torch.empty((nnz,), device=device, dtype=torch.int32)
+    batch_indices_total = torch.repeat_interleave(
+        torch.arange(batch_size, device=device),
+        append_indptr[1:] - append_indptr[:-1],
+        output_size=total,
+    )
+    # positions[i] = i + seq_lens[b] - append_indptr[b + 1]
+    positions_total = (
+        torch.arange(total, device=device)
+        + (seq_lens - append_indptr[1:])[batch_indices_total]
+    )
+    batch_indices[:total] = batch_indices_total[:nnz]
+    positions[:total] = positions_total[:nnz]
+    return batch_indices, positions
+
+
 def get_seq_lens(
     kv_indptr: torch.Tensor, kv_last_page_len: torch.Tensor, page_size: int
 ) -> torch.Tensor:
@@ -242,16 +447,391 @@ def get_seq_lens(
     )
 
 
+def reclaim_sliding_window_pages(
+    kv_indptr: torch.Tensor,
+    kv_indices: torch.Tensor,
+    kv_last_page_len: torch.Tensor,
+    page_size: int,
+    window_left: int,
+    qo_lens: Optional[torch.Tensor] = None,
+) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+    r"""Drop the leading pages of each request that lie entirely outside of the
+    attention window of a sliding window (``window_left >= 0``) layer.
+
+    The query at position ``p`` attends to the kv positions ``[p - window_left, p]``,
+    so the pages before position ``kv_len - qo_len - window_left`` are never read again.
+    They are removed from the page table and returned for the caller to release.
+
+    Parameters
+    ----------
+    kv_indptr : torch.Tensor
+        The indptr of the paged kv-cache, shape: ``[batch_size + 1]``.
+    kv_indices : torch.Tensor
+        The page indices of the paged kv-cache, shape: ``[kv_indptr[-1]]``.
+    kv_last_page_len : torch.Tensor
+        The number of entries in the last page of each request in the paged kv cache,
+        shape: ``[batch_size]``.
+    page_size : int
+        The size of a page in the paged kv-cache.
+    window_left : int
+        The left (inclusive) window size of the layer, ``-1`` disables reclamation.
+    qo_lens : Optional[torch.Tensor]
+        The number of queries of each request in the next step, shape: ``[batch_size]``,
+        defaults to ``1`` (decode). The kv lengths include the queries.
+
+    Returns
+    -------
+    kv_indptr : torch.Tensor
+        The indptr of the trimmed page table, shape: ``[batch_size + 1]``.
+    kv_indices : torch.Tensor
+        The page indices of the trimmed page table, shape: ``[kv_indptr[-1]]``.
+    kv_last_page_len : torch.Tensor
+        The last page lengths of the trimmed page table (unchanged), shape: ``[batch_size]``.
+    released_page_ids : torch.Tensor
+        The dropped page indices, shape: ``[num_released_pages]``.
+    kv_offsets : torch.Tensor
+        The number of dropped tokens of each request, shape: ``[batch_size]``. Positions
+        in the trimmed page table are the sequence positions minus :attr:`kv_offsets`.
+
+    Example
+    -------
+    >>> import torch
+    >>> import flashinfer
+    >>> kv_indptr = torch.tensor([0, 4, 5], dtype=torch.int32)
+    >>> kv_indices = torch.tensor([3, 8, 1, 6, 2], dtype=torch.int32)
+    >>> kv_last_page_len = torch.tensor([2, 3], dtype=torch.int32)
+    >>> kv_indptr, kv_indices, kv_last_page_len, released, kv_offsets = (
+    ...     flashinfer.reclaim_sliding_window_pages(
+    ...         kv_indptr, kv_indices, kv_last_page_len, 4, window_left=4
+    ...     )
+    ... )
+    >>> kv_indices
+    tensor([1, 6, 2], dtype=torch.int32)
+    >>> released
+    tensor([3, 8], dtype=torch.int32)
+    >>> kv_offsets
+    tensor([8, 0], dtype=torch.int32)
+
+    Note
+    ----
+    Dropping leading pages shifts the kv positions of a request and the positions of
+    its queries by the same amount, the sliding window, causal mask, ALiBi bias and
+    in-kernel RoPE only depend on relative positions, so the trimmed page table can be
+    passed to the ``plan`` methods of the decode and prefill wrappers as is. Positions
+    used to append to the trimmed page table should be offset by :attr:`kv_offsets`.
+    The page memory is O(window) instead of O(sequence) if this is applied every step.
+
+    See Also
+    --------
+    get_seq_lens
+    """
+    device = kv_indices.device
+    kv_indptr = kv_indptr.to(device)
+    kv_last_page_len = kv_last_page_len.to(device)
+    num_pages = (kv_indptr[1:] - kv_indptr[:-1]).long()
+    num_dropped = _get_num_unread_pages(
+        num_pages,
+        get_seq_lens(kv_indptr, kv_last_page_len, page_size),
+        page_size,
+        qo_lens,
+        window_left=window_left,
+    )
+    return _drop_pages(
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        page_size,
+        torch.zeros_like(num_pages),
+        num_dropped,
+    )
+
+
+def _get_num_unread_pages(
+    num_pages: torch.Tensor,
+    kv_lens: torch.Tensor,
+    page_size: int,
+    qo_lens: Optional[torch.Tensor] = None,
+    window_left: Union[int, torch.Tensor] = -1,
+    chunk_size: int = 0,
+) -> torch.Tensor:
+    # the number of leading pages of each request that its queries never read, the
+    # pages before the window (window_left >= 0, per request if a tensor) and before
+    # the aligned chunk (chunk_size > 0) of its first query, the queries are the last
+    # qo_lens (defaults to 1) tokens of the kv and the last page is always kept
+    device = kv_lens.device
+    kv_lens = kv_lens.long()
+    if qo_lens is None:
+        qo_lens = torch.ones_like(kv_lens)
+    first_pos = torch.clamp(kv_lens - qo_lens.to(device).long(), min=0)
+    window = torch.as_tensor(window_left, device=device).long()
+    begin = torch.where(window >= 0, torch.clamp(first_pos - window, min=0), 0)
+    if chunk_size > 0:
+        begin = torch.maximum(begin, first_pos // chunk_size * chunk_size)
+    return torch.minimum(
+        begin // page_size, torch.clamp(num_pages.to(device).long() - 1, min=0)
+    )
+
+
+def _drop_unread_pages(
+    kv_indptr: torch.Tensor,
+    kv_indices: torch.Tensor,
+    kv_last_page_len: torch.Tensor,
+    page_size: int,
+    qo_lens: Optional[torch.Tensor] = None,
+    window_left: Union[int, torch.Tensor] = -1,
+    chunk_size: int = 0,
+) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    # drop the leading pages of each request never read by its queries (see
+    # _get_num_unread_pages). Returns the trimmed (kv_indptr, kv_indices), on the
+    # device of kv_indices, and the number of dropped tokens of each request.
+    device = kv_indices.device
+    kv_indptr = kv_indptr.to(device)
+    kv_last_page_len = kv_last_page_len.to(device)
+    num_pages = (kv_indptr[1:] - kv_indptr[:-1]).long()
+    num_dropped = _get_num_unread_pages(
+        num_pages,
+        get_seq_lens(kv_indptr, kv_last_page_len, page_size),
+        page_size,
+        qo_lens,
+        window_left,
+        chunk_size,
+    )
+    kv_indptr, kv_indices, _, _, kv_offsets = _drop_pages(
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        page_size,
+        torch.zeros_like(num_pages),
+        num_dropped,
+    )
+    return kv_indptr, kv_indices, kv_offsets
+
+
+def _split_chunked_paged_kv(
+    qo_indptr: torch.Tensor,
+    kv_indptr: torch.Tensor,
+    kv_indices: torch.Tensor,
+    kv_last_page_len: torch.Tensor,
+    page_size: int,
+    chunk_size: int,
+) -> Tuple[torch.Tensor, ...]:
+    # chunked local attention as plain attention over sub-requests, for the kernels
+    # without a chunk mask: the queries of each request are split by their aligned
+    # chunk, and each sub-request only reads the pages of its chunk. The queries stay
+    # in order and remain the last positions of the kv of their sub-request, so the
+    # causal mask is unchanged. Returns the (qo_indptr, kv_indptr, kv_indices,
+    # kv_last_page_len) of the sub-requests, on the device of kv_indices, the position
+    # of the first key of each sub-request in its sequence, which is before the chunk
+    # (in its first page) if chunk_size is not a multiple of page_size, and the request
+    # of each sub-request.
+    device = kv_indices.device
+    qo_indptr = qo_indptr.to(device, torch.int64)
+    kv_indptr = kv_indptr.to(device, torch.int64)
+    kv_last_page_len = kv_last_page_len.to(device, torch.int64)
+    qo_lens = qo_indptr[1:] - qo_indptr[:-1]
+    kv_lens = get_seq_lens(kv_indptr, kv_last_page_len, page_size)
+    first_pos = torch.clamp(kv_lens - qo_lens, min=0)
+    last_chunk = torch.clamp(kv_lens - 1, min=0) // chunk_size
+    first_chunk = torch.minimum(first_pos // chunk_size, last_chunk)
+    num_chunks = last_chunk - first_chunk + 1
+    num_sub = int(num_chunks.sum())
+    request = torch.repeat_interleave(
+        torch.arange(len(qo_lens), device=device), num_chunks, output_size=num_sub
+    )
+    sub_begin = torch.cumsum(num_chunks, 0) - num_chunks
+    chunk = first_chunk[request] + torch.arange(num_sub, device=device)
+    chunk = chunk - sub_begin[request]
+    chunk_begin = chunk * chunk_size
+    chunk_end = torch.minimum(chunk_begin + chunk_size, kv_lens[request])
+    qo_lens = torch.clamp(
+        chunk_end - torch.maximum(chunk_begin, first_pos[request]), min=0
+    )
+    # the sub-request of a chunk reads the pages of its chunk
+    num_pages = (chunk_end + page_size - 1) // page_size
+    page_begin = _get_num_unread_pages(
+        num_pages, chunk_end, page_size, qo_lens, chunk_size=chunk_size
+    )
+    num_pages = num_pages - page_begin
+    num_sub_pages = int(num_pages.sum())
+    sub = torch.repeat_interleave(
+        torch.arange(num_sub, device=device), num_pages, output_size=num_sub_pages
+    )
+    sub_kv_indptr = torch.zeros(num_sub + 1, dtype=torch.int64, device=device)
+    torch.cumsum(num_pages, 0, out=sub_kv_indptr[1:])
+    page_pos = kv_indptr[request][sub] + page_begin[sub]
+    page_pos = page_pos + torch.arange(num_sub_pages, device=device)
+    page_pos = page_pos - sub_kv_indptr[sub]
+    sub_qo_indptr = torch.zeros(num_sub + 1, dtype=torch.int64, device=device)
+    torch.cumsum(qo_lens, 0, out=sub_qo_indptr[1:])
+    return (
+        sub_qo_indptr.int(),
+        sub_kv_indptr.int(),
+        kv_indices[page_pos],
+        (chunk_end - (page_begin + num_pages - 1) * page_size).int(),
+        (page_begin * page_size).int(),
+        request,
+    )
+
+
+def _truncate_paged_kv(
+    kv_indptr: torch.Tensor,
+    kv_indices: torch.Tensor,
+    page_size: int,
+    kv_lens: torch.Tensor,
+) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    # keep the pages of the first kv_lens[i] tokens of each request (at most its
+    # length), returns the (kv_indptr, kv_indices, kv_last_page_len) of the truncated
+    # page table on the device of kv_indices, requests truncated to no token have no
+    # page and a last page length of 0
+    device = kv_indices.device
+    kv_indptr = kv_indptr.to(device)
+    kv_lens = kv_lens.to(device).long()
+    num_pages = (kv_indptr[1:] - kv_indptr[:-1]).long()
+    num_kept = (kv_lens + page_size - 1) // page_size
+    kv_last_page_len = (kv_lens - torch.clamp(num_kept - 1, min=0) * page_size).int()
+    kv_indptr, kv_indices, _, _, _ = _drop_pages(
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        page_size,
+        num_kept,
+        num_pages - num_kept,
+    )
+    return kv_indptr, kv_indices, kv_last_page_len
+
+
+def _drop_pages(
+    kv_indptr: torch.Tensor,
+    kv_indices: torch.Tensor,
+    kv_last_page_len: torch.Tensor,
+    page_size: int,
+    drop_begin: torch.Tensor,
+    num_dropped: torch.Tensor,
+) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+    # drop pages [drop_begin[i], drop_begin[i] + num_dropped[i]) of each request
+    device = kv_indices.device
+    num_pages = (kv_indptr[1:] - kv_indptr[:-1]).long()
+    total = int(kv_indptr[-1].item())
+    batch_indices = torch.repeat_interleave(
+        torch.arange(len(num_pages), device=device), num_pages, output_size=total
+    )
+    page_offsets = torch.arange(total, device=device) - kv_indptr.long()[batch_indices]
+    page_offsets = page_offsets - drop_begin[batch_indices]
+    keep = (page_offsets < 0) | (page_offsets >= num_dropped[batch_indices])
+    new_kv_indptr = torch.zeros_like(kv_indptr)
+    torch.cumsum(num_pages - num_dropped, 0, out=new_kv_indptr[1:])
+    kv_indices = kv_indices[:total]
+    return (
+        new_kv_indptr,
+        kv_indices[keep],
+        kv_last_page_len,
+        kv_indices[~keep],
+        (num_dropped * page_size).to(kv_last_page_len.dtype),
+    )
+
+
+def retain_sink_and_window_pages(
+    kv_indptr: torch.Tensor,
+    kv_indices: torch.Tensor,
+    kv_last_page_len: torch.Tensor,
+    page_size: int,
+    num_sink_tokens: int,
+    window_left: int,
+    qo_lens: Optional[torch.Tensor] = None,
+) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+    r"""Evict the middle pages of each request, retaining the attention sink pages and
+    the pages of the recent window, as in `StreamingLLM <https://arxiv.org/abs/2309.17453>`_.
+
+    The first ``ceil(num_sink_tokens / page_size)`` pages and the pages covering kv
+    positions ``[kv_len - qo_len - window_left, kv_len)`` are retained, the pages in
+    between are removed from the page table and returned for the caller to release.
+
+    Parameters
+    ----------
+    kv_indptr : torch.Tensor
+        The indptr of the paged kv-cache, shape: ``[batch_size + 1]``.
+    kv_indices : torch.Tensor
+        The page indices of the paged kv-cache, shape: ``[kv_indptr[-1]]``.
+    kv_last_page_len : torch.Tensor
+        The number of entries in the last page of each request in the paged kv cache,
+        shape: ``[batch_size]``.
+    page_size : int
+        The size of a page in the paged kv-cache.
+    num_sink_tokens : int
+        The number of attention sink tokens at the beginning of each request, rounded
+        up to whole pages.
+    window_left : int
+        The number of recent tokens retained before the first query of the next step.
+    qo_lens : Optional[torch.Tensor]
+        The number of queries of each request in the next step, shape: ``[batch_size]``,
+        defaults to ``1`` (decode). The kv lengths include the queries.
+
+    Returns
+    -------
+    kv_indptr : torch.Tensor
+        The indptr of the retained page table, shape: ``[batch_size + 1]``.
+    kv_indices : torch.Tensor
+        The page indices of the retained page table, shape: ``[kv_indptr[-1]]``.
+    kv_last_page_len : torch.Tensor
+        The last page lengths of the retained page table (unchanged), shape: ``[batch_size]``.
+    released_page_ids : torch.Tensor
+        The evicted page indices, shape: ``[num_released_pages]``.
+    kv_offsets : torch.Tensor
+        The number of evicted tokens of each request, shape: ``[batch_size]``. New tokens
+        are appended to the retained page table at ``position - kv_offsets``.
+
+    Note
+    ----
+    The keys must be stored without rotary embedding and the wrappers planned with
+    ``pos_encoding_mode="ROPE_LLAMA"``: the kernels apply RoPE with the positions in
+    the retained cache (the sink tokens keep their positions and the window follows
+    them), which is the position re-basing of StreamingLLM. The kv memory and the
+    per-token attention cost are then bounded by ``num_sink_tokens + window_left``.
+    :func:`flashinfer.torch_attention.paged_attention_torch` is the pure PyTorch
+    reference of the attention on the retained cache.
+
+    See Also
+    --------
+    reclaim_sliding_window_pages
+    """
+    device = kv_indices.device
+    kv_indptr = kv_indptr.to(device)
+    kv_last_page_len = kv_last_page_len.to(device)
+    num_pages = (kv_indptr[1:] - kv_indptr[:-1]).long()
+    num_sink_pages = torch.clamp(
+        num_pages, max=(num_sink_tokens + page_size - 1) // page_size
+    )
+    window_begin = torch.maximum(
+        _get_num_unread_pages(
+            num_pages,
+            get_seq_lens(kv_indptr, kv_last_page_len, page_size),
+            page_size,
+            qo_lens,
+            window_left=window_left,
+        ),
+        num_sink_pages,
+    )
+    return _drop_pages(
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        page_size,
+        num_sink_pages,
+        window_begin - num_sink_pages,
+    )
+
+
 def append_paged_kv_cache(
     append_key: torch.Tensor,
     append_value: torch.Tensor,
     batch_indices: torch.Tensor,
     positions: torch.Tensor,
     paged_kv_cache: Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]],
-    kv_indices: torch.Tensor,
+    kv_indices: Union[torch.Tensor, RunLengthPageIndices],
     kv_indptr: torch.Tensor,
     kv_last_page_len: torch.Tensor,
     kv_layout: str = "NHD",
+    page_key_summary: Optional[torch.Tensor] = None,
 ) -> None:
     r"""Append a batch of key-value pairs to a paged key-value cache.
 
@@ -281,8 +861,9 @@ def append_paged_kv_cache(
           :attr:`kv_layout` is ``HND``. Where ``paged_kv_cache[:, 0]`` is the key-cache and
           ``paged_kv_cache[:, 1]`` is the value-cache.
 
-    kv_indices : torch.Tensor
-        The page indices of the paged kv-cache, shape: ``[kv_indptr[-1]]``.
+    kv_indices : Union[torch.Tensor, RunLengthPageIndices]
+        The page indices of the paged kv-cache, shape: ``[kv_indptr[-1]]``, or their
+        run-length encoding.
     kv_indptr : torch.Tensor
         The indptr of the paged kv-cache, shape: ``[batch_size + 1]``.
     kv_last_page_len : torch.Tensor
@@ -290,6 +871,10 @@ def append_paged_kv_cache(
         shape: ``[batch_size]``.
     kv_layout : str
         The layout of the paged kv-cache, either ``NHD`` or ``HND``.
+    page_key_summary : Optional[torch.Tensor]
+        If provided, the per-page elementwise min/max of the keys (see
+        :func:`compute_page_key_summary`) are updated in-place with the appended keys,
+        shape: ``[max_num_pages, 2, num_kv_heads, head_dim]``.
 
     Example
     -------
@@ -353,12 +938,21 @@ def append_paged_kv_cache(
     which means :attr:`kv_indices`, :attr:`kv_indptr`, :attr:`kv_last_page_len` has
     incorporated appended k/v.
 
+    If the tensors are on cpu, a vectorized PyTorch implementation is used instead of
+    the cuda kernel.
+
     See Also
     --------
     get_batch_indices_positions
     """
     _check_kv_layout(kv_layout)
-    _append_paged_kv_cache_kernel(
+    if append_key.device.type == "cpu":
+        append_fn = _append_paged_kv_cache_torch
+    else:
+        append_fn = _append_paged_kv_cache_kernel
+        if isinstance(kv_indices, RunLengthPageIndices):
+            kv_indices = kv_indices.expand()
+    append_fn(
         append_key,
         append_value,
         batch_indices,
@@ -369,3 +963,913 @@ def append_paged_kv_cache(
         kv_last_page_len,
         TensorLayout[kv_layout].value,
     )
+    if page_key_summary is not None:
+        k_cache, _ = _unpack_paged_kv_cache(paged_kv_cache, kv_layout)
+        page_size = k_cache.shape[1 if kv_layout == "NHD" else 2]
+        page_ids, entry_ids = _get_page_entry_ids(
+            batch_indices, positions, kv_indices, kv_indptr, page_size
+        )
+        _update_page_key_summary(page_key_summary, page_ids, entry_ids, append_key)
+
+
+def _update_page_key_summary(
+    page_key_summary: torch.Tensor,
+    page_ids: torch.Tensor,
+    entry_ids: torch.Tensor,
+    append_key: torch.Tensor,
+) -> None:
+    # pages whose first entry is appended are (re)allocated, reset their summary
+    fresh_page_ids = page_ids[entry_ids == 0]
+    page_key_summary[fresh_page_ids, 0] = float("inf")
+    page_key_summary[fresh_page_ids, 1] = float("-inf")
+    index = page_ids.view(-1, 1, 1).expand_as(append_key)
+    append_key = append_key.to(page_key_summary.dtype)
+    page_key_summary[:, 0].scatter_reduce_(0, index, append_key, reduce="amin")
+    page_key_summary[:, 1].scatter_reduce_(0, index, append_key, reduce="amax")
+
+
+def compute_page_key_summary(
+    paged_kv_cache: Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]],
+    kv_indices: torch.Tensor,
+    kv_indptr: torch.Tensor,
+    kv_last_page_len: torch.Tensor,
+    kv_layout: str = "NHD",
+    out: Optional[torch.Tensor] = None,
+) -> torch.Tensor:
+    r"""Compute the per-page elementwise min/max of the keys, used to estimate the
+    attention scores of pages in :func:`select_top_k_pages`.
+
+    Parameters
+    ----------
+    paged_kv_cache : Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]]
+        The paged KV-Cache stored as a tuple of tensors or a single tensor, see
+        :func:`append_paged_kv_cache`.
+    kv_indices : torch.Tensor
+        The page indices of the paged kv-cache, shape: ``[kv_indptr[-1]]``.
+    kv_indptr : torch.Tensor
+        The indptr of the paged kv-cache, shape: ``[batch_size + 1]``.
+    kv_last_page_len : torch.Tensor
+        The number of entries in the last page of each request in the paged kv cache,
+        shape: ``[batch_size]``.
+    kv_layout : str
+        The layout of the paged kv-cache, either ``NHD`` or ``HND``.
+    out : Optional[torch.Tensor]
+        The float32 output tensor, shape: ``[max_num_pages, 2, num_kv_heads, head_dim]``,
+        only the rows of the pages in :attr:`kv_indices` are written.
+
+    Returns
+    -------
+    page_key_summary : torch.Tensor
+        The elementwise min (``[:, 0]``) and max (``[:, 1]``) of the keys of each page,
+        shape: ``[max_num_pages, 2, num_kv_heads, head_dim]``.
+
+    Note
+    ----
+    Pass the summary to :func:`append_paged_kv_cache` to keep it up to date as new
+    keys are appended.
+    """
+    _check_kv_layout(kv_layout)
+    k_cache, _ = _unpack_paged_kv_cache(paged_kv_cache, kv_layout)
+    if kv_layout == "HND":
+        k_cache = k_cache.transpose(1, 2)
+    max_num_pages, page_size, num_kv_heads, head_dim = k_cache.shape
+    if out is None:
+        out = torch.empty(
+            max_num_pages,
+            2,
+            num_kv_heads,
+            head_dim,
+            dtype=torch.float32,
+            device=k_cache.device,
+        )
+    kv_indptr = kv_indptr.to(k_cache.device).long()
+    kv_last_page_len = kv_last_page_len.to(k_cache.device).long()
+    num_pages = kv_indptr[1:] - kv_indptr[:-1]
+    total = int(kv_indptr[-1].item())
+    page_ids = kv_indices[:total].to(k_cache.device).long()
+    # the number of valid entries of each page, the last page of a request is partial
+    page_len = torch.full((total,), page_size, device=k_cache.device)
+    is_last = kv_indptr[1:][num_pages > 0] - 1
+    page_len[is_last] = kv_last_page_len[num_pages > 0]
+    valid = (
+        torch.arange(page_size, device=k_cache.device)[None, :] < page_len[:, None]
+    )[:, :, None, None]
+    keys = k_cache[page_ids].to(torch.float32)
+    out[page_ids, 0] = keys.masked_fill(~valid, float("inf")).amin(dim=1)
+    out[page_ids, 1] = keys.masked_fill(~valid, float("-inf")).amax(dim=1)
+    return out
+
+
+def select_top_k_pages(
+    q: torch.Tensor,
+    page_key_summary: torch.Tensor,
+    kv_indptr: torch.Tensor,
+    kv_indices: torch.Tensor,
+    kv_last_page_len: torch.Tensor,
+    page_budget: int,
+) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    r"""Select the pages of each request with the highest estimated attention scores
+    for the current decode queries, following `Quest <https://arxiv.org/abs/2406.10774>`_.
+
+    The score of a page is the upper bound of ``q . k`` over the keys of the page,
+    ``sum_d max(q_d * min_d, q_d * max_d)``, summed over the query heads. The last
+    (partial) page of each request is always selected, and the selected pages keep
+    their order so that the reduced page table can be passed to
+    :meth:`flashinfer.decode.BatchDecodeWithPagedKVCacheWrapper.plan` as is.
+
+    Parameters
+    ----------
+    q : torch.Tensor
+        The decode queries, shape: ``[batch_size, num_qo_heads, head_dim]``.
+    page_key_summary : torch.Tensor
+        The per-page key min/max, shape: ``[max_num_pages, 2, num_kv_heads, head_dim]``,
+        see :func:`compute_page_key_summary`.
+    kv_indptr : torch.Tensor
+        The indptr of the paged kv-cache, shape: ``[batch_size + 1]``.
+    kv_indices : torch.Tensor
+        The page indices of the paged kv-cache, shape: ``[kv_indptr[-1]]``.
+    kv_last_page_len : torch.Tensor
+        The number of entries in the last page of each request in the paged kv cache,
+        shape: ``[batch_size]``.
+    page_budget : int
+        The maximum number of pages selected for each request.
+
+    Returns
+    -------
+    kv_indptr : torch.Tensor
+        The indptr of the reduced page table, shape: ``[batch_size + 1]``.
+    kv_indices : torch.Tensor
+        The selected page indices, shape: ``[kv_indptr[-1]]``.
+    kv_last_page_len : torch.Tensor
+        The last page lengths of the reduced page table (unchanged), shape: ``[batch_size]``.
+
+    Note
+    ----
+    The attention on the reduced page table is an approximation, the kernels index
+    keys by their order in the page table, so it should be used with keys stored
+    with RoPE already applied (``pos_encoding_mode="NONE"``).
+    """
+    if page_budget <= 0:
+        raise ValueError("page_budget should be positive, got {}.".format(page_budget))
+    device = page_key_summary.device
+    kv_indptr = kv_indptr.to(device)
+    num_pages = (kv_indptr[1:] - kv_indptr[:-1]).long()
+    total = int(kv_indptr[-1].item())
+    page_ids = kv_indices[:total].to(device).long()
+    batch_indices = torch.repeat_interleave(
+        torch.arange(len(num_pages), device=device), num_pages, output_size=total
+    )
+    num_kv_heads = page_key_summary.shape[2]
+    q = q.to(device, torch.float32)
+    q = q.view(q.shape[0], num_kv_heads, -1, q.shape[-1])
+    summary = page_key_summary[page_ids][:, :, :, None, :]
+    q_pages = q[batch_indices]
+    scores = torch.maximum(q_pages * summary[:, 0], q_pages * summary[:, 1])
+    scores = scores.sum(dim=(1, 2, 3))
+    page_offsets = torch.arange(total, device=device) - kv_indptr.long()[batch_indices]
+    scores[page_offsets == num_pages[batch_indices] - 1] = float("inf")
+
+    selected = _rank_pages_by_score(scores, batch_indices, kv_indptr) < page_budget
+    new_kv_indptr = torch.zeros_like(kv_indptr)
+    torch.cumsum(torch.clamp(num_pages, max=page_budget), 0, out=new_kv_indptr[1:])
+    return new_kv_indptr, kv_indices[:total][selected], kv_last_page_len
+
+
+def _rank_pages_by_score(
+    scores: torch.Tensor, batch_indices: torch.Tensor, kv_indptr: torch.Tensor
+) -> torch.Tensor:
+    # rank the pages within each request by descending score, ties keep page order
+    total = scores.shape[0]
+    order = torch.argsort(scores, descending=True, stable=True)
+    order = order[torch.argsort(batch_indices[order], stable=True)]
+    rank = torch.empty_like(order)
+    rank[order] = (
+        torch.arange(total, device=scores.device)
+        - kv_indptr.long()[batch_indices[order]]
+    )
+    return rank
+
+
+def evict_low_mass_pages(
+    attention_mass: torch.Tensor,
+    kv_indptr: torch.Tensor,
+    kv_indices: torch.Tensor,
+    kv_last_page_len: torch.Tensor,
+    page_budget: int,
+    num_sink_pages: int = 0,
+    num_recent_pages: int = 1,
+) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+    r"""Evict the pages of each request with the lowest accumulated attention mass,
+    following heavy-hitter eviction policies such as `H2O <https://arxiv.org/abs/2306.14048>`_
+    and `SnapKV <https://arxiv.org/abs/2404.14469>`_, at page granularity.
+
+    The mass is accumulated by the ``attention_mass`` argument of
+    :meth:`flashinfer.decode.BatchDecodeWithPagedKVCacheWrapper.run` and
+    :meth:`flashinfer.prefill.BatchPrefillWithPagedKVCacheWrapper.run`, the score of a
+    page is its mass summed over the kv heads. The first :attr:`num_sink_pages` and the
+    last :attr:`num_recent_pages` pages of each request are always retained, and the
+    retained pages keep their order.
+
+    Parameters
+    ----------
+    attention_mass : torch.Tensor
+        The accumulated attention mass, shape: ``[max_num_pages, num_kv_heads]`` or
+        ``[max_num_pages, page_size, num_kv_heads]``.
+    kv_indptr : torch.Tensor
+        The indptr of the paged kv-cache, shape: ``[batch_size + 1]``.
+    kv_indices : torch.Tensor
+        The page indices of the paged kv-cache, shape: ``[kv_indptr[-1]]``.
+    kv_last_page_len : torch.Tensor
+        The number of entries in the last page of each request in the paged kv cache,
+        shape: ``[batch_size]``.
+    page_budget : int
+        The maximum number of pages retained for each request.
+    num_sink_pages : int
+        The number of leading (attention sink) pages always retained, defaults to ``0``.
+    num_recent_pages : int
+        The number of trailing pages always retained, defaults to ``1`` (the last,
+        partially filled page).
+
+    Returns
+    -------
+    kv_indptr : torch.Tensor
+        The indptr of the retained page table, shape: ``[batch_size + 1]``.
+    kv_indices : torch.Tensor
+        The retained page indices, shape: ``[kv_indptr[-1]]``.
+    kv_last_page_len : torch.Tensor
+        The last page lengths of the retained page table (unchanged), shape: ``[batch_size]``.
+    released_page_ids : torch.Tensor
+        The evicted page indices, which can be returned to the page allocator,
+        shape: ``[num_released_pages]``.
+
+    Note
+    ----
+    The kernels index keys by their order in the page table, so the keys should be
+    stored with RoPE already applied (``pos_encoding_mode="NONE"``). The mass of the
+    released pages is not reset, callers should zero those rows before reusing the pages.
+    """
+    if page_budget < num_sink_pages + num_recent_pages or page_budget <= 0:
+        raise ValueError(
+            "page_budget {} should be positive and no less than num_sink_pages + "
+            "num_recent_pages = {}.".format(
+                page_budget, num_sink_pages + num_recent_pages
+            )
+        )
+    _check_attention_mass(attention_mass)
+    device = attention_mass.device
+    kv_indptr = kv_indptr.to(device)
+    num_pages = (kv_indptr[1:] - kv_indptr[:-1]).long()
+    total = int(kv_indptr[-1].item())
+    kv_indices = kv_indices[:total].to(device)
+    batch_indices = torch.repeat_interleave(
+        torch.arange(len(num_pages), device=device), num_pages, output_size=total
+    )
+    scores = attention_mass.flatten(1).sum(dim=1).to(torch.float32)[kv_indices.long()]
+    page_offsets = torch.arange(total, device=device) - kv_indptr.long()[batch_indices]
+    pinned = (page_offsets < num_sink_pages) | (
+        page_offsets >= num_pages[batch_indices] - num_recent_pages
+    )
+    scores[pinned] = float("inf")
+
+    selected = _rank_pages_by_score(scores, batch_indices, kv_indptr) < page_budget
+    new_kv_indptr = torch.zeros_like(kv_indptr)
+    torch.cumsum(torch.clamp(num_pages, max=page_budget), 0, out=new_kv_indptr[1:])
+    return (
+        new_kv_indptr,
+        kv_indices[selected],
+        kv_last_page_len,
+        kv_indices[~selected],
+    )
+
+
+def _get_quant_max(dtype: torch.dtype) -> float:
+    if dtype == torch.int8:
+        return 127.0
+    if dtype in [torch.float8_e4m3fn, torch.float8_e5m2]:
+        return torch.finfo(dtype).max
+    raise ValueError(
+        "Unsupported quantized kv-cache dtype {}, expect int8 or float8".format(dtype)
+    )
+
+
+def _cast_quantized(x: torch.Tensor, dtype: torch.dtype) -> torch.Tensor:
+    qmax = _get_quant_max(dtype)
+    if dtype == torch.int8:
+        x = x.round()
+    return x.clamp(-qmax, qmax).to(dtype)
+
+
+def _broadcast_page_scale(scale: torch.Tensor, kv_layout: str) -> torch.Tensor:
+    # [n] -> [n, 1, 1, 1]
+    # [n, num_kv_heads] -> [n, 1, num_kv_heads, 1] (NHD) or [n, num_kv_heads, 1, 1] (HND)
+    if scale.ndim == 1:
+        return scale[:, None, None, None]
+    if kv_layout == "NHD":
+        return scale[:, None, :, None]
+    return scale[:, :, None, None]
+
+
+def _check_page_scale(
+    scale: torch.Tensor, cache: torch.Tensor, kv_layout: str, name: str
+) -> None:
+    num_kv_heads = cache.shape[2] if kv_layout == "NHD" else cache.shape[1]
+    if scale.ndim not in [1, 2] or scale.size(0) != cache.size(0):
+        raise ValueError(
+            "{} should have shape [max_num_pages] or [max_num_pages, num_kv_heads], "
+            "got {}".format(name, tuple(scale.shape))
+        )
+    if scale.ndim == 2 and scale.size(1) != num_kv_heads:
+        raise ValueError(
+            "The second dimension of {} should be num_kv_heads {}, got {}".format(
+                name, num_kv_heads, scale.size(1)
+            )
+        )
+    if scale.dtype != torch.float32:
+        raise ValueError("{} should be a float32 tensor".format(name))
+
+
+def _quantize_and_append(
+    x: torch.Tensor,
+    cache: torch.Tensor,
+    scale: torch.Tensor,
+    page_ids: torch.Tensor,
+    entry_ids: torch.Tensor,
+    kv_layout: str,
+) -> None:
+    qmax = _get_quant_max(cache.dtype)
+    x = x.float()
+    amax = x.abs().amax(dim=-1)  # [nnz, num_kv_heads]
+    if scale.ndim == 1:
+        amax = amax.amax(dim=-1)  # [nnz]
+
+    touched, inverse = torch.unique(page_ids, return_inverse=True)
+    old_scale = scale[touched]
+    # NOTE: pages whose first entry is written in this call do not hold valid data yet,
+    # their (stale) scales are discarded.
+    fresh = torch.zeros(len(touched), dtype=torch.bool, device=x.device)
+    fresh[inverse[entry_ids == 0]] = True
+    old_scale = torch.where(
+        fresh if scale.ndim == 1 else fresh[:, None], 0.0, old_scale
+    )
+    index = inverse if amax.ndim == 1 else inverse[:, None].expand_as(amax)
+    new_scale = torch.maximum(
+        old_scale,
+        torch.zeros_like(old_scale).scatter_reduce_(0, index, amax, "amax") / qmax,
+    )
+
+    # requantize the existing entries of the pages whose scale has grown
+    ratio = torch.where(new_scale > 0, old_scale / new_scale, 1.0)
+    grown = (ratio < 1).view(len(touched), -1).any(dim=-1)
+    if grown.any():
+        rows = touched[grown]
+        cache[rows] = _cast_quantized(
+            cache[rows].float() * _broadcast_page_scale(ratio[grown], kv_layout),
+            cache.dtype,
+        )
+    scale[touched] = new_scale
+
+    entry_scale = new_scale[inverse]
+    entry_scale = torch.where(entry_scale > 0, entry_scale, 1.0)
+    entry_scale = (
+        entry_scale[:, None, None] if scale.ndim == 1 else entry_scale[..., None]
+    )
+    _scatter_page_entries(
+        cache,
+        page_ids,
+        entry_ids,
+        _cast_quantized(x / entry_scale, cache.dtype),
+        kv_layout,
+    )
+
+
+def append_paged_kv_cache_quantized(
+    append_key: torch.Tensor,
+    append_value: torch.Tensor,
+    batch_indices: torch.Tensor,
+    positions: torch.Tensor,
+    paged_kv_cache: Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]],
+    k_scale: torch.Tensor,
+    v_scale: torch.Tensor,
+    kv_indices: Union[torch.Tensor, RunLengthPageIndices],
+    kv_indptr: torch.Tensor,
+    kv_last_page_len: torch.Tensor,
+    kv_layout: str = "NHD",
+) -> None:
+    r"""Quantize a batch of fp16/bf16 key-value pairs on the fly and append them to a
+    fp8/int8 paged key-value cache, maintaining per-page (or per-page-per-head) scales.
+
+    The scale of a page is the absolute maximum of the entries in the page divided by
+    the maximum representable value of the cache dtype, i.e. an entry is dequantized as
+    ``cache_entry * scale``. When appended entries increase the scale of a page, the
+    existing entries of the page are requantized to the new scale. Pages whose first
+    entry is written in this call are treated as freshly allocated and their previous
+    scales are discarded.
+
+    Parameters
+    ----------
+    append_key : torch.Tensor
+        The key tensor to append in ragged tensor format, shape:
+        ``[append_indptr[-1], num_kv_heads, head_dim]``, in float16/bfloat16/float32.
+    append_value : torch.Tensor
+        The value tensor to append in ragged tensor format, shape:
+        ``[append_indptr[-1], num_kv_heads, head_dim]``, in float16/bfloat16/float32.
+    batch_indices : torch.Tensor
+        The batch indices of the each entry in the appended key-value pairs, shape: ``[append_indptr[-1]]``.
+    positions : torch.Tensor
+        The positions of the each entry in the appended key-value pairs, shape: ``[append_indptr[-1]]``.
+    paged_kv_cache : Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]]
+        The paged KV-Cache stored as a tuple of tensors or a single tensor, see
+        :func:`append_paged_kv_cache`, the data type should be ``torch.int8``,
+        ``torch.float8_e4m3fn`` or ``torch.float8_e5m2``.
+    k_scale : torch.Tensor
+        The float32 scales of the key-cache, updated in-place, shape: ``[max_num_pages]``
+        for per-page scales or ``[max_num_pages, num_kv_heads]`` for per-page-per-head scales.
+    v_scale : torch.Tensor
+        The float32 scales of the value-cache, updated in-place, same shape as :attr:`k_scale`.
+    kv_indices : Union[torch.Tensor, RunLengthPageIndices]
+        The page indices of the paged kv-cache, shape: ``[kv_indptr[-1]]``, or their
+        run-length encoding.
+    kv_indptr : torch.Tensor
+        The indptr of the paged kv-cache, shape: ``[batch_size + 1]``.
+    kv_last_page_len : torch.Tensor
+        The number of entries in the last page of each request in the paged kv cache,
+        shape: ``[batch_size]``.
+    kv_layout : str
+        The layout of the paged kv-cache, either ``NHD`` or ``HND``.
+
+    Example
+    -------
+    >>> import torch
+    >>> import flashinfer
+    >>> max_num_pages, page_size, num_kv_heads, head_dim = 8, 16, 4, 64
+    >>> paged_kv_cache = torch.zeros(
+    ...     max_num_pages, 2, page_size, num_kv_heads, head_dim, dtype=torch.float8_e4m3fn
+    ... )
+    >>> k_scale = torch.zeros(max_num_pages, num_kv_heads)
+    >>> v_scale = torch.zeros(max_num_pages, num_kv_heads)
+    >>> k_append = torch.randn(20, num_kv_heads, head_dim).half()
+    >>> v_append = torch.randn(20, num_kv_heads, head_dim).half()
+    >>> kv_indptr = torch.tensor([0, 2], dtype=torch.int32)
+    >>> kv_indices = torch.tensor([5, 2], dtype=torch.int32)
+    >>> kv_last_page_len = torch.tensor([4], dtype=torch.int32)
+    >>> batch_indices, positions = flashinfer.get_batch_indices_positions(
+    ...     torch.tensor([0, 20], dtype=torch.int32),
+    ...     flashinfer.get_seq_lens(kv_indptr, kv_last_page_len, page_size),
+    ...     20,
+    ... )
+    >>> flashinfer.append_paged_kv_cache_quantized(
+    ...     k_append, v_append, batch_indices, positions, paged_kv_cache,
+    ...     k_scale, v_scale, kv_indices, kv_indptr, kv_last_page_len,
+    ... )
+    >>> k_scale[5].shape
+    torch.Size([4])
+
+    Note
+    ----
+    The scale tensors can be passed as ``k_scale``/``v_scale`` to the ``run`` method of
+    :class:`flashinfer.decode.BatchDecodeWithPagedKVCacheWrapper` and
+    :class:`flashinfer.prefill.BatchPrefillWithPagedKVCacheWrapper`.
+
+    See Also
+    --------
+    append_paged_kv_cache
+    """
+    _check_kv_layout(kv_layout)
+    k_cache, v_cache = _unpack_paged_kv_cache(paged_kv_cache, kv_layout)
+    _check_page_scale(k_scale, k_cache, kv_layout, "k_scale")
+    _check_page_scale(v_scale, v_cache, kv_layout, "v_scale")
+    page_size = k_cache.shape[1] if kv_layout == "NHD" else k_cache.shape[2]
+    page_ids, entry_ids = _get_page_entry_ids(
+        batch_indices, positions, kv_indices, kv_indptr, page_size
+    )
+    _quantize_and_append(append_key, k_cache, k_scale, page_ids, entry_ids, kv_layout)
+    _quantize_and_append(append_value, v_cache, v_scale, page_ids, entry_ids, kv_layout)
+
+
+def _dequantize_paged_kv_cache(
+    k_cache: torch.Tensor,
+    v_cache: torch.Tensor,
+    k_scale: torch.Tensor,
+    v_scale: torch.Tensor,
+    kv_indices: torch.Tensor,
+    kv_layout: str,
+    dtype: torch.dtype,
+) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    r"""Gather the pages in :attr:`kv_indices` and dequantize them with per-page
+    (or per-page-per-head) scales, return the compacted k/v caches and the page indices
+    into the compacted caches.
+
+    Each referenced page is gathered once and scaled in :attr:`dtype`, this is a
+    reference, the torch and triton backends load the scales in the attention kernels
+    and the CUDA backends reject per-page scales."""
+    _check_page_scales(k_scale, v_scale, k_cache, v_cache, kv_layout)
+    page_ids, indices = torch.unique(kv_indices.long(), return_inverse=True)
+    k = k_cache[page_ids].to(dtype)
+    k.mul_(_broadcast_page_scale(k_scale[page_ids], kv_layout).to(dtype))
+    v = v_cache[page_ids].to(dtype)
+    v.mul_(_broadcast_page_scale(v_scale[page_ids], kv_layout).to(dtype))
+    return k, v, indices.to(torch.int32)
+
+
+def _check_attention_mass(
+    attention_mass: torch.Tensor, backend: Optional[str] = None
+) -> None:
+    # the attention mass buffer of the paged wrappers and evict_low_mass_pages, the
+    # mass is accumulated inside the attention loops of the torch and triton backends
+    if backend is not None and backend not in ["torch", "triton"]:
+        raise ValueError(
+            "attention_mass is only supported by the torch and triton backends, got "
+            "backend {}.".format(backend)
+        )
+    if attention_mass.dim() not in [2, 3]:
+        raise ValueError(
+            "attention_mass should be a 2-D (per page) or 3-D (per token) tensor, "
+            "got {}-D.".format(attention_mass.dim())
+        )
+
+
+def _check_page_scales(
+    k_scale: torch.Tensor,
+    v_scale: torch.Tensor,
+    k_cache: torch.Tensor,
+    v_cache: torch.Tensor,
+    kv_layout: str,
+) -> None:
+    # the per-page scales passed to the run methods of the paged wrappers
+    if not (torch.is_tensor(k_scale) and torch.is_tensor(v_scale)):
+        raise ValueError(
+            "k_scale and v_scale should both be tensors when per-page scales are used."
+        )
+    _check_page_scale(k_scale, k_cache, kv_layout, "k_scale")
+    _check_page_scale(v_scale, v_cache, kv_layout, "v_scale")
+    if k_scale.shape != v_scale.shape:
+        raise ValueError(
+            "k_scale and v_scale should have the same shape, got {} and {}".format(
+                tuple(k_scale.shape), tuple(v_scale.shape)
+            )
+        )
+
+
+def _unpack_multi_layer_paged_kv_cache(
+    paged_kv_cache: Union[
+        torch.Tensor,
+        Tuple[torch.Tensor, torch.Tensor],
+        List[Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]]],
+    ],
+    kv_layout: str,
+) -> Tuple[
+    Union[torch.Tensor, List[torch.Tensor]], Union[torch.Tensor, List[torch.Tensor]]
+]:
+    if isinstance(paged_kv_cache, list):
+        k_caches, v_caches = zip(
+            *[_unpack_paged_kv_cache(c, kv_layout) for c in paged_kv_cache]
+        )
+        return list(k_caches), list(v_caches)
+    if isinstance(paged_kv_cache, tuple):
+        paged_k_cache, paged_v_cache = paged_kv_cache
+        if paged_k_cache.ndim != 5 or paged_v_cache.ndim != 5:
+            raise ValueError(
+                "The layer-stacked k/v caches should be 5-D tensors, got {}D and {}D".format(
+                    paged_k_cache.ndim, paged_v_cache.ndim
+                )
+            )
+        return paged_k_cache, paged_v_cache
+    if torch.is_tensor(paged_kv_cache):
+        if paged_kv_cache.ndim != 6:
+            raise ValueError(
+                "The layer-stacked kv cache should be a 6-D tensor, got {}D".format(
+                    paged_kv_cache.ndim
+                )
+            )
+        paged_k_cache, paged_v_cache = paged_kv_cache.unbind(dim=2)
+        return paged_k_cache, paged_v_cache
+    raise KeyError(
+        "Unrecognized paged_kv_cache type {}, expect a single tensor, a tuple of tensors "
+        "or a list of per-layer caches.".format(type(paged_kv_cache))
+    )
+
+
+def append_paged_kv_cache_multi_layer(
+    append_key: torch.Tensor,
+    append_value: torch.Tensor,
+    batch_indices: torch.Tensor,
+    positions: torch.Tensor,
+    paged_kv_cache: Union[
+        torch.Tensor,
+        Tuple[torch.Tensor, torch.Tensor],
+        List[Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]]],
+    ],
+    kv_indices: Union[torch.Tensor, RunLengthPageIndices],
+    kv_indptr: torch.Tensor,
+    kv_last_page_len: torch.Tensor,
+    kv_layout: str = "NHD",
+) -> None:
+    r"""Append a batch of key-value pairs of all layers to the paged key-value caches
+    of all layers at once.
+
+    The page table lookup (batch indices and positions to page and entry indices) is
+    performed once and shared by all layers, and a layer-stacked cache is updated with a
+    single scatter per key/value.
+
+    Parameters
+    ----------
+    append_key : torch.Tensor
+        The layer-stacked key tensor to append in ragged tensor format, shape:
+        ``[num_layers, append_indptr[-1], num_kv_heads, head_dim]``.
+    append_value : torch.Tensor
+        The layer-stacked value tensor to append in ragged tensor format, shape:
+        ``[num_layers, append_indptr[-1], num_kv_heads, head_dim]``.
+    batch_indices : torch.Tensor
+        The batch indices of the each entry in the appended key-value pairs, shape: ``[append_indptr[-1]]``.
+    positions : torch.Tensor
+        The positions of the each entry in the appended key-value pairs, shape: ``[append_indptr[-1]]``.
+    paged_kv_cache : Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor], List]
+        The paged KV-Caches of all layers, could be:
+
+        * a single 6-D layer-stacked tensor with shape:
+          ``[num_layers, max_num_pages, 2, page_size, num_kv_heads, head_dim]`` if
+          :attr:`kv_layout` is ``NHD``, and
+          ``[num_layers, max_num_pages, 2, num_kv_heads, page_size, head_dim]`` if
+          :attr:`kv_layout` is ``HND``.
+
+        * a tuple ``(k_cache, v_cache)`` of 5-D layer-stacked tensors, each with shape:
+          ``[num_layers, max_num_pages, page_size, num_kv_heads, head_dim]`` if :attr:`kv_layout`
+          is ``NHD``, and ``[num_layers, max_num_pages, num_kv_heads, page_size, head_dim]`` if
+          :attr:`kv_layout` is ``HND``.
+
+        * a list of per-layer paged kv-caches, each in the format accepted by
+          :func:`append_paged_kv_cache`.
+    kv_indices : Union[torch.Tensor, RunLengthPageIndices]
+        The page indices of the paged kv-cache, shape: ``[kv_indptr[-1]]``, or their
+        run-length encoding.
+    kv_indptr : torch.Tensor
+        The indptr of the paged kv-cache, shape: ``[batch_size + 1]``.
+    kv_last_page_len : torch.Tensor
+        The number of entries in the last page of each request in the paged kv cache,
+        shape: ``[batch_size]``.
+    kv_layout : str
+        The layout of the paged kv-cache, either ``NHD`` or ``HND``.
+
+    Example
+    -------
+    >>> import torch
+    >>> import flashinfer
+    >>> num_layers, max_num_pages, page_size, num_kv_heads, head_dim = 80, 64, 16, 8, 128
+    >>> paged_kv_cache = torch.zeros(
+    ...     num_layers, max_num_pages, 2, page_size, num_kv_heads, head_dim,
+    ...     dtype=torch.float16, device="cuda:0",
+    ... )
+    >>> kv_indptr = torch.tensor([0, 3, 5], dtype=torch.int32, device="cuda:0")
+    >>> kv_indices = torch.tensor([7, 1, 12, 3, 9], dtype=torch.int32, device="cuda:0")
+    >>> kv_last_page_len = torch.tensor([4, 11], dtype=torch.int32, device="cuda:0")
+    >>> # decode step: append one token per request for all layers
+    >>> batch_indices = torch.tensor([0, 1], dtype=torch.int32, device="cuda:0")
+    >>> positions = torch.tensor([35, 26], dtype=torch.int32, device="cuda:0")
+    >>> k_append = torch.randn(num_layers, 2, num_kv_heads, head_dim).half().to(0)
+    >>> v_append = torch.randn(num_layers, 2, num_kv_heads, head_dim).half().to(0)
+    >>> flashinfer.append_paged_kv_cache_multi_layer(
+    ...     k_append, v_append, batch_indices, positions, paged_kv_cache,
+    ...     kv_indices, kv_indptr, kv_last_page_len,
+    ... )
+
+    See Also
+    --------
+    append_paged_kv_cache
+    """
+    _check_kv_layout(kv_layout)
+    k_caches, v_caches = _unpack_multi_layer_paged_kv_cache(paged_kv_cache, kv_layout)
+    if append_key.ndim != 4 or append_value.ndim != 4:
+        raise ValueError(
+            "append_key and append_value should be 4-D layer-stacked tensors."
+        )
+    num_layers = len(k_caches)
+    if append_key.size(0) != num_layers or append_value.size(0) != num_layers:
+        raise ValueError(
+            "The number of layers of append_key/append_value ({}, {}) mismatches the "
+            "number of layers of paged_kv_cache ({})".format(
+                append_key.size(0), append_value.size(0), num_layers
+            )
+        )
+    page_shape = (
+        k_caches.shape[2:] if torch.is_tensor(k_caches) else k_caches[0].shape[1:]
+    )
+    page_size = page_shape[0] if kv_layout == "NHD" else page_shape[1]
+    page_ids, entry_ids = _get_page_entry_ids(
+        batch_indices, positions, kv_indices, kv_indptr, page_size
+    )
+    if torch.is_tensor(k_caches):
+        if kv_layout == "NHD":
+            # [num_layers, nnz, num_kv_heads, head_dim]
+            k_caches[:, page_ids, entry_ids] = append_key.to(k_caches.dtype)
+            v_caches[:, page_ids, entry_ids] = append_value.to(v_caches.dtype)
+        else:
+            # NOTE: advanced indices are not adjacent, the indexed dimensions come first:
+            # [nnz, num_layers, num_kv_heads, head_dim]
+            k_caches[:, page_ids, :, entry_ids] = append_key.transpose(0, 1).to(
+                k_caches.dtype
+            )
+            v_caches[:, page_ids, :, entry_ids] = append_value.transpose(0, 1).to(
+                v_caches.dtype
+            )
+    else:
+        for k_cache, v_cache, k, v in zip(k_caches, v_caches, append_key, append_value):
+            _scatter_page_entries(k_cache, page_ids, entry_ids, k, kv_layout)
+            _scatter_page_entries(v_cache, page_ids, entry_ids, v, kv_layout)
+
+
+def get_slot_mapping(
+    batch_indices: torch.Tensor,
+    positions: torch.Tensor,
+    kv_indices: Union[torch.Tensor, RunLengthPageIndices],
+    kv_indptr: torch.Tensor,
+    page_size: int,
+) -> torch.Tensor:
+    r"""Convert batch indices and positions of appended entries to flat slot indices
+    ``page_id * page_size + entry_id`` in the paged kv-cache.
+
+    The slot mapping only depends on the page table, it can be computed once per step
+    (e.g. by the scheduler) and shared by all layers in
+    :func:`append_paged_kv_cache_with_slot_mapping`.
+
+    Parameters
+    ----------
+    batch_indices : torch.Tensor
+        The batch indices of the each entry in the appended key-value pairs, shape: ``[nnz]``.
+    positions : torch.Tensor
+        The positions of the each entry in the appended key-value pairs, shape: ``[nnz]``.
+    kv_indices : Union[torch.Tensor, RunLengthPageIndices]
+        The page indices of the paged kv-cache, shape: ``[kv_indptr[-1]]``, or their
+        run-length encoding.
+    kv_indptr : torch.Tensor
+        The indptr of the paged kv-cache, shape: ``[batch_size + 1]``.
+    page_size : int
+        The size of a page in the paged kv-cache.
+
+    Returns
+    -------
+    slot_mapping : torch.Tensor
+        The int64 slot index of each entry, shape: ``[nnz]``.
+
+    See Also
+    --------
+    get_batch_indices_positions
+    append_paged_kv_cache_with_slot_mapping
+    """
+    page_ids, entry_ids = _get_page_entry_ids(
+        batch_indices, positions, kv_indices, kv_indptr, page_size
+    )
+    return page_ids * page_size + entry_ids
+
+
+def append_paged_kv_cache_with_slot_mapping(
+    append_key: torch.Tensor,
+    append_value: torch.Tensor,
+    slot_mapping: torch.Tensor,
+    paged_kv_cache: Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]],
+    kv_layout: str = "NHD",
+) -> None:
+    r"""Append a batch of key-value pairs to a paged key-value cache at precomputed
+    flat slot indices, without consulting the page table.
+
+    Parameters
+    ----------
+    append_key : torch.Tensor
+        The key tensor to append, shape: ``[nnz, num_kv_heads, head_dim]``.
+    append_value : torch.Tensor
+        The value tensor to append, shape: ``[nnz, num_kv_heads, head_dim]``.
+    slot_mapping : torch.Tensor
+        The slot index ``page_id * page_size + entry_id`` of each appended entry,
+        shape: ``[nnz]``.
+    paged_kv_cache : Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]]
+        The paged KV-Cache stored as a tuple of tensors or a single tensor, see
+        :func:`append_paged_kv_cache`.
+    kv_layout : str
+        The layout of the paged kv-cache, either ``NHD`` or ``HND``.
+
+    Example
+    -------
+    >>> import torch
+    >>> import flashinfer
+    >>> max_num_pages, page_size, num_kv_heads, head_dim = 64, 16, 8, 128
+    >>> paged_kv_cache = torch.zeros(
+    ...     max_num_pages, 2, page_size, num_kv_heads, head_dim,
+    ...     dtype=torch.float16, device="cuda:0",
+    ... )
+    >>> # decode step: request 0 writes entry 3 of page 7, request 1 writes entry 10 of page 9
+    >>> slot_mapping = torch.tensor([7 * 16 + 3, 9 * 16 + 10], device="cuda:0")
+    >>> k_append = torch.randn(2, num_kv_heads, head_dim).half().to(0)
+    >>> v_append = torch.randn(2, num_kv_heads, head_dim).half().to(0)
+    >>> flashinfer.append_paged_kv_cache_with_slot_mapping(
+    ...     k_append, v_append, slot_mapping, paged_kv_cache
+    ... )
+
+    Note
+    ----
+    Every entry of :attr:`slot_mapping` must be a valid slot, padded tokens should be
+    mapped to a reserved (scratch) page.
+
+    See Also
+    --------
+    get_slot_mapping
+    append_paged_kv_cache
+    """
+    _check_kv_layout(kv_layout)
+    k_cache, v_cache = _unpack_paged_kv_cache(paged_kv_cache, kv_layout)
+    page_size = k_cache.shape[1] if kv_layout == "NHD" else k_cache.shape[2]
+    slot_mapping = slot_mapping.to(k_cache.device, torch.int64)
+    page_ids = slot_mapping // page_size
+    entry_ids = slot_mapping % page_size
+    _scatter_page_entries(k_cache, page_ids, entry_ids, append_key, kv_layout)
+    _scatter_page_entries(v_cache, page_ids, entry_ids, append_value, kv_layout)
+
+
+def allocate_paged_kv_cache_pool(
+    num_layers: int,
+    max_num_pages: int,
+    page_size: int,
+    num_kv_heads: int,
+    head_dim: int,
+    dtype: torch.dtype = torch.float16,
+    device: Union[str, torch.device] = "cuda",
+    kv_layout: str = "NHD",
+    pool_layout: str = "layer_major",
+) -> Tuple[torch.Tensor, List[torch.Tensor]]:
+    r"""Allocate the paged kv-cache of all layers in a single tensor, and return the
+    per-layer paged kv-cache views into it.
+
+    Parameters
+    ----------
+    num_layers : int
+        The number of layers.
+    max_num_pages : int
+        The number of pages of each layer.
+    page_size : int
+        The size of a page in the paged kv-cache.
+    num_kv_heads : int
+        The number of key/value heads.
+    head_dim : int
+        The dimension of the heads.
+    dtype : torch.dtype
+        The data type of the paged kv-cache, defaults to ``torch.float16``.
+    device : Union[str, torch.device]
+        The device of the paged kv-cache, defaults to ``cuda``.
+    kv_layout : str
+        The layout of the paged kv-cache of each layer, either ``NHD`` or ``HND``.
+    pool_layout : str
+        The layout of the pool, either ``layer_major`` or ``page_major``:
+
+        * ``layer_major``: the pool has shape ``[num_layers, max_num_pages, 2, ...]``,
+          the paged kv-cache of each layer is contiguous.
+        * ``page_major``: the pool has shape ``[max_num_pages, num_layers, 2, ...]``,
+          a page of all layers is contiguous, so that ``kv_pool[page_ids]`` moves the
+          pages of all layers with a single copy (e.g. for offloading and migration).
+
+    Returns
+    -------
+    kv_pool : torch.Tensor
+        The pool tensor, the last three dimensions are ``[page_size, num_kv_heads, head_dim]``
+        if :attr:`kv_layout` is ``NHD`` and ``[num_kv_heads, page_size, head_dim]`` if
+        :attr:`kv_layout` is ``HND``.
+    kv_caches : List[torch.Tensor]
+        The 5-D paged kv-cache view of each layer, shape: ``[max_num_pages, 2, ...]``,
+        they can be passed wherever a paged kv-cache tensor is accepted.
+
+    Example
+    -------
+    >>> import torch
+    >>> import flashinfer
+    >>> kv_pool, kv_caches = flashinfer.allocate_paged_kv_cache_pool(
+    ...     32, 1024, 16, 8, 128, pool_layout="page_major"
+    ... )
+    >>> kv_pool.shape
+    torch.Size([1024, 32, 2, 16, 8, 128])
+    >>> kv_caches[0].shape
+    torch.Size([1024, 2, 16, 8, 128])
+
+    Note
+    ----
+    In ``page_major`` layout the per-layer views are not contiguous, the kernels
+    address pages with the stride of the view. The layer-stacked 6-D layout accepted
+    by :func:`append_paged_kv_cache_multi_layer` is ``kv_pool`` for ``layer_major``
+    and ``kv_pool.transpose(0, 1)`` for ``page_major``.
+    """
+    _check_kv_layout(kv_layout)
+    if kv_layout == "NHD":
+        page_shape = (page_size, num_kv_heads, head_dim)
+    else:
+        page_shape = (num_kv_heads, page_size, head_dim)
+    if pool_layout == "layer_major":
+        kv_pool = torch.empty(
+            num_layers, max_num_pages, 2, *page_shape, dtype=dtype, device=device
+        )
+        return kv_pool, list(kv_pool.unbind(0))
+    if pool_layout == "page_major":
+        kv_pool = torch.empty(
+            max_num_pages, num_layers, 2, *page_shape, dtype=dtype, device=device
+        )
+        return kv_pool, list(kv_pool.unbind(1))
+    raise KeyError(
+        "Unrecognized pool layout {}, expect layer_major or page_major.".format(
+            pool_layout
+        )
+    )
@@ -24,6 +24,8 @@ import torch
 
 from .jit import (
     gen_batch_prefill_module,
+    gen_batch_prefill_per_request_module,
+    gen_batch_prefill_segment_module,
     gen_customize_batch_prefill_module,
     gen_single_prefill_module,
     get_batch_prefill_uri,
@@ -31,22 +33,46 @@ from .jit import (
     has_prebuilt_ops,
     prebuilt_ops_uri,
 )
-from .page import block_sparse_indices_to_vector_sparse_offsets, get_seq_lens
+from .metadata import BatchMetadata, _check_batch_metadata_page_size
+from .page import (
+    RunLengthPageIndices,
+    _check_attention_mass,
+    _check_page_scales,
+    _drop_unread_pages,
+    _expand_page_indices,
+    _split_chunked_paged_kv,
+    _truncate_paged_kv,
+    block_sparse_indices_to_vector_sparse_offsets,
+    get_seq_lens,
+)
 from .quantization import packbits, segment_packbits
+from .torch_attention import (
+    _batch_prefill_torch,
+    _get_paged_kv_torch,
+    _get_paged_mass_torch,
+    _merge_state_torch,
+    _segment_packbits_torch,
+    _single_prefill_torch,
+)
+from .triton.prefill import batch_prefill_with_kv_cache
 from .utils import (
     MaskMode,
     PosEncodingMode,
     TensorLayout,
+    _canonicalize_per_request_param,
     _check_cached_qkv_data_type,
     _check_kv_layout,
     _check_pos_encoding_mode,
     _check_shape_dtype_device,
     _get_cache_alibi_slopes_buf,
     _get_cache_buf,
+    _get_kernel_window_left,
+    _get_per_request_param_buf,
     _unpack_paged_kv_cache,
     canonicalize_torch_dtype,
     determine_attention_backend,
     get_cuda_stream,
+    get_indptr,
     is_float8,
     register_custom_op,
     register_fake_op,
@@ -590,6 +616,27 @@ def get_batch_prefill_jit_module(module_name: str, jit_module: Any):
     return _batch_prefill_jit_modules[module_name]
 
 
+def get_batch_prefill_segment_module(*args):
+    # the fa2 module of the SegmentAttention variant, which compares the segment ids in
+    # the logits mask instead of reading them expanded into a custom mask
+    uri = get_batch_prefill_uri("fa2", *args) + "_segment"
+    if uri in _batch_prefill_jit_modules:
+        return _batch_prefill_jit_modules[uri]
+    return get_batch_prefill_jit_module(uri, gen_batch_prefill_segment_module(*args))
+
+
+def get_batch_prefill_per_request_module(*args):
+    # the fa2 module of the PerRequestAttention variant, which reads the window and the
+    # soft cap of each request from the request_window_left and request_logits_soft_cap
+    # buffers
+    uri = get_batch_prefill_uri("fa2", *args) + "_per_request"
+    if uri in _batch_prefill_jit_modules:
+        return _batch_prefill_jit_modules[uri]
+    return get_batch_prefill_jit_module(
+        uri, gen_batch_prefill_per_request_module(*args)
+    )
+
+
 def single_prefill_with_kv_cache_with_jit_module(
     jit_module: Any,
     q: torch.Tensor,
@@ -684,6 +731,9 @@ def single_prefill_with_kv_cache(
     rope_theta: Optional[float] = None,
     return_lse: bool = False,
     backend: str = "auto",
+    qo_segment_ids: Optional[torch.Tensor] = None,
+    kv_segment_ids: Optional[torch.Tensor] = None,
+    prefix_len: int = 0,
 ) -> Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]]:
     r"""Prefill/Append attention with KV cache for single request, return the attention
     output.
@@ -742,9 +792,29 @@ def single_prefill_with_kv_cache(
     return_lse : bool
         Whether to return the log sum exp value of the attention logits.
     backend : str
-        The implementation backend, could be ``auto``/``fa2`` or ``fa3``. Defaults to ``auto``.
-        If set to ``auto``, the function will automatically choose the backend based on the
-        device architecture and kernel availability.
+        The implementation backend, could be ``auto``/``fa2``/``fa3`` or ``torch``. Defaults
+        to ``auto``. If set to ``auto``, the function will automatically choose the backend
+        based on the device architecture and kernel availability, ``torch`` is used for CPU
+        tensors. The ``torch`` backend streams the kv in tiles with online softmax and
+        processes the (kv head, query tile) pairs with a thread pool, its peak memory does
+        not grow with the sequence length.
+    qo_segment_ids : Optional[torch.Tensor]
+        The int32 segment (e.g. document of a packed sequence) id of each query token,
+        shape: ``[qo_len]``. If provided with :attr:`kv_segment_ids`, a query only attends
+        to the keys of the same segment, in addition to the causal, window and custom
+        masks. Only the ``torch`` backend avoids the dense mask, it evaluates the segment
+        mask per tile. The CUDA kernels have no segment mask mode and receive the
+        segment ids expanded into a ``[qo_len, kv_len]`` custom mask.
+    kv_segment_ids : Optional[torch.Tensor]
+        The int32 segment id of each key/value token, shape: ``[kv_len]``.
+    prefix_len : int
+        The length of the bidirectional prefix for prefix-LM attention: with
+        :attr:`causal`, the first ``prefix_len`` keys are visible to all queries and the
+        rest is causal. Ignored with a custom mask. On the CUDA backends, the prefix and
+        the causal suffix are computed by two launches with the standard masks merged by
+        their logsumexp (so that the ``fa3`` backend stays eligible), unless combined
+        with segment ids, a sliding window or a positional encoding, in which case the
+        expanded custom mask is used.
 
     Returns
     -------
@@ -796,7 +866,6 @@ def single_prefill_with_kv_cache(
     """
     _check_pos_encoding_mode(pos_encoding_mode)
     _check_kv_layout(kv_layout)
-    tmp = _get_cache_buf("single_prefill_with_kv_cache_tmp", 32 * 1024 * 1024, q.device)
     if logits_soft_cap is None:
         logits_soft_cap = 0.0
     if sm_scale is None:
@@ -805,6 +874,89 @@ def single_prefill_with_kv_cache(
         rope_scale = 1.0
     if rope_theta is None:
         rope_theta = 1e4
+    kv_len = k.size(0) if kv_layout == "NHD" else k.size(1)
+    _check_segment_ids(qo_segment_ids, kv_segment_ids, q.size(0), kv_len)
+    if backend == "auto" and q.device.type == "cpu":
+        backend = "torch"
+    if backend == "torch":
+        if custom_mask is not None and packed_custom_mask is None:
+            packed_custom_mask, _ = _segment_packbits_torch(
+                custom_mask.contiguous().view(-1),
+                torch.tensor([0, custom_mask.numel()]),
+                bitorder="little",
+            )
+        out = torch.empty(q.shape[:-1] + v.shape[-1:], dtype=q.dtype, device=q.device)
+        lse = None
+        if return_lse:
+            lse = torch.empty(
+                (q.size(0), q.size(1)), dtype=torch.float32, device=q.device
+            )
+        _single_prefill_torch(
+            q,
+            k,
+            v,
+            causal,
+            packed_custom_mask,
+            kv_layout,
+            pos_encoding_mode,
+            window_left,
+            logits_soft_cap,
+            sm_scale,
+            rope_scale,
+            rope_theta,
+            out,
+            lse,
+            qo_segment_ids=qo_segment_ids,
+            kv_segment_ids=kv_segment_ids,
+            prefix_len=prefix_len if causal else 0,
+        )
+        return (out, lse) if return_lse else out
+
+    if causal and prefix_len > 0 and custom_mask is None and packed_custom_mask is None:
+        if qo_segment_ids is None and window_left < 0 and pos_encoding_mode == "NONE":
+            return _single_prefill_prefix_lm(
+                functools.partial(
+                    single_prefill_with_kv_cache,
+                    kv_layout=kv_layout,
+                    use_fp16_qk_reduction=use_fp16_qk_reduction,
+                    sm_scale=sm_scale,
+                    logits_soft_cap=logits_soft_cap,
+                    return_lse=True,
+                    backend=backend,
+                ),
+                q,
+                k,
+                v,
+                kv_layout,
+                prefix_len,
+                return_lse,
+            )
+        # the positions of the kv slices would differ, apply the prefix in the mask
+        custom_mask = _get_per_request_window_mask(
+            torch.tensor([q.size(0)]),
+            torch.tensor([kv_len]),
+            window_left,
+            causal,
+            None,
+            q.device,
+            prefix_len=prefix_len,
+        )
+    if qo_segment_ids is not None:
+        # the kernels have no segment mask, expand the segment ids into the mask
+        if custom_mask is None and packed_custom_mask is not None:
+            raise ValueError(
+                "Segment ids are not supported with packed_custom_mask, "
+                "please provide custom_mask instead."
+            )
+        custom_mask = _get_segment_mask(
+            torch.tensor([q.size(0)]),
+            torch.tensor([kv_len]),
+            qo_segment_ids,
+            kv_segment_ids,
+            causal,
+            custom_mask,
+        )
+    tmp = _get_cache_buf("single_prefill_with_kv_cache_tmp", 32 * 1024 * 1024, q.device)
     if custom_mask is not None and packed_custom_mask is None:
         # create packed custom mask from custom mask
         packed_custom_mask = packbits(
@@ -871,6 +1023,40 @@ single_prefill_with_kv_cache_return_lse = functools.partial(
 )
 
 
+def _single_prefill_prefix_lm(
+    attention,
+    q: torch.Tensor,
+    k: torch.Tensor,
+    v: torch.Tensor,
+    kv_layout: str,
+    prefix_len: int,
+    return_lse: bool,
+) -> Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]]:
+    # Prefix-LM attention as a non-causal launch on the prefix and a causal launch on
+    # the rest of the kv merged by their logsumexp, attention(q, k, v, causal=...)
+    # returns the output and the lse. Both launches use the standard masks, so the fa3
+    # kernels and the causal tile skipping stay available.
+    kv_dim = 0 if kv_layout == "NHD" else 1
+    kv_len = k.size(kv_dim)
+    if prefix_len >= kv_len:
+        out, lse = attention(q, k, v, causal=False)
+    else:
+        o_prefix, lse_prefix = attention(
+            q,
+            k.narrow(kv_dim, 0, prefix_len),
+            v.narrow(kv_dim, 0, prefix_len),
+            causal=False,
+        )
+        o_suffix, lse_suffix = attention(
+            q,
+            k.narrow(kv_dim, prefix_len, kv_len - prefix_len),
+            v.narrow(kv_dim, prefix_len, kv_len - prefix_len),
+            causal=True,
+        )
+        out, lse = _merge_state_torch(o_prefix, lse_prefix, o_suffix, lse_suffix)
+    return (out, lse) if return_lse else out
+
+
 def _compute_page_mask_indptr(
     qo_indptr: torch.Tensor,
     paged_kv_indptr: torch.Tensor,
@@ -894,6 +1080,334 @@ def _compute_page_mask_indptr(
     return mask_indptr
 
 
+def _get_mask_positions(
+    qo_lens: torch.Tensor, kv_lens: torch.Tensor, device: torch.device
+) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+    # The masks of the requests are built at once on the device as a [num_rows,
+    # max_kv_len] padded matrix, returns the request and the position of each query row
+    # ([num_rows, 1]), the kv positions ([1, max_kv_len]) and the valid entries of the
+    # padded matrix, whose selection is the flattened mask of the kernels.
+    qo_lens = qo_lens.to(device, torch.int64)
+    kv_lens = kv_lens.to(device, torch.int64)
+    num_rows = int(qo_lens.sum())
+    max_kv_len = int(kv_lens.max()) if len(kv_lens) else 0
+    request = torch.repeat_interleave(
+        torch.arange(len(qo_lens), device=device), qo_lens, output_size=num_rows
+    )
+    qo_begin = torch.cumsum(qo_lens, 0) - qo_lens
+    q_pos = (kv_lens - qo_lens - qo_begin)[request] + torch.arange(
+        num_rows, device=device
+    )
+    kv_pos = torch.arange(max_kv_len, device=device)[None, :]
+    valid = kv_pos < kv_lens[request][:, None]
+    return request[:, None], q_pos[:, None], kv_pos, valid
+
+
+def _split_chunked_ragged_kv(
+    qo_indptr: torch.Tensor, kv_indptr: torch.Tensor, chunk_size: int
+) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    # The ragged counterpart of flashinfer.page._split_chunked_paged_kv, the kv of a
+    # chunk is a slice of the ragged kv so the split is exact for any chunk_size. A
+    # sub-request without queries covers the kv before the first chunk of each request,
+    # to keep the kv indptr contiguous. Returns the (qo_indptr, kv_indptr) of the
+    # sub-requests and the request of each sub-request.
+    device = qo_indptr.device
+    qo_indptr = qo_indptr.to(torch.int64)
+    kv_indptr = kv_indptr.to(device, torch.int64)
+    qo_lens = qo_indptr[1:] - qo_indptr[:-1]
+    kv_lens = kv_indptr[1:] - kv_indptr[:-1]
+    first_pos = torch.clamp(kv_lens - qo_lens, min=0)
+    last_chunk = torch.clamp(kv_lens - 1, min=0) // chunk_size
+    first_chunk = torch.minimum(first_pos // chunk_size, last_chunk)
+    num_sub_per_request = last_chunk - first_chunk + 2
+    num_sub = int(num_sub_per_request.sum())
+    request = torch.repeat_interleave(
+        torch.arange(len(qo_lens), device=device),
+        num_sub_per_request,
+        output_size=num_sub,
+    )
+    sub_begin = torch.cumsum(num_sub_per_request, 0) - num_sub_per_request
+    j = torch.arange(num_sub, device=device) - sub_begin[request]
+    chunk_begin = (first_chunk[request] + j - 1) * chunk_size
+    kv_begin = torch.where(j == 0, 0, chunk_begin)
+    kv_end = torch.where(
+        j == 0,
+        chunk_begin + chunk_size,
+        torch.minimum(chunk_begin + chunk_size, kv_lens[request]),
+    )
+    qo_lens = torch.where(
+        j == 0,
+        0,
+        torch.clamp(kv_end - torch.maximum(kv_begin, first_pos[request]), min=0),
+    )
+    sub_qo_indptr = torch.zeros(num_sub + 1, dtype=torch.int64, device=device)
+    torch.cumsum(qo_lens, 0, out=sub_qo_indptr[1:])
+    sub_kv_indptr = torch.cat([kv_indptr[request] + kv_begin, kv_indptr[-1:]])
+    return sub_qo_indptr.int(), sub_kv_indptr.int(), request
+
+
+def _split_prefix_lm_queries(
+    qo_indptr: torch.Tensor,
+    kv_lens: torch.Tensor,
+    prefix_len: Union[int, torch.Tensor],
+) -> Tuple[torch.Tensor, ...]:
+    # Prefix-LM attention without a mask: the queries inside the prefix of their request
+    # see the whole prefix, i.e. attend non-causally to the first min(prefix_len,
+    # kv_len) keys, and the queries past the prefix only need the causal mask. Both
+    # groups stay the last queries of their kv, so their positions (RoPE, ALiBi,
+    # window) are unchanged. Returns the qo_indptr of the queries inside and past the
+    # prefixes, their rows in the query tensor and the kv lengths of the prefixes.
+    qo_indptr = qo_indptr.to("cpu", torch.int64)
+    kv_lens = kv_lens.to("cpu", torch.int64)
+    prefix_len = torch.as_tensor(prefix_len, dtype=torch.int64)
+    qo_lens = qo_indptr[1:] - qo_indptr[:-1]
+    prefix_qo_lens = torch.clamp(prefix_len - (kv_lens - qo_lens), min=0)
+    prefix_qo_lens = torch.minimum(prefix_qo_lens, qo_lens)
+    num_rows = int(qo_indptr[-1])
+    request = torch.repeat_interleave(
+        torch.arange(len(qo_lens)), qo_lens, output_size=num_rows
+    )
+    rows = torch.arange(num_rows)
+    in_prefix = rows - qo_indptr[request] < prefix_qo_lens[request]
+    return (
+        get_indptr(prefix_qo_lens).int(),
+        get_indptr(qo_lens - prefix_qo_lens).int(),
+        rows[in_prefix],
+        rows[~in_prefix],
+        torch.minimum(prefix_len, kv_lens),
+    )
+
+
+def _get_prefix_lm_ragged_indptr(
+    prefix_qo_indptr: torch.Tensor,
+    kv_indptr: torch.Tensor,
+    prefix_kv_lens: torch.Tensor,
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    # The prefixes are not contiguous in the ragged kv, a sub-request without queries
+    # covers the rest of the kv of each request (as in _split_chunked_ragged_kv).
+    # Returns the (qo_indptr, kv_indptr) of the 2 * batch_size sub-requests.
+    prefix_qo_indptr = prefix_qo_indptr.to("cpu", torch.int64)
+    kv_indptr = kv_indptr.to("cpu", torch.int64)
+    prefix_qo_lens = prefix_qo_indptr[1:] - prefix_qo_indptr[:-1]
+    qo_lens = torch.stack([prefix_qo_lens, torch.zeros_like(prefix_qo_lens)], 1)
+    kv_begin = torch.stack([kv_indptr[:-1], kv_indptr[:-1] + prefix_kv_lens], 1)
+    return (
+        get_indptr(qo_lens.flatten()).int(),
+        torch.cat([kv_begin.flatten(), kv_indptr[-1:]]).int(),
+    )
+
+
+def _get_prefix_lm_wrappers(wrapper: Any) -> Tuple[Any, Any]:
+    # the inner wrappers of the launches on the queries inside and past the prefixes,
+    # created once, the launches run one after the other on the float workspace buffer
+    # (and the kv offsets buffer of fa3) of the wrapper
+    if wrapper._prefix_lm_wrappers is None:
+        wrapper._prefix_lm_wrappers = tuple(
+            type(wrapper)(
+                wrapper._float_workspace_buffer,
+                wrapper._kv_layout,
+                backend=wrapper._backend,
+            )
+            for _ in range(2)
+        )
+    for inner in wrapper._prefix_lm_wrappers:
+        inner._float_workspace_buffer = wrapper._float_workspace_buffer
+        if hasattr(wrapper, "_vector_sparse_indices_buffer"):
+            inner._vector_sparse_indices_buffer = wrapper._vector_sparse_indices_buffer
+    return wrapper._prefix_lm_wrappers
+
+
+def _run_prefix_lm(
+    wrappers: Tuple[Any, Any],
+    rows: Tuple[torch.Tensor, torch.Tensor],
+    q: torch.Tensor,
+    kv: Tuple[Any, ...],
+    head_dim_vo: int,
+    out: Optional[torch.Tensor],
+    lse: Optional[torch.Tensor],
+    return_lse: bool,
+    **kwargs,
+) -> Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]]:
+    # run the launches planned on the queries inside and past the prefixes, a wrapper
+    # is None if its group has no query, and scatter their rows to the output
+    out_shape = q.shape[:-1] + (head_dim_vo,)
+    if out is None:
+        out = torch.empty(out_shape, dtype=q.dtype, device=q.device)
+    else:
+        _check_shape_dtype_device(out, out_shape, q.dtype, q.device, "out")
+    if return_lse:
+        if lse is None:
+            lse = torch.empty(
+                (q.size(0), q.size(1)), dtype=torch.float32, device=q.device
+            )
+        else:
+            _check_shape_dtype_device(
+                lse, (q.size(0), q.size(1)), torch.float32, q.device, "lse"
+            )
+    for wrapper, group_rows in zip(wrappers, rows):
+        if wrapper is None:
+            continue
+        o, group_lse = wrapper.run(q[group_rows], *kv, return_lse=True, **kwargs)
+        out[group_rows] = o
+        if return_lse:
+            lse[group_rows] = group_lse
+    return (out, lse) if return_lse else out
+
+
+def _get_per_request_window_mask(
+    qo_lens: torch.Tensor,
+    kv_lens: torch.Tensor,
+    window_left: Union[int, torch.Tensor],
+    causal: bool,
+    custom_mask: Optional[torch.Tensor],
+    device: torch.device,
+    prefix_len: Union[int, torch.Tensor] = 0,
+    chunk_size: int = 0,
+    chunk_offset: Union[int, torch.Tensor] = 0,
+) -> torch.Tensor:
+    # Build the flattened custom mask applying a different sliding window to each
+    # request, so that a batch mixing window sizes runs in a single kernel launch.
+    # The causal flag is ignored by the kernels in custom mask mode, it is applied
+    # here unless the user provides a custom mask, the first prefix_len keys of each
+    # request are visible to all its queries (prefix-LM). With chunk_size > 0, the
+    # queries only attend to the keys of their aligned chunk, chunk_offset is the
+    # position of the first key of each request in its sequence.
+    request, q_pos, kv_pos, valid = _get_mask_positions(qo_lens, kv_lens, device)
+    mask = valid.clone()
+    batch_size = len(qo_lens)
+
+    def _expand(x: Union[int, torch.Tensor]) -> torch.Tensor:
+        x = torch.as_tensor(x, dtype=torch.int64).to(device)
+        return x.expand(batch_size)[request]
+
+    if causal and custom_mask is None:
+        mask &= (kv_pos <= q_pos) | (kv_pos < _expand(prefix_len))
+    if torch.is_tensor(window_left) or window_left >= 0:
+        window = _expand(window_left)
+        mask &= (window < 0) | (kv_pos >= q_pos - window)
+    if chunk_size > 0:
+        offset = _expand(chunk_offset)
+        chunk_begin = (q_pos + offset) // chunk_size * chunk_size - offset
+        mask &= (kv_pos >= chunk_begin) & (kv_pos < chunk_begin + chunk_size)
+    mask = mask[valid]
+    if custom_mask is not None:
+        mask &= custom_mask.contiguous().view(-1).to(device, torch.bool)
+    return mask
+
+
+def _get_segment_mask(
+    qo_lens: torch.Tensor,
+    kv_lens: torch.Tensor,
+    qo_segment_ids: torch.Tensor,
+    kv_segment_ids: torch.Tensor,
+    causal: bool,
+    custom_mask: Optional[torch.Tensor],
+) -> torch.Tensor:
+    # Expand the segment ids into the flattened custom mask of the fa2/fa3 kernels, on
+    # the device of the segment ids. This is the fallback of the launches without the
+    # SegmentAttention variant (fa3, jit_args and cuda graph mode), the other backends
+    # compare the segment ids in the kernel without this mask. As
+    # in _get_per_request_window_mask, the causal flag is applied here unless the user
+    # provides a custom mask.
+    device = qo_segment_ids.device
+    request, q_pos, kv_pos, valid = _get_mask_positions(qo_lens, kv_lens, device)
+    kv_begin = torch.cumsum(kv_lens.to(device, torch.int64), 0) - kv_lens.to(
+        device, torch.int64
+    )
+    kv_token = torch.clamp(
+        kv_begin[request] + kv_pos, max=max(len(kv_segment_ids) - 1, 0)
+    )
+    mask = valid & (qo_segment_ids[:, None] == kv_segment_ids.to(device)[kv_token])
+    if causal and custom_mask is None:
+        mask &= kv_pos <= q_pos
+    mask = mask[valid]
+    if custom_mask is not None:
+        mask &= custom_mask.contiguous().view(-1).to(device, torch.bool)
+    return mask
+
+
+def _check_chunk_size(
+    chunk_size: int,
+    custom_mask: Optional[torch.Tensor],
+    packed_custom_mask: Optional[torch.Tensor],
+    qo_segment_ids: Optional[torch.Tensor],
+    prefix_len: Union[int, torch.Tensor],
+) -> None:
+    # the chunks are aligned to the sequence positions, the masks indexed by the kv
+    # positions of the plan are not combined with the dropped pages
+    if chunk_size < 0:
+        raise ValueError(
+            "chunk_size should be non-negative, got {}.".format(chunk_size)
+        )
+    if chunk_size > 0 and (
+        custom_mask is not None
+        or packed_custom_mask is not None
+        or qo_segment_ids is not None
+        or torch.is_tensor(prefix_len)
+        or prefix_len > 0
+    ):
+        raise ValueError(
+            "chunk_size is not compatible with custom masks, segment ids and "
+            "prefix_len."
+        )
+
+
+def _check_segment_ids(
+    qo_segment_ids: Optional[torch.Tensor],
+    kv_segment_ids: Optional[torch.Tensor],
+    num_qo_tokens: int,
+    num_kv_tokens: int,
+) -> None:
+    if (qo_segment_ids is None) != (kv_segment_ids is None):
+        raise ValueError(
+            "qo_segment_ids and kv_segment_ids should be provided together."
+        )
+    if qo_segment_ids is None:
+        return
+    if qo_segment_ids.shape != (num_qo_tokens,):
+        raise ValueError(
+            "qo_segment_ids should have shape ({},), got {}.".format(
+                num_qo_tokens, tuple(qo_segment_ids.shape)
+            )
+        )
+    if kv_segment_ids.shape != (num_kv_tokens,):
+        raise ValueError(
+            "kv_segment_ids should have shape ({},), got {}.".format(
+                num_kv_tokens, tuple(kv_segment_ids.shape)
+            )
+        )
+
+
+def _get_segment_ids_bufs(
+    qo_segment_ids: Optional[torch.Tensor],
+    kv_segment_ids: Optional[torch.Tensor],
+    kv_lens: torch.Tensor,
+    device: torch.device,
+) -> Tuple[Optional[torch.Tensor], ...]:
+    # the segment ids and the token indptr of the kv segment ids read by the torch and
+    # triton backends
+    if qo_segment_ids is None:
+        return None, None, None
+    kv_segment_indptr = torch.zeros(len(kv_lens) + 1, dtype=torch.int32)
+    torch.cumsum(kv_lens, 0, out=kv_segment_indptr[1:])
+    return (
+        qo_segment_ids.to(device, torch.int32),
+        kv_segment_ids.to(device, torch.int32),
+        kv_segment_indptr.to(device),
+    )
+
+
+def _check_uniform_logits_soft_cap(
+    logits_soft_cap: Union[float, torch.Tensor],
+) -> None:
+    if torch.is_tensor(logits_soft_cap):
+        raise ValueError(
+            "The CUDA kernels take a single logits_soft_cap per plan, per-request "
+            "logits_soft_cap with different values is only supported by the torch "
+            "and triton backends."
+        )
+
+
 class BatchPrefillWithPagedKVCacheWrapper:
     r"""Wrapper class for prefill/append attention with paged kv-cache for batch of
     requests.
@@ -1064,12 +1578,29 @@ class BatchPrefillWithPagedKVCacheWrapper:
             The implementation backend, could be ``auto``/``fa2`` or ``fa3``. Defaults to ``auto``.
             If set to ``auto``, the wrapper will automatically choose the backend based on the
             device architecture and kernel availability.
+            If set to ``torch``, the attention is computed with pure PyTorch (e.g. for
+            CPU-only hosts), the query tiles are processed by a thread pool with online
+            softmax over kv tiles. If set to ``triton``, a Triton kernel is used (the tile
+            sizes are tuned and cached per problem shape, runs on CPU with
+            ``TRITON_INTERPRET=1``), ``ROPE_LLAMA`` is not supported. The ``torch`` and
+            ``triton`` backends do not support CUDAGraph and :attr:`jit_args`.
 
         jit_args : Optional[List[Any]]
             If provided, the wrapper will use the provided arguments to create the JIT module,
             otherwise, the wrapper will use default attention implementation.
         """
         _check_kv_layout(kv_layout)
+        if backend not in ["auto", "fa2", "fa3", "torch", "triton"]:
+            raise KeyError(
+                "Invalid backend {}, expect one of auto, fa2, fa3, torch or "
+                "triton.".format(backend)
+            )
+        if backend in ["torch", "triton"] and (use_cuda_graph or jit_args is not None):
+            raise ValueError(
+                "The {} backend does not support cuda graph and jit_args.".format(
+                    backend
+                )
+            )
 
         if jit_args is not None:
             self._jit_module = get_batch_prefill_jit_module(
@@ -1095,15 +1626,20 @@ class BatchPrefillWithPagedKVCacheWrapper:
         self._kv_lens_buffer = torch.empty(
             (32768,), dtype=torch.int32, device=self.device
         )
-        self._int_workspace_buffer = torch.empty(
-            (8 * 1024 * 1024,), dtype=torch.uint8, device=self.device
-        )
-        self._pin_memory_int_workspace_buffer = torch.empty(
-            self._int_workspace_buffer.shape,
-            dtype=self._int_workspace_buffer.dtype,
-            device="cpu",
-            pin_memory=True,
-        )
+        if backend in ["torch", "triton"]:
+            # no scheduler workspace, the pinned host buffer also requires CUDA
+            self._int_workspace_buffer = None
+            self._pin_memory_int_workspace_buffer = None
+        else:
+            self._int_workspace_buffer = torch.empty(
+                (8 * 1024 * 1024,), dtype=torch.uint8, device=self.device
+            )
+            self._pin_memory_int_workspace_buffer = torch.empty(
+                self._int_workspace_buffer.shape,
+                dtype=self._int_workspace_buffer.dtype,
+                device="cpu",
+                pin_memory=True,
+            )
         self._use_cuda_graph = use_cuda_graph
         if use_cuda_graph:
             if not torch.is_tensor(qo_indptr_buf):
@@ -1143,6 +1679,9 @@ class BatchPrefillWithPagedKVCacheWrapper:
         self._mask_indptr_buf = mask_indptr_buf
         self._max_total_num_rows = None
         self._backend = backend
+        self._prefix_lm_wrappers = None
+        self._prefix_lm_rows = None
+        self._use_segment_kernel = False
 
     @property
     def is_cuda_graph_enabled(self) -> bool:
@@ -1174,10 +1713,10 @@ class BatchPrefillWithPagedKVCacheWrapper:
 
     def plan(
         self,
-        qo_indptr: torch.Tensor,
-        paged_kv_indptr: torch.Tensor,
-        paged_kv_indices: torch.Tensor,
-        paged_kv_last_page_len: torch.Tensor,
+        qo_indptr: Optional[torch.Tensor],
+        paged_kv_indptr: Optional[torch.Tensor],
+        paged_kv_indices: Union[torch.Tensor, RunLengthPageIndices],
+        paged_kv_last_page_len: Optional[torch.Tensor],
         num_qo_heads: int,
         num_kv_heads: int,
         head_dim_qk: int,
@@ -1189,27 +1728,37 @@ class BatchPrefillWithPagedKVCacheWrapper:
         pos_encoding_mode: str = "NONE",
         use_fp16_qk_reduction: bool = False,
         sm_scale: Optional[float] = None,
-        window_left: int = -1,
-        logits_soft_cap: Optional[float] = None,
+        window_left: Union[int, torch.Tensor] = -1,
+        logits_soft_cap: Optional[Union[float, torch.Tensor]] = None,
         rope_scale: Optional[float] = None,
         rope_theta: Optional[float] = None,
         q_data_type: Union[str, torch.dtype] = "float16",
         kv_data_type: Optional[Union[str, torch.dtype]] = None,
         non_blocking: bool = False,
+        batch_metadata: Optional[BatchMetadata] = None,
+        qo_segment_ids: Optional[torch.Tensor] = None,
+        kv_segment_ids: Optional[torch.Tensor] = None,
+        prefix_len: Union[int, torch.Tensor] = 0,
+        chunk_size: int = 0,
+        mask_indptr: Optional[torch.Tensor] = None,
     ) -> None:
         r"""Plan batch prefill/append attention on Paged KV-Cache for given problem specification.
 
         Parameters
         ----------
-        qo_indptr : torch.Tensor
-            The indptr of the query/output tensor, shape: ``[batch_size + 1]``.
-        paged_kv_indptr : torch.Tensor
-            The indptr of the paged kv-cache, shape: ``[batch_size + 1]``.
-        paged_kv_indices : torch.Tensor
-            The page indices of the paged kv-cache, shape: ``[qo_indptr[-1]]``.
-        paged_kv_last_page_len : torch.Tensor
+        qo_indptr : Optional[torch.Tensor]
+            The indptr of the query/output tensor, shape: ``[batch_size + 1]``, can be
+            ``None`` if :attr:`batch_metadata` is provided.
+        paged_kv_indptr : Optional[torch.Tensor]
+            The indptr of the paged kv-cache, shape: ``[batch_size + 1]``, can be ``None``
+            if :attr:`batch_metadata` is provided.
+        paged_kv_indices : Union[torch.Tensor, RunLengthPageIndices]
+            The page indices of the paged kv-cache, shape: ``[qo_indptr[-1]]``, or their
+            run-length encoding (see :class:`flashinfer.page.RunLengthPageIndices`).
+        paged_kv_last_page_len : Optional[torch.Tensor]
             The number of entries in the last page of each request in the paged
-            kv-cache, shape: ``[batch_size]``.
+            kv-cache, shape: ``[batch_size]``, can be ``None`` if :attr:`batch_metadata`
+            is provided.
         num_qo_heads : int
             The number of query/output heads.
         num_kv_heads : int
@@ -1247,15 +1796,24 @@ class BatchPrefillWithPagedKVCacheWrapper:
         use_fp16_qk_reduction : bool
             Whether to use f16 for qk reduction (faster at the cost of slight precision
             loss).
-        window_left : int
+        window_left : Union[int, torch.Tensor]
             The left (inclusive) window size for the attention window, when set to ``-1``, the window
             size will be set to the full length of the sequence. Defaults to ``-1``.
-        logits_soft_cap : Optional[float]
+            Could also be an int32 tensor of per-request window sizes, shape: ``[batch_size]``.
+            The ``torch`` and ``triton`` backends read the windows per request, the
+            ``fa2``/``fa3`` kernels take a single window, so the windows are applied through
+            a custom mask built on the device, after dropping the pages before the window
+            of the first query of each request so that the mask only spans the windows.
+        logits_soft_cap : Optional[Union[float, torch.Tensor]]
             The attention logits soft capping value (used in Gemini, Grok and Gemma-2, etc.), if not
             provided, will be set to ``0``. If greater than 0, the logits will be capped according to
             formula:
             :math:`\texttt{logits_soft_cap} \times \mathrm{tanh}(x / \texttt{logits_soft_cap})`,
             where :math:`x` is the input logits.
+            Could also be a float32 tensor of per-request values, shape: ``[batch_size]``,
+            which is only supported by the ``torch`` and ``triton`` backends: the CUDA
+            kernels take a single soft cap per plan and raise a ``ValueError`` if the
+            values differ.
         sm_scale : Optional[float]
             The scale used in softmax, if not provided, will be set to
             ``1.0 / sqrt(head_dim)``.
@@ -1271,6 +1829,60 @@ class BatchPrefillWithPagedKVCacheWrapper:
         non_blocking : bool
             Whether to copy the input tensors to the device asynchronously, defaults to ``False``.
             If ``True``, user should synchronize before calling :meth:`run` or cuda graph replay.
+        batch_metadata : Optional[BatchMetadata]
+            The batch metadata of this step, if provided, :attr:`qo_indptr`,
+            :attr:`paged_kv_indptr`, :attr:`paged_kv_last_page_len` and the mask indptr
+            are taken from its cached host and device tensors instead of being computed
+            and copied between host and device.
+        qo_segment_ids : Optional[torch.Tensor]
+            The int32 segment (e.g. document) id of each query token, shape:
+            ``[qo_indptr[-1]]``. If provided with :attr:`kv_segment_ids`, a query only
+            attends to the keys of the same segment, in addition to the causal, window and
+            custom masks. This replaces the custom mask of packed sequences: the
+            ``torch``, ``triton`` and ``fa2`` backends compare the segment ids in the
+            kernel, with a cost linear in the number of tokens (``fa2`` through a
+            JIT-compiled attention variant, ``backend="auto"`` selects ``fa2``). The
+            ``fa3`` kernels, :attr:`jit_args` and cuda graph mode fall back to the segment
+            ids expanded on the device into a custom mask of
+            ``sum(qo_len[i] * kv_len[i] for i in range(batch_size))`` bits.
+        kv_segment_ids : Optional[torch.Tensor]
+            The int32 segment id of each key/value token, concatenated over the requests,
+            shape: ``[sum(kv_len[i] for i in range(batch_size))]``.
+        prefix_len : Union[int, torch.Tensor]
+            The length of the bidirectional prefix (e.g. image or prompt tokens) of each
+            request for prefix-LM attention: with :attr:`causal`, the first
+            ``prefix_len`` keys are visible to all queries of the request and the rest is
+            causal. Could be a tensor of per-request values, shape: ``[batch_size]``.
+            Ignored with a custom mask. The ``torch`` and ``triton`` backends skip the
+            kv tiles past both the prefix and the diagonal. The ``fa2``/``fa3`` kernels
+            have no prefix-LM mask, the queries inside the prefix of their request attend
+            to the whole prefix and the others only need the causal mask, so they are
+            planned as two launches with the standard masks: a non-causal launch of the
+            queries inside the prefixes on the prefix pages and a causal launch of the other
+            queries, which keeps the ``fa3`` kernels and the causal tile skipping. With
+            per-request :attr:`window_left`, segment ids, :attr:`jit_args` or in
+            CUDAGraph mode, the prefixes are expanded into a custom mask instead.
+        chunk_size : int
+            The chunk size of chunked local attention (e.g. the local layers of
+            Llama 4), if greater than ``0``, the query at position ``p`` only attends to
+            the keys of its aligned chunk ``[p // chunk_size * chunk_size, p]`` (the
+            whole chunk without :attr:`causal`). The pages before the chunk of the
+            first query of each request are never read. The ``torch`` and ``triton``
+            backends skip the kv tiles outside the chunks. The ``fa2``/``fa3`` kernels
+            have no chunk mask, the queries of each request are split by chunk into
+            sub-requests reading only the pages of their chunk, which need no mask if
+            :attr:`chunk_size` is a multiple of :attr:`page_size`, otherwise a custom
+            mask over the sub-requests (of at most ``chunk_size + page_size`` keys per
+            query) hides the head of their first page. In CUDAGraph mode the batch size
+            is fixed and the ``fa2``/``fa3`` kernels receive the expanded custom mask.
+            Not compatible with custom masks, segment ids and :attr:`prefix_len`.
+            Defaults to ``0`` (disabled).
+        mask_indptr : Optional[torch.Tensor]
+            The byte indptr of :attr:`packed_custom_mask` when the mask of each request
+            is packed separately, shape: ``[batch_size + 1]``, e.g. as returned by
+            :func:`flashinfer.quantization.segment_packbits` or
+            :func:`flashinfer.mask.build_tree_attention_mask`. Defaults to the indptr
+            computed from the query and kv lengths.
 
         Note
         ----
@@ -1294,29 +1906,289 @@ class BatchPrefillWithPagedKVCacheWrapper:
         if head_dim_vo is None:
             head_dim_vo = head_dim_qk
 
+        if batch_metadata is not None:
+            _check_batch_metadata_page_size(batch_metadata, page_size)
+            names = ["qo_indptr", "kv_page_indptr", "kv_last_page_len"]
+            qo_indptr, paged_kv_indptr, paged_kv_last_page_len = (
+                batch_metadata.get_tensors(names, self.device)
+            )
+            qo_indptr_host, paged_kv_indptr_host, kv_lens_arr_host = (
+                batch_metadata.get_tensors(["qo_indptr", "kv_page_indptr", "kv_lens"])
+            )
+        else:
+            # NOTE(Zihao): only required if qo_indptr/paged_kv_indptr are device tensors
+            qo_indptr_host = qo_indptr.to("cpu")
+            paged_kv_indptr_host = paged_kv_indptr.to("cpu")
+            paged_kv_last_page_len_host = paged_kv_last_page_len.to("cpu")
+            kv_lens_arr_host = get_seq_lens(
+                paged_kv_indptr_host, paged_kv_last_page_len_host, page_size
+            )
+
         batch_size = len(qo_indptr) - 1
-        if custom_mask is not None or packed_custom_mask is not None:
-            mask_indptr = _compute_page_mask_indptr(
+        paged_kv_indices = _expand_page_indices(
+            paged_kv_indices, paged_kv_indptr_host, self.device, non_blocking
+        )
+        logits_soft_cap = _canonicalize_per_request_param(
+            logits_soft_cap, batch_size, "logits_soft_cap"
+        )
+        if self._backend not in ["torch", "triton"]:
+            _check_uniform_logits_soft_cap(logits_soft_cap)
+        window_left = _canonicalize_per_request_param(
+            window_left, batch_size, "window_left"
+        )
+        _check_segment_ids(
+            qo_segment_ids,
+            kv_segment_ids,
+            int(qo_indptr_host[-1]),
+            int(kv_lens_arr_host.sum()),
+        )
+        # the fa2 kernels compare the segment ids in the logits mask of the
+        # SegmentAttention variant, the other CUDA launches (fa3, jit_args and cuda
+        # graph mode) receive the segment ids expanded into the custom mask
+        self._use_segment_kernel = (
+            qo_segment_ids is not None
+            and self._backend in ["auto", "fa2"]
+            and self._jit_module is None
+            and not self.is_cuda_graph_enabled
+        )
+        prefix_len = _canonicalize_per_request_param(
+            prefix_len, batch_size, "prefix_len"
+        )
+        use_prefix = (
+            causal
+            and (torch.is_tensor(prefix_len) or prefix_len > 0)
+            and custom_mask is None
+            and packed_custom_mask is None
+        )
+        _check_chunk_size(
+            chunk_size, custom_mask, packed_custom_mask, qo_segment_ids, prefix_len
+        )
+        self._prefix_lm_rows = None
+        if (
+            use_prefix
+            and self._backend not in ["torch", "triton"]
+            and self._jit_module is None
+            and not self.is_cuda_graph_enabled
+            and not torch.is_tensor(window_left)
+            and qo_segment_ids is None
+        ):
+            # the kernels have no prefix-LM mask, instead of expanding the prefixes
+            # into a custom mask, plan a non-causal launch of the queries inside the
+            # prefixes on the prefix pages and a causal launch of the other queries
+            (
+                prefix_qo_indptr,
+                suffix_qo_indptr,
+                prefix_rows,
+                suffix_rows,
+                prefix_kv_lens,
+            ) = _split_prefix_lm_queries(qo_indptr_host, kv_lens_arr_host, prefix_len)
+            if len(prefix_rows) == 0:
+                # no query inside the prefixes, prefix-LM reduces to the causal mask
+                use_prefix = False
+            else:
+                prefix_wrapper, suffix_wrapper = _get_prefix_lm_wrappers(self)
+                plan_kwargs = dict(
+                    num_qo_heads=num_qo_heads,
+                    num_kv_heads=num_kv_heads,
+                    head_dim_qk=head_dim_qk,
+                    page_size=page_size,
+                    head_dim_vo=head_dim_vo,
+                    pos_encoding_mode=pos_encoding_mode,
+                    use_fp16_qk_reduction=use_fp16_qk_reduction,
+                    sm_scale=sm_scale,
+                    window_left=window_left,
+                    logits_soft_cap=logits_soft_cap,
+                    rope_scale=rope_scale,
+                    rope_theta=rope_theta,
+                    q_data_type=q_data_type,
+                    kv_data_type=kv_data_type,
+                    non_blocking=non_blocking,
+                )
+                prefix_wrapper.plan(
+                    prefix_qo_indptr,
+                    *_truncate_paged_kv(
+                        paged_kv_indptr_host,
+                        paged_kv_indices,
+                        page_size,
+                        prefix_kv_lens,
+                    ),
+                    causal=False,
+                    **plan_kwargs,
+                )
+                if len(suffix_rows) > 0:
+                    suffix_wrapper.plan(
+                        suffix_qo_indptr,
+                        paged_kv_indptr,
+                        paged_kv_indices,
+                        paged_kv_last_page_len,
+                        causal=True,
+                        **plan_kwargs,
+                    )
+                else:
+                    suffix_wrapper = None
+                self._prefix_lm_plans = (prefix_wrapper, suffix_wrapper)
+                self._prefix_lm_rows = (
+                    prefix_rows.to(self.device, non_blocking=non_blocking),
+                    suffix_rows.to(self.device, non_blocking=non_blocking),
+                )
+                return
+        chunk_offset: Union[int, torch.Tensor] = 0
+        use_chunk_mask = False
+        if (
+            chunk_size > 0
+            and self._backend not in ["torch", "triton"]
+            and not self.is_cuda_graph_enabled
+        ):
+            # the kernels have no chunk mask, split the queries of each request by
+            # chunk into sub-requests reading only the pages of their chunk, the chunks
+            # only need a mask for the head of their first page if they are not page
+            # aligned
+            (
                 qo_indptr,
                 paged_kv_indptr,
+                paged_kv_indices,
+                paged_kv_last_page_len,
+                chunk_offset,
+                request,
+            ) = _split_chunked_paged_kv(
+                qo_indptr_host,
+                paged_kv_indptr_host,
+                paged_kv_indices,
                 paged_kv_last_page_len,
                 page_size,
+                chunk_size,
+            )
+            qo_indptr_host = qo_indptr.to("cpu")
+            paged_kv_indptr_host = paged_kv_indptr.to("cpu")
+            kv_lens_arr_host = get_seq_lens(
+                paged_kv_indptr_host, paged_kv_last_page_len.to("cpu"), page_size
             )
+            batch_size = len(qo_indptr_host) - 1
+            if torch.is_tensor(window_left):
+                window_left = _canonicalize_per_request_param(
+                    window_left[request.cpu()], batch_size, "window_left"
+                )
+            use_chunk_mask = chunk_size % page_size != 0
+            batch_metadata = None
+        elif chunk_size > 0:
+            # the pages before the chunk of the first query are never read, the chunks
+            # stay aligned to the positions in the original page table (chunk_offset)
+            paged_kv_indptr_device = paged_kv_indptr.device
+            paged_kv_indptr, paged_kv_indices, chunk_offset = _drop_unread_pages(
+                paged_kv_indptr_host,
+                paged_kv_indices,
+                paged_kv_last_page_len,
+                page_size,
+                qo_indptr_host[1:] - qo_indptr_host[:-1],
+                chunk_size=chunk_size,
+            )
+            paged_kv_indptr = paged_kv_indptr.to(paged_kv_indptr_device)
+            paged_kv_indptr_host = paged_kv_indptr.to("cpu")
+            chunk_offset = _canonicalize_per_request_param(
+                chunk_offset, batch_size, "chunk_offset"
+            )
+            kv_lens_arr_host = kv_lens_arr_host - chunk_offset
+            # the page table and the mask indptr of the metadata are stale
+            batch_metadata = None
+            use_chunk_mask = self._backend not in ["torch", "triton"]
+        elif (
+            torch.is_tensor(window_left)
+            and self._backend not in ["torch", "triton"]
+            and custom_mask is None
+            and packed_custom_mask is None
+            and qo_segment_ids is None
+        ):
+            # the per-request windows are applied through the custom mask below, drop
+            # the pages before the window of the first query of each request, so that
+            # the mask only spans the windows instead of the whole kv
+            paged_kv_indptr_device = paged_kv_indptr.device
+            paged_kv_indptr, paged_kv_indices, window_offset = _drop_unread_pages(
+                paged_kv_indptr_host,
+                paged_kv_indices,
+                paged_kv_last_page_len,
+                page_size,
+                qo_indptr_host[1:] - qo_indptr_host[:-1],
+                window_left=window_left,
+            )
+            paged_kv_indptr = paged_kv_indptr.to(paged_kv_indptr_device)
+            paged_kv_indptr_host = paged_kv_indptr.to("cpu")
+            window_offset = window_offset.to("cpu")
+            kv_lens_arr_host = kv_lens_arr_host - window_offset
+            if use_prefix:
+                # the dropped prefix keys are outside the windows of all queries
+                prefix_len = torch.clamp(
+                    torch.as_tensor(prefix_len) - window_offset, min=0
+                )
+            batch_metadata = None
+        if (
+            torch.is_tensor(window_left) or use_prefix or use_chunk_mask
+        ) and self._backend not in ["torch", "triton"]:
+            # the kernels take a single window and have no prefix-LM and chunk masks,
+            # fold the per-request windows, the prefixes and the chunks into the mask
+            if custom_mask is None and packed_custom_mask is not None:
+                raise ValueError(
+                    "Per-request window_left is not supported with packed_custom_mask, "
+                    "please provide custom_mask instead."
+                )
+            custom_mask = _get_per_request_window_mask(
+                qo_indptr_host[1:] - qo_indptr_host[:-1],
+                kv_lens_arr_host,
+                window_left,
+                causal,
+                custom_mask,
+                qo_indptr.device,
+                prefix_len=prefix_len,
+                chunk_size=chunk_size if use_chunk_mask else 0,
+                chunk_offset=chunk_offset,
+            )
+        if (
+            qo_segment_ids is not None
+            and self._backend not in ["torch", "triton"]
+            and not self._use_segment_kernel
+        ):
+            # fallback of the launches without the segment mask variant, expand the
+            # segment ids into the mask
+            if custom_mask is None and packed_custom_mask is not None:
+                raise ValueError(
+                    "Segment ids are not supported with packed_custom_mask, "
+                    "please provide custom_mask instead."
+                )
+            custom_mask = _get_segment_mask(
+                qo_indptr_host[1:] - qo_indptr_host[:-1],
+                kv_lens_arr_host,
+                qo_segment_ids,
+                kv_segment_ids,
+                causal,
+                custom_mask,
+            )
+        if custom_mask is not None or (
+            packed_custom_mask is not None and mask_indptr is None
+        ):
+            if batch_metadata is not None:
+                mask_device = (
+                    custom_mask if custom_mask is not None else packed_custom_mask
+                ).device
+                mask_indptr = batch_metadata.get("mask_indptr", mask_device)
+            else:
+                mask_indptr = _compute_page_mask_indptr(
+                    qo_indptr,
+                    paged_kv_indptr,
+                    paged_kv_last_page_len,
+                    page_size,
+                )
         if packed_custom_mask is None and custom_mask is not None:
             # create packed custom mask from custom mask
-            packed_custom_mask, mask_indptr = segment_packbits(
+            packbits = (
+                _segment_packbits_torch
+                if self._backend in ["torch", "triton"]
+                else segment_packbits
+            )
+            packed_custom_mask, mask_indptr = packbits(
                 custom_mask.contiguous().view(-1),
                 mask_indptr,
                 bitorder="little",
             )
 
-        # NOTE(Zihao): only required if qo_indptr/paged_kv_indptr are device tensors
-        qo_indptr_host = qo_indptr.to("cpu")
-        paged_kv_indptr_host = paged_kv_indptr.to("cpu")
-        paged_kv_last_page_len_host = paged_kv_last_page_len.to("cpu")
-        kv_lens_arr_host = get_seq_lens(
-            paged_kv_indptr_host, paged_kv_last_page_len_host, page_size
-        )
         self._kv_lens_buffer[: len(kv_lens_arr_host)].copy_(
             kv_lens_arr_host, non_blocking=non_blocking
         )
@@ -1392,10 +2264,43 @@ class BatchPrefillWithPagedKVCacheWrapper:
         self._cached_q_data_type = q_data_type
         self._cached_kv_data_type = kv_data_type
 
-        if self._jit_module is not None:
+        if self._backend in ["torch", "triton"]:
+            # the kernels read the plan buffers in run, nothing to schedule
+            self._cached_module = None
+            (
+                self._qo_segment_ids_buf,
+                self._kv_segment_ids_buf,
+                self._kv_segment_indptr_buf,
+            ) = _get_segment_ids_bufs(
+                qo_segment_ids, kv_segment_ids, kv_lens_arr_host, self.device
+            )
+            self._prefix_len = prefix_len if causal else 0
+            if self._backend == "triton":
+                if pos_encoding_mode == "ROPE_LLAMA":
+                    raise ValueError(
+                        "The triton backend does not support ROPE_LLAMA, please apply "
+                        "rotary embedding to query and key before attention."
+                    )
+                self._max_qo_len = int((qo_indptr_host[1:] - qo_indptr_host[:-1]).max())
+                self._window_left_buf = _get_per_request_param_buf(
+                    window_left, -1, batch_size, torch.int32, self.device
+                )
+                self._logits_soft_cap_buf = _get_per_request_param_buf(
+                    logits_soft_cap, 0.0, batch_size, torch.float32, self.device
+                )
+                self._prefix_len_buf = _get_per_request_param_buf(
+                    self._prefix_len, 0, batch_size, torch.int32, self.device
+                )
+                self._chunk_offset_buf = _get_per_request_param_buf(
+                    chunk_offset, 0, batch_size, torch.int32, self.device
+                )
+        elif self._jit_module is not None:
             self._cached_module = self._jit_module
         else:
-            if self._backend == "auto":
+            if self._use_segment_kernel:
+                # the hopper variants have no logits mask
+                self._backend = "fa2"
+            elif self._backend == "auto":
                 self._backend = determine_attention_backend(
                     self.device,
                     PosEncodingMode[pos_encoding_mode].value,
@@ -1413,14 +2318,24 @@ class BatchPrefillWithPagedKVCacheWrapper:
                 head_dim_qk,
                 head_dim_vo,
                 PosEncodingMode[pos_encoding_mode].value,
-                window_left >= 0,  # use_sliding_window
+                _get_kernel_window_left(window_left) >= 0,  # use_sliding_window
                 logits_soft_cap > 0,  # use_logits_soft_cap
                 use_fp16_qk_reduction,
             )
 
-            self._cached_module = get_batch_prefill_module(self._backend)(
-                *get_module_args
-            )
+            if self._use_segment_kernel:
+                (
+                    self._qo_segment_ids_buf,
+                    self._kv_segment_ids_buf,
+                    self._kv_segment_indptr_buf,
+                ) = _get_segment_ids_bufs(
+                    qo_segment_ids, kv_segment_ids, kv_lens_arr_host, self.device
+                )
+                self._cached_module = get_batch_prefill_segment_module(*get_module_args)
+            else:
+                self._cached_module = get_batch_prefill_module(self._backend)(
+                    *get_module_args
+                )
 
         if self._backend == "fa3":
             if page_size != 1:
@@ -1438,30 +2353,35 @@ class BatchPrefillWithPagedKVCacheWrapper:
                 ].copy_(vector_sparse_indptr_host, non_blocking=non_blocking)
                 paged_kv_indptr_host = vector_sparse_indptr_host
 
-        with self.device as device:
-            self._plan_info = self._cached_module.plan(
-                self._float_workspace_buffer,
-                self._int_workspace_buffer,
-                self._pin_memory_int_workspace_buffer,
-                qo_indptr_host,
-                paged_kv_indptr_host,
-                kv_lens_arr_host,
-                self._max_total_num_rows or total_num_rows,
-                batch_size,
-                num_qo_heads,
-                num_kv_heads,
-                page_size,
-                self.is_cuda_graph_enabled,
-                head_dim_qk,
-                head_dim_vo,
-                causal,
-                get_cuda_stream(device),
-            )
+        if self._backend in ["torch", "triton"]:
+            self._plan_info = None
+        else:
+            with self.device as device:
+                self._plan_info = self._cached_module.plan(
+                    self._float_workspace_buffer,
+                    self._int_workspace_buffer,
+                    self._pin_memory_int_workspace_buffer,
+                    qo_indptr_host,
+                    paged_kv_indptr_host,
+                    kv_lens_arr_host,
+                    self._max_total_num_rows or total_num_rows,
+                    batch_size,
+                    num_qo_heads,
+                    num_kv_heads,
+                    page_size,
+                    self.is_cuda_graph_enabled,
+                    head_dim_qk,
+                    head_dim_vo,
+                    causal,
+                    get_cuda_stream(device),
+                )
 
         self._causal = causal
         self._pos_encoding_mode = pos_encoding_mode
         self._use_fp16_qk_reduction = use_fp16_qk_reduction
         self._window_left = window_left
+        self._chunk_size = chunk_size
+        self._chunk_offset = chunk_offset
         self._logits_soft_cap = logits_soft_cap
         self._sm_scale = sm_scale
         self._rope_scale = rope_scale
@@ -1501,10 +2421,11 @@ class BatchPrefillWithPagedKVCacheWrapper:
         q: torch.Tensor,
         paged_kv_cache: Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]],
         *args,
-        k_scale: Optional[float] = None,
-        v_scale: Optional[float] = None,
+        k_scale: Optional[Union[float, torch.Tensor]] = None,
+        v_scale: Optional[Union[float, torch.Tensor]] = None,
         out: Optional[torch.Tensor] = None,
         lse: Optional[torch.Tensor] = None,
+        attention_mass: Optional[torch.Tensor] = None,
         return_lse: Literal[False] = False,
     ) -> torch.Tensor: ...
 
@@ -1514,10 +2435,11 @@ class BatchPrefillWithPagedKVCacheWrapper:
         q: torch.Tensor,
         paged_kv_cache: Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]],
         *args,
-        k_scale: Optional[float] = None,
-        v_scale: Optional[float] = None,
+        k_scale: Optional[Union[float, torch.Tensor]] = None,
+        v_scale: Optional[Union[float, torch.Tensor]] = None,
         out: Optional[torch.Tensor] = None,
         lse: Optional[torch.Tensor] = None,
+        attention_mass: Optional[torch.Tensor] = None,
         return_lse: Literal[True] = True,
     ) -> Tuple[torch.Tensor, torch.Tensor]: ...
 
@@ -1526,10 +2448,11 @@ class BatchPrefillWithPagedKVCacheWrapper:
         q: torch.Tensor,
         paged_kv_cache: Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]],
         *args,
-        k_scale: Optional[float] = None,
-        v_scale: Optional[float] = None,
+        k_scale: Optional[Union[float, torch.Tensor]] = None,
+        v_scale: Optional[Union[float, torch.Tensor]] = None,
         out: Optional[torch.Tensor] = None,
         lse: Optional[torch.Tensor] = None,
+        attention_mass: Optional[torch.Tensor] = None,
         return_lse: bool = False,
     ) -> Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]]:
         r"""Compute batch prefill/append attention between query and paged kv-cache.
@@ -1554,14 +2477,26 @@ class BatchPrefillWithPagedKVCacheWrapper:
 
         *args
             Additional arguments for custom kernels.
-        k_scale : Optional[float]
+        k_scale : Optional[Union[float, torch.Tensor]]
             The calibration scale of key for fp8 input, if not provided, will be set to ``1.0``.
-        v_scale : Optional[float]
+            Could also be a float32 tensor of per-page (``[max_num_pages]``) or
+            per-page-per-head (``[max_num_pages, num_kv_heads]``) scales maintained by
+            :func:`flashinfer.page.append_paged_kv_cache_quantized`, only supported by the
+            ``torch`` and ``triton`` backends.
+        v_scale : Optional[Union[float, torch.Tensor]]
             The calibration scale of value for fp8 input, if not provided, will be set to ``1.0``.
+            Could also be a float32 tensor of per-page (or per-page-per-head) scales, in which
+            case :attr:`k_scale` should be a tensor of the same shape.
         out : Optional[torch.Tensor]
             The output tensor, if not provided, will be allocated internally.
         lse : Optional[torch.Tensor]
             The log-sum-exp of attention logits, if not provided, will be allocated internally.
+        attention_mass : Optional[torch.Tensor]
+            If provided, the softmax mass of the attention is accumulated (added) into this
+            float32 buffer, per page with shape ``[max_num_pages, num_kv_heads]`` or per
+            token with shape ``[max_num_pages, page_size, num_kv_heads]``, summed over the
+            query tokens and the query heads of each kv head group. Only supported by the
+            ``torch`` and ``triton`` backends.
         return_lse : bool
             Whether to return the logsumexp of attention output
 
@@ -1573,8 +2508,55 @@ class BatchPrefillWithPagedKVCacheWrapper:
 
             * The attention output, shape: ``[qo_indptr[-1], num_qo_heads, head_dim]``.
             * The logsumexp of attention output, shape: ``[qo_indptr[-1], num_qo_heads]``.
+
+        Note
+        ----
+        When per-page scale tensors are provided, the ``torch`` and ``triton`` backends
+        dequantize the pages as the attention reads them, the wrapper is planned with the
+        quantized ``kv_data_type``. The other backends take scalar scales only and raise
+        a ``ValueError``. Per-page scales are not compatible with CUDAGraph.
+
+        The attention mass is accumulated inside the attention, with all its masks: once
+        the logsumexp of the query rows is final, a second sweep over their kv tiles
+        recomputes the normalized probabilities and adds them up per kv token. It is not
+        compatible with CUDAGraph.
         """
+        if self._prefix_lm_rows is not None:
+            return _run_prefix_lm(
+                self._prefix_lm_plans,
+                self._prefix_lm_rows,
+                q,
+                (paged_kv_cache,) + args,
+                _unpack_paged_kv_cache(paged_kv_cache, self._kv_layout)[1].shape[-1],
+                out,
+                lse,
+                return_lse,
+                k_scale=k_scale,
+                v_scale=v_scale,
+                attention_mass=attention_mass,
+            )
+        if attention_mass is not None:
+            _check_attention_mass(attention_mass, self._backend)
+            if self.is_cuda_graph_enabled:
+                raise ValueError("attention_mass is not supported in cuda graph mode.")
         k_cache, v_cache = _unpack_paged_kv_cache(paged_kv_cache, self._kv_layout)
+        paged_kv_indices = self._paged_kv_indices_buf
+        page_k_scale = page_v_scale = None
+        if torch.is_tensor(k_scale) or torch.is_tensor(v_scale):
+            if self.is_cuda_graph_enabled:
+                raise ValueError(
+                    "Per-page kv scales are not supported in cuda graph mode."
+                )
+            if self._backend not in ["torch", "triton"]:
+                raise ValueError(
+                    "Per-page kv scales are only supported by the torch and triton "
+                    "backends, the CUDA kernels take float k_scale and v_scale, got "
+                    "backend {}.".format(self._backend)
+                )
+            # the pages are dequantized as the attention reads them
+            _check_page_scales(k_scale, v_scale, k_cache, v_cache, self._kv_layout)
+            page_k_scale, page_v_scale = k_scale, v_scale
+            k_scale = v_scale = None
         _check_cached_qkv_data_type(
             q, k_cache, self._cached_q_data_type, self._cached_kv_data_type
         )
@@ -1585,7 +2567,7 @@ class BatchPrefillWithPagedKVCacheWrapper:
         else:
             page_size = k_cache.shape[2]
             stride_n = k_cache.stride(2)
-        window_left = self._window_left
+        window_left = _get_kernel_window_left(self._window_left)
         logits_soft_cap = self._logits_soft_cap
         sm_scale = self._sm_scale
         rope_scale = self._rope_scale
@@ -1631,7 +2613,7 @@ class BatchPrefillWithPagedKVCacheWrapper:
             # NOTE(Zihao): we divide both stride_block and stride_n by stride_n
             # because we will multiply stride_n back in the kernel
             sparse_indices = block_sparse_indices_to_vector_sparse_offsets(
-                self._paged_kv_indices_buf,
+                paged_kv_indices,
                 self._paged_kv_indptr_buf,
                 self._vector_sparse_indices_buffer,  # output
                 self._vector_sparse_indptr_buffer,
@@ -1642,7 +2624,7 @@ class BatchPrefillWithPagedKVCacheWrapper:
             )
             sparse_indptr = self._vector_sparse_indptr_buffer
         else:
-            sparse_indices = self._paged_kv_indices_buf
+            sparse_indices = paged_kv_indices
             sparse_indptr = self._paged_kv_indptr_buf
 
         run_args = [
@@ -1665,6 +2647,19 @@ class BatchPrefillWithPagedKVCacheWrapper:
 
         if self._jit_module is not None:
             run_args.extend(list(args))
+        elif self._use_segment_kernel:
+            run_args += [
+                self._custom_mask_buf,
+                self._mask_indptr_buf,
+                _get_cache_alibi_slopes_buf(q.shape[1], q.device),
+                self._qo_segment_ids_buf,
+                self._kv_segment_ids_buf,
+                self._kv_segment_indptr_buf,
+                logits_soft_cap,
+                sm_scale,
+                1.0 / rope_scale,  # rope_rcp_scale
+                1.0 / rope_theta,  # rope_rcp_theta
+            ]
         else:
             run_args += [
                 self._custom_mask_buf,
@@ -1676,7 +2671,87 @@ class BatchPrefillWithPagedKVCacheWrapper:
                 rope_theta,
             ]
 
-        self._cached_module.paged_run(*run_args)
+        if self._backend == "torch":
+            k_nhd, v_nhd = k_cache, v_cache
+            if self._kv_layout == "HND":
+                k_nhd, v_nhd = k_cache.transpose(1, 2), v_cache.transpose(1, 2)
+            paged_kv_indptr = self._paged_kv_indptr_buf.tolist()
+            _batch_prefill_torch(
+                q,
+                self._qo_indptr_buf,
+                get_seq_lens(
+                    self._paged_kv_indptr_buf,
+                    self._paged_kv_last_page_len_buf,
+                    page_size,
+                ).tolist(),
+                _get_paged_kv_torch(
+                    k_nhd,
+                    v_nhd,
+                    paged_kv_indptr,
+                    paged_kv_indices.long(),
+                    k_scale=page_k_scale,
+                    v_scale=page_v_scale,
+                ),
+                self._causal,
+                self._custom_mask_buf,
+                self._mask_indptr_buf,
+                self._pos_encoding_mode,
+                self._window_left,
+                logits_soft_cap,
+                sm_scale,
+                rope_scale,
+                rope_theta,
+                out,
+                lse,
+                qo_segment_ids=self._qo_segment_ids_buf,
+                kv_segment_ids=self._kv_segment_ids_buf,
+                prefix_len=self._prefix_len,
+                chunk_size=self._chunk_size,
+                chunk_offset=self._chunk_offset,
+                add_mass=(
+                    None
+                    if attention_mass is None
+                    else _get_paged_mass_torch(
+                        attention_mass, paged_kv_indptr, paged_kv_indices, page_size
+                    )
+                ),
+            )
+        elif self._backend == "triton":
+            batch_prefill_with_kv_cache(
+                q,
+                k_cache,
+                v_cache,
+                self._qo_indptr_buf,
+                self._paged_kv_indptr_buf,
+                paged_kv_indices,
+                self._paged_kv_last_page_len_buf,
+                self._kv_layout,
+                self._max_qo_len,
+                self._causal,
+                sm_scale,
+                packed_custom_mask=self._custom_mask_buf,
+                mask_indptr=self._mask_indptr_buf,
+                window_left=self._window_left_buf,
+                logits_soft_cap=self._logits_soft_cap_buf,
+                alibi_slopes=(
+                    _get_cache_alibi_slopes_buf(q.shape[1], q.device)
+                    if self._pos_encoding_mode == "ALIBI"
+                    else None
+                ),
+                qo_segment_ids=self._qo_segment_ids_buf,
+                kv_segment_ids=self._kv_segment_ids_buf,
+                kv_segment_indptr=self._kv_segment_indptr_buf,
+                prefix_len=self._prefix_len_buf,
+                chunk_size=self._chunk_size,
+                chunk_offset=self._chunk_offset_buf,
+                k_scale=page_k_scale,
+                v_scale=page_v_scale,
+                out=out,
+                lse=lse,
+                attention_mass=attention_mass,
+            )
+        else:
+            self._cached_module.paged_run(*run_args)
         if v_scale is not None:
             out *= v_scale
 
@@ -1874,12 +2949,30 @@ class BatchPrefillWithRaggedKVCacheWrapper:
             The implementation backend, could be ``auto``/``fa2`` or ``fa3``. Defaults to ``auto``.
             If set to ``auto``, the wrapper will automatically choose the backend based on the
             device architecture and kernel availability.
+            If set to ``torch``, the attention is computed with pure PyTorch (e.g. for
+            CPU-only hosts), the query tiles are processed by a thread pool with online
+            softmax over kv tiles. If set to ``triton``, a Triton kernel is used (the tile
+            sizes are tuned and cached per problem shape, runs on CPU with
+            ``TRITON_INTERPRET=1``), ``ROPE_LLAMA`` is not supported. The ``torch`` and
+            ``triton`` backends do not support CUDAGraph and :attr:`jit_args`.
 
         jit_args : Optional[List[Any]]
             If provided, the wrapper will use the provided arguments to create the JIT module,
             otherwise, the wrapper will use default attention implementation.
         """
         _check_kv_layout(kv_layout)
+        if backend not in ["auto", "fa2", "fa3", "torch", "triton"]:
+            raise KeyError(
+                "Invalid backend {}, expect one of auto, fa2, fa3, torch or "
+                "triton.".format(backend)
+            )
+        if backend in ["torch", "triton"] and (use_cuda_graph or jit_args is not None):
+            raise ValueError(
+                "The {} backend does not support cuda graph and jit_args.".format(
+                    backend
+                )
+            )
+
         if jit_args is not None:
             self._jit_module = get_batch_prefill_jit_module(
                 jit_args[0],
@@ -1891,15 +2984,20 @@ class BatchPrefillWithRaggedKVCacheWrapper:
         self._kv_layout = kv_layout
         self._float_workspace_buffer = float_workspace_buffer
         self.device = float_workspace_buffer.device
-        self._int_workspace_buffer = torch.empty(
-            (8 * 1024 * 1024,), dtype=torch.uint8, device=self.device
-        )
-        self._pin_memory_int_workspace_buffer = torch.empty(
-            self._int_workspace_buffer.shape,
-            dtype=torch.uint8,
-            pin_memory=True,
-            device="cpu",
-        )
+        if backend in ["torch", "triton"]:
+            # no scheduler workspace, the pinned host buffer also requires CUDA
+            self._int_workspace_buffer = None
+            self._pin_memory_int_workspace_buffer = None
+        else:
+            self._int_workspace_buffer = torch.empty(
+                (8 * 1024 * 1024,), dtype=torch.uint8, device=self.device
+            )
+            self._pin_memory_int_workspace_buffer = torch.empty(
+                self._int_workspace_buffer.shape,
+                dtype=torch.uint8,
+                pin_memory=True,
+                device="cpu",
+            )
         self._use_cuda_graph = use_cuda_graph
         if use_cuda_graph:
             if not torch.is_tensor(qo_indptr_buf):
@@ -1926,6 +3024,9 @@ class BatchPrefillWithRaggedKVCacheWrapper:
         self._mask_indptr_buf = mask_indptr_buf
         self._max_total_num_rows = None
         self._backend = backend
+        self._prefix_lm_wrappers = None
+        self._prefix_lm_rows = None
+        self._use_segment_kernel = False
 
     @property
     def is_cuda_graph_enabled(self) -> bool:
@@ -1957,8 +3058,8 @@ class BatchPrefillWithRaggedKVCacheWrapper:
 
     def plan(
         self,
-        qo_indptr: torch.Tensor,
-        kv_indptr: torch.Tensor,
+        qo_indptr: Optional[torch.Tensor],
+        kv_indptr: Optional[torch.Tensor],
         num_qo_heads: int,
         num_kv_heads: int,
         head_dim_qk: int,
@@ -1968,22 +3069,30 @@ class BatchPrefillWithRaggedKVCacheWrapper:
         causal: bool = False,
         pos_encoding_mode: str = "NONE",
         use_fp16_qk_reduction: bool = False,
-        window_left: int = -1,
-        logits_soft_cap: Optional[float] = None,
+        window_left: Union[int, torch.Tensor] = -1,
+        logits_soft_cap: Optional[Union[float, torch.Tensor]] = None,
         sm_scale: Optional[float] = None,
         rope_scale: Optional[float] = None,
         rope_theta: Optional[float] = None,
         q_data_type: Union[str, torch.dtype] = "float16",
         kv_data_type: Optional[Union[str, torch.dtype]] = None,
+        batch_metadata: Optional[BatchMetadata] = None,
+        qo_segment_ids: Optional[torch.Tensor] = None,
+        kv_segment_ids: Optional[torch.Tensor] = None,
+        prefix_len: Union[int, torch.Tensor] = 0,
+        chunk_size: int = 0,
+        mask_indptr: Optional[torch.Tensor] = None,
     ) -> None:
         r"""Plan batch prefill/append attention on Ragged KV-Cache for given problem specification.
 
         Parameters
         ----------
-        qo_indptr : torch.Tensor
-            The indptr of the query/output tensor, shape: ``[batch_size + 1]``.
-        kv_indptr : torch.Tensor
-            The indptr of the key/value tensor, shape: ``[batch_size + 1]``.
+        qo_indptr : Optional[torch.Tensor]
+            The indptr of the query/output tensor, shape: ``[batch_size + 1]``, can be
+            ``None`` if :attr:`batch_metadata` is provided.
+        kv_indptr : Optional[torch.Tensor]
+            The indptr of the key/value tensor, shape: ``[batch_size + 1]``, can be
+            ``None`` if :attr:`batch_metadata` is provided.
         num_qo_heads : int
             The number of query/output heads.
         num_kv_heads : int
@@ -2021,15 +3130,23 @@ class BatchPrefillWithRaggedKVCacheWrapper:
         use_fp16_qk_reduction : bool
             Whether to use f16 for qk reduction (faster at the cost of slight precision
             loss).
-        window_left : int
+        window_left : Union[int, torch.Tensor]
             The left (inclusive) window size for the attention window, when set to ``-1``, the window
             size will be set to the full length of the sequence. Defaults to ``-1``.
-        logits_soft_cap : Optional[float]
+            Could also be an int32 tensor of per-request window sizes, shape: ``[batch_size]``.
+            The ``torch`` and ``triton`` backends read the windows per request, the
+            ``fa2``/``fa3`` kernels take a single window, so the windows are applied through
+            a custom mask built on the device.
+        logits_soft_cap : Optional[Union[float, torch.Tensor]]
             The attention logits soft capping value (used in Gemini, Grok and Gemma-2, etc.), if not
             provided, will be set to ``0``. If greater than 0, the logits will be capped according to
             formula:
             :math:`\texttt{logits_soft_cap} \times \mathrm{tanh}(x / \texttt{logits_soft_cap})`,
             where :math:`x` is the input logits.
+            Could also be a float32 tensor of per-request values, shape: ``[batch_size]``,
+            which is only supported by the ``torch`` and ``triton`` backends: the CUDA
+            kernels take a single soft cap per plan and raise a ``ValueError`` if the
+            values differ.
         sm_scale : Optional[float]
             The scale used in softmax, if not provided, will be set to
             ``1.0 / sqrt(head_dim_qk)``.
@@ -2042,6 +3159,55 @@ class BatchPrefillWithRaggedKVCacheWrapper:
             The data type of the query tensor, defaults to torch.float16.
         kv_data_type : Optional[Union[str, torch.dtype]]
             The data type of the key/value tensor. If None, will be set to :attr:`q_data_type`.
+        batch_metadata : Optional[BatchMetadata]
+            The batch metadata of this step, if provided, :attr:`qo_indptr`,
+            :attr:`kv_indptr` and the mask indptr are taken from its cached host and
+            device tensors instead of being computed and copied between host and device.
+        qo_segment_ids : Optional[torch.Tensor]
+            The int32 segment (e.g. document) id of each query token, shape:
+            ``[qo_indptr[-1]]``. If provided with :attr:`kv_segment_ids`, a query only
+            attends to the keys of the same segment, in addition to the causal, window and
+            custom masks. This replaces the custom mask of packed sequences: the
+            ``torch``, ``triton`` and ``fa2`` backends compare the segment ids in the
+            kernel, with a cost linear in the number of tokens (``fa2`` through a
+            JIT-compiled attention variant, ``backend="auto"`` selects ``fa2``). The
+            ``fa3`` kernels, :attr:`jit_args` and cuda graph mode fall back to the segment
+            ids expanded on the device into a custom mask of
+            ``sum(qo_len[i] * kv_len[i] for i in range(batch_size))`` bits.
+        kv_segment_ids : Optional[torch.Tensor]
+            The int32 segment id of each key/value token, concatenated over the requests,
+            shape: ``[sum(kv_len[i] for i in range(batch_size))]``.
+        prefix_len : Union[int, torch.Tensor]
+            The length of the bidirectional prefix (e.g. image or prompt tokens) of each
+            request for prefix-LM attention: with :attr:`causal`, the first
+            ``prefix_len`` keys are visible to all queries of the request and the rest is
+            causal. Could be a tensor of per-request values, shape: ``[batch_size]``.
+            Ignored with a custom mask. The ``torch`` and ``triton`` backends skip the
+            kv tiles past both the prefix and the diagonal. The ``fa2``/``fa3`` kernels
+            have no prefix-LM mask, the queries inside the prefix of their request attend
+            to the whole prefix and the others only need the causal mask, so they are
+            planned as two launches with the standard masks: a non-causal launch of the
+            queries inside the prefixes on the prefix keys and a causal launch of the other
+            queries, which keeps the ``fa3`` kernels and the causal tile skipping. With
+            per-request :attr:`window_left`, segment ids, :attr:`jit_args` or in
+            CUDAGraph mode, the prefixes are expanded into a custom mask instead.
+        chunk_size : int
+            The chunk size of chunked local attention (e.g. the local layers of
+            Llama 4), if greater than ``0``, the query at position ``p`` only attends to
+            the keys of its aligned chunk ``[p // chunk_size * chunk_size, p]`` (the
+            whole chunk without :attr:`causal`). The ``torch`` and ``triton`` backends
+            skip the kv tiles outside the chunks. The ``fa2``/``fa3`` kernels have no
+            chunk mask, the queries of each request are split by chunk into
+            sub-requests attending to the kv slice of their chunk, without a mask
+            (except in CUDAGraph mode, where the batch size is fixed and the kernels
+            receive the expanded custom mask). Not compatible with custom masks, segment
+            ids and :attr:`prefix_len`. Defaults to ``0`` (disabled).
+        mask_indptr : Optional[torch.Tensor]
+            The byte indptr of :attr:`packed_custom_mask` when the mask of each request
+            is packed separately, shape: ``[batch_size + 1]``, e.g. as returned by
+            :func:`flashinfer.quantization.segment_packbits` or
+            :func:`flashinfer.mask.build_tree_attention_mask`. Defaults to the indptr
+            computed from the query and kv lengths.
 
         Note
         ----
@@ -2065,25 +3231,200 @@ class BatchPrefillWithRaggedKVCacheWrapper:
         if logits_soft_cap is None:
             logits_soft_cap = 0.0
 
+        if batch_metadata is not None:
+            names = ["qo_indptr", "kv_indptr"]
+            qo_indptr, kv_indptr = batch_metadata.get_tensors(names, self.device)
+            qo_indptr_host, kv_indptr_host = batch_metadata.get_tensors(names)
+        else:
+            # NOTE(Zihao): only required if qo_indptr/paged_kv_indptr are device tensors
+            qo_indptr_host = qo_indptr.to("cpu")
+            kv_indptr_host = kv_indptr.to("cpu")
+
         batch_size = len(qo_indptr) - 1
         if len(kv_indptr) != batch_size + 1:
             raise ValueError(
                 "The kv_indptr length should be equal to mask_indptr length."
             )
-        if custom_mask is not None or packed_custom_mask is not None:
-            mask_indptr = _compute_mask_indptr(qo_indptr, kv_indptr)
+        logits_soft_cap = _canonicalize_per_request_param(
+            logits_soft_cap, batch_size, "logits_soft_cap"
+        )
+        if self._backend not in ["torch", "triton"]:
+            _check_uniform_logits_soft_cap(logits_soft_cap)
+        window_left = _canonicalize_per_request_param(
+            window_left, batch_size, "window_left"
+        )
+        _check_segment_ids(
+            qo_segment_ids,
+            kv_segment_ids,
+            int(qo_indptr_host[-1]),
+            int(kv_indptr_host[-1]),
+        )
+        # the fa2 kernels compare the segment ids in the logits mask of the
+        # SegmentAttention variant, the other CUDA launches (fa3, jit_args and cuda
+        # graph mode) receive the segment ids expanded into the custom mask
+        self._use_segment_kernel = (
+            qo_segment_ids is not None
+            and self._backend in ["auto", "fa2"]
+            and self._jit_module is None
+            and not self.is_cuda_graph_enabled
+        )
+        prefix_len = _canonicalize_per_request_param(
+            prefix_len, batch_size, "prefix_len"
+        )
+        use_prefix = (
+            causal
+            and (torch.is_tensor(prefix_len) or prefix_len > 0)
+            and custom_mask is None
+            and packed_custom_mask is None
+        )
+        _check_chunk_size(
+            chunk_size, custom_mask, packed_custom_mask, qo_segment_ids, prefix_len
+        )
+        self._prefix_lm_rows = None
+        if (
+            use_prefix
+            and self._backend not in ["torch", "triton"]
+            and self._jit_module is None
+            and not self.is_cuda_graph_enabled
+            and not torch.is_tensor(window_left)
+            and qo_segment_ids is None
+        ):
+            # the kernels have no prefix-LM mask, instead of expanding the prefixes
+            # into a custom mask, plan a non-causal launch of the queries inside the
+            # prefixes on the prefix keys and a causal launch of the other queries
+            (
+                prefix_qo_indptr,
+                suffix_qo_indptr,
+                prefix_rows,
+                suffix_rows,
+                prefix_kv_lens,
+            ) = _split_prefix_lm_queries(
+                qo_indptr_host, kv_indptr_host[1:] - kv_indptr_host[:-1], prefix_len
+            )
+            if len(prefix_rows) == 0:
+                # no query inside the prefixes, prefix-LM reduces to the causal mask
+                use_prefix = False
+            else:
+                prefix_wrapper, suffix_wrapper = _get_prefix_lm_wrappers(self)
+                plan_kwargs = dict(
+                    num_qo_heads=num_qo_heads,
+                    num_kv_heads=num_kv_heads,
+                    head_dim_qk=head_dim_qk,
+                    head_dim_vo=head_dim_vo,
+                    pos_encoding_mode=pos_encoding_mode,
+                    use_fp16_qk_reduction=use_fp16_qk_reduction,
+                    window_left=window_left,
+                    logits_soft_cap=logits_soft_cap,
+                    sm_scale=sm_scale,
+                    rope_scale=rope_scale,
+                    rope_theta=rope_theta,
+                    q_data_type=q_data_type,
+                    kv_data_type=kv_data_type,
+                )
+                prefix_wrapper.plan(
+                    *_get_prefix_lm_ragged_indptr(
+                        prefix_qo_indptr, kv_indptr_host, prefix_kv_lens
+                    ),
+                    causal=False,
+                    **plan_kwargs,
+                )
+                if len(suffix_rows) > 0:
+                    suffix_wrapper.plan(
+                        suffix_qo_indptr, kv_indptr, causal=True, **plan_kwargs
+                    )
+                else:
+                    suffix_wrapper = None
+                self._prefix_lm_plans = (prefix_wrapper, suffix_wrapper)
+                self._prefix_lm_rows = (
+                    prefix_rows.to(self.device),
+                    suffix_rows.to(self.device),
+                )
+                return
+        chunk_offset = 0
+        use_chunk_mask = False
+        if chunk_size > 0 and self._backend not in ["torch", "triton"]:
+            if self.is_cuda_graph_enabled:
+                # the batch size is fixed, the chunks are applied through the mask
+                use_chunk_mask = True
+            else:
+                # the kernels have no chunk mask, split the queries of each request by
+                # chunk into sub-requests attending to the kv slice of their chunk
+                qo_indptr_device = qo_indptr.device
+                qo_indptr_host, kv_indptr_host, request = _split_chunked_ragged_kv(
+                    qo_indptr_host, kv_indptr_host, chunk_size
+                )
+                qo_indptr = qo_indptr_host.to(qo_indptr_device)
+                kv_indptr = kv_indptr_host.to(kv_indptr.device)
+                batch_size = len(qo_indptr_host) - 1
+                if torch.is_tensor(window_left):
+                    window_left = _canonicalize_per_request_param(
+                        window_left[request], batch_size, "window_left"
+                    )
+                batch_metadata = None
+        if (
+            torch.is_tensor(window_left) or use_prefix or use_chunk_mask
+        ) and self._backend not in ["torch", "triton"]:
+            # the kernels take a single window and have no prefix-LM and chunk masks,
+            # fold the per-request windows, the prefixes and the chunks into the mask
+            if custom_mask is None and packed_custom_mask is not None:
+                raise ValueError(
+                    "Per-request window_left is not supported with packed_custom_mask, "
+                    "please provide custom_mask instead."
+                )
+            custom_mask = _get_per_request_window_mask(
+                qo_indptr_host[1:] - qo_indptr_host[:-1],
+                kv_indptr_host[1:] - kv_indptr_host[:-1],
+                window_left,
+                causal,
+                custom_mask,
+                qo_indptr.device,
+                prefix_len=prefix_len,
+                chunk_size=chunk_size if use_chunk_mask else 0,
+                chunk_offset=chunk_offset,
+            )
+        if (
+            qo_segment_ids is not None
+            and self._backend not in ["torch", "triton"]
+            and not self._use_segment_kernel
+        ):
+            # fallback of the launches without the segment mask variant, expand the
+            # segment ids into the mask
+            if custom_mask is None and packed_custom_mask is not None:
+                raise ValueError(
+                    "Segment ids are not supported with packed_custom_mask, "
+                    "please provide custom_mask instead."
+                )
+            custom_mask = _get_segment_mask(
+                qo_indptr_host[1:] - qo_indptr_host[:-1],
+                kv_indptr_host[1:] - kv_indptr_host[:-1],
+                qo_segment_ids,
+                kv_segment_ids,
+                causal,
+                custom_mask,
+            )
+        if custom_mask is not None or (
+            packed_custom_mask is not None and mask_indptr is None
+        ):
+            if batch_metadata is not None:
+                mask_device = (
+                    custom_mask if custom_mask is not None else packed_custom_mask
+                ).device
+                mask_indptr = batch_metadata.get("mask_indptr", mask_device)
+            else:
+                mask_indptr = _compute_mask_indptr(qo_indptr, kv_indptr)
         if packed_custom_mask is None and custom_mask is not None:
             # create packed custom mask from custom mask
-            packed_custom_mask, mask_indptr = segment_packbits(
+            packbits = (
+                _segment_packbits_torch
+                if self._backend in ["torch", "triton"]
+                else segment_packbits
+            )
+            packed_custom_mask, mask_indptr = packbits(
                 custom_mask.contiguous().view(-1),
                 mask_indptr,
                 bitorder="little",
             )
 
-        # NOTE(Zihao): only required if qo_indptr/paged_kv_indptr are device tensors
-        qo_indptr_host = qo_indptr.to("cpu")
-        kv_indptr_host = kv_indptr.to("cpu")
-
         total_num_rows = qo_indptr_host[-1]
 
         if self.is_cuda_graph_enabled:
@@ -2128,10 +3469,46 @@ class BatchPrefillWithRaggedKVCacheWrapper:
         self._cached_kv_data_type = kv_data_type
         kv_len_arr = kv_indptr_host[1:] - kv_indptr_host[:-1]
 
-        if self._jit_module is not None:
+        if self._backend in ["torch", "triton"]:
+            # the kernels read the plan buffers in run, nothing to schedule
+            self._cached_module = None
+            (
+                self._qo_segment_ids_buf,
+                self._kv_segment_ids_buf,
+                self._kv_segment_indptr_buf,
+            ) = _get_segment_ids_bufs(
+                qo_segment_ids,
+                kv_segment_ids,
+                kv_indptr_host[1:] - kv_indptr_host[:-1],
+                self.device,
+            )
+            self._prefix_len = prefix_len if causal else 0
+            if self._backend == "triton":
+                if pos_encoding_mode == "ROPE_LLAMA":
+                    raise ValueError(
+                        "The triton backend does not support ROPE_LLAMA, please apply "
+                        "rotary embedding to query and key before attention."
+                    )
+                self._max_qo_len = int((qo_indptr_host[1:] - qo_indptr_host[:-1]).max())
+                self._window_left_buf = _get_per_request_param_buf(
+                    window_left, -1, batch_size, torch.int32, self.device
+                )
+                self._logits_soft_cap_buf = _get_per_request_param_buf(
+                    logits_soft_cap, 0.0, batch_size, torch.float32, self.device
+                )
+                self._prefix_len_buf = _get_per_request_param_buf(
+                    self._prefix_len, 0, batch_size, torch.int32, self.device
+                )
+                self._chunk_offset_buf = _get_per_request_param_buf(
+                    chunk_offset, 0, batch_size, torch.int32, self.device
+                )
+        elif self._jit_module is not None:
             self._cached_module = self._jit_module
         else:
-            if self._backend == "auto":
+            if self._use_segment_kernel:
+                # the hopper variants have no logits mask
+                self._backend = "fa2"
+            elif self._backend == "auto":
                 self._backend = determine_attention_backend(
                     self.device,
                     PosEncodingMode[pos_encoding_mode].value,
@@ -2149,38 +3526,53 @@ class BatchPrefillWithRaggedKVCacheWrapper:
                 head_dim_qk,
                 head_dim_vo,
                 PosEncodingMode[pos_encoding_mode].value,
-                window_left >= 0,  # use_sliding_window
+                _get_kernel_window_left(window_left) >= 0,  # use_sliding_window
                 logits_soft_cap > 0,  # use_logits_soft_cap
                 use_fp16_qk_reduction,
             )
-            self._cached_module = get_batch_prefill_module(self._backend)(
-                *get_module_args
-            )
+            if self._use_segment_kernel:
+                (
+                    self._qo_segment_ids_buf,
+                    self._kv_segment_ids_buf,
+                    self._kv_segment_indptr_buf,
+                ) = _get_segment_ids_bufs(
+                    qo_segment_ids, kv_segment_ids, kv_len_arr, self.device
+                )
+                self._cached_module = get_batch_prefill_segment_module(*get_module_args)
+            else:
+                self._cached_module = get_batch_prefill_module(self._backend)(
+                    *get_module_args
+                )
 
-        with self.device as device:
-            self._plan_info = self._cached_module.plan(
-                self._float_workspace_buffer,
-                self._int_workspace_buffer,
-                self._pin_memory_int_workspace_buffer,
-                qo_indptr_host,
-                kv_indptr_host,
-                kv_len_arr,
-                self._max_total_num_rows or total_num_rows,
-                batch_size,
-                num_qo_heads,
-                num_kv_heads,
-                1,  # page_size
-                self.is_cuda_graph_enabled,
-                head_dim_qk,
-                head_dim_vo,
-                causal,
-                get_cuda_stream(device),
-            )
+        if self._backend in ["torch", "triton"]:
+            self._plan_info = None
+        else:
+            with self.device as device:
+                self._plan_info = self._cached_module.plan(
+                    self._float_workspace_buffer,
+                    self._int_workspace_buffer,
+                    self._pin_memory_int_workspace_buffer,
+                    qo_indptr_host,
+                    kv_indptr_host,
+                    kv_len_arr,
+                    self._max_total_num_rows or total_num_rows,
+                    batch_size,
+                    num_qo_heads,
+                    num_kv_heads,
+                    1,  # page_size
+                    self.is_cuda_graph_enabled,
+                    head_dim_qk,
+                    head_dim_vo,
+                    causal,
+                    get_cuda_stream(device),
+                )
 
         self._causal = causal
         self._pos_encoding_mode = pos_encoding_mode
         self._use_fp16_qk_reduction = use_fp16_qk_reduction
         self._window_left = window_left
+        self._chunk_size = chunk_size
+        self._chunk_offset = chunk_offset
         self._logits_soft_cap = logits_soft_cap
         self._sm_scale = sm_scale
         self._rope_scale = rope_scale
@@ -2276,11 +3668,22 @@ class BatchPrefillWithRaggedKVCacheWrapper:
             * The attention output, shape: ``[qo_indptr[-1], num_qo_heads, head_dim_vo]``.
             * The logsumexp of attention output, shape: ``[qo_indptr[-1], num_qo_heads]``.
         """
+        if self._prefix_lm_rows is not None:
+            return _run_prefix_lm(
+                self._prefix_lm_plans,
+                self._prefix_lm_rows,
+                q,
+                (k, v) + args,
+                v.shape[-1],
+                out,
+                lse,
+                return_lse,
+            )
         _check_cached_qkv_data_type(
             q, k, self._cached_q_data_type, self._cached_kv_data_type
         )
 
-        window_left = self._window_left
+        window_left = _get_kernel_window_left(self._window_left)
         logits_soft_cap = self._logits_soft_cap
         sm_scale = self._sm_scale
         rope_scale = self._rope_scale
@@ -2311,7 +3714,7 @@ class BatchPrefillWithRaggedKVCacheWrapper:
                 out, q.shape[:-1] + v.shape[-1:], q.dtype, q.device, "out"
             )
 
-        if is_float8(q):
+        if is_float8(q) and self._backend != "torch":
             logging.warning(
                 "Our current prefill kernel implementation needs f16 input, the f8 inputs "
                 " are casted to f16, which could result in performance degradation."
@@ -2345,6 +3748,19 @@ class BatchPrefillWithRaggedKVCacheWrapper:
         ]
         if self._jit_module is not None:
             run_args.extend(list(args))
+        elif self._use_segment_kernel:
+            run_args += [
+                self._custom_mask_buf,
+                self._mask_indptr_buf,
+                _get_cache_alibi_slopes_buf(q.shape[1], self.device),
+                self._qo_segment_ids_buf,
+                self._kv_segment_ids_buf,
+                self._kv_segment_indptr_buf,
+                logits_soft_cap,
+                sm_scale,
+                1.0 / rope_scale,  # rope_rcp_scale
+                1.0 / rope_theta,  # rope_rcp_theta
+            ]
         else:
             run_args += [
                 self._custom_mask_buf,
@@ -2356,7 +3772,69 @@ class BatchPrefillWithRaggedKVCacheWrapper:
                 rope_theta,
             ]
 
-        self._cached_module.ragged_run(*run_args)
+        if self._backend == "torch":
+            kv_indptr = self._kv_indptr_buf.tolist()
+            k_nhd, v_nhd = k, v
+            if self._kv_layout == "HND":
+                k_nhd, v_nhd = k.transpose(0, 1), v.transpose(0, 1)
+            _batch_prefill_torch(
+                q,
+                self._qo_indptr_buf,
+                [end - begin for begin, end in zip(kv_indptr[:-1], kv_indptr[1:])],
+                lambda i, begin, end: (
+                    k_nhd[kv_indptr[i] + begin : kv_indptr[i] + end],
+                    v_nhd[kv_indptr[i] + begin : kv_indptr[i] + end],
+                ),
+                self._causal,
+                self._custom_mask_buf,
+                self._mask_indptr_buf,
+                self._pos_encoding_mode,
+                self._window_left,
+                logits_soft_cap,
+                sm_scale,
+                rope_scale,
+                rope_theta,
+                out,
+                lse,
+                qo_segment_ids=self._qo_segment_ids_buf,
+                kv_segment_ids=self._kv_segment_ids_buf,
+                prefix_len=self._prefix_len,
+                chunk_size=self._chunk_size,
+                chunk_offset=self._chunk_offset,
+            )
+        elif self._backend == "triton":
+            batch_prefill_with_kv_cache(
+                q,
+                k,
+                v,
+                self._qo_indptr_buf,
+                self._kv_indptr_buf,
+                None,  # kv_indices
+                None,  # kv_last_page_len
+                self._kv_layout,
+                self._max_qo_len,
+                self._causal,
+                sm_scale,
+                packed_custom_mask=self._custom_mask_buf,
+                mask_indptr=self._mask_indptr_buf,
+                window_left=self._window_left_buf,
+                logits_soft_cap=self._logits_soft_cap_buf,
+                alibi_slopes=(
+                    _get_cache_alibi_slopes_buf(q.shape[1], q.device)
+                    if self._pos_encoding_mode == "ALIBI"
+                    else None
+                ),
+                qo_segment_ids=self._qo_segment_ids_buf,
+                kv_segment_ids=self._kv_segment_ids_buf,
+                kv_segment_indptr=self._kv_segment_indptr_buf,
+                prefix_len=self._prefix_len_buf,
+                chunk_size=self._chunk_size,
+                chunk_offset=self._chunk_offset_buf,
+                out=out,
+                lse=lse,
+            )
+        else:
+            self._cached_module.ragged_run(*run_args)
         return (out, lse) if return_lse else out
 
     run_return_lse = functools.partialmethod(run, return_lse=True)
@@ -0,0 +1,399 @@
+"""
+Copyright (c) 2025 by FlashInfer team.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import contextlib
+import json
+import mmap
+import os
+import struct
+from typing import Any, Dict, Optional, Tuple, Union
+
+import numpy as np
+import torch
+
+from .utils import _check_kv_layout, _unpack_paged_kv_cache, canonicalize_torch_dtype
+
+# File layout (all offsets are in bytes from the beginning of the file):
+#
+#   [magic: 8 bytes][header_len: uint64][header: json, utf-8]
+#   [page tables: indptr | indices | last_page_len | page_ids, int32]
+#   [page data: num_snapshot_pages x (2, page_size, num_kv_heads, head_dim) or
+#               num_snapshot_pages x (2, num_kv_heads, page_size, head_dim)]
+#
+# The page data section is aligned to ``_SNAPSHOT_ALIGNMENT`` so that it can be
+# mapped with ``mmap`` and restored page by page without touching the rest of the file.
+_SNAPSHOT_MAGIC = b"FISNAP01"
+_SNAPSHOT_ALIGNMENT = 4096
+_SNAPSHOT_VERSION = 1
+
+
+def _align_up(x: int, alignment: int) -> int:
+    return (x + alignment - 1) // alignment * alignment
+
+
+def _frombuffer(
+    buffer: mmap.mmap, dtype: torch.dtype, count: int, offset: int
+) -> torch.Tensor:
+    if count == 0:
+        return torch.empty(0, dtype=dtype)
+    # NOTE: unlike torch.frombuffer, the numpy array holds a buffer export of the mmap,
+    # the mapping outlives the PagedKVCacheSnapshot as long as the tensor is alive.
+    nbytes = count * torch.empty(0, dtype=dtype).element_size()
+    data = np.frombuffer(buffer, dtype=np.uint8, count=nbytes, offset=offset)
+    return torch.from_numpy(data).view(dtype)
+
+
+def _as_bytes(x: torch.Tensor) -> memoryview:
+    # NOTE: numpy does not understand bfloat16/float8, reinterpret as uint8 first.
+    return memoryview(x.contiguous().view(torch.uint8).numpy()).cast("B")
+
+
+def save_paged_kv_cache_snapshot(
+    path: Union[str, os.PathLike],
+    paged_kv_cache: Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]],
+    kv_indptr: torch.Tensor,
+    kv_indices: torch.Tensor,
+    kv_last_page_len: torch.Tensor,
+    kv_layout: str = "NHD",
+    chunk_pages: int = 1024,
+) -> None:
+    r"""Persist the pages referenced by a page table, together with the page table itself,
+    to a snapshot file that can be restored with :func:`load_paged_kv_cache_snapshot`.
+
+    Only the pages referenced by :attr:`kv_indices` are written (each page once, even if it
+    is shared by multiple requests), pages are gathered on the device in chunks of
+    :attr:`chunk_pages` and written to the file with bulk I/O.
+
+    Parameters
+    ----------
+    path : Union[str, os.PathLike]
+        The path of the snapshot file.
+    paged_kv_cache : Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]]
+        The paged KV-Cache stored as a tuple of tensors or a single tensor:
+
+        * a tuple ``(k_cache, v_cache)`` of 4-D tensors, each with shape:
+          ``[max_num_pages, page_size, num_kv_heads, head_dim]`` if :attr:`kv_layout` is ``NHD``,
+          and ``[max_num_pages, num_kv_heads, page_size, head_dim]`` if :attr:`kv_layout` is ``HND``.
+
+        * a single 5-D tensor with shape:
+          ``[max_num_pages, 2, page_size, num_kv_heads, head_dim]`` if
+          :attr:`kv_layout` is ``NHD``, and
+          ``[max_num_pages, 2, num_kv_heads, page_size, head_dim]`` if
+          :attr:`kv_layout` is ``HND``. Where ``paged_kv_cache[:, 0]`` is the key-cache and
+          ``paged_kv_cache[:, 1]`` is the value-cache.
+    kv_indptr : torch.Tensor
+        The indptr of the paged kv-cache, shape: ``[batch_size + 1]``.
+    kv_indices : torch.Tensor
+        The page indices of the paged kv-cache, shape: ``[kv_indptr[-1]]``.
+    kv_last_page_len : torch.Tensor
+        The number of entries in the last page of each request in the paged kv cache,
+        shape: ``[batch_size]``.
+    kv_layout : str
+        The layout of the paged kv-cache, either ``NHD`` or ``HND``.
+    chunk_pages : int
+        The number of pages gathered and written per I/O call, defaults to ``1024``.
+
+    See Also
+    --------
+    load_paged_kv_cache_snapshot
+    """
+    _check_kv_layout(kv_layout)
+    k_cache, v_cache = _unpack_paged_kv_cache(paged_kv_cache, kv_layout)
+    if k_cache.shape != v_cache.shape or k_cache.dtype != v_cache.dtype:
+        raise ValueError("k_cache and v_cache should have the same shape and dtype.")
+    if kv_layout == "NHD":
+        _, page_size, num_kv_heads, head_dim = k_cache.shape
+    else:
+        _, num_kv_heads, page_size, head_dim = k_cache.shape
+
+    kv_indptr_host = kv_indptr.to("cpu", torch.int32)
+    kv_indices_host = kv_indices.to("cpu", torch.int32)
+    kv_last_page_len_host = kv_last_page_len.to("cpu", torch.int32)
+    page_ids_host = torch.unique(kv_indices_host[: kv_indptr_host[-1].item()])
+    page_ids = page_ids_host.to(k_cache.device, torch.int64)
+
+    tables = [kv_indptr_host, kv_indices_host, kv_last_page_len_host, page_ids_host]
+    page_shape = [2] + list(k_cache.shape[1:])
+    page_nbytes = k_cache[0].numel() * 2 * k_cache.element_size()
+
+    header: Dict[str, Any] = {
+        "version": _SNAPSHOT_VERSION,
+        "kv_layout": kv_layout,
+        "dtype": str(k_cache.dtype).replace("torch.", ""),
+        "page_size": page_size,
+        "num_kv_heads": num_kv_heads,
+        "head_dim": head_dim,
+        "batch_size": len(kv_last_page_len_host),
+        "num_pages": len(page_ids_host),
+        "page_shape": page_shape,
+        "page_nbytes": page_nbytes,
+        "tables": [len(t) for t in tables],
+    }
+    # NOTE: the header contains the data offset which depends on the header size,
+    # reserve 32 bytes of (whitespace) padding for it.
+    header["data_offset"] = 0
+    header_bytes = json.dumps(header).encode("utf-8")
+    tables_offset = len(_SNAPSHOT_MAGIC) + 8 + len(header_bytes) + 32
+    tables_nbytes = sum(len(t) for t in tables) * 4
+    header["data_offset"] = _align_up(
+        tables_offset + tables_nbytes, _SNAPSHOT_ALIGNMENT
+    )
+    header_bytes = json.dumps(header).encode("utf-8").ljust(len(header_bytes) + 32)
+
+    with open(path, "wb") as f:
+        f.write(_SNAPSHOT_MAGIC)
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        for t in tables:
+            f.write(_as_bytes(t))
+        f.write(b"\0" * (header["data_offset"] - f.tell()))
+        for start in range(0, len(page_ids), chunk_pages):
+            chunk = page_ids[start : start + chunk_pages]
+            pages = torch.stack([k_cache[chunk], v_cache[chunk]], dim=1)
+            f.write(_as_bytes(pages.to("cpu")))
+
+
+class PagedKVCacheSnapshot:
+    r"""A memory-mapped snapshot of a paged kv-cache created by
+    :func:`save_paged_kv_cache_snapshot`.
+
+    Page data is not read until it is requested, :meth:`restore` only touches the
+    pages that are restored, which makes it possible to bring back a subset of the
+    requests (e.g. a hot prefix) without reading the whole file.
+
+    Attributes
+    ----------
+    kv_layout : str
+        The layout of the snapshot pages, either ``NHD`` or ``HND``.
+    dtype : torch.dtype
+        The data type of the snapshot pages.
+    page_size : int
+        The page size of the paged kv-cache.
+    num_kv_heads : int
+        The number of key/value heads.
+    head_dim : int
+        The dimension of the heads.
+    kv_indptr : torch.Tensor
+        The saved indptr of the paged kv-cache, shape: ``[batch_size + 1]``.
+        The page tables are copied out of the file and stay valid after :meth:`close`.
+    kv_indices : torch.Tensor
+        The saved page indices of the paged kv-cache, shape: ``[kv_indptr[-1]]``.
+    kv_last_page_len : torch.Tensor
+        The saved number of entries in the last page of each request, shape: ``[batch_size]``.
+    page_ids : torch.Tensor
+        The sorted (original) page indices stored in the snapshot, shape: ``[num_pages]``.
+    """
+
+    def __init__(self, path: Union[str, os.PathLike]) -> None:
+        self.path = os.fspath(path)
+        self._mmap: Optional[mmap.mmap] = None
+        with open(self.path, "rb") as f:
+            # NOTE: ACCESS_COPY gives a writable (copy-on-write) view, which is required by
+            # torch.frombuffer, the file itself is never modified.
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        if self._mmap[: len(_SNAPSHOT_MAGIC)] != _SNAPSHOT_MAGIC:
+            raise ValueError(f"{self.path} is not a paged kv-cache snapshot.")
+        offset = len(_SNAPSHOT_MAGIC)
+        (header_len,) = struct.unpack_from("<Q", self._mmap, offset)
+        offset += 8
+        header = json.loads(bytes(self._mmap[offset : offset + header_len]))
+        offset += header_len
+        if header["version"] != _SNAPSHOT_VERSION:
+            raise ValueError(
+                "Unsupported snapshot version {}".format(header["version"])
+            )
+
+        self.kv_layout: str = header["kv_layout"]
+        self.dtype = canonicalize_torch_dtype(header["dtype"])
+        self.page_size: int = header["page_size"]
+        self.num_kv_heads: int = header["num_kv_heads"]
+        self.head_dim: int = header["head_dim"]
+        self._page_shape = tuple(header["page_shape"])
+        self._page_nbytes: int = header["page_nbytes"]
+        self._data_offset: int = header["data_offset"]
+
+        tables = []
+        for numel in header["tables"]:
+            tables.append(_frombuffer(self._mmap, torch.int32, numel, offset).clone())
+            offset += numel * 4
+        self.kv_indptr, self.kv_indices, self.kv_last_page_len, self.page_ids = tables
+
+    @property
+    def batch_size(self) -> int:
+        return len(self.kv_last_page_len)
+
+    @property
+    def num_pages(self) -> int:
+        return len(self.page_ids)
+
+    def _page_rows(self, page_ids: torch.Tensor) -> torch.Tensor:
+        page_ids = page_ids.to("cpu", torch.int32)
+        rows = torch.searchsorted(self.page_ids, page_ids)
+        if len(rows) > 0 and (
+            rows.max().item() >= self.num_pages
+            or not torch.equal(self.page_ids[rows], page_ids)
+        ):
+            raise ValueError("Some of the requested pages are not in the snapshot.")
+        return rows
+
+    def pages(self, page_ids: Optional[torch.Tensor] = None) -> torch.Tensor:
+        r"""Return the (memory-mapped) data of the requested pages.
+
+        Parameters
+        ----------
+        page_ids : Optional[torch.Tensor]
+            The original page indices to read, if not provided, all pages in the snapshot
+            are returned.
+
+        Returns
+        -------
+        torch.Tensor
+            The page data on cpu, shape: ``[len(page_ids), 2, page_size, num_kv_heads, head_dim]``
+            if :attr:`kv_layout` is ``NHD``, and
+            ``[len(page_ids), 2, num_kv_heads, page_size, head_dim]`` if :attr:`kv_layout` is ``HND``.
+            When :attr:`page_ids` is not provided the returned tensor is a zero-copy view of
+            the file, which keeps the file mapped until it is released, even after
+            :meth:`close`.
+        """
+        if self._mmap is None:
+            raise ValueError("The snapshot {} is closed.".format(self.path))
+        data = _frombuffer(
+            self._mmap,
+            torch.uint8,
+            self.num_pages * self._page_nbytes,
+            self._data_offset,
+        )
+        data = data.view(self.dtype).view((self.num_pages,) + self._page_shape)
+        if page_ids is None:
+            return data
+        return data[self._page_rows(page_ids)]
+
+    def request_page_ids(self, request_idx: int) -> torch.Tensor:
+        r"""Return the original page indices of the :attr:`request_idx`-th saved request."""
+        return self.kv_indices[
+            self.kv_indptr[request_idx] : self.kv_indptr[request_idx + 1]
+        ]
+
+    def restore(
+        self,
+        paged_kv_cache: Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]],
+        page_ids: Optional[torch.Tensor] = None,
+        dst_page_ids: Optional[torch.Tensor] = None,
+        chunk_pages: int = 1024,
+    ) -> None:
+        r"""Copy pages of the snapshot into a paged kv-cache.
+
+        Parameters
+        ----------
+        paged_kv_cache : Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]]
+            The destination paged kv-cache, must have the same layout, dtype and page shape
+            as the snapshot.
+        page_ids : Optional[torch.Tensor]
+            The original page indices to restore, if not provided, all pages in the snapshot
+            are restored.
+        dst_page_ids : Optional[torch.Tensor]
+            The page indices in :attr:`paged_kv_cache` to write :attr:`page_ids` to, if not
+            provided, pages are restored to their original indices.
+        chunk_pages : int
+            The number of pages copied to the device per call, defaults to ``1024``.
+        """
+        k_cache, v_cache = _unpack_paged_kv_cache(paged_kv_cache, self.kv_layout)
+        if tuple(k_cache.shape[1:]) != self._page_shape[1:]:
+            raise ValueError(
+                "The page shape of paged_kv_cache {} mismatches the snapshot {}".format(
+                    tuple(k_cache.shape[1:]), self._page_shape[1:]
+                )
+            )
+        if k_cache.dtype != self.dtype:
+            raise ValueError(
+                "The dtype of paged_kv_cache {} mismatches the snapshot {}".format(
+                    k_cache.dtype, self.dtype
+                )
+            )
+        if page_ids is None:
+            page_ids = self.page_ids
+        if dst_page_ids is None:
+            dst_page_ids = page_ids
+        if len(dst_page_ids) != len(page_ids):
+            raise ValueError("page_ids and dst_page_ids should have the same length.")
+
+        rows = self._page_rows(page_ids)
+        dst_page_ids = dst_page_ids.to(k_cache.device, torch.int64)
+        data = self.pages()
+        for start in range(0, len(rows), chunk_pages):
+            pages = data[rows[start : start + chunk_pages]].to(k_cache.device)
+            dst = dst_page_ids[start : start + chunk_pages]
+            k_cache[dst] = pages[:, 0]
+            v_cache[dst] = pages[:, 1]
+
+    def close(self) -> None:
+        r"""Close the snapshot, the file stays mapped until the views returned by
+        :meth:`pages` are released."""
+        if self._mmap is None:
+            return
+        with contextlib.suppress(BufferError):
+            # the pages() views hold the mapping, it is unmapped with the last of them
+            self._mmap.close()
+        self._mmap = None
+
+    def __enter__(self) -> "PagedKVCacheSnapshot":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def load_paged_kv_cache_snapshot(
+    path: Union[str, os.PathLike],
+) -> PagedKVCacheSnapshot:
+    r"""Open a snapshot created by :func:`save_paged_kv_cache_snapshot` with ``mmap``.
+
+    Only the header and page tables are read eagerly, page data is read lazily when
+    pages are restored with :meth:`PagedKVCacheSnapshot.restore`.
+
+    Parameters
+    ----------
+    path : Union[str, os.PathLike]
+        The path of the snapshot file.
+
+    Returns
+    -------
+    PagedKVCacheSnapshot
+        The memory-mapped snapshot.
+
+    Example
+    -------
+    >>> import torch
+    >>> import flashinfer
+    >>> kv_cache = torch.randn(16, 2, 4, 2, 8).half()
+    >>> kv_indptr = torch.tensor([0, 2, 5], dtype=torch.int32)
+    >>> kv_indices = torch.tensor([3, 1, 7, 8, 9], dtype=torch.int32)
+    >>> kv_last_page_len = torch.tensor([3, 4], dtype=torch.int32)
+    >>> flashinfer.save_paged_kv_cache_snapshot(
+    ...     "/tmp/kv.snapshot", kv_cache, kv_indptr, kv_indices, kv_last_page_len
+    ... )
+    >>> snapshot = flashinfer.load_paged_kv_cache_snapshot("/tmp/kv.snapshot")
+    >>> new_kv_cache = torch.zeros_like(kv_cache)
+    >>> # only restore the pages of the second request
+    >>> snapshot.restore(new_kv_cache, snapshot.request_page_ids(1))
+    >>> torch.equal(new_kv_cache[7:10], kv_cache[7:10])
+    True
+
+    See Also
+    --------
+    save_paged_kv_cache_snapshot
+    """
+    return PagedKVCacheSnapshot(path)
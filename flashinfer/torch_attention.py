@@ -0,0 +1,1196 @@
+"""
+Copyright (c) 2025 by FlashInfer team.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import functools
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple, Union
+
+import torch
+
+from .utils import (
+    _check_kv_layout,
+    _check_pos_encoding_mode,
+    _unpack_paged_kv_cache,
+    get_alibi_slopes,
+)
+
+# Pure PyTorch implementations of the attention kernels, they follow the semantics of
+# the CUDA kernels (positions, masks, logits transforms, base-2 logsumexp) and are used
+# as reference implementations and on devices without the CUDA kernels.
+
+_thread_pools: Dict[int, ThreadPoolExecutor] = {}
+
+
+def _get_thread_pool(num_workers: int) -> ThreadPoolExecutor:
+    # shared worker pools, torch operators release the GIL so the requests assigned to
+    # different workers run in parallel
+    pool = _thread_pools.get(num_workers)
+    if pool is None:
+        pool = ThreadPoolExecutor(
+            max_workers=num_workers, thread_name_prefix="flashinfer_torch"
+        )
+        _thread_pools[num_workers] = pool
+    return pool
+
+
+def _partition_requests(costs: List[int], num_parts: int) -> List[Tuple[int, int]]:
+    # split the requests into at most num_parts contiguous ranges of similar cost
+    total = max(sum(costs), 1)
+    ranges = []
+    begin, acc = 0, 0
+    for i, cost in enumerate(costs):
+        acc += cost
+        if acc * num_parts >= total * (len(ranges) + 1) or i == len(costs) - 1:
+            ranges.append((begin, i + 1))
+            begin = i + 1
+    return ranges
+
+
+def _get_request_param_tensor(
+    x: Union[int, float, torch.Tensor], begin: int, end: int, device: torch.device
+) -> torch.Tensor:
+    # the per-request values of requests [begin, end) as a float32 tensor
+    if torch.is_tensor(x):
+        return x[begin:end].to(device, torch.float32)
+    return torch.full((end - begin,), float(x), device=device)
+
+
+def _apply_rope_torch(
+    x: torch.Tensor, positions: torch.Tensor, rope_scale: float, rope_theta: float
+) -> torch.Tensor:
+    # x: [n, num_heads, head_dim], rotate-half (non-interleaved) llama rope as in the
+    # kernels, freq[i] = rope_theta ** (-2i / head_dim) / rope_scale
+    head_dim = x.shape[-1]
+    half = head_dim // 2
+    freq = torch.pow(
+        rope_theta,
+        -torch.arange(0, half, device=x.device, dtype=torch.float32) * 2 / head_dim,
+    )
+    angle = (positions.to(torch.float32)[:, None] * (freq / rope_scale)[None, :])[
+        :, None, :
+    ]
+    cos, sin = torch.cos(angle), torch.sin(angle)
+    x1, x2 = x[..., :half], x[..., half:]
+    return torch.cat([x1 * cos - x2 * sin, x2 * cos + x1 * sin], dim=-1)
+
+
+def _attention_logits_torch(
+    q: torch.Tensor,
+    k: torch.Tensor,
+    causal: bool,
+    pos_encoding_mode: str,
+    window_left: int,
+    logits_soft_cap: float,
+    sm_scale: float,
+    rope_scale: float,
+    rope_theta: float,
+    prefix_len: int = 0,
+    chunk_size: int = 0,
+    chunk_offset: int = 0,
+    qo_segment_ids: Optional[torch.Tensor] = None,
+    kv_segment_ids: Optional[torch.Tensor] = None,
+) -> torch.Tensor:
+    # q: [qo_len, num_qo_heads, head_dim_qk], k: [kv_len, num_kv_heads, head_dim_qk],
+    # the queries are the last qo_len tokens, the first prefix_len keys are visible to
+    # all queries under the causal mask (prefix-LM). With chunk_size > 0, the queries
+    # only attend to the keys of their aligned chunk, chunk_offset is the position of
+    # the first key in the sequence. The segment ids of the queries and keys restrict
+    # the attention to tokens of the same segment. Returns the masked (natural base)
+    # logits, shape: [num_qo_heads, qo_len, kv_len].
+    qo_len, num_qo_heads, _ = q.shape
+    kv_len, num_kv_heads, _ = k.shape
+    device = q.device
+    q = q.to(torch.float32)
+    k = k.to(torch.float32)
+    q_pos = torch.arange(kv_len - qo_len, kv_len, device=device)
+    kv_pos = torch.arange(kv_len, device=device)
+    if pos_encoding_mode == "ROPE_LLAMA":
+        q = _apply_rope_torch(q, q_pos, rope_scale, rope_theta)
+        k = _apply_rope_torch(k, kv_pos, rope_scale, rope_theta)
+    k = k.repeat_interleave(num_qo_heads // num_kv_heads, dim=1)
+
+    logits = torch.einsum("qhd,khd->hqk", q, k)
+    if pos_encoding_mode == "ALIBI":
+        slopes = get_alibi_slopes(num_qo_heads).to(device)
+        logits = (
+            logits * sm_scale
+            + slopes[:, None, None] * (kv_pos[None, :] - q_pos[:, None])[None]
+        )
+        scale = 1.0
+    else:
+        scale = sm_scale
+    if logits_soft_cap > 0:
+        logits = logits_soft_cap * torch.tanh(logits * (sm_scale / logits_soft_cap))
+    else:
+        logits = logits * scale
+
+    mask = torch.ones(qo_len, kv_len, dtype=torch.bool, device=device)
+    if causal:
+        mask &= (kv_pos[None, :] <= q_pos[:, None]) | (kv_pos[None, :] < prefix_len)
+    if window_left >= 0:
+        mask &= kv_pos[None, :] >= q_pos[:, None] - window_left
+    if chunk_size > 0:
+        mask &= (kv_pos[None, :] + chunk_offset) // chunk_size == (
+            q_pos[:, None] + chunk_offset
+        ) // chunk_size
+    if qo_segment_ids is not None:
+        mask &= qo_segment_ids.to(device)[:, None] == kv_segment_ids.to(device)[None, :]
+    return logits.masked_fill(~mask[None], float("-inf"))
+
+
+def _attention_torch(
+    q: torch.Tensor,
+    k: torch.Tensor,
+    v: torch.Tensor,
+    causal: bool,
+    pos_encoding_mode: str,
+    window_left: int,
+    logits_soft_cap: float,
+    sm_scale: float,
+    rope_scale: float,
+    rope_theta: float,
+    prefix_len: int = 0,
+    chunk_size: int = 0,
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    # v: [kv_len, num_kv_heads, head_dim_vo], see _attention_logits_torch
+    logits = _attention_logits_torch(
+        q,
+        k,
+        causal,
+        pos_encoding_mode,
+        window_left,
+        logits_soft_cap,
+        sm_scale,
+        rope_scale,
+        rope_theta,
+        prefix_len,
+        chunk_size,
+    )
+    v = v.to(torch.float32).repeat_interleave(q.shape[1] // v.shape[1], dim=1)
+    lse = torch.logsumexp(logits, dim=-1)
+    p = torch.exp(logits - lse[..., None])
+    # fully masked rows produce zeros, as in the kernels
+    p = torch.nan_to_num(p, nan=0.0)
+    o = torch.einsum("hqk,khd->qhd", p, v)
+    return o, (lse * math.log2(math.e)).transpose(0, 1)
+
+
+def _merge_state_torch(
+    v_a: torch.Tensor, s_a: torch.Tensor, v_b: torch.Tensor, s_b: torch.Tensor
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    # torch implementation of flashinfer.cascade.merge_state (base-2 lse), the states
+    # without any visible kv (lse is -inf) have no weight
+    s_max = torch.maximum(s_a, s_b)
+    s_max = torch.where(torch.isinf(s_max), 0.0, s_max)
+    w_a = torch.exp2(s_a - s_max)
+    w_b = torch.exp2(s_b - s_max)
+    d = w_a + w_b
+    v = v_a.float() * w_a[..., None] + v_b.float() * w_b[..., None]
+    v = v / torch.where(d > 0, d, 1.0)[..., None]
+    return v.to(v_a.dtype), s_max + torch.log2(d)
+
+
+def _get_request_param(x: Union[int, float, torch.Tensor], i: int):
+    # window_left and logits_soft_cap could be given per request
+    return x[i].item() if torch.is_tensor(x) else x
+
+
+def _scale_pages_torch(pages: torch.Tensor, scale: Optional[torch.Tensor]):
+    # dequantize gathered NHD pages [n, page_size, num_kv_heads, head_dim] with their
+    # per-page ([n]) or per-page-per-head ([n, num_kv_heads]) scales
+    pages = pages.float()
+    if scale is None:
+        return pages
+    if scale.ndim == 1:
+        return pages * scale[:, None, None, None]
+    return pages * scale[:, None, :, None]
+
+
+def _get_request_kv_torch(
+    k_cache: torch.Tensor,
+    v_cache: torch.Tensor,
+    pages: torch.Tensor,
+    kv_len: int,
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    # gather the kv of a request from NHD k/v caches, shape: [kv_len, num_kv_heads, head_dim]
+    k = k_cache[pages].flatten(0, 1)[:kv_len]
+    v = v_cache[pages].flatten(0, 1)[:kv_len]
+    return k, v
+
+
+def accumulate_attention_mass_torch(
+    attention_mass: torch.Tensor,
+    q: torch.Tensor,
+    paged_kv_cache: Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]],
+    lse: torch.Tensor,
+    qo_indptr: torch.Tensor,
+    kv_indptr: torch.Tensor,
+    kv_indices: torch.Tensor,
+    kv_last_page_len: torch.Tensor,
+    kv_layout: str = "NHD",
+    causal: bool = True,
+    pos_encoding_mode: str = "NONE",
+    window_left: Union[int, torch.Tensor] = -1,
+    logits_soft_cap: Optional[Union[float, torch.Tensor]] = None,
+    sm_scale: Optional[float] = None,
+    rope_scale: Optional[float] = None,
+    rope_theta: Optional[float] = None,
+    mass_page_ids: Optional[torch.Tensor] = None,
+    chunk_size: int = 0,
+    chunk_offset: Union[int, torch.Tensor] = 0,
+    qo_segment_ids: Optional[torch.Tensor] = None,
+    kv_segment_ids: Optional[torch.Tensor] = None,
+    prefix_len: Union[int, torch.Tensor] = 0,
+) -> torch.Tensor:
+    r"""Accumulate the softmax mass of the attention on paged kv-cache, per kv page (or
+    per kv token) and per kv head, into :attr:`attention_mass`.
+
+    The probabilities are normalized with the logsumexp :attr:`lse` returned by the
+    attention kernels, the logits of each request are materialized. This is the
+    reference of the ``attention_mass`` argument of the paged wrappers, whose
+    ``torch`` and ``triton`` backends accumulate the mass inside the attention.
+
+    Parameters
+    ----------
+    attention_mass : torch.Tensor
+        The float32 accumulator, shape: ``[max_num_pages, num_kv_heads]`` to accumulate
+        per page, or ``[max_num_pages, page_size, num_kv_heads]`` to accumulate per token.
+    q : torch.Tensor
+        The query tensor, shape: ``[qo_indptr[-1], num_qo_heads, head_dim]``.
+    paged_kv_cache : Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]]
+        The paged kv-cache, see :func:`flashinfer.page.append_paged_kv_cache`.
+    lse : torch.Tensor
+        The (base-2) logsumexp returned by the attention, shape:
+        ``[qo_indptr[-1], num_qo_heads]``.
+    qo_indptr : torch.Tensor
+        The indptr of the query tensor, shape: ``[batch_size + 1]``.
+    kv_indptr : torch.Tensor
+        The indptr of the paged kv-cache, shape: ``[batch_size + 1]``.
+    kv_indices : torch.Tensor
+        The page indices of the paged kv-cache, shape: ``[kv_indptr[-1]]``.
+    kv_last_page_len : torch.Tensor
+        The number of entries in the last page of each request in the paged kv cache,
+        shape: ``[batch_size]``.
+    kv_layout : str
+        The layout of the paged kv-cache, either ``NHD`` or ``HND``.
+    causal, pos_encoding_mode, window_left, logits_soft_cap, sm_scale, rope_scale, rope_theta
+        The attention parameters, see :func:`paged_attention_torch`.
+    mass_page_ids : Optional[torch.Tensor]
+        The rows of :attr:`attention_mass` of the pages in :attr:`kv_indices`, defaults
+        to :attr:`kv_indices`.
+    chunk_size : int
+        The chunk size of chunked local attention, see :func:`paged_attention_torch`.
+    chunk_offset : Union[int, torch.Tensor]
+        The position in the sequence of the first kv of the page table of each request
+        (e.g. the dropped leading tokens), the chunks are aligned to the sequence
+        positions. Could be a tensor of per-request values, shape: ``[batch_size]``.
+    qo_segment_ids : Optional[torch.Tensor]
+        The segment id of each query token, shape: ``[qo_indptr[-1]]``. If provided with
+        :attr:`kv_segment_ids`, a query only attends to the keys of the same segment.
+    kv_segment_ids : Optional[torch.Tensor]
+        The segment id of each key token, concatenated over the requests, shape:
+        ``[sum(kv_len[i] for i in range(batch_size))]``.
+    prefix_len : Union[int, torch.Tensor]
+        The length of the bidirectional prefix of each request (prefix-LM), see
+        :func:`paged_attention_torch`.
+
+    Returns
+    -------
+    torch.Tensor
+        :attr:`attention_mass`, the mass is summed over the queries and the query heads
+        of each kv head group.
+    """
+    _check_kv_layout(kv_layout)
+    _check_pos_encoding_mode(pos_encoding_mode)
+    k_cache, v_cache = _unpack_paged_kv_cache(paged_kv_cache, kv_layout)
+    if kv_layout == "HND":
+        k_cache = k_cache.transpose(1, 2)
+        v_cache = v_cache.transpose(1, 2)
+    page_size, num_kv_heads = k_cache.shape[1], k_cache.shape[2]
+    if attention_mass.dim() not in [2, 3]:
+        raise ValueError(
+            "attention_mass should be a 2-D (per page) or 3-D (per token) tensor, "
+            "got {}-D.".format(attention_mass.dim())
+        )
+    if logits_soft_cap is None:
+        logits_soft_cap = 0.0
+    if sm_scale is None:
+        sm_scale = 1.0 / math.sqrt(q.shape[-1])
+    if rope_scale is None:
+        rope_scale = 1.0
+    if rope_theta is None:
+        rope_theta = 1e4
+    if mass_page_ids is None:
+        mass_page_ids = kv_indices
+
+    qo_indptr = qo_indptr.tolist()
+    kv_indptr = kv_indptr.tolist()
+    kv_last_page_len = kv_last_page_len.tolist()
+    kv_indices = kv_indices.to(k_cache.device, torch.int64)
+    mass_page_ids = mass_page_ids.to(attention_mass.device, torch.int64)
+    lse = lse.to(torch.float32) / math.log2(math.e)
+    kv_segment_begin = 0
+    for i in range(len(kv_last_page_len)):
+        pages = kv_indices[kv_indptr[i] : kv_indptr[i + 1]]
+        kv_len = max(len(pages) - 1, 0) * page_size + kv_last_page_len[i]
+        qo_segment_ids_i = kv_segment_ids_i = None
+        if qo_segment_ids is not None:
+            qo_segment_ids_i = qo_segment_ids[qo_indptr[i] : qo_indptr[i + 1]]
+            kv_segment_ids_i = kv_segment_ids[
+                kv_segment_begin : kv_segment_begin + kv_len
+            ]
+        kv_segment_begin += kv_len
+        if kv_len <= 0 or qo_indptr[i + 1] == qo_indptr[i]:
+            continue
+        k, _ = _get_request_kv_torch(k_cache, v_cache, pages, kv_len)
+        q_i = q[qo_indptr[i] : qo_indptr[i + 1]]
+        logits = _attention_logits_torch(
+            q_i,
+            k.to(q.device),
+            causal,
+            pos_encoding_mode,
+            _get_request_param(window_left, i),
+            _get_request_param(logits_soft_cap, i),
+            sm_scale,
+            rope_scale,
+            rope_theta,
+            prefix_len=_get_request_param(prefix_len, i),
+            chunk_size=chunk_size,
+            chunk_offset=_get_request_param(chunk_offset, i),
+            qo_segment_ids=qo_segment_ids_i,
+            kv_segment_ids=kv_segment_ids_i,
+        )
+        lse_i = lse[qo_indptr[i] : qo_indptr[i + 1]].transpose(0, 1)
+        p = torch.nan_to_num(torch.exp(logits - lse_i[..., None]), nan=0.0)
+        # [num_qo_heads, qo_len, kv_len] -> [kv_len, num_kv_heads]
+        mass = p.view(num_kv_heads, -1, kv_len).sum(dim=1).transpose(0, 1)
+        mass = mass.to(attention_mass.device)
+        num_pages = len(pages)
+        mass = torch.nn.functional.pad(mass, (0, 0, 0, num_pages * page_size - kv_len))
+        mass = mass.view(num_pages, page_size, num_kv_heads)
+        rows = mass_page_ids[kv_indptr[i] : kv_indptr[i + 1]]
+        if attention_mass.dim() == 2:
+            attention_mass.index_add_(0, rows, mass.sum(dim=1))
+        else:
+            attention_mass.index_add_(0, rows, mass)
+    return attention_mass
+
+
+def paged_attention_torch(
+    q: torch.Tensor,
+    paged_kv_cache: Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]],
+    qo_indptr: torch.Tensor,
+    kv_indptr: torch.Tensor,
+    kv_indices: torch.Tensor,
+    kv_last_page_len: torch.Tensor,
+    kv_layout: str = "NHD",
+    causal: bool = True,
+    pos_encoding_mode: str = "NONE",
+    window_left: Union[int, torch.Tensor] = -1,
+    logits_soft_cap: Optional[Union[float, torch.Tensor]] = None,
+    sm_scale: Optional[float] = None,
+    rope_scale: Optional[float] = None,
+    rope_theta: Optional[float] = None,
+    return_lse: bool = False,
+    prefix_len: Union[int, torch.Tensor] = 0,
+    chunk_size: int = 0,
+) -> Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]]:
+    r"""Pure PyTorch batch attention on paged kv-cache, the reference of
+    :class:`flashinfer.decode.BatchDecodeWithPagedKVCacheWrapper` (with
+    ``qo_indptr = arange(batch_size + 1)``) and
+    :class:`flashinfer.prefill.BatchPrefillWithPagedKVCacheWrapper`.
+
+    Parameters
+    ----------
+    q : torch.Tensor
+        The query tensor, shape: ``[qo_indptr[-1], num_qo_heads, head_dim]``.
+    paged_kv_cache : Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]]
+        The paged kv-cache, see :func:`flashinfer.page.append_paged_kv_cache`.
+    qo_indptr : torch.Tensor
+        The indptr of the query tensor, shape: ``[batch_size + 1]``.
+    kv_indptr : torch.Tensor
+        The indptr of the paged kv-cache, shape: ``[batch_size + 1]``.
+    kv_indices : torch.Tensor
+        The page indices of the paged kv-cache, shape: ``[kv_indptr[-1]]``.
+    kv_last_page_len : torch.Tensor
+        The number of entries in the last page of each request in the paged kv cache,
+        shape: ``[batch_size]``.
+    kv_layout : str
+        The layout of the paged kv-cache, either ``NHD`` or ``HND``.
+    causal : bool
+        Whether to apply causal mask, the queries of a request are aligned to the end
+        of its kv, defaults to ``True``.
+    pos_encoding_mode : str
+        ``NONE``/``ROPE_LLAMA``/``ALIBI``, RoPE is applied to the queries and keys with
+        their positions in the (paged) kv of the request.
+    window_left : Union[int, torch.Tensor]
+        The left (inclusive) window size, ``-1`` disables sliding window, could also be
+        a tensor of per-request window sizes, shape: ``[batch_size]``.
+    logits_soft_cap : Optional[Union[float, torch.Tensor]]
+        The logits soft capping value, ``None`` or ``0`` disables soft capping, could
+        also be a tensor of per-request values, shape: ``[batch_size]``.
+    sm_scale : Optional[float]
+        The softmax scale, defaults to ``1 / sqrt(head_dim)``.
+    rope_scale : Optional[float]
+        The RoPE interpolation scale, defaults to ``1``.
+    rope_theta : Optional[float]
+        The RoPE theta, defaults to ``1e4``.
+    return_lse : bool
+        Whether to return the (base-2) logsumexp of the attention logits.
+    prefix_len : Union[int, torch.Tensor]
+        The length of the bidirectional prefix of each request (prefix-LM), the first
+        ``prefix_len`` keys are visible to all queries of the request under the causal
+        mask. Could be a tensor of per-request values, shape: ``[batch_size]``.
+    chunk_size : int
+        The chunk size of chunked local attention, if greater than ``0``, the query at
+        position ``p`` only attends to the keys of the aligned chunk
+        ``[p // chunk_size * chunk_size, (p // chunk_size + 1) * chunk_size)``, in
+        addition to the other masks. Defaults to ``0`` (disabled).
+
+    Returns
+    -------
+    Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]]
+        The attention output in the data type of :attr:`q`, shape:
+        ``[qo_indptr[-1], num_qo_heads, head_dim]``, and the float32 logsumexp with shape
+        ``[qo_indptr[-1], num_qo_heads]`` if :attr:`return_lse` is ``True``.
+    """
+    _check_kv_layout(kv_layout)
+    _check_pos_encoding_mode(pos_encoding_mode)
+    k_cache, v_cache = _unpack_paged_kv_cache(paged_kv_cache, kv_layout)
+    if kv_layout == "HND":
+        k_cache = k_cache.transpose(1, 2)
+        v_cache = v_cache.transpose(1, 2)
+    page_size = k_cache.shape[1]
+    if logits_soft_cap is None:
+        logits_soft_cap = 0.0
+    if sm_scale is None:
+        sm_scale = 1.0 / math.sqrt(q.shape[-1])
+    if rope_scale is None:
+        rope_scale = 1.0
+    if rope_theta is None:
+        rope_theta = 1e4
+
+    qo_indptr = qo_indptr.tolist()
+    kv_indptr = kv_indptr.tolist()
+    kv_last_page_len = kv_last_page_len.tolist()
+    kv_indices = kv_indices.to(k_cache.device, torch.int64)
+    o = torch.empty(q.shape[:2] + v_cache.shape[-1:], dtype=q.dtype, device=q.device)
+    lse = torch.empty(q.shape[:2], dtype=torch.float32, device=q.device)
+    for i in range(len(kv_last_page_len)):
+        pages = kv_indices[kv_indptr[i] : kv_indptr[i + 1]]
+        kv_len = max(len(pages) - 1, 0) * page_size + kv_last_page_len[i]
+        k, v = _get_request_kv_torch(k_cache, v_cache, pages, kv_len)
+        o_i, lse_i = _attention_torch(
+            q[qo_indptr[i] : qo_indptr[i + 1]],
+            k.to(q.device),
+            v.to(q.device),
+            causal,
+            pos_encoding_mode,
+            _get_request_param(window_left, i),
+            _get_request_param(logits_soft_cap, i),
+            sm_scale,
+            rope_scale,
+            rope_theta,
+            _get_request_param(prefix_len, i),
+            chunk_size,
+        )
+        o[qo_indptr[i] : qo_indptr[i + 1]] = o_i.to(q.dtype)
+        lse[qo_indptr[i] : qo_indptr[i + 1]] = lse_i
+    return (o, lse) if return_lse else o
+
+
+def headwise_paged_decode_attention_torch(
+    q: torch.Tensor,
+    paged_kv_cache: Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]],
+    kv_indptr: torch.Tensor,
+    kv_indices: torch.Tensor,
+    kv_last_page_len: torch.Tensor,
+    kv_layout: str = "NHD",
+    window_left: Union[int, torch.Tensor] = -1,
+    logits_soft_cap: Optional[Union[float, torch.Tensor]] = None,
+    sm_scale: Optional[float] = None,
+    return_lse: bool = False,
+) -> Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]]:
+    r"""Pure PyTorch decode attention on a head-wise paged kv-cache, the reference of
+    :class:`flashinfer.decode.BatchDecodeWithHeadwisePagedKVCacheWrapper`.
+
+    Parameters
+    ----------
+    q : torch.Tensor
+        The query tensor, shape: ``[batch_size, num_qo_heads, head_dim]``.
+    paged_kv_cache : Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]]
+        The head-wise paged kv-cache, with ``num_kv_heads = 1`` in each page.
+    kv_indptr : torch.Tensor
+        The indptr of the head-wise page table, shape: ``[batch_size * num_kv_heads + 1]``,
+        the page list of kv head ``h`` of request ``i`` is at ``i * num_kv_heads + h``.
+    kv_indices : torch.Tensor
+        The page indices of the head-wise page table, shape: ``[kv_indptr[-1]]``.
+    kv_last_page_len : torch.Tensor
+        The number of entries in the last page of each ``(request, kv_head)`` pair,
+        shape: ``[batch_size * num_kv_heads]``.
+    kv_layout : str
+        The layout of the paged kv-cache, either ``NHD`` or ``HND``.
+    window_left, logits_soft_cap, sm_scale
+        The attention parameters, per-request tensors have shape ``[batch_size]``,
+        see :func:`paged_attention_torch`.
+    return_lse : bool
+        Whether to return the (base-2) logsumexp of the attention logits.
+
+    Returns
+    -------
+    Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]]
+        The attention output, shape: ``[batch_size, num_qo_heads, head_dim]``, and the
+        logsumexp with shape ``[batch_size, num_qo_heads]`` if :attr:`return_lse` is ``True``.
+    """
+    batch_size, num_qo_heads, head_dim = q.shape
+    num_kv_heads = len(kv_last_page_len) // batch_size
+    if torch.is_tensor(window_left):
+        window_left = window_left.repeat_interleave(num_kv_heads)
+    if torch.is_tensor(logits_soft_cap):
+        logits_soft_cap = logits_soft_cap.repeat_interleave(num_kv_heads)
+    o, lse = paged_attention_torch(
+        q.reshape(batch_size * num_kv_heads, num_qo_heads // num_kv_heads, head_dim),
+        paged_kv_cache,
+        torch.arange(batch_size * num_kv_heads + 1),
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        kv_layout=kv_layout,
+        causal=False,
+        window_left=window_left,
+        logits_soft_cap=logits_soft_cap,
+        sm_scale=sm_scale,
+        return_lse=True,
+    )
+    o = o.view(batch_size, num_qo_heads, -1)
+    return (o, lse.view(batch_size, num_qo_heads)) if return_lse else o
+
+
+def _batch_decode_torch_range(
+    q: torch.Tensor,
+    k_cache: torch.Tensor,
+    v_cache: torch.Tensor,
+    kv_indptr: List[int],
+    kv_indices: torch.Tensor,
+    kv_lens: List[int],
+    begin: int,
+    end: int,
+    pos_encoding_mode: str,
+    window_left: Union[int, torch.Tensor],
+    logits_soft_cap: Union[float, torch.Tensor],
+    sm_scale: float,
+    rope_scale: float,
+    rope_theta: float,
+    out: torch.Tensor,
+    lse: Optional[torch.Tensor],
+    k_scale: Optional[torch.Tensor] = None,
+    v_scale: Optional[torch.Tensor] = None,
+    attention_mass: Optional[torch.Tensor] = None,
+    mass_lock: Optional[threading.Lock] = None,
+) -> None:
+    # decode attention of requests [begin, end), with the pages of all requests
+    # gathered at once into a padded [batch, max_kv_len, num_kv_heads, head_dim] tensor,
+    # the gathered pages are dequantized with their per-page scales if provided. The
+    # probabilities are added to the per-page (or per-token) attention_mass under
+    # mass_lock if provided.
+    device = q.device
+    batch_size = end - begin
+    _, page_size, num_kv_heads, _ = k_cache.shape
+    num_qo_heads, head_dim = q.shape[1], q.shape[2]
+    group_size = num_qo_heads // num_kv_heads
+    num_pages = torch.tensor(
+        [kv_indptr[i + 1] - kv_indptr[i] for i in range(begin, end)], device=device
+    )
+    max_num_pages = max(int(num_pages.max()), 1)
+    page_table = torch.zeros(
+        batch_size, max_num_pages, dtype=torch.int64, device=device
+    )
+    page_valid = (
+        torch.arange(max_num_pages, device=device)[None, :] < num_pages[:, None]
+    )
+    page_table[page_valid] = kv_indices[kv_indptr[begin] : kv_indptr[end]].to(device)
+    max_kv_len = max_num_pages * page_size
+    page_table = page_table.flatten()
+    k = _scale_pages_torch(
+        k_cache[page_table], None if k_scale is None else k_scale[page_table]
+    ).reshape(batch_size, max_kv_len, num_kv_heads, -1)
+    v = _scale_pages_torch(
+        v_cache[page_table], None if v_scale is None else v_scale[page_table]
+    ).reshape(batch_size, max_kv_len, num_kv_heads, -1)
+
+    kv_len = torch.tensor(kv_lens[begin:end], device=device)
+    kv_pos = torch.arange(max_kv_len, device=device)
+    q_pos = kv_len - 1
+    qf = q[begin:end].float()
+    if pos_encoding_mode == "ROPE_LLAMA":
+        qf = _apply_rope_torch(qf, q_pos, rope_scale, rope_theta)
+        k = _apply_rope_torch(
+            k.view(batch_size * max_kv_len, num_kv_heads, head_dim),
+            kv_pos.repeat(batch_size),
+            rope_scale,
+            rope_theta,
+        ).view(batch_size, max_kv_len, num_kv_heads, head_dim)
+    # GQA: broadcast the kv heads to the query heads of their group
+    qf = qf.view(batch_size, num_kv_heads, group_size, head_dim)
+    logits = torch.einsum("bhgd,blhd->bhgl", qf, k)
+    rel_pos = (kv_pos[None, :] - q_pos[:, None])[:, None, None, :]
+    if pos_encoding_mode == "ALIBI":
+        slopes = get_alibi_slopes(num_qo_heads).to(device)
+        slopes = slopes.view(1, num_kv_heads, group_size, 1)
+        logits = logits * sm_scale + slopes * rel_pos
+        scale = 1.0
+    else:
+        scale = sm_scale
+    cap = _get_request_param_tensor(logits_soft_cap, begin, end, device)
+    if bool((cap > 0).any()):
+        cap = cap[:, None, None, None]
+        safe_cap = torch.where(cap > 0, cap, 1.0)
+        logits = torch.where(
+            cap > 0,
+            safe_cap * torch.tanh(logits * (sm_scale / safe_cap)),
+            logits * scale,
+        )
+    else:
+        logits = logits * scale
+
+    mask = kv_pos[None, :] < kv_len[:, None]
+    window = _get_request_param_tensor(window_left, begin, end, device)
+    mask &= (window[:, None] < 0) | (
+        kv_pos[None, :] >= q_pos[:, None] - window[:, None]
+    )
+    logits = logits.masked_fill(~mask[:, None, None, :], float("-inf"))
+    lse_range = torch.logsumexp(logits, dim=-1)
+    p = torch.nan_to_num(torch.exp(logits - lse_range[..., None]), nan=0.0)
+    o = torch.einsum("bhgl,blhd->bhgd", p, v)
+    out[begin:end] = o.reshape(batch_size, num_qo_heads, -1).to(out.dtype)
+    if attention_mass is not None:
+        # [batch, num_kv_heads, group_size, max_kv_len] -> [num_valid_pages, page_size,
+        # num_kv_heads]
+        mass = p.sum(dim=2).transpose(1, 2)
+        mass = mass.reshape(batch_size, max_num_pages, page_size, num_kv_heads)
+        mass = mass[page_valid].to(attention_mass.device)
+        pages = page_table.view(batch_size, max_num_pages)[page_valid]
+        pages = pages.to(attention_mass.device)
+        with mass_lock:
+            if attention_mass.dim() == 2:
+                attention_mass.index_add_(0, pages, mass.sum(dim=1))
+            else:
+                attention_mass.index_add_(0, pages, mass)
+    if lse is not None:
+        lse[begin:end] = (lse_range * math.log2(math.e)).view(batch_size, num_qo_heads)
+
+
+def _batch_decode_torch(
+    q: torch.Tensor,
+    k_cache: torch.Tensor,
+    v_cache: torch.Tensor,
+    kv_indptr: torch.Tensor,
+    kv_indices: torch.Tensor,
+    kv_last_page_len: torch.Tensor,
+    kv_layout: str,
+    pos_encoding_mode: str,
+    window_left: Union[int, torch.Tensor],
+    logits_soft_cap: Union[float, torch.Tensor],
+    sm_scale: float,
+    rope_scale: float,
+    rope_theta: float,
+    out: torch.Tensor,
+    lse: Optional[torch.Tensor],
+    num_workers: Optional[int] = None,
+    k_scale: Optional[torch.Tensor] = None,
+    v_scale: Optional[torch.Tensor] = None,
+    attention_mass: Optional[torch.Tensor] = None,
+) -> None:
+    # The torch backend of BatchDecodeWithPagedKVCacheWrapper, the requests are split
+    # into contiguous ranges of similar kv length processed by a thread pool. k_scale
+    # and v_scale are the optional per-page (or per-page-per-head) scales of a
+    # quantized cache, the pages are dequantized as they are gathered. The softmax mass
+    # of the kv is optionally added to attention_mass.
+    if kv_layout == "HND":
+        k_cache = k_cache.transpose(1, 2)
+        v_cache = v_cache.transpose(1, 2)
+    page_size = k_cache.shape[1]
+    kv_indptr = kv_indptr.tolist()
+    kv_last_page_len = kv_last_page_len.tolist()
+    batch_size = len(kv_last_page_len)
+    kv_lens = [
+        max(kv_indptr[i + 1] - kv_indptr[i] - 1, 0) * page_size + kv_last_page_len[i]
+        for i in range(batch_size)
+    ]
+    if batch_size == 0:
+        return
+    if num_workers is None:
+        num_workers = torch.get_num_threads()
+    ranges = _partition_requests(kv_lens, min(num_workers, batch_size))
+    args = (
+        q,
+        k_cache,
+        v_cache,
+        kv_indptr,
+        kv_indices.long(),
+        kv_lens,
+    )
+    params = (
+        pos_encoding_mode,
+        window_left,
+        logits_soft_cap,
+        sm_scale,
+        rope_scale,
+        rope_theta,
+        out,
+        lse,
+        k_scale,
+        v_scale,
+        attention_mass,
+        threading.Lock(),
+    )
+    if len(ranges) == 1:
+        _batch_decode_torch_range(*args, 0, batch_size, *params)
+        return
+    futures = [
+        _get_thread_pool(len(ranges)).submit(
+            _batch_decode_torch_range, *args, begin, end, *params
+        )
+        for begin, end in ranges
+    ]
+    for future in futures:
+        future.result()
+
+
+def _segment_packbits_torch(
+    x: torch.Tensor, indptr: torch.Tensor, bitorder: str = "big"
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    # torch implementation of flashinfer.quantization.segment_packbits
+    weights = 2 ** torch.arange(8, device=x.device, dtype=torch.int32)
+    if bitorder == "big":
+        weights = weights.flip(0)
+    indptr = indptr.tolist()
+    packed = []
+    for begin, end in zip(indptr[:-1], indptr[1:]):
+        bits = torch.nn.functional.pad(
+            x[begin:end].to(torch.int32), (0, -(end - begin) % 8)
+        )
+        packed.append((bits.view(-1, 8) * weights).sum(dim=-1).to(torch.uint8))
+    packed_len = torch.tensor([len(y) for y in packed], dtype=torch.int32)
+    new_indptr = torch.zeros(len(indptr), dtype=torch.int32)
+    torch.cumsum(packed_len, 0, out=new_indptr[1:])
+    return torch.cat(packed).to(x.device), new_indptr.to(x.device)
+
+
+def _get_packed_mask_tile(
+    packed_mask: torch.Tensor,
+    kv_len: int,
+    row_begin: int,
+    row_end: int,
+    col_begin: int,
+    col_end: int,
+) -> torch.Tensor:
+    # read the [row_end - row_begin, col_end - col_begin] tile of the (little bitorder)
+    # packed mask of a request without unpacking the whole mask
+    rows = torch.arange(
+        row_begin, row_end, device=packed_mask.device, dtype=torch.int64
+    )
+    cols = torch.arange(
+        col_begin, col_end, device=packed_mask.device, dtype=torch.int64
+    )
+    bit_idx = rows[:, None] * kv_len + cols[None, :]
+    byte = packed_mask[bit_idx >> 3].to(torch.int32)
+    return ((byte >> (bit_idx & 7).to(torch.int32)) & 1).bool()
+
+
+def _prefill_tile_torch(
+    q: torch.Tensor,
+    get_kv,
+    qo_len: int,
+    kv_len: int,
+    row_begin: int,
+    row_end: int,
+    causal: bool,
+    packed_mask: Optional[torch.Tensor],
+    pos_encoding_mode: str,
+    window_left: int,
+    logits_soft_cap: float,
+    sm_scale: float,
+    rope_scale: float,
+    rope_theta: float,
+    kv_tile_size: int,
+    alibi_slopes: Optional[torch.Tensor] = None,
+    qo_segment_ids: Optional[torch.Tensor] = None,
+    kv_segment_ids: Optional[torch.Tensor] = None,
+    prefix_len: int = 0,
+    chunk_size: int = 0,
+    chunk_offset: int = 0,
+    add_mass=None,
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    # Attention of the query rows [row_begin, row_end) of a request, q has shape
+    # [row_end - row_begin, num_qo_heads, head_dim_qk] and get_kv(begin, end) returns the
+    # [end - begin, num_kv_heads, head_dim] keys and values of the request. The kv is
+    # processed in tiles with online softmax, the scores are never materialized beyond
+    # [num_qo_heads, num_rows, kv_tile_size]. The packed mask replaces the causal mask as
+    # in the kernels. alibi_slopes overrides the slopes of the heads of q (when q is a
+    # subset of the heads). qo_segment_ids (of the rows) and kv_segment_ids (of the kv of
+    # the request) restrict the attention to tokens of the same segment, on top of the
+    # other masks. The first prefix_len keys are visible to all the rows under the causal
+    # mask. With chunk_size > 0, the rows only attend to the kv of their aligned chunk
+    # (chunk_offset is the position of the first kv in the sequence) and the kv tiles
+    # outside the chunks of the rows are skipped. If add_mass is provided, a second sweep
+    # over the kv tiles recomputes their probabilities, normalized with the final
+    # logsumexp of the rows, and calls add_mass(begin, end, mass) with the mass of the kv
+    # [begin, end) summed over the rows and the query heads of each kv head, shape:
+    # [end - begin, num_kv_heads]. Returns the float32 output and the base-2 logsumexp.
+    device = q.device
+    num_rows, num_qo_heads, _ = q.shape
+    q_pos = torch.arange(row_begin, row_end, device=device) + (kv_len - qo_len)
+    kv_begin, kv_end = 0, kv_len
+    if causal and packed_mask is None:
+        kv_end = min(kv_len, max(kv_len - qo_len + row_end, prefix_len))
+    if window_left >= 0:
+        kv_begin = max(0, kv_len - qo_len + row_begin - window_left)
+    if chunk_size > 0:
+        first_chunk = (kv_len - qo_len + row_begin + chunk_offset) // chunk_size
+        last_chunk = (kv_len - qo_len + row_end - 1 + chunk_offset) // chunk_size
+        kv_begin = max(kv_begin, first_chunk * chunk_size - chunk_offset)
+        kv_end = min(kv_end, (last_chunk + 1) * chunk_size - chunk_offset)
+
+    qf = q.float()
+    if pos_encoding_mode == "ROPE_LLAMA":
+        qf = _apply_rope_torch(qf, q_pos, rope_scale, rope_theta)
+    slopes = None
+    if pos_encoding_mode == "ALIBI":
+        if alibi_slopes is None:
+            alibi_slopes = get_alibi_slopes(num_qo_heads)
+        slopes = alibi_slopes.to(device)[:, None, None]
+
+    def get_logits(begin: int, end: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        # the masked (natural base) logits of the kv tile [begin, end), shape:
+        # [num_qo_heads, num_rows, end - begin], and its values
+        k, v = get_kv(begin, end)
+        k = k.float()
+        kv_pos = torch.arange(begin, end, device=device)
+        if pos_encoding_mode == "ROPE_LLAMA":
+            k = _apply_rope_torch(k, kv_pos, rope_scale, rope_theta)
+        group_size = num_qo_heads // k.shape[1]
+        k = k.repeat_interleave(group_size, dim=1)
+        s = torch.einsum("qhd,khd->hqk", qf, k)
+        if slopes is not None:
+            s = s * sm_scale + slopes * (kv_pos[None, :] - q_pos[:, None])[None]
+            scale = 1.0
+        else:
+            scale = sm_scale
+        if logits_soft_cap > 0:
+            s = logits_soft_cap * torch.tanh(s * (sm_scale / logits_soft_cap))
+        else:
+            s = s * scale
+        if packed_mask is not None:
+            mask = _get_packed_mask_tile(
+                packed_mask, kv_len, row_begin, row_end, begin, end
+            )
+        else:
+            mask = torch.ones(num_rows, end - begin, dtype=torch.bool, device=device)
+            if causal:
+                mask &= (kv_pos[None, :] <= q_pos[:, None]) | (
+                    kv_pos[None, :] < prefix_len
+                )
+        if window_left >= 0:
+            mask &= kv_pos[None, :] >= q_pos[:, None] - window_left
+        if chunk_size > 0:
+            mask &= (kv_pos[None, :] + chunk_offset) // chunk_size == (
+                q_pos[:, None] + chunk_offset
+            ) // chunk_size
+        if qo_segment_ids is not None:
+            mask &= qo_segment_ids[:, None] == kv_segment_ids[None, begin:end]
+        return s.masked_fill(~mask[None], float("-inf")), v
+
+    m = torch.full((num_qo_heads, num_rows), float("-inf"), device=device)
+    d = torch.zeros(num_qo_heads, num_rows, device=device)
+    acc = None
+    for begin in range(kv_begin, kv_end, kv_tile_size):
+        end = min(begin + kv_tile_size, kv_end)
+        s, v = get_logits(begin, end)
+        v = v.float().repeat_interleave(num_qo_heads // v.shape[1], dim=1)
+
+        # online softmax update
+        m_new = torch.maximum(m, s.amax(dim=-1))
+        m_safe = torch.where(torch.isinf(m_new), 0.0, m_new)
+        alpha = torch.exp(m - m_safe)
+        p = torch.exp(s - m_safe[..., None])
+        d = d * alpha + p.sum(dim=-1)
+        pv = torch.einsum("hqk,khd->hqd", p, v)
+        acc = pv if acc is None else acc * alpha[..., None] + pv
+        m = m_new
+
+    if acc is None:
+        # no visible kv, the output is zero as in the kernels
+        head_dim_vo = get_kv(0, 0)[1].shape[-1]
+        o = torch.zeros(num_rows, num_qo_heads, head_dim_vo, device=device)
+        return o, torch.full((num_rows, num_qo_heads), float("-inf"), device=device)
+    o = acc / torch.where(d > 0, d, 1.0)[..., None]
+    lse = m + torch.log(d)
+    if add_mass is not None:
+        # the rows without visible kv have no mass
+        lse_safe = torch.where(d > 0, lse, 0.0)
+        for begin in range(kv_begin, kv_end, kv_tile_size):
+            end = min(begin + kv_tile_size, kv_end)
+            s, v = get_logits(begin, end)
+            p = torch.exp(s - lse_safe[..., None])
+            # [num_qo_heads, num_rows, n] -> [n, num_kv_heads]
+            add_mass(begin, end, p.view(v.shape[1], -1, end - begin).sum(dim=1).T)
+    lse = lse * math.log2(math.e)
+    return o.transpose(0, 1), lse.transpose(0, 1)
+
+
+def _batch_prefill_torch(
+    q: torch.Tensor,
+    qo_indptr: torch.Tensor,
+    kv_lens: List[int],
+    get_kv,
+    causal: bool,
+    packed_custom_mask: Optional[torch.Tensor],
+    packed_mask_indptr: Optional[torch.Tensor],
+    pos_encoding_mode: str,
+    window_left: Union[int, torch.Tensor],
+    logits_soft_cap: Union[float, torch.Tensor],
+    sm_scale: float,
+    rope_scale: float,
+    rope_theta: float,
+    out: torch.Tensor,
+    lse: Optional[torch.Tensor],
+    qo_segment_ids: Optional[torch.Tensor] = None,
+    kv_segment_ids: Optional[torch.Tensor] = None,
+    prefix_len: Union[int, torch.Tensor] = 0,
+    chunk_size: int = 0,
+    chunk_offset: Union[int, torch.Tensor] = 0,
+    add_mass=None,
+    qo_tile_size: int = 128,
+    kv_tile_size: int = 512,
+    num_workers: Optional[int] = None,
+) -> None:
+    # The torch backend of the batch prefill wrappers, get_kv(i, begin, end) returns the
+    # keys and values [begin, end) of request i, add_mass(i, begin, end, mass) optionally
+    # accumulates the attention mass of the kv [begin, end) of request i. The query tiles of all requests are
+    # processed by a thread pool, each writes its own rows of out and lse. The segment
+    # ids are flattened over the query and kv tokens of the requests, chunk_offset is
+    # the per-request position of the first kv in the sequence (chunked attention).
+    qo_indptr = qo_indptr.tolist()
+    if packed_custom_mask is not None:
+        packed_mask_indptr = packed_mask_indptr.tolist()
+    kv_indptr = [0]
+    for kv_len in kv_lens:
+        kv_indptr.append(kv_indptr[-1] + kv_len)
+    tasks = []
+    for i in range(len(kv_lens)):
+        qo_len = qo_indptr[i + 1] - qo_indptr[i]
+        for row_begin in range(0, qo_len, qo_tile_size):
+            tasks.append((i, row_begin, min(row_begin + qo_tile_size, qo_len)))
+
+    def run_task(task):
+        i, row_begin, row_end = task
+        packed_mask = None
+        if packed_custom_mask is not None:
+            packed_mask = packed_custom_mask[
+                packed_mask_indptr[i] : packed_mask_indptr[i + 1]
+            ]
+        qo_segment_ids_tile = kv_segment_ids_i = None
+        if qo_segment_ids is not None:
+            qo_segment_ids_tile = qo_segment_ids[
+                qo_indptr[i] + row_begin : qo_indptr[i] + row_end
+            ]
+            kv_segment_ids_i = kv_segment_ids[kv_indptr[i] : kv_indptr[i + 1]]
+        o, lse_tile = _prefill_tile_torch(
+            q[qo_indptr[i] + row_begin : qo_indptr[i] + row_end],
+            functools.partial(get_kv, i),
+            qo_indptr[i + 1] - qo_indptr[i],
+            kv_lens[i],
+            row_begin,
+            row_end,
+            causal,
+            packed_mask,
+            pos_encoding_mode,
+            _get_request_param(window_left, i),
+            _get_request_param(logits_soft_cap, i),
+            sm_scale,
+            rope_scale,
+            rope_theta,
+            kv_tile_size,
+            qo_segment_ids=qo_segment_ids_tile,
+            kv_segment_ids=kv_segment_ids_i,
+            prefix_len=_get_request_param(prefix_len, i),
+            chunk_size=chunk_size,
+            chunk_offset=_get_request_param(chunk_offset, i),
+            add_mass=None if add_mass is None else functools.partial(add_mass, i),
+        )
+        out[qo_indptr[i] + row_begin : qo_indptr[i] + row_end] = o.to(out.dtype)
+        if lse is not None:
+            lse[qo_indptr[i] + row_begin : qo_indptr[i] + row_end] = lse_tile
+
+    _run_tasks(run_task, tasks, num_workers)
+
+
+def _run_tasks(run_task, tasks: List, num_workers: Optional[int]) -> None:
+    # run the independent tasks on the shared thread pool
+    if num_workers is None:
+        num_workers = torch.get_num_threads()
+    num_workers = min(num_workers, len(tasks))
+    if num_workers <= 1:
+        for task in tasks:
+            run_task(task)
+        return
+    for future in [_get_thread_pool(num_workers).submit(run_task, t) for t in tasks]:
+        future.result()
+
+
+def _single_prefill_torch(
+    q: torch.Tensor,
+    k: torch.Tensor,
+    v: torch.Tensor,
+    causal: bool,
+    packed_custom_mask: Optional[torch.Tensor],
+    kv_layout: str,
+    pos_encoding_mode: str,
+    window_left: int,
+    logits_soft_cap: float,
+    sm_scale: float,
+    rope_scale: float,
+    rope_theta: float,
+    out: torch.Tensor,
+    lse: Optional[torch.Tensor],
+    qo_segment_ids: Optional[torch.Tensor] = None,
+    kv_segment_ids: Optional[torch.Tensor] = None,
+    prefix_len: int = 0,
+    qo_tile_size: int = 128,
+    kv_tile_size: int = 512,
+    num_workers: Optional[int] = None,
+) -> None:
+    # The torch backend of single_prefill_with_kv_cache, for long sequences on CPU. A
+    # single request is split into (kv head, query tile) tasks so that all the workers
+    # are busy, each task streams the kv of its head in tiles. The peak memory of a task
+    # is O(group_size * qo_tile_size * kv_tile_size) regardless of the sequence length.
+    if kv_layout == "HND":
+        k, v = k.transpose(0, 1), v.transpose(0, 1)
+    qo_len, num_qo_heads, _ = q.shape
+    kv_len, num_kv_heads, _ = k.shape
+    group_size = num_qo_heads // num_kv_heads
+    alibi_slopes = get_alibi_slopes(num_qo_heads)
+    tasks = [
+        (kv_head, row_begin, min(row_begin + qo_tile_size, qo_len))
+        for kv_head in range(num_kv_heads)
+        for row_begin in range(0, qo_len, qo_tile_size)
+    ]
+
+    def run_task(task):
+        kv_head, row_begin, row_end = task
+        heads = slice(kv_head * group_size, (kv_head + 1) * group_size)
+
+        def get_kv(begin: int, end: int) -> Tuple[torch.Tensor, torch.Tensor]:
+            return (
+                k[begin:end, kv_head : kv_head + 1],
+                v[begin:end, kv_head : kv_head + 1],
+            )
+
+        o, lse_tile = _prefill_tile_torch(
+            q[row_begin:row_end, heads],
+            get_kv,
+            qo_len,
+            kv_len,
+            row_begin,
+            row_end,
+            causal,
+            packed_custom_mask,
+            pos_encoding_mode,
+            window_left,
+            logits_soft_cap,
+            sm_scale,
+            rope_scale,
+            rope_theta,
+            kv_tile_size,
+            alibi_slopes=alibi_slopes[heads],
+            qo_segment_ids=(
+                None if qo_segment_ids is None else qo_segment_ids[row_begin:row_end]
+            ),
+            kv_segment_ids=kv_segment_ids,
+            prefix_len=prefix_len,
+        )
+        out[row_begin:row_end, heads] = o.to(out.dtype)
+        if lse is not None:
+            lse[row_begin:row_end, heads] = lse_tile
+
+    _run_tasks(run_task, tasks, num_workers)
+
+
+def _get_paged_kv_torch(
+    k_cache: torch.Tensor,
+    v_cache: torch.Tensor,
+    kv_indptr: List[int],
+    kv_indices: torch.Tensor,
+    k_scale: Optional[torch.Tensor] = None,
+    v_scale: Optional[torch.Tensor] = None,
+):
+    # returns get_kv(i, begin, end) gathering only the pages covering [begin, end) from
+    # the NHD k/v caches, the pages of a quantized cache are dequantized with their
+    # per-page scales as they are gathered
+    page_size = k_cache.shape[1]
+
+    def get_kv(i: int, begin: int, end: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        first = kv_indptr[i] + begin // page_size
+        last = kv_indptr[i] + (end + page_size - 1) // page_size
+        pages = kv_indices[first:last]
+        offset = begin % page_size
+        if k_scale is None and v_scale is None:
+            k = k_cache[pages].flatten(0, 1)[offset : offset + end - begin]
+            v = v_cache[pages].flatten(0, 1)[offset : offset + end - begin]
+            return k, v
+        k = _scale_pages_torch(
+            k_cache[pages], None if k_scale is None else k_scale[pages]
+        )
+        v = _scale_pages_torch(
+            v_cache[pages], None if v_scale is None else v_scale[pages]
+        )
+        return (
+            k.flatten(0, 1)[offset : offset + end - begin],
+            v.flatten(0, 1)[offset : offset + end - begin],
+        )
+
+    return get_kv
+
+
+def _get_paged_mass_torch(
+    attention_mass: torch.Tensor,
+    kv_indptr: List[int],
+    kv_indices: torch.Tensor,
+    page_size: int,
+):
+    # returns add_mass(i, begin, end, mass) adding the [end - begin, num_kv_heads] mass
+    # of the kv [begin, end) of request i to the rows of its pages in the per-page
+    # ([max_num_pages, num_kv_heads]) or per-token ([max_num_pages, page_size,
+    # num_kv_heads]) buffer, the workers of the thread pool add under a lock
+    lock = threading.Lock()
+    kv_indices = kv_indices.to(attention_mass.device, torch.int64)
+
+    def add_mass(i: int, begin: int, end: int, mass: torch.Tensor) -> None:
+        pos = torch.arange(begin, end, device=attention_mass.device)
+        pages = kv_indices[kv_indptr[i] + pos // page_size]
+        mass = mass.to(attention_mass.device)
+        with lock:
+            if attention_mass.dim() == 2:
+                attention_mass.index_add_(0, pages, mass)
+            else:
+                attention_mass.index_put_(
+                    (pages, pos % page_size), mass, accumulate=True
+                )
+
+    return add_mass
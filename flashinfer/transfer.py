@@ -0,0 +1,399 @@
+"""
+Copyright (c) 2025 by FlashInfer team.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import struct
+from typing import (
+    BinaryIO,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
+
+import torch
+
+from .page import RunLengthPageIndices
+from .snapshot import _as_bytes
+from .utils import _check_kv_layout, _unpack_paged_kv_cache
+
+# Wire format of a chunk written by :func:`write_kv_chunk`:
+#
+#   [layer: int64][page_offset: int64][num_pages: int64][nbytes: int64][data: nbytes]
+#
+# where data is the raw bytes of a ``[num_pages, 2, ...]`` transfer buffer.
+_CHUNK_HEADER = struct.Struct("<qqqq")
+
+_PagedKVCache = Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]]
+
+
+class KVTransferChunk(NamedTuple):
+    r"""A chunk of the kv-cache of a request in transfer.
+
+    Attributes
+    ----------
+    layer : int
+        The layer of the chunk.
+    page_offset : int
+        The offset of the first page of the chunk in the page table of the request.
+    data : torch.Tensor
+        The pages of the chunk, shape: ``[num_pages, 2, ...]``, where the last three
+        dimensions follow the kv layout of the exporting kv-cache.
+    """
+
+    layer: int
+    page_offset: int
+    data: torch.Tensor
+
+
+def _get_page_ids(
+    kv_indices: Union[torch.Tensor, RunLengthPageIndices], device: torch.device
+) -> torch.Tensor:
+    if isinstance(kv_indices, RunLengthPageIndices):
+        kv_indices = kv_indices.expand()
+    return kv_indices.to(device, torch.int64)
+
+
+def _gather_pages(
+    paged_kv_cache: _PagedKVCache,
+    page_ids: torch.Tensor,
+    kv_layout: str,
+    out: Optional[torch.Tensor] = None,
+) -> torch.Tensor:
+    if torch.is_tensor(paged_kv_cache) and paged_kv_cache.ndim == 5:
+        return torch.index_select(paged_kv_cache, 0, page_ids, out=out)
+    k_cache, v_cache = _unpack_paged_kv_cache(paged_kv_cache, kv_layout)
+    if out is None:
+        out = torch.empty(
+            (len(page_ids), 2) + tuple(k_cache.shape[1:]),
+            dtype=k_cache.dtype,
+            device=k_cache.device,
+        )
+    out[:, 0] = k_cache[page_ids]
+    out[:, 1] = v_cache[page_ids]
+    return out
+
+
+def _scatter_pages(
+    kv_buffer: torch.Tensor,
+    paged_kv_cache: _PagedKVCache,
+    page_ids: torch.Tensor,
+    kv_layout: str,
+) -> None:
+    if torch.is_tensor(paged_kv_cache) and paged_kv_cache.ndim == 5:
+        paged_kv_cache.index_copy_(0, page_ids, kv_buffer.to(paged_kv_cache.device))
+        return
+    k_cache, v_cache = _unpack_paged_kv_cache(paged_kv_cache, kv_layout)
+    kv_buffer = kv_buffer.to(k_cache.device)
+    k_cache.index_copy_(0, page_ids, kv_buffer[:, 0])
+    v_cache.index_copy_(0, page_ids, kv_buffer[:, 1])
+
+
+def export_request_kv(
+    paged_kv_cache: Union[_PagedKVCache, List[_PagedKVCache]],
+    kv_indices: Union[torch.Tensor, RunLengthPageIndices],
+    kv_layout: str = "NHD",
+    out: Optional[torch.Tensor] = None,
+) -> torch.Tensor:
+    r"""Gather the pages of a request into a contiguous transfer buffer.
+
+    Parameters
+    ----------
+    paged_kv_cache : Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor], List]
+        The paged kv-cache of a layer, as a single 5-D tensor or a tuple of 4-D k/v
+        tensors (see :func:`flashinfer.page.append_paged_kv_cache`), or a list of
+        the paged kv-caches of multiple layers.
+    kv_indices : Union[torch.Tensor, RunLengthPageIndices]
+        The page indices of the request (e.g. ``kv_indices[kv_indptr[i]:kv_indptr[i + 1]]``),
+        or their run-length encoding.
+    kv_layout : str
+        The layout of the paged kv-cache, either ``NHD`` or ``HND``.
+    out : Optional[torch.Tensor]
+        The output buffer, e.g. a pinned or shared memory tensor, if not provided, will
+        be allocated on the device of the kv-cache.
+
+    Returns
+    -------
+    torch.Tensor
+        The transfer buffer, shape: ``[num_pages, 2, ...]`` for a single layer and
+        ``[num_layers, num_pages, 2, ...]`` for a list of layers, where the last three
+        dimensions are the page shape of :attr:`kv_layout`.
+
+    See Also
+    --------
+    import_request_kv
+    """
+    _check_kv_layout(kv_layout)
+    if isinstance(paged_kv_cache, list):
+        page_ids = _get_page_ids(
+            kv_indices, _unpack_paged_kv_cache(paged_kv_cache[0], kv_layout)[0].device
+        )
+        if out is None:
+            return torch.stack(
+                [_gather_pages(c, page_ids, kv_layout) for c in paged_kv_cache]
+            )
+        for c, out_layer in zip(paged_kv_cache, out.unbind(0)):
+            out_layer.copy_(_gather_pages(c, page_ids, kv_layout))
+        return out
+    k_cache, _ = _unpack_paged_kv_cache(paged_kv_cache, kv_layout)
+    page_ids = _get_page_ids(kv_indices, k_cache.device)
+    if out is not None and (out.device != k_cache.device or not out.is_contiguous()):
+        out.copy_(_gather_pages(paged_kv_cache, page_ids, kv_layout))
+        return out
+    return _gather_pages(paged_kv_cache, page_ids, kv_layout, out=out)
+
+
+def import_request_kv(
+    kv_buffer: torch.Tensor,
+    paged_kv_cache: Union[_PagedKVCache, List[_PagedKVCache]],
+    kv_indices: Union[torch.Tensor, RunLengthPageIndices],
+    kv_layout: str = "NHD",
+) -> None:
+    r"""Scatter a transfer buffer produced by :func:`export_request_kv` to the pages of
+    a request.
+
+    Parameters
+    ----------
+    kv_buffer : torch.Tensor
+        The transfer buffer, shape: ``[num_pages, 2, ...]`` for a single layer and
+        ``[num_layers, num_pages, 2, ...]`` for a list of layers.
+    paged_kv_cache : Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor], List]
+        The destination paged kv-cache, see :func:`export_request_kv`.
+    kv_indices : Union[torch.Tensor, RunLengthPageIndices]
+        The destination page indices of the request, shape: ``[num_pages]``,
+        or their run-length encoding.
+    kv_layout : str
+        The layout of the paged kv-cache, either ``NHD`` or ``HND``.
+
+    Note
+    ----
+    The destination pages must be allocated by the caller, the page size and the kv
+    layout should match the exporting kv-cache.
+    """
+    _check_kv_layout(kv_layout)
+    if isinstance(paged_kv_cache, list):
+        if len(kv_buffer) != len(paged_kv_cache):
+            raise ValueError(
+                "The number of layers of kv_buffer {} mismatches the number of "
+                "kv-caches {}.".format(len(kv_buffer), len(paged_kv_cache))
+            )
+        page_ids = _get_page_ids(
+            kv_indices, _unpack_paged_kv_cache(paged_kv_cache[0], kv_layout)[0].device
+        )
+        for c, kv_buffer_layer in zip(paged_kv_cache, kv_buffer.unbind(0)):
+            _scatter_pages(kv_buffer_layer, c, page_ids, kv_layout)
+        return
+    k_cache, _ = _unpack_paged_kv_cache(paged_kv_cache, kv_layout)
+    page_ids = _get_page_ids(kv_indices, k_cache.device)
+    if len(kv_buffer) != len(page_ids):
+        raise ValueError(
+            "The number of pages of kv_buffer {} mismatches the number of page "
+            "indices {}.".format(len(kv_buffer), len(page_ids))
+        )
+    _scatter_pages(kv_buffer, paged_kv_cache, page_ids, kv_layout)
+
+
+def export_request_kv_chunked(
+    paged_kv_cache: _PagedKVCache,
+    kv_indices: Union[torch.Tensor, RunLengthPageIndices],
+    layer: int = 0,
+    kv_layout: str = "NHD",
+    chunk_pages: int = 64,
+    device: Union[str, torch.device] = "cpu",
+) -> Iterator[KVTransferChunk]:
+    r"""Stream the pages of a request of one layer as chunks of :attr:`chunk_pages` pages.
+
+    The copy of the next chunk to :attr:`device` is issued before the current chunk
+    is yielded, so that sending a chunk overlaps with gathering the next one. Calling
+    it for each layer as soon as the layer is computed overlaps the transfer with the
+    remaining prefill layers.
+
+    Parameters
+    ----------
+    paged_kv_cache : Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]]
+        The paged kv-cache of the layer.
+    kv_indices : Union[torch.Tensor, RunLengthPageIndices]
+        The page indices of the request, or their run-length encoding.
+    layer : int
+        The layer index recorded in the chunks, defaults to ``0``.
+    kv_layout : str
+        The layout of the paged kv-cache, either ``NHD`` or ``HND``.
+    chunk_pages : int
+        The number of pages per chunk, defaults to ``64``.
+    device : Union[str, torch.device]
+        The device of the yielded chunks, defaults to ``cpu`` (pinned memory if the
+        kv-cache is on cuda).
+
+    Yields
+    ------
+    KVTransferChunk
+        The chunks in page order, the data of a chunk is valid until the next chunk is
+        requested from the iterator.
+
+    See Also
+    --------
+    import_request_kv_chunked
+    """
+    _check_kv_layout(kv_layout)
+    if chunk_pages <= 0:
+        raise ValueError("chunk_pages should be positive, got {}.".format(chunk_pages))
+    k_cache, _ = _unpack_paged_kv_cache(paged_kv_cache, kv_layout)
+    page_ids = _get_page_ids(kv_indices, k_cache.device)
+    device = torch.device(device)
+    pin_memory = device.type == "cpu" and k_cache.device.type == "cuda"
+    num_pages = len(page_ids)
+
+    def _issue(page_offset: int) -> Tuple[torch.Tensor, Optional[torch.cuda.Event]]:
+        # NOTE: double buffered, the gather and the copy of a chunk are asynchronous
+        # w.r.t. the host if the chunk is copied from cuda to pinned memory.
+        chunk = _gather_pages(
+            paged_kv_cache, page_ids[page_offset : page_offset + chunk_pages], kv_layout
+        )
+        if chunk.device == device:
+            return chunk, None
+        out = torch.empty(
+            chunk.shape, dtype=chunk.dtype, device=device, pin_memory=pin_memory
+        )
+        out.copy_(chunk, non_blocking=pin_memory)
+        if not pin_memory:
+            return out, None
+        event = torch.cuda.Event()
+        event.record(torch.cuda.current_stream(k_cache.device))
+        return out, event
+
+    if num_pages == 0:
+        return
+    pending = _issue(0)
+    for page_offset in range(0, num_pages, chunk_pages):
+        current, event = pending
+        if page_offset + chunk_pages < num_pages:
+            pending = _issue(page_offset + chunk_pages)
+        if event is not None:
+            event.synchronize()
+        yield KVTransferChunk(layer, page_offset, current)
+
+
+def import_request_kv_chunked(
+    chunks: Iterable[KVTransferChunk],
+    paged_kv_cache: Union[_PagedKVCache, List[_PagedKVCache]],
+    kv_indices: Union[torch.Tensor, RunLengthPageIndices],
+    kv_layout: str = "NHD",
+) -> int:
+    r"""Scatter chunks produced by :func:`export_request_kv_chunked` to the pages of a
+    request as they arrive.
+
+    Parameters
+    ----------
+    chunks : Iterable[KVTransferChunk]
+        The chunks, in any order, e.g. an iterator over :func:`read_kv_chunk`.
+    paged_kv_cache : Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor], List]
+        The destination paged kv-cache of a layer (all chunks should be of this layer),
+        or a list of the paged kv-caches of all layers (indexed by the chunk layer).
+    kv_indices : Union[torch.Tensor, RunLengthPageIndices]
+        The destination page indices of the request, or their run-length encoding.
+    kv_layout : str
+        The layout of the paged kv-cache, either ``NHD`` or ``HND``.
+
+    Returns
+    -------
+    int
+        The number of imported chunks.
+    """
+    _check_kv_layout(kv_layout)
+    caches = paged_kv_cache if isinstance(paged_kv_cache, list) else None
+    device = _unpack_paged_kv_cache(
+        caches[0] if caches is not None else paged_kv_cache, kv_layout
+    )[0].device
+    page_ids = _get_page_ids(kv_indices, device)
+    num_chunks = 0
+    for chunk in chunks:
+        cache = caches[chunk.layer] if caches is not None else paged_kv_cache
+        chunk_page_ids = page_ids[
+            chunk.page_offset : chunk.page_offset + len(chunk.data)
+        ]
+        if len(chunk_page_ids) != len(chunk.data):
+            raise ValueError(
+                "The chunk at page offset {} with {} pages exceeds the {} page indices.".format(
+                    chunk.page_offset, len(chunk.data), len(page_ids)
+                )
+            )
+        _scatter_pages(chunk.data, cache, chunk_page_ids, kv_layout)
+        num_chunks += 1
+    return num_chunks
+
+
+def write_kv_chunk(f: BinaryIO, chunk: KVTransferChunk) -> None:
+    r"""Write a chunk to a binary stream, e.g. ``socket.makefile("wb")`` or a pipe.
+
+    Parameters
+    ----------
+    f : BinaryIO
+        The binary stream.
+    chunk : KVTransferChunk
+        The chunk, its data is copied to host memory if needed.
+    """
+    data = _as_bytes(chunk.data.cpu())
+    f.write(
+        _CHUNK_HEADER.pack(chunk.layer, chunk.page_offset, len(chunk.data), len(data))
+    )
+    f.write(data)
+
+
+def read_kv_chunk(
+    f: BinaryIO, page_shape: Tuple[int, ...], dtype: torch.dtype
+) -> Optional[KVTransferChunk]:
+    r"""Read a chunk written by :func:`write_kv_chunk` from a binary stream.
+
+    Parameters
+    ----------
+    f : BinaryIO
+        The binary stream.
+    page_shape : Tuple[int, ...]
+        The shape of a page of the kv-cache, i.e. ``paged_kv_cache.shape[1:]`` of a
+        5-D kv-cache, which should match the exporting kv-cache.
+    dtype : torch.dtype
+        The data type of the kv-cache.
+
+    Returns
+    -------
+    Optional[KVTransferChunk]
+        The chunk on cpu, or ``None`` if the stream is exhausted.
+    """
+    header = f.read(_CHUNK_HEADER.size)
+    if not header:
+        return None
+    if len(header) != _CHUNK_HEADER.size:
+        raise ValueError("Truncated kv chunk header.")
+    layer, page_offset, num_pages, nbytes = _CHUNK_HEADER.unpack(header)
+    data = bytearray(nbytes)
+    view = memoryview(data)
+    received = 0
+    while received < nbytes:
+        n = f.readinto(view[received:])
+        if not n:
+            raise ValueError("Truncated kv chunk data.")
+        received += n
+    page_shape = tuple(page_shape)
+    data = (
+        torch.frombuffer(data, dtype=torch.uint8)
+        if nbytes > 0
+        else torch.empty(0, dtype=torch.uint8)
+    )
+    return KVTransferChunk(
+        layer, page_offset, data.view(dtype).view((num_pages,) + page_shape)
+    )
@@ -0,0 +1,243 @@
+from typing import Optional, Tuple
+
+import torch
+import triton  # type: ignore[import]
+
+from .kernels.decode import batch_decode_paged_kernel, merge_split_kv_kernel
+from .utils import check_device, check_dim
+
+# the minimal number of kv tokens of a split, shorter splits do not pay for the merge
+_MIN_SPLIT_KV_LEN = 256
+
+
+def plan_split_kv(
+    kv_indptr_host: torch.Tensor,
+    page_size: int,
+    num_qo_heads: int,
+    num_kv_heads: int,
+    head_dim: int,
+    workspace_size: int,
+    device: torch.device,
+) -> Tuple[int, int]:
+    """Choose the split-kv partition of batch decode.
+
+    The kv of each request is split into chunks of ``pages_per_split`` pages when the
+    batch alone cannot fill the device, the partial states are stored in the float
+    workspace buffer and merged afterwards.
+
+    Args:
+        kv_indptr_host: The page indptr of the paged kv-cache on host.
+        page_size: The page size of the paged kv-cache.
+        num_qo_heads: The number of query heads.
+        num_kv_heads: The number of key/value heads.
+        head_dim: The head dimension.
+        workspace_size: The size (in bytes) of the float workspace buffer.
+        device: The device of the kernels.
+
+    Returns:
+        The number of pages of each split and the maximum number of splits of a
+        request, ``max_num_splits == 1`` means no split.
+    """
+    batch_size = len(kv_indptr_host) - 1
+    num_pages = kv_indptr_host[1:] - kv_indptr_host[:-1]
+    max_num_pages = max(int(num_pages.max()), 1) if batch_size > 0 else 1
+    if device.type == "cuda":
+        num_sms = torch.cuda.get_device_properties(device).multi_processor_count
+    else:
+        num_sms = 1
+    num_ctas = batch_size * num_kv_heads
+    # the partial output and lse of a split, in float32
+    split_bytes = max(batch_size, 1) * num_qo_heads * (head_dim + 1) * 4
+    max_num_splits = min(
+        triton.cdiv(2 * num_sms, max(num_ctas, 1)),
+        triton.cdiv(max_num_pages * page_size, _MIN_SPLIT_KV_LEN),
+        workspace_size // split_bytes,
+    )
+    if max_num_splits <= 1:
+        return max_num_pages, 1
+    pages_per_split = triton.cdiv(max_num_pages, max_num_splits)
+    return pages_per_split, triton.cdiv(max_num_pages, pages_per_split)
+
+
+def batch_decode_with_paged_kv_cache(
+    q: torch.Tensor,
+    k_cache: torch.Tensor,
+    v_cache: torch.Tensor,
+    kv_indptr: torch.Tensor,
+    kv_indices: torch.Tensor,
+    kv_last_page_len: torch.Tensor,
+    kv_layout: str,
+    pages_per_split: int,
+    max_num_splits: int,
+    sm_scale: float,
+    window_left: Optional[torch.Tensor] = None,
+    logits_soft_cap: Optional[torch.Tensor] = None,
+    alibi_slopes: Optional[torch.Tensor] = None,
+    k_scale: Optional[torch.Tensor] = None,
+    v_scale: Optional[torch.Tensor] = None,
+    workspace_buffer: Optional[torch.Tensor] = None,
+    out: Optional[torch.Tensor] = None,
+    lse: Optional[torch.Tensor] = None,
+    attention_mass: Optional[torch.Tensor] = None,
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Batch decode attention on paged kv-cache with split-kv.
+
+    Args:
+        q: The query tensor, of shape `(batch_size, num_qo_heads, head_dim)`.
+        k_cache: The key cache, of shape `(max_num_pages, page_size, num_kv_heads,
+            head_dim)` for `NHD` layout or `(max_num_pages, num_kv_heads, page_size,
+            head_dim)` for `HND` layout.
+        v_cache: The value cache, of the same shape as `k_cache`.
+        kv_indptr: The page indptr, of shape `(batch_size + 1,)`.
+        kv_indices: The page indices, of shape `(kv_indptr[-1],)`.
+        kv_last_page_len: The number of entries in the last page of each request.
+        kv_layout: The layout of the kv-cache, `NHD` or `HND`.
+        pages_per_split: The number of pages of each kv split, see `plan_split_kv`.
+        max_num_splits: The maximum number of splits of a request.
+        sm_scale: The scale of the attention logits.
+        window_left: Optional int32 per-request left window sizes (`-1` for no window).
+        logits_soft_cap: Optional float32 per-request soft caps (`0` for no capping).
+        alibi_slopes: Optional float32 ALiBi slopes of each query head.
+        k_scale: Optional float32 per-page scales of a quantized key cache, of shape
+            `(max_num_pages,)` or `(max_num_pages, num_kv_heads)`.
+        v_scale: The per-page scales of the value cache, of the same shape as
+            `k_scale`.
+        workspace_buffer: The buffer of the partial states of the splits, required
+            when `max_num_splits > 1`.
+        out: The optional output tensor.
+        lse: The optional base-2 logsumexp tensor, of shape `(batch_size, num_qo_heads)`.
+        attention_mass: Optional float32 buffer of shape `(max_num_pages,
+            num_kv_heads)` or `(max_num_pages, page_size, num_kv_heads)`, the softmax
+            mass of the kv (per page or per token) summed over the query heads of each
+            kv head is added to it. The kv of the requests is not split in this case,
+            the mass is normalized with the final lse of each request.
+
+    Returns:
+        The attention output and the base-2 logsumexp of the attention logits.
+    """
+    check_dim(3, q)
+    check_dim(4, k_cache)
+    check_dim(4, v_cache)
+    check_device([q, k_cache, v_cache, kv_indptr, kv_indices, kv_last_page_len])
+    assert q.stride(-1) == 1 and k_cache.stride(-1) == 1 and v_cache.stride(-1) == 1
+    batch_size, num_qo_heads, head_dim = q.shape
+    if kv_layout == "NHD":
+        page_size, num_kv_heads = k_cache.shape[1], k_cache.shape[2]
+        stride_k_n, stride_k_h = k_cache.stride(1), k_cache.stride(2)
+        stride_v_n, stride_v_h = v_cache.stride(1), v_cache.stride(2)
+    else:
+        num_kv_heads, page_size = k_cache.shape[1], k_cache.shape[2]
+        stride_k_n, stride_k_h = k_cache.stride(2), k_cache.stride(1)
+        stride_v_n, stride_v_h = v_cache.stride(2), v_cache.stride(1)
+    group_size = num_qo_heads // num_kv_heads
+    use_page_scale = k_scale is not None
+    if use_page_scale:
+        assert k_scale.shape == v_scale.shape and k_scale.stride() == v_scale.stride()
+        stride_scale_page = k_scale.stride(0)
+        stride_scale_h = k_scale.stride(1) if k_scale.dim() == 2 else 0
+    else:
+        stride_scale_page = stride_scale_h = 0
+    if attention_mass is not None:
+        # a single split per request, the pages of a request are at most all the pages
+        pages_per_split, max_num_splits = max(kv_indices.numel(), 1), 1
+        stride_mass_page = attention_mass.stride(0)
+        stride_mass_n = attention_mass.stride(1) if attention_mass.dim() == 3 else 0
+        stride_mass_h = attention_mass.stride(-1)
+    else:
+        stride_mass_page = stride_mass_n = stride_mass_h = 0
+    if out is None:
+        out = torch.empty_like(q)
+    if lse is None:
+        lse = torch.empty(
+            (batch_size, num_qo_heads), dtype=torch.float32, device=q.device
+        )
+
+    if max_num_splits > 1:
+        num_elems = batch_size * max_num_splits * num_qo_heads
+        workspace = workspace_buffer[: num_elems * (head_dim + 1) * 4]
+        workspace = workspace.view(torch.float32)
+        o_partial = workspace[: num_elems * head_dim].view(
+            batch_size, max_num_splits, num_qo_heads, head_dim
+        )
+        lse_partial = workspace[num_elems * head_dim :].view(
+            batch_size, max_num_splits, num_qo_heads
+        )
+        stride_o_split = o_partial.stride(1)
+        stride_lse_split = lse_partial.stride(1)
+    else:
+        o_partial, lse_partial = out, lse
+        stride_o_split = stride_lse_split = 0
+
+    BLOCK_G = triton.next_power_of_2(group_size)
+    BLOCK_D = triton.next_power_of_2(head_dim)
+    BLOCK_N = min(64, max(16, triton.next_power_of_2(8192 // (BLOCK_G * BLOCK_D))))
+    batch_decode_paged_kernel[(batch_size, num_kv_heads, max_num_splits)](
+        q,
+        k_cache,
+        v_cache,
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        window_left,
+        logits_soft_cap,
+        alibi_slopes,
+        k_scale,
+        v_scale,
+        o_partial,
+        lse_partial,
+        attention_mass,
+        q.stride(0),
+        q.stride(1),
+        k_cache.stride(0),
+        stride_k_n,
+        stride_k_h,
+        v_cache.stride(0),
+        stride_v_n,
+        stride_v_h,
+        o_partial.stride(0),
+        stride_o_split,
+        o_partial.stride(-2),
+        lse_partial.stride(0),
+        stride_lse_split,
+        lse_partial.stride(-1),
+        stride_scale_page,
+        stride_scale_h,
+        stride_mass_page,
+        stride_mass_n,
+        stride_mass_h,
+        sm_scale,
+        page_size,
+        pages_per_split,
+        head_dim,
+        GROUP_SIZE=group_size,
+        BLOCK_G=BLOCK_G,
+        BLOCK_D=BLOCK_D,
+        BLOCK_N=BLOCK_N,
+        USE_ALIBI=alibi_slopes is not None,
+        USE_SOFT_CAP=logits_soft_cap is not None,
+        USE_WINDOW=window_left is not None,
+        USE_PAGE_SCALE=use_page_scale,
+        USE_MASS=attention_mass is not None,
+    )
+    if max_num_splits > 1:
+        merge_split_kv_kernel[(batch_size, num_qo_heads)](
+            o_partial,
+            lse_partial,
+            kv_indptr,
+            out,
+            lse,
+            o_partial.stride(0),
+            o_partial.stride(1),
+            o_partial.stride(2),
+            lse_partial.stride(0),
+            lse_partial.stride(1),
+            lse_partial.stride(2),
+            out.stride(0),
+            out.stride(1),
+            lse.stride(0),
+            lse.stride(1),
+            pages_per_split,
+            head_dim,
+            BLOCK_D=BLOCK_D,
+        )
+    return out, lse
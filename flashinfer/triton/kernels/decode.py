@@ -0,0 +1,271 @@
+import triton  # type: ignore[import]
+import triton.language as tl  # type: ignore[import]
+
+
+@triton.jit
+def batch_decode_paged_kernel(
+    q_ptr,
+    k_ptr,
+    v_ptr,
+    kv_indptr_ptr,
+    kv_indices_ptr,
+    kv_last_page_len_ptr,
+    window_left_ptr,
+    logits_soft_cap_ptr,
+    alibi_slopes_ptr,
+    k_scale_ptr,
+    v_scale_ptr,
+    o_ptr,
+    lse_ptr,
+    mass_ptr,
+    stride_q_b,
+    stride_q_h,
+    stride_k_page,
+    stride_k_n,
+    stride_k_h,
+    stride_v_page,
+    stride_v_n,
+    stride_v_h,
+    stride_o_b,
+    stride_o_split,
+    stride_o_h,
+    stride_lse_b,
+    stride_lse_split,
+    stride_lse_h,
+    stride_scale_page,
+    stride_scale_h,
+    stride_mass_page,
+    stride_mass_n,
+    stride_mass_h,
+    sm_scale,
+    page_size,
+    pages_per_split,
+    head_dim,
+    GROUP_SIZE: tl.constexpr,
+    BLOCK_G: tl.constexpr,
+    BLOCK_D: tl.constexpr,
+    BLOCK_N: tl.constexpr,
+    USE_ALIBI: tl.constexpr,
+    USE_SOFT_CAP: tl.constexpr,
+    USE_WINDOW: tl.constexpr,
+    USE_PAGE_SCALE: tl.constexpr,
+    USE_MASS: tl.constexpr,
+):
+    # one program per (request, kv head, kv split), the query heads of the kv head group
+    # are processed together so that each kv tile is loaded once. With USE_PAGE_SCALE,
+    # the quantized kv is dequantized with the per-page (stride_scale_h == 0) or
+    # per-page-per-head scales of the pages as it is loaded. With USE_MASS (a single
+    # split per request), the softmax mass of the kv tokens, summed over the query heads
+    # of the group, is added to the mass buffer (stride_mass_n == 0 accumulates per
+    # page).
+    batch_idx = tl.program_id(axis=0)
+    kv_head_idx = tl.program_id(axis=1)
+    split_idx = tl.program_id(axis=2)
+
+    page_begin = tl.load(kv_indptr_ptr + batch_idx)
+    num_pages = tl.load(kv_indptr_ptr + batch_idx + 1) - page_begin
+    if split_idx * pages_per_split >= num_pages:
+        return
+    kv_len = (num_pages - 1) * page_size + tl.load(kv_last_page_len_ptr + batch_idx)
+    chunk_begin = split_idx * pages_per_split * page_size
+    chunk_end = tl.minimum(chunk_begin + pages_per_split * page_size, kv_len)
+    if USE_WINDOW:
+        window_left = tl.load(window_left_ptr + batch_idx)
+        if window_left >= 0:
+            chunk_begin = tl.maximum(chunk_begin, kv_len - 1 - window_left)
+
+    offs_g = tl.arange(0, BLOCK_G)
+    offs_d = tl.arange(0, BLOCK_D)
+    mask_g = offs_g < GROUP_SIZE
+    mask_d = offs_d < head_dim
+    qo_heads = kv_head_idx * GROUP_SIZE + offs_g
+    q = tl.load(
+        q_ptr
+        + batch_idx * stride_q_b
+        + qo_heads[:, None] * stride_q_h
+        + offs_d[None, :],
+        mask=mask_g[:, None] & mask_d[None, :],
+        other=0.0,
+    ).to(tl.float32)
+    if USE_ALIBI:
+        slopes = tl.load(alibi_slopes_ptr + qo_heads, mask=mask_g, other=0.0)
+    if USE_SOFT_CAP:
+        logits_soft_cap = tl.load(logits_soft_cap_ptr + batch_idx)
+        # the requests with zero soft cap are uncapped
+        soft_cap_scale = sm_scale / tl.where(logits_soft_cap > 0, logits_soft_cap, 1.0)
+
+    log2e = 1.4426950408889634
+    m = tl.full([BLOCK_G], float("-inf"), dtype=tl.float32)
+    d = tl.zeros([BLOCK_G], dtype=tl.float32)
+    acc = tl.zeros([BLOCK_G, BLOCK_D], dtype=tl.float32)
+    lse = tl.zeros([BLOCK_G], dtype=tl.float32)
+    # the second sweep (USE_MASS) recomputes the probabilities of the tiles, normalized
+    # with the final lse of the query heads, and accumulates their mass
+    for sweep in tl.static_range(1 + USE_MASS):
+        for start in tl.range(chunk_begin, chunk_end, BLOCK_N):
+            offs_n = start + tl.arange(0, BLOCK_N)
+            mask_n = offs_n < chunk_end
+            page = tl.load(
+                kv_indices_ptr + page_begin + offs_n // page_size, mask=mask_n, other=0
+            ).to(tl.int64)
+            entry = offs_n % page_size
+            kv_mask = mask_n[:, None] & mask_d[None, :]
+            k = tl.load(
+                k_ptr
+                + page[:, None] * stride_k_page
+                + entry[:, None] * stride_k_n
+                + kv_head_idx * stride_k_h
+                + offs_d[None, :],
+                mask=kv_mask,
+                other=0.0,
+            ).to(tl.float32)
+            if sweep == 0:
+                v = tl.load(
+                    v_ptr
+                    + page[:, None] * stride_v_page
+                    + entry[:, None] * stride_v_n
+                    + kv_head_idx * stride_v_h
+                    + offs_d[None, :],
+                    mask=kv_mask,
+                    other=0.0,
+                ).to(tl.float32)
+            if USE_PAGE_SCALE:
+                scale_offsets = page * stride_scale_page + kv_head_idx * stride_scale_h
+                k_scale = tl.load(k_scale_ptr + scale_offsets, mask=mask_n, other=0.0)
+                k = k * k_scale[:, None]
+                if sweep == 0:
+                    v_scale = tl.load(
+                        v_scale_ptr + scale_offsets, mask=mask_n, other=0.0
+                    )
+                    v = v * v_scale[:, None]
+
+            # the group of a decode step is small, the reduction is done on the cuda
+            # cores
+            s = tl.sum(q[:, None, :] * k[None, :, :], axis=2)
+            scale = sm_scale
+            if USE_ALIBI:
+                s = s * sm_scale + slopes[:, None] * (offs_n - (kv_len - 1))[None, :]
+                scale = 1.0
+            if USE_SOFT_CAP:
+                # tanh(x) = 2 * sigmoid(2x) - 1
+                s = tl.where(
+                    logits_soft_cap > 0,
+                    logits_soft_cap
+                    * (2.0 * tl.sigmoid(2.0 * s * soft_cap_scale) - 1.0),
+                    s * scale,
+                )
+            else:
+                s = s * scale
+            s = tl.where(mask_n[None, :], s * log2e, float("-inf"))
+
+            if sweep == 0:
+                # online softmax in base 2, each tile has at least one valid kv
+                m_new = tl.maximum(m, tl.max(s, axis=1))
+                alpha = tl.exp2(m - m_new)
+                p = tl.exp2(s - m_new[:, None])
+                d = d * alpha + tl.sum(p, axis=1)
+                acc = acc * alpha[:, None] + tl.sum(
+                    p[:, :, None] * v[None, :, :], axis=1
+                )
+                m = m_new
+            else:
+                p = tl.where(mask_g[:, None], tl.exp2(s - lse[:, None]), 0.0)
+                tl.atomic_add(
+                    mass_ptr
+                    + page * stride_mass_page
+                    + entry * stride_mass_n
+                    + kv_head_idx * stride_mass_h,
+                    tl.sum(p, axis=0),
+                    mask=mask_n,
+                )
+
+        if sweep == 0:
+            o = acc / tl.where(d > 0, d, 1.0)[:, None]
+            tl.store(
+                o_ptr
+                + batch_idx * stride_o_b
+                + split_idx * stride_o_split
+                + qo_heads[:, None] * stride_o_h
+                + offs_d[None, :],
+                o.to(o_ptr.dtype.element_ty),
+                mask=mask_g[:, None] & mask_d[None, :],
+            )
+            lse = m + tl.log2(d)
+            tl.store(
+                lse_ptr
+                + batch_idx * stride_lse_b
+                + split_idx * stride_lse_split
+                + qo_heads * stride_lse_h,
+                lse,
+                mask=mask_g,
+            )
+
+
+@triton.jit
+def merge_split_kv_kernel(
+    o_partial_ptr,
+    lse_partial_ptr,
+    kv_indptr_ptr,
+    o_ptr,
+    lse_ptr,
+    stride_o_partial_b,
+    stride_o_partial_split,
+    stride_o_partial_h,
+    stride_lse_partial_b,
+    stride_lse_partial_split,
+    stride_lse_partial_h,
+    stride_o_b,
+    stride_o_h,
+    stride_lse_b,
+    stride_lse_h,
+    pages_per_split,
+    head_dim,
+    BLOCK_D: tl.constexpr,
+):
+    # merge the partial states of the kv splits of a (request, query head)
+    batch_idx = tl.program_id(axis=0)
+    head_idx = tl.program_id(axis=1)
+    num_pages = tl.load(kv_indptr_ptr + batch_idx + 1) - tl.load(
+        kv_indptr_ptr + batch_idx
+    )
+    num_splits = tl.cdiv(num_pages, pages_per_split)
+
+    offs_d = tl.arange(0, BLOCK_D)
+    mask_d = offs_d < head_dim
+    m = float("-inf")
+    d = 0.0
+    acc = tl.zeros([BLOCK_D], dtype=tl.float32)
+    for split_idx in tl.range(0, num_splits):
+        s = tl.load(
+            lse_partial_ptr
+            + batch_idx * stride_lse_partial_b
+            + split_idx * stride_lse_partial_split
+            + head_idx * stride_lse_partial_h
+        )
+        o = tl.load(
+            o_partial_ptr
+            + batch_idx * stride_o_partial_b
+            + split_idx * stride_o_partial_split
+            + head_idx * stride_o_partial_h
+            + offs_d,
+            mask=mask_d,
+            other=0.0,
+        )
+        # the splits outside the window are empty (lse is -inf)
+        m_new = tl.maximum(m, s)
+        m_safe = tl.where(m_new == float("-inf"), 0.0, m_new)
+        alpha = tl.exp2(m - m_safe)
+        beta = tl.exp2(s - m_safe)
+        acc = acc * alpha + o * beta
+        d = d * alpha + beta
+        m = m_new
+
+    o = acc / tl.where(d > 0, d, 1.0)
+    tl.store(
+        o_ptr + batch_idx * stride_o_b + head_idx * stride_o_h + offs_d,
+        o.to(o_ptr.dtype.element_ty),
+        mask=mask_d,
+    )
+    tl.store(
+        lse_ptr + batch_idx * stride_lse_b + head_idx * stride_lse_h, m + tl.log2(d)
+    )
@@ -0,0 +1,44 @@
+import triton  # type: ignore[import]
+import triton.language as tl  # type: ignore[import]
+
+
+@triton.jit
+def segment_packed_mask_window_kernel(
+    x_ptr,
+    out_ptr,
+    mask_indptr_ptr,
+    qo_lens_ptr,
+    kv_lens_ptr,
+    window_left_ptr,
+    CAUSAL: tl.constexpr,
+    USE_WINDOW: tl.constexpr,
+    BLOCK_SIZE: tl.constexpr,
+):
+    # one program per (request, block of bytes) of the little bitorder packed
+    # [qo_len, kv_len] masks, the bits of a byte are expanded in registers only, the
+    # queries are the last qo_len tokens of the kv
+    batch_idx = tl.program_id(axis=0)
+    byte_begin = tl.program_id(axis=1) * BLOCK_SIZE
+    mask_begin = tl.load(mask_indptr_ptr + batch_idx)
+    num_bytes = tl.load(mask_indptr_ptr + batch_idx + 1) - mask_begin
+    if byte_begin >= num_bytes:
+        return
+    qo_len = tl.load(qo_lens_ptr + batch_idx).to(tl.int64)
+    kv_len = tl.load(kv_lens_ptr + batch_idx).to(tl.int64)
+
+    offs = byte_begin + tl.arange(0, BLOCK_SIZE)
+    mask = offs < num_bytes
+    byte = tl.load(x_ptr + mask_begin + offs, mask=mask, other=0).to(tl.int32)
+    offs_bit = tl.arange(0, 8)
+    bit = offs[:, None].to(tl.int64) * 8 + offs_bit[None, :]
+    row = bit // kv_len
+    col = bit % kv_len
+    q_pos = kv_len - qo_len + row
+    keep = bit < qo_len * kv_len
+    if CAUSAL:
+        keep = keep & (col <= q_pos)
+    if USE_WINDOW:
+        window_left = tl.load(window_left_ptr + batch_idx)
+        keep = keep & ((window_left < 0) | (col >= q_pos - window_left))
+    keep_byte = tl.sum(keep.to(tl.int32) << offs_bit[None, :], axis=1)
+    tl.store(out_ptr + mask_begin + offs, (byte & keep_byte).to(tl.uint8), mask=mask)
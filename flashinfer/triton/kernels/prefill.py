@@ -0,0 +1,335 @@
+import torch
+import triton  # type: ignore[import]
+import triton.language as tl  # type: ignore[import]
+
+
+def _prune_prefill_configs(configs, named_args, **kwargs):
+    # there is nothing to tune on devices without a triton driver (e.g. the
+    # interpreter), and benchmarking would launch the configs into a captured graph
+    if named_args["q_ptr"].device.type != "cuda" or (
+        torch.cuda.is_current_stream_capturing()
+    ):
+        return configs[:1]
+    return configs
+
+
+# the fastest config of each problem shape is measured on its first launch, the first
+# config is used without benchmarking
+@triton.autotune(
+    configs=[
+        triton.Config({"BLOCK_M": 64, "BLOCK_N": 64}, num_warps=4),
+        triton.Config({"BLOCK_M": 128, "BLOCK_N": 64}, num_warps=8),
+        triton.Config({"BLOCK_M": 128, "BLOCK_N": 32}, num_warps=4),
+        triton.Config({"BLOCK_M": 64, "BLOCK_N": 32}, num_warps=4),
+        triton.Config({"BLOCK_M": 128, "BLOCK_N": 128}, num_warps=8),
+    ],
+    key=[
+        "page_size",
+        "group_size",
+        "head_dim_qk",
+        "head_dim_vo",
+        "max_qo_len_bucket",
+        "PAGED",
+        "CAUSAL",
+        "USE_CUSTOM_MASK",
+        "USE_ALIBI",
+        "USE_SOFT_CAP",
+        "USE_WINDOW",
+        "USE_SEGMENT_IDS",
+        "USE_PREFIX",
+        "USE_CHUNK",
+        "USE_PAGE_SCALE",
+        "USE_MASS",
+    ],
+    prune_configs_by={"early_config_prune": _prune_prefill_configs},
+    # the mass is accumulated, benchmarking the configs should not add to it
+    restore_value=["mass_ptr"],
+)
+@triton.jit
+def batch_prefill_kernel(
+    q_ptr,
+    k_ptr,
+    v_ptr,
+    qo_indptr_ptr,
+    kv_indptr_ptr,
+    kv_indices_ptr,
+    kv_last_page_len_ptr,
+    custom_mask_ptr,
+    mask_indptr_ptr,
+    window_left_ptr,
+    logits_soft_cap_ptr,
+    alibi_slopes_ptr,
+    qo_segment_ids_ptr,
+    kv_segment_ids_ptr,
+    kv_segment_indptr_ptr,
+    prefix_len_ptr,
+    chunk_offset_ptr,
+    k_scale_ptr,
+    v_scale_ptr,
+    o_ptr,
+    lse_ptr,
+    mass_ptr,
+    stride_q_n,
+    stride_q_h,
+    stride_k_page,
+    stride_k_n,
+    stride_k_h,
+    stride_v_page,
+    stride_v_n,
+    stride_v_h,
+    stride_o_n,
+    stride_o_h,
+    stride_lse_n,
+    stride_scale_page,
+    stride_scale_h,
+    stride_mass_page,
+    stride_mass_n,
+    stride_mass_h,
+    sm_scale,
+    page_size,
+    group_size,
+    head_dim_qk,
+    head_dim_vo,
+    chunk_size,
+    max_qo_len_bucket,
+    PAGED: tl.constexpr,
+    CAUSAL: tl.constexpr,
+    USE_CUSTOM_MASK: tl.constexpr,
+    USE_ALIBI: tl.constexpr,
+    USE_SOFT_CAP: tl.constexpr,
+    USE_WINDOW: tl.constexpr,
+    USE_SEGMENT_IDS: tl.constexpr,
+    USE_PREFIX: tl.constexpr,
+    USE_CHUNK: tl.constexpr,
+    USE_PAGE_SCALE: tl.constexpr,
+    USE_MASS: tl.constexpr,
+    BLOCK_M: tl.constexpr,
+    BLOCK_N: tl.constexpr,
+    BLOCK_DQK: tl.constexpr,
+    BLOCK_DVO: tl.constexpr,
+    DOT_PRECISION: tl.constexpr,
+):
+    # one program per (request, query tile, query head), the queries are the last qo_len
+    # tokens of the kv. The kv is either paged (kv_indptr is the page indptr) or ragged
+    # (kv_indptr is the token indptr), the custom mask replaces the causal mask. The
+    # segment ids restrict the attention to tokens of the same segment, kv_segment_indptr
+    # is the token indptr of the kv segment ids. With USE_PREFIX, the first prefix_len
+    # keys of a request are visible to all its queries under the causal mask (prefix-LM).
+    # With USE_CHUNK, the queries only attend to the kv of their aligned chunk of
+    # chunk_size positions, chunk_offset is the position of the first kv in the
+    # sequence. With USE_PAGE_SCALE, the quantized paged kv is dequantized with the
+    # per-page (stride_scale_h == 0) or per-page-per-head scales as it is loaded.
+    # With USE_MASS, the softmax mass of the paged kv tokens, summed over the queries, is
+    # added to the mass buffer (stride_mass_n == 0 accumulates per page).
+    # max_qo_len_bucket only keys the tuned configs.
+    batch_idx = tl.program_id(axis=0)
+    row_begin = tl.program_id(axis=1) * BLOCK_M
+    qo_head_idx = tl.program_id(axis=2)
+    kv_head_idx = qo_head_idx // group_size
+
+    qo_begin = tl.load(qo_indptr_ptr + batch_idx)
+    qo_len = tl.load(qo_indptr_ptr + batch_idx + 1) - qo_begin
+    if row_begin >= qo_len:
+        return
+    kv_begin = tl.load(kv_indptr_ptr + batch_idx)
+    kv_end = tl.load(kv_indptr_ptr + batch_idx + 1)
+    if PAGED:
+        kv_len = tl.where(
+            kv_end > kv_begin,
+            (kv_end - kv_begin - 1) * page_size
+            + tl.load(kv_last_page_len_ptr + batch_idx),
+            0,
+        )
+    else:
+        kv_len = kv_end - kv_begin
+
+    offs_m = row_begin + tl.arange(0, BLOCK_M)
+    mask_m = offs_m < qo_len
+    q_pos = kv_len - qo_len + offs_m
+    offs_dqk = tl.arange(0, BLOCK_DQK)
+    offs_dvo = tl.arange(0, BLOCK_DVO)
+    mask_dqk = offs_dqk < head_dim_qk
+    mask_dvo = offs_dvo < head_dim_vo
+    q = tl.load(
+        q_ptr
+        + (qo_begin + offs_m)[:, None].to(tl.int64) * stride_q_n
+        + qo_head_idx * stride_q_h
+        + offs_dqk[None, :],
+        mask=mask_m[:, None] & mask_dqk[None, :],
+        other=0.0,
+    )
+
+    # the kv range visible to the query tile
+    lo = 0
+    hi = kv_len
+    if CAUSAL:
+        hi = tl.minimum(kv_len, kv_len - qo_len + row_begin + BLOCK_M)
+        if USE_PREFIX:
+            # the tiles past both the prefix and the diagonal are skipped
+            prefix_len = tl.load(prefix_len_ptr + batch_idx)
+            hi = tl.maximum(hi, tl.minimum(prefix_len, kv_len))
+    if USE_WINDOW:
+        window_left = tl.load(window_left_ptr + batch_idx)
+        if window_left >= 0:
+            lo = tl.maximum(0, kv_len - qo_len + row_begin - window_left)
+    if USE_CHUNK:
+        # the tiles outside the chunks of the query tile are skipped
+        chunk_offset = tl.load(chunk_offset_ptr + batch_idx)
+        row_end = tl.minimum(row_begin + BLOCK_M, qo_len)
+        first_chunk = (kv_len - qo_len + row_begin + chunk_offset) // chunk_size
+        last_chunk = (kv_len - qo_len + row_end - 1 + chunk_offset) // chunk_size
+        lo = tl.maximum(lo, first_chunk * chunk_size - chunk_offset)
+        hi = tl.minimum(hi, (last_chunk + 1) * chunk_size - chunk_offset)
+    if USE_CUSTOM_MASK:
+        mask_begin = tl.load(mask_indptr_ptr + batch_idx).to(tl.int64)
+    if USE_ALIBI:
+        slope = tl.load(alibi_slopes_ptr + qo_head_idx)
+    if USE_SEGMENT_IDS:
+        q_seg = tl.load(qo_segment_ids_ptr + qo_begin + offs_m, mask=mask_m, other=-1)
+        kv_seg_begin = tl.load(kv_segment_indptr_ptr + batch_idx)
+    if USE_SOFT_CAP:
+        logits_soft_cap = tl.load(logits_soft_cap_ptr + batch_idx)
+        # the requests with zero soft cap are uncapped
+        soft_cap_scale = sm_scale / tl.where(logits_soft_cap > 0, logits_soft_cap, 1.0)
+
+    log2e = 1.4426950408889634
+    m = tl.full([BLOCK_M], float("-inf"), dtype=tl.float32)
+    d = tl.zeros([BLOCK_M], dtype=tl.float32)
+    acc = tl.zeros([BLOCK_M, BLOCK_DVO], dtype=tl.float32)
+    lse = tl.zeros([BLOCK_M], dtype=tl.float32)
+    # the second sweep (USE_MASS) recomputes the probabilities of the visible tiles,
+    # normalized with the final lse of the rows, and accumulates their mass
+    for sweep in tl.static_range(1 + USE_MASS):
+        for start in tl.range(lo, hi, BLOCK_N):
+            offs_n = start + tl.arange(0, BLOCK_N)
+            mask_n = offs_n < hi
+            if PAGED:
+                page = tl.load(
+                    kv_indices_ptr + kv_begin + offs_n // page_size,
+                    mask=mask_n,
+                    other=0,
+                ).to(tl.int64)
+                entry = offs_n % page_size
+                k_offsets = page * stride_k_page + entry * stride_k_n
+                v_offsets = page * stride_v_page + entry * stride_v_n
+            else:
+                token = (kv_begin + offs_n).to(tl.int64)
+                k_offsets = token * stride_k_n
+                v_offsets = token * stride_v_n
+            k = tl.load(
+                k_ptr
+                + k_offsets[:, None]
+                + kv_head_idx * stride_k_h
+                + offs_dqk[None, :],
+                mask=mask_n[:, None] & mask_dqk[None, :],
+                other=0.0,
+            )
+            if sweep == 0:
+                v = tl.load(
+                    v_ptr
+                    + v_offsets[:, None]
+                    + kv_head_idx * stride_v_h
+                    + offs_dvo[None, :],
+                    mask=mask_n[:, None] & mask_dvo[None, :],
+                    other=0.0,
+                )
+            if USE_PAGE_SCALE:
+                scale_offsets = page * stride_scale_page + kv_head_idx * stride_scale_h
+                k_scale = tl.load(k_scale_ptr + scale_offsets, mask=mask_n, other=0.0)
+                k = k.to(tl.float32) * k_scale[:, None]
+                if sweep == 0:
+                    v_scale = tl.load(
+                        v_scale_ptr + scale_offsets, mask=mask_n, other=0.0
+                    )
+                    v = v.to(tl.float32) * v_scale[:, None]
+            k = k.to(q.dtype)
+            if sweep == 0:
+                v = v.to(q.dtype)
+
+            s = tl.dot(q, tl.trans(k), input_precision=DOT_PRECISION)
+            scale = sm_scale
+            if USE_ALIBI:
+                s = s * sm_scale + slope * (offs_n[None, :] - q_pos[:, None])
+                scale = 1.0
+            if USE_SOFT_CAP:
+                # tanh(x) = 2 * sigmoid(2x) - 1
+                s = tl.where(
+                    logits_soft_cap > 0,
+                    logits_soft_cap
+                    * (2.0 * tl.sigmoid(2.0 * s * soft_cap_scale) - 1.0),
+                    s * scale,
+                )
+            else:
+                s = s * scale
+
+            mask = mask_m[:, None] & mask_n[None, :]
+            if CAUSAL:
+                if USE_PREFIX:
+                    mask = mask & (
+                        (offs_n[None, :] <= q_pos[:, None])
+                        | (offs_n[None, :] < prefix_len)
+                    )
+                else:
+                    mask = mask & (offs_n[None, :] <= q_pos[:, None])
+            if USE_CUSTOM_MASK:
+                bit = offs_m[:, None].to(tl.int64) * kv_len + offs_n[None, :]
+                byte = tl.load(
+                    custom_mask_ptr + mask_begin + (bit >> 3), mask=mask, other=0
+                )
+                mask = mask & (((byte.to(tl.int32) >> (bit & 7).to(tl.int32)) & 1) == 1)
+            if USE_WINDOW:
+                mask = mask & (
+                    (window_left < 0)
+                    | (offs_n[None, :] >= q_pos[:, None] - window_left)
+                )
+            if USE_CHUNK:
+                mask = mask & (
+                    (offs_n[None, :] + chunk_offset) // chunk_size
+                    == (q_pos[:, None] + chunk_offset) // chunk_size
+                )
+            if USE_SEGMENT_IDS:
+                kv_seg = tl.load(
+                    kv_segment_ids_ptr + kv_seg_begin + offs_n, mask=mask_n, other=-2
+                )
+                mask = mask & (q_seg[:, None] == kv_seg[None, :])
+            s = tl.where(mask, s * log2e, float("-inf"))
+
+            if sweep == 0:
+                # online softmax in base 2, the rows without visible kv stay at -inf
+                m_new = tl.maximum(m, tl.max(s, axis=1))
+                m_safe = tl.where(m_new == float("-inf"), 0.0, m_new)
+                alpha = tl.exp2(m - m_safe)
+                p = tl.exp2(s - m_safe[:, None])
+                d = d * alpha + tl.sum(p, axis=1)
+                acc = acc * alpha[:, None] + tl.dot(
+                    p.to(v.dtype), v, input_precision=DOT_PRECISION
+                )
+                m = m_new
+            else:
+                p = tl.exp2(s - lse[:, None])
+                tl.atomic_add(
+                    mass_ptr
+                    + page * stride_mass_page
+                    + entry * stride_mass_n
+                    + kv_head_idx * stride_mass_h,
+                    tl.sum(p, axis=0),
+                    mask=mask_n,
+                )
+
+        if sweep == 0:
+            o = acc / tl.where(d > 0, d, 1.0)[:, None]
+            tl.store(
+                o_ptr
+                + (qo_begin + offs_m)[:, None].to(tl.int64) * stride_o_n
+                + qo_head_idx * stride_o_h
+                + offs_dvo[None, :],
+                o.to(o_ptr.dtype.element_ty),
+                mask=mask_m[:, None] & mask_dvo[None, :],
+            )
+            tl.store(
+                lse_ptr + (qo_begin + offs_m).to(tl.int64) * stride_lse_n + qo_head_idx,
+                m + tl.log2(d),
+                mask=mask_m,
+            )
+            # the rows without visible kv have no mass
+            lse = tl.where(d > 0, m + tl.log2(d), 0.0)
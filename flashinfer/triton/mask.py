@@ -0,0 +1,54 @@
+from typing import Optional
+
+import torch
+import triton  # type: ignore[import]
+
+from .kernels.mask import segment_packed_mask_window_kernel
+from .utils import check_device, check_dim
+
+
+def segment_packed_mask_apply_window(
+    packed_mask: torch.Tensor,
+    mask_indptr: torch.Tensor,
+    qo_lens: torch.Tensor,
+    kv_lens: torch.Tensor,
+    window_left: Optional[torch.Tensor],
+    causal: bool,
+) -> torch.Tensor:
+    """Apply the causal and sliding window masks to packed custom masks.
+
+    Args:
+        packed_mask: The uint8 flattened `[qo_len, kv_len]` masks of the requests,
+            packed with `segment_packbits(..., bitorder="little")`.
+        mask_indptr: The byte indptr of `packed_mask`, of shape `(batch_size + 1,)`.
+        qo_lens: The int32 query length of each request, of shape `(batch_size,)`.
+        kv_lens: The int32 kv length of each request, of shape `(batch_size,)`.
+        window_left: Optional int32 per-request left window sizes (`-1` for no
+            window).
+        causal: Whether to apply the causal mask.
+
+    Returns:
+        A copy of `packed_mask` with the bits outside the causal and window masks
+        cleared, the bytes outside the segments are copied unchanged.
+    """
+    check_dim(1, packed_mask)
+    check_device([packed_mask, mask_indptr, qo_lens, kv_lens])
+    out = packed_mask.clone()
+    batch_size = len(mask_indptr) - 1
+    max_num_bytes = int((mask_indptr[1:] - mask_indptr[:-1]).max()) if batch_size else 0
+    BLOCK_SIZE = 1024
+    grid = (batch_size, triton.cdiv(max_num_bytes, BLOCK_SIZE))
+    if grid[0] * grid[1] == 0:
+        return out
+    segment_packed_mask_window_kernel[grid](
+        packed_mask,
+        out,
+        mask_indptr,
+        qo_lens,
+        kv_lens,
+        window_left,
+        CAUSAL=causal,
+        USE_WINDOW=window_left is not None,
+        BLOCK_SIZE=BLOCK_SIZE,
+    )
+    return out
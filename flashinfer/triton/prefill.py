@@ -0,0 +1,216 @@
+from typing import Optional, Tuple
+
+import torch
+import triton  # type: ignore[import]
+
+from .kernels.prefill import batch_prefill_kernel
+from .utils import check_device, check_dim
+
+
+def _get_kv_strides(x: torch.Tensor, kv_layout: str, paged: bool):
+    # returns (stride_page, stride_n, stride_h)
+    if paged:
+        if kv_layout == "NHD":
+            return x.stride(0), x.stride(1), x.stride(2)
+        return x.stride(0), x.stride(2), x.stride(1)
+    if kv_layout == "NHD":
+        return 0, x.stride(0), x.stride(1)
+    return 0, x.stride(1), x.stride(0)
+
+
+def batch_prefill_with_kv_cache(
+    q: torch.Tensor,
+    k: torch.Tensor,
+    v: torch.Tensor,
+    qo_indptr: torch.Tensor,
+    kv_indptr: torch.Tensor,
+    kv_indices: Optional[torch.Tensor],
+    kv_last_page_len: Optional[torch.Tensor],
+    kv_layout: str,
+    max_qo_len: int,
+    causal: bool,
+    sm_scale: float,
+    packed_custom_mask: Optional[torch.Tensor] = None,
+    mask_indptr: Optional[torch.Tensor] = None,
+    window_left: Optional[torch.Tensor] = None,
+    logits_soft_cap: Optional[torch.Tensor] = None,
+    alibi_slopes: Optional[torch.Tensor] = None,
+    qo_segment_ids: Optional[torch.Tensor] = None,
+    kv_segment_ids: Optional[torch.Tensor] = None,
+    kv_segment_indptr: Optional[torch.Tensor] = None,
+    prefix_len: Optional[torch.Tensor] = None,
+    chunk_size: int = 0,
+    chunk_offset: Optional[torch.Tensor] = None,
+    k_scale: Optional[torch.Tensor] = None,
+    v_scale: Optional[torch.Tensor] = None,
+    out: Optional[torch.Tensor] = None,
+    lse: Optional[torch.Tensor] = None,
+    attention_mass: Optional[torch.Tensor] = None,
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Batch prefill attention on paged or ragged kv-cache.
+
+    Args:
+        q: The query tensor, of shape `(qo_indptr[-1], num_qo_heads, head_dim_qk)`.
+        k: The key tensor, a paged cache of shape `(max_num_pages, page_size,
+            num_kv_heads, head_dim_qk)` (`NHD`) or `(max_num_pages, num_kv_heads,
+            page_size, head_dim_qk)` (`HND`) if `kv_indices` is provided, otherwise a
+            ragged tensor of shape `(kv_indptr[-1], num_kv_heads, head_dim_qk)` (`NHD`)
+            or `(num_kv_heads, kv_indptr[-1], head_dim_qk)` (`HND`).
+        v: The value tensor, of the same layout as `k` with `head_dim_vo`.
+        qo_indptr: The query indptr, of shape `(batch_size + 1,)`.
+        kv_indptr: The page indptr of the paged kv-cache, or the token indptr of the
+            ragged kv, of shape `(batch_size + 1,)`.
+        kv_indices: The page indices, `None` for ragged kv.
+        kv_last_page_len: The number of entries in the last page of each request,
+            `None` for ragged kv.
+        kv_layout: The layout of the kv, `NHD` or `HND`.
+        max_qo_len: The maximum query length of the requests.
+        causal: Whether to apply causal mask, ignored if `packed_custom_mask` is
+            provided.
+        sm_scale: The scale of the attention logits.
+        packed_custom_mask: Optional custom mask of each request, flattened and
+            packed with `segment_packbits(..., bitorder="little")`.
+        mask_indptr: The byte indptr of `packed_custom_mask`.
+        window_left: Optional int32 per-request left window sizes (`-1` for no window).
+        logits_soft_cap: Optional float32 per-request soft caps (`0` for no capping).
+        alibi_slopes: Optional float32 ALiBi slopes of each query head.
+        qo_segment_ids: Optional int32 segment id of each query token, of shape
+            `(qo_indptr[-1],)`, the attention is restricted to the kv tokens of the same
+            segment.
+        kv_segment_ids: The int32 segment id of each kv token of the requests.
+        kv_segment_indptr: The token indptr of `kv_segment_ids`, of shape
+            `(batch_size + 1,)`.
+        prefix_len: Optional int32 per-request prefix lengths, the first `prefix_len`
+            keys of a request are visible to all its queries under the causal mask.
+        chunk_size: The chunk size of chunked local attention, `0` disables it. The
+            queries only attend to the kv of their aligned chunk of `chunk_size`
+            positions.
+        chunk_offset: Optional int32 per-request position of the first kv in the
+            sequence, the chunks are aligned to the sequence positions. Defaults to
+            zeros.
+        k_scale: Optional float32 per-page scales of a quantized paged key cache, of
+            shape `(max_num_pages,)` or `(max_num_pages, num_kv_heads)`.
+        v_scale: The per-page scales of the value cache, of the same shape as
+            `k_scale`.
+        out: The optional output tensor.
+        lse: The optional base-2 logsumexp tensor, of shape
+            `(qo_indptr[-1], num_qo_heads)`.
+        attention_mass: Optional float32 buffer of a paged kv-cache, of shape
+            `(max_num_pages, num_kv_heads)` or `(max_num_pages, page_size,
+            num_kv_heads)`, the softmax mass of the kv (per page or per token) summed
+            over the queries and the query heads of each kv head is added to it.
+
+    Returns:
+        The attention output and the base-2 logsumexp of the attention logits.
+    """
+    paged = kv_indices is not None
+    check_dim(3, q)
+    check_dim(4 if paged else 3, k)
+    check_dim(4 if paged else 3, v)
+    check_device([q, k, v, qo_indptr, kv_indptr])
+    assert q.stride(-1) == 1 and k.stride(-1) == 1 and v.stride(-1) == 1
+    nnz_qo, num_qo_heads, head_dim_qk = q.shape
+    head_dim_vo = v.shape[-1]
+    if paged:
+        page_size = k.shape[1] if kv_layout == "NHD" else k.shape[2]
+        num_kv_heads = k.shape[2] if kv_layout == "NHD" else k.shape[1]
+    else:
+        page_size = 1
+        num_kv_heads = k.shape[1] if kv_layout == "NHD" else k.shape[0]
+    stride_k_page, stride_k_n, stride_k_h = _get_kv_strides(k, kv_layout, paged)
+    stride_v_page, stride_v_n, stride_v_h = _get_kv_strides(v, kv_layout, paged)
+    if out is None:
+        out = torch.empty(
+            (nnz_qo, num_qo_heads, head_dim_vo), dtype=q.dtype, device=q.device
+        )
+    if lse is None:
+        lse = torch.empty((nnz_qo, num_qo_heads), dtype=torch.float32, device=q.device)
+    batch_size = len(qo_indptr) - 1
+    use_custom_mask = packed_custom_mask is not None
+    use_prefix = prefix_len is not None and causal and not use_custom_mask
+    use_chunk = chunk_size > 0
+    use_page_scale = k_scale is not None
+    if use_page_scale:
+        assert paged, "per-page scales require a paged kv-cache"
+        assert k_scale.shape == v_scale.shape and k_scale.stride() == v_scale.stride()
+        stride_scale_page = k_scale.stride(0)
+        stride_scale_h = k_scale.stride(1) if k_scale.dim() == 2 else 0
+    else:
+        stride_scale_page = stride_scale_h = 0
+    if attention_mass is not None:
+        assert paged, "the attention mass requires a paged kv-cache"
+        stride_mass_page = attention_mass.stride(0)
+        stride_mass_n = attention_mass.stride(1) if attention_mass.dim() == 3 else 0
+        stride_mass_h = attention_mass.stride(-1)
+    else:
+        stride_mass_page = stride_mass_n = stride_mass_h = 0
+    if use_chunk and chunk_offset is None:
+        chunk_offset = torch.zeros(batch_size, dtype=torch.int32, device=q.device)
+    BLOCK_DQK = max(16, triton.next_power_of_2(head_dim_qk))
+    BLOCK_DVO = max(16, triton.next_power_of_2(head_dim_vo))
+
+    def grid(meta):
+        return (batch_size, triton.cdiv(max_qo_len, meta["BLOCK_M"]), num_qo_heads)
+
+    batch_prefill_kernel[grid](
+        q,
+        k,
+        v,
+        qo_indptr,
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        packed_custom_mask,
+        mask_indptr,
+        window_left,
+        logits_soft_cap,
+        alibi_slopes,
+        qo_segment_ids,
+        kv_segment_ids,
+        kv_segment_indptr,
+        prefix_len,
+        chunk_offset,
+        k_scale,
+        v_scale,
+        out,
+        lse,
+        attention_mass,
+        q.stride(0),
+        q.stride(1),
+        stride_k_page,
+        stride_k_n,
+        stride_k_h,
+        stride_v_page,
+        stride_v_n,
+        stride_v_h,
+        out.stride(0),
+        out.stride(1),
+        lse.stride(0),
+        stride_scale_page,
+        stride_scale_h,
+        stride_mass_page,
+        stride_mass_n,
+        stride_mass_h,
+        sm_scale,
+        page_size,
+        num_qo_heads // num_kv_heads,
+        head_dim_qk,
+        head_dim_vo,
+        chunk_size,
+        triton.next_power_of_2(max_qo_len),
+        PAGED=paged,
+        CAUSAL=causal and not use_custom_mask,
+        USE_CUSTOM_MASK=use_custom_mask,
+        USE_ALIBI=alibi_slopes is not None,
+        USE_SOFT_CAP=logits_soft_cap is not None,
+        USE_WINDOW=window_left is not None,
+        USE_SEGMENT_IDS=qo_segment_ids is not None,
+        USE_PREFIX=use_prefix,
+        USE_CHUNK=use_chunk,
+        USE_PAGE_SCALE=use_page_scale,
+        USE_MASS=attention_mass is not None,
+        BLOCK_DQK=BLOCK_DQK,
+        BLOCK_DVO=BLOCK_DVO,
+        DOT_PRECISION="ieee" if q.dtype == torch.float32 else "tf32",
+    )
+    return out, lse
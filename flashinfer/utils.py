@@ -88,6 +88,46 @@ def _check_pos_encoding_mode(pos_encoding_mode: str) -> None:
         raise KeyError("Invalid pos_encoding_mode {}".format(pos_encoding_mode))
 
 
+def _canonicalize_per_request_param(
+    x: Union[int, float, torch.Tensor], batch_size: int, name: str
+) -> Union[int, float, torch.Tensor]:
+    # per-request attention parameters (window_left, logits_soft_cap) could be given as
+    # a tensor of shape [batch_size], which is collapsed to a scalar if all values agree
+    if not torch.is_tensor(x):
+        return x
+    if x.shape != (batch_size,):
+        raise ValueError(
+            "Per-request {} should have shape [batch_size] = [{}], got {}.".format(
+                name, batch_size, tuple(x.shape)
+            )
+        )
+    x = x.to("cpu")
+    if batch_size > 0 and bool((x == x[0]).all()):
+        return x[0].item()
+    return x
+
+
+def _get_per_request_param_buf(
+    x: Union[int, float, torch.Tensor],
+    default: Union[int, float],
+    batch_size: int,
+    dtype: torch.dtype,
+    device: torch.device,
+) -> Optional[torch.Tensor]:
+    # the [batch_size] device tensor of a canonicalized per-request parameter for the
+    # kernels reading it per request, None if all requests use the default value
+    if not torch.is_tensor(x):
+        if x == default:
+            return None
+        x = torch.full((batch_size,), x)
+    return x.to(device, dtype)
+
+
+def _get_kernel_window_left(window_left: Union[int, torch.Tensor]) -> int:
+    # per-request windows are applied through a custom mask, not by the kernel
+    return -1 if torch.is_tensor(window_left) else window_left
+
+
 def _check_kv_layout(kv_layout: str) -> None:
     if not hasattr(TensorLayout, kv_layout):
         raise KeyError("Invalid kv_layout {}".format(kv_layout))
@@ -90,6 +90,83 @@ struct DefaultAttention : AttentionVariantBase {
   })
 };
 
+// DefaultAttention with the window and the logits soft cap of each request read from the
+// request_window_left and request_logits_soft_cap buffers instead of the single values of
+// the launch, a non-positive soft cap disables the soft capping of its request
+template <bool use_custom_mask, bool use_sliding_window, bool use_logits_soft_cap, bool use_alibi>
+struct PerRequestAttention
+    : DefaultAttention<use_custom_mask, use_sliding_window, use_logits_soft_cap, use_alibi> {
+  using Base =
+      DefaultAttention<use_custom_mask, use_sliding_window, use_logits_soft_cap, use_alibi>;
+
+  bool apply_soft_cap;
+
+  // Create closure
+  template <typename Params>
+  __device__ __host__ PerRequestAttention(const Params& params, uint32_t batch_idx,
+                                          uint8_t* smem_ptr)
+      : Base(params, batch_idx, smem_ptr) {
+    if constexpr (use_logits_soft_cap) {
+      const float logits_soft_cap = params.request_logits_soft_cap[batch_idx];
+      apply_soft_cap = logits_soft_cap > 0.f;
+      if (apply_soft_cap) {
+        this->soft_cap_pre_tanh_scale = params.sm_scale * math::ptx_rcp(logits_soft_cap);
+        this->sm_scale_log2 = math::log2e * logits_soft_cap;
+      } else {
+        this->sm_scale_log2 = (use_alibi ? 1.f : float(params.sm_scale)) * math::log2e;
+      }
+    }
+    if constexpr (use_sliding_window) {
+      const int32_t window_left = params.request_window_left[batch_idx];
+      this->window_left = (window_left >= 0) ? window_left : this->kv_len;
+    }
+  }
+
+  REGISTER_LOGITS_TRANSFORM(params, logits, batch_idx, qo_idx, kv_idx, qo_head_idx, kv_head_idx, {
+    if constexpr (use_alibi) {
+      logits = logits * params.sm_scale +
+               params.maybe_alibi_slopes[qo_head_idx] * float(int(kv_idx) - int(qo_idx));
+    }
+    if constexpr (use_logits_soft_cap) {
+      if (apply_soft_cap) {
+        logits = float(math::tanh(logits * this->soft_cap_pre_tanh_scale));
+      }
+    }
+    return logits;
+  })
+};
+
+// DefaultAttention with a segment (e.g. document of a packed sequence) mask, a query only
+// attends to the keys of the same segment, the segment ids are compared in the kernel
+// instead of being expanded into a [qo_len, kv_len] custom mask
+template <bool use_custom_mask, bool use_sliding_window, bool use_logits_soft_cap, bool use_alibi>
+struct SegmentAttention
+    : DefaultAttention<use_custom_mask, use_sliding_window, use_logits_soft_cap, use_alibi> {
+  using Base =
+      DefaultAttention<use_custom_mask, use_sliding_window, use_logits_soft_cap, use_alibi>;
+
+  int32_t* qo_segment_ids_ptr;
+  int32_t* kv_segment_ids_ptr;
+
+  // Create closure
+  template <typename Params>
+  __device__ __host__ SegmentAttention(const Params& params, uint32_t batch_idx,
+                                       uint8_t* smem_ptr)
+      : Base(params, batch_idx, smem_ptr) {
+    qo_segment_ids_ptr = params.qo_segment_ids + params.q_indptr[batch_idx];
+    kv_segment_ids_ptr = params.kv_segment_ids + params.kv_segment_indptr[batch_idx];
+  }
+
+  REGISTER_LOGITS_MASK(params, batch_idx, qo_idx, kv_idx, qo_head_idx, kv_head_idx, {
+    // the padded rows and columns of the last tiles are outside the segment ids
+    if (qo_idx >= this->qo_len || kv_idx >= this->kv_len) {
+      return false;
+    }
+    return Base::LogitsMask(params, batch_idx, qo_idx, kv_idx, qo_head_idx, kv_head_idx) &&
+           qo_segment_ids_ptr[qo_idx] == kv_segment_ids_ptr[kv_idx];
+  })
+};
+
 };  // namespace flashinfer
 
 #endif  // FLASHINFER_ATTENTION_VARIANTS_CUH_
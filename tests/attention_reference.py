@@ -0,0 +1,92 @@
+"""
+Copyright (c) 2025 by FlashInfer team.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Shared paged kv-cache builders and masked attention reference for the attention tests.
+"""
+
+import math
+
+import torch
+
+
+def get_indptr(lens, device="cpu"):
+    indptr = torch.zeros(len(lens) + 1, dtype=torch.int32)
+    indptr[1:] = torch.cumsum(torch.as_tensor(lens), 0)
+    return indptr.to(device)
+
+
+def make_paged_kv(
+    kv_lens,
+    page_size,
+    num_kv_heads,
+    head_dim,
+    kv_layout="NHD",
+    device="cpu",
+    num_spare_pages=3,
+):
+    # random page table over a cache with num_spare_pages unused pages, returns
+    # (kv_data, kv_indptr, kv_indices, kv_last_page_len) on device
+    num_pages = (kv_lens + page_size - 1) // page_size
+    kv_indptr = get_indptr(num_pages)
+    max_num_pages = kv_indptr[-1].item() + num_spare_pages
+    kv_indices = torch.randperm(max_num_pages)[: kv_indptr[-1].item()].int()
+    kv_last_page_len = ((kv_lens - 1) % page_size + 1).int()
+    if kv_layout == "NHD":
+        shape = (max_num_pages, 2, page_size, num_kv_heads, head_dim)
+    else:
+        shape = (max_num_pages, 2, num_kv_heads, page_size, head_dim)
+    return (
+        torch.randn(*shape, device=device),
+        kv_indptr.to(device),
+        kv_indices.to(device),
+        kv_last_page_len.to(device),
+    )
+
+
+def masked_attention_ref(q, k, v, mask):
+    # q: [qo_len, Hq, D], k: [kv_len, Hkv, D], v: [kv_len, Hkv, Dv], mask: [qo_len, kv_len]
+    # returns the output and the base-2 lse, fully masked rows have zero output
+    group_size = q.shape[1] // k.shape[1]
+    k = k.float().repeat_interleave(group_size, dim=1)
+    v = v.float().repeat_interleave(group_size, dim=1)
+    logits = torch.einsum("qhd,khd->hqk", q.float(), k) / math.sqrt(q.shape[-1])
+    logits = logits.masked_fill(~mask[None], float("-inf"))
+    lse = torch.logsumexp(logits, dim=-1)
+    p = torch.exp(logits - lse[..., None]).nan_to_num()
+    o = torch.einsum("hqk,khd->qhd", p, v)
+    return o, (lse * math.log2(math.e)).transpose(0, 1)
+
+
+def masked_attention_mass_ref(q, k, mask):
+    # the softmax mass of the keys under the [qo_len, kv_len] mask, summed over the
+    # queries and the query heads of each kv head, shape: [kv_len, Hkv]
+    num_kv_heads = k.shape[1]
+    group_size = q.shape[1] // num_kv_heads
+    k = k.float().repeat_interleave(group_size, dim=1)
+    logits = torch.einsum("qhd,khd->hqk", q.float(), k) / math.sqrt(q.shape[-1])
+    logits = logits.masked_fill(~mask[None], float("-inf"))
+    p = torch.softmax(logits, dim=-1).nan_to_num()
+    return p.view(num_kv_heads, -1, k.shape[0]).sum(dim=1).T
+
+
+def scatter_page_mass(masses, kv_indptr, kv_indices, page_size, max_num_pages):
+    # scatter the [kv_len, Hkv] mass of each request to the token slots of its pages,
+    # shape: [max_num_pages, page_size, Hkv]
+    out = torch.zeros(max_num_pages, page_size, masses[0].shape[1])
+    for i, mass in enumerate(masses):
+        pages = kv_indices[kv_indptr[i] : kv_indptr[i + 1]].long().cpu()
+        pos = torch.arange(mass.shape[0])
+        out.index_put_((pages[pos // page_size], pos % page_size), mass.cpu())
+    return out
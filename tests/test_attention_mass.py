@@ -0,0 +1,505 @@
+"""
+Copyright (c) 2025 by FlashInfer team.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import math
+import os
+
+import pytest
+import torch
+from attention_reference import (
+    get_indptr,
+    make_paged_kv,
+    masked_attention_mass_ref,
+    scatter_page_mass,
+)
+
+import flashinfer
+from flashinfer.torch_attention import (
+    accumulate_attention_mass_torch,
+    paged_attention_torch,
+)
+
+if torch.cuda.is_available():
+    device = "cuda:0"
+else:
+    device = "cpu"
+# the triton backend runs on CPU in the interpreter
+backends = ["torch"]
+if torch.cuda.is_available() or os.environ.get("TRITON_INTERPRET") == "1":
+    backends.append("triton")
+
+
+@pytest.mark.parametrize("page_size", [1, 5, 16])
+@pytest.mark.parametrize("causal", [False, True])
+@pytest.mark.parametrize("per_token", [False, True])
+@pytest.mark.parametrize("kv_layout", ["NHD", "HND"])
+def test_accumulate_attention_mass(page_size, causal, per_token, kv_layout):
+    torch.manual_seed(42)
+    num_qo_heads, num_kv_heads, head_dim = 4, 2, 32
+    kv_lens = torch.tensor([1, 17, 33, 64])
+    qo_lens = torch.tensor([1, 3, 1, 5])
+    qo_indptr = torch.zeros(len(qo_lens) + 1, dtype=torch.int32)
+    qo_indptr[1:] = torch.cumsum(qo_lens, 0)
+    kv_data, kv_indptr, kv_indices, kv_last_page_len = make_paged_kv(
+        kv_lens, page_size, num_kv_heads, head_dim, kv_layout, "cpu"
+    )
+    q = torch.randn(qo_indptr[-1].item(), num_qo_heads, head_dim)
+    _, lse = paged_attention_torch(
+        q,
+        kv_data,
+        qo_indptr,
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        kv_layout=kv_layout,
+        causal=causal,
+        return_lse=True,
+    )
+    max_num_pages = kv_data.shape[0]
+    if per_token:
+        attention_mass = torch.zeros(max_num_pages, page_size, num_kv_heads)
+    else:
+        attention_mass = torch.zeros(max_num_pages, num_kv_heads)
+    accumulate_attention_mass_torch(
+        attention_mass,
+        q,
+        kv_data,
+        lse,
+        qo_indptr,
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        kv_layout=kv_layout,
+        causal=causal,
+    )
+
+    # reference: explicit softmax per request, scattered to the token slots
+    k_cache = kv_data[:, 0] if kv_layout == "NHD" else kv_data[:, 0].transpose(1, 2)
+    mass_ref = torch.zeros(max_num_pages, page_size, num_kv_heads)
+    group_size = num_qo_heads // num_kv_heads
+    for i in range(len(kv_lens)):
+        kv_len, qo_len = kv_lens[i].item(), qo_lens[i].item()
+        pages = kv_indices[kv_indptr[i] : kv_indptr[i + 1]].long()
+        k = k_cache[pages].flatten(0, 1)[:kv_len]
+        q_i = q[qo_indptr[i] : qo_indptr[i + 1]]
+        for h in range(num_qo_heads):
+            logits = q_i[:, h] @ k[:, h // group_size].T / math.sqrt(head_dim)
+            if causal:
+                q_pos = torch.arange(kv_len - qo_len, kv_len)[:, None]
+                logits[torch.arange(kv_len)[None, :] > q_pos] = float("-inf")
+            p = torch.softmax(logits, dim=-1).sum(dim=0)
+            for j in range(kv_len):
+                mass_ref[pages[j // page_size], j % page_size, h // group_size] += p[j]
+    if not per_token:
+        mass_ref = mass_ref.sum(dim=1)
+    torch.testing.assert_close(attention_mass, mass_ref, rtol=1e-4, atol=1e-4)
+    # every query distributes a unit mass per query head
+    torch.testing.assert_close(
+        attention_mass.sum(), torch.tensor(float(qo_lens.sum() * num_qo_heads))
+    )
+
+
+@pytest.mark.parametrize("page_budget", [2, 3, 8])
+@pytest.mark.parametrize("num_sink_pages", [0, 1])
+def test_evict_low_mass_pages(page_budget, num_sink_pages):
+    torch.manual_seed(42)
+    num_pages = torch.tensor([1, 4, 9])
+    kv_indptr = torch.zeros(len(num_pages) + 1, dtype=torch.int32)
+    kv_indptr[1:] = torch.cumsum(num_pages, 0)
+    total = kv_indptr[-1].item()
+    kv_indices = torch.randperm(total + 3)[:total].int()
+    kv_last_page_len = torch.tensor([3, 1, 2], dtype=torch.int32)
+    attention_mass = torch.rand(total + 3, 2)
+
+    new_kv_indptr, new_kv_indices, new_last_page_len, released = (
+        flashinfer.evict_low_mass_pages(
+            attention_mass,
+            kv_indptr,
+            kv_indices,
+            kv_last_page_len,
+            page_budget,
+            num_sink_pages=num_sink_pages,
+        )
+    )
+    score = attention_mass.sum(dim=1)
+    released_ref = []
+    for i in range(len(num_pages)):
+        pages = kv_indices[kv_indptr[i] : kv_indptr[i + 1]].tolist()
+        pinned = set(pages[:num_sink_pages] + pages[-1:])
+        others = sorted(
+            (p for p in pages if p not in pinned), key=lambda p: -score[p].item()
+        )
+        kept = pinned | set(others[: max(page_budget - len(pinned), 0)])
+        kept_ref = [p for p in pages if p in kept]
+        released_ref += [p for p in pages if p not in kept]
+        kept_i = new_kv_indices[new_kv_indptr[i] : new_kv_indptr[i + 1]].tolist()
+        assert kept_i == kept_ref
+    assert sorted(released.tolist()) == sorted(released_ref)
+    torch.testing.assert_close(new_last_page_len, kv_last_page_len)
+
+
+def _get_request_kv(kv_data, kv_indptr, kv_indices, kv_lens, i):
+    pages = kv_indices[kv_indptr[i] : kv_indptr[i + 1]].long()
+    return kv_data[pages, 0].flatten(0, 1)[: kv_lens[i]]
+
+
+@pytest.mark.parametrize("backend", backends)
+@pytest.mark.parametrize("mask_mode", ["causal", "custom", "window"])
+@pytest.mark.parametrize("per_token", [False, True])
+def test_batch_prefill_attention_mass(backend, mask_mode, per_token):
+    # the mass is accumulated inside the attention loops, under all the masks
+    torch.manual_seed(42)
+    num_qo_heads, num_kv_heads, head_dim, page_size = 4, 2, 32, 4
+    qo_lens = torch.tensor([1, 7, 20])
+    kv_lens = torch.tensor([5, 30, 20])
+    qo_indptr = get_indptr(qo_lens)
+    kv_data, kv_indptr, kv_indices, kv_last_page_len = make_paged_kv(
+        kv_lens, page_size, num_kv_heads, head_dim
+    )
+    q = torch.randn(qo_indptr[-1].item(), num_qo_heads, head_dim)
+    custom_mask = torch.rand(int((qo_lens * kv_lens).sum())) > 0.3
+    window_left = torch.tensor([2, -1, 5], dtype=torch.int32)
+    masses_ref = []
+    mask_offset = 0
+    for i in range(len(kv_lens)):
+        qo_len, kv_len = qo_lens[i].item(), kv_lens[i].item()
+        q_pos = torch.arange(kv_len - qo_len, kv_len)[:, None]
+        kv_pos = torch.arange(kv_len)[None, :]
+        if mask_mode == "custom":
+            mask = custom_mask[mask_offset : mask_offset + qo_len * kv_len]
+            mask = mask.view(qo_len, kv_len)
+            mask_offset += qo_len * kv_len
+        else:
+            mask = kv_pos <= q_pos
+            if mask_mode == "window" and window_left[i] >= 0:
+                mask = mask & (kv_pos >= q_pos - window_left[i])
+        masses_ref.append(
+            masked_attention_mass_ref(
+                q[qo_indptr[i] : qo_indptr[i + 1]],
+                _get_request_kv(kv_data, kv_indptr, kv_indices, kv_lens, i),
+                mask,
+            )
+        )
+    mass_ref = scatter_page_mass(
+        masses_ref, kv_indptr, kv_indices, page_size, kv_data.shape[0]
+    )
+    if not per_token:
+        mass_ref = mass_ref.sum(dim=1)
+
+    wrapper = flashinfer.BatchPrefillWithPagedKVCacheWrapper(
+        torch.empty(32 * 1024 * 1024, dtype=torch.uint8, device=device),
+        backend=backend,
+    )
+    wrapper.plan(
+        qo_indptr.to(device),
+        kv_indptr.to(device),
+        kv_indices.to(device),
+        kv_last_page_len.to(device),
+        num_qo_heads,
+        num_kv_heads,
+        head_dim,
+        page_size,
+        causal=True,
+        custom_mask=custom_mask.to(device) if mask_mode == "custom" else None,
+        window_left=window_left if mask_mode == "window" else -1,
+        q_data_type=torch.float32,
+    )
+    attention_mass = torch.zeros(mass_ref.shape, device=device)
+    wrapper.run(q.to(device), kv_data.to(device), attention_mass=attention_mass)
+    torch.testing.assert_close(attention_mass.cpu(), mass_ref, rtol=1e-4, atol=1e-4)
+
+
+@pytest.mark.parametrize("backend", backends)
+@pytest.mark.parametrize("per_token", [False, True])
+def test_batch_prefill_attention_mass_segment_ids(backend, per_token):
+    # packed sequences: the mass only goes to the keys of the segment of each query
+    torch.manual_seed(42)
+    num_qo_heads, num_kv_heads, head_dim, page_size = 4, 2, 32, 4
+    qo_lens = torch.tensor([6, 17])
+    kv_lens = torch.tensor([10, 17])
+    qo_indptr = get_indptr(qo_lens)
+    kv_data, kv_indptr, kv_indices, kv_last_page_len = make_paged_kv(
+        kv_lens, page_size, num_kv_heads, head_dim
+    )
+    q = torch.randn(qo_indptr[-1].item(), num_qo_heads, head_dim)
+    kv_segment_ids = torch.cat(
+        [torch.sort(torch.randint(0, 3, (n,)))[0] for n in kv_lens.tolist()]
+    ).int()
+    kv_segment_indptr = get_indptr(kv_lens)
+    qo_segment_ids = torch.cat(
+        [
+            kv_segment_ids[
+                kv_segment_indptr[i + 1] - qo_lens[i] : kv_segment_indptr[i + 1]
+            ]
+            for i in range(len(qo_lens))
+        ]
+    )
+    masses_ref = []
+    for i in range(len(kv_lens)):
+        qo_len, kv_len = qo_lens[i].item(), kv_lens[i].item()
+        q_pos = torch.arange(kv_len - qo_len, kv_len)[:, None]
+        kv_seg = kv_segment_ids[kv_segment_indptr[i] : kv_segment_indptr[i + 1]]
+        qo_seg = qo_segment_ids[qo_indptr[i] : qo_indptr[i + 1]]
+        mask = (torch.arange(kv_len)[None, :] <= q_pos) & (
+            qo_seg[:, None] == kv_seg[None, :]
+        )
+        masses_ref.append(
+            masked_attention_mass_ref(
+                q[qo_indptr[i] : qo_indptr[i + 1]],
+                _get_request_kv(kv_data, kv_indptr, kv_indices, kv_lens, i),
+                mask,
+            )
+        )
+    mass_ref = scatter_page_mass(
+        masses_ref, kv_indptr, kv_indices, page_size, kv_data.shape[0]
+    )
+    if not per_token:
+        mass_ref = mass_ref.sum(dim=1)
+
+    wrapper = flashinfer.BatchPrefillWithPagedKVCacheWrapper(
+        torch.empty(32 * 1024 * 1024, dtype=torch.uint8, device=device),
+        backend=backend,
+    )
+    wrapper.plan(
+        qo_indptr.to(device),
+        kv_indptr.to(device),
+        kv_indices.to(device),
+        kv_last_page_len.to(device),
+        num_qo_heads,
+        num_kv_heads,
+        head_dim,
+        page_size,
+        causal=True,
+        q_data_type=torch.float32,
+        qo_segment_ids=qo_segment_ids.to(device),
+        kv_segment_ids=kv_segment_ids.to(device),
+    )
+    attention_mass = torch.zeros(mass_ref.shape, device=device)
+    _, lse = wrapper.run(
+        q.to(device), kv_data.to(device), attention_mass=attention_mass, return_lse=True
+    )
+    torch.testing.assert_close(attention_mass.cpu(), mass_ref, rtol=1e-4, atol=1e-4)
+    # the torch reference with the segment ids
+    mass = torch.zeros(mass_ref.shape)
+    accumulate_attention_mass_torch(
+        mass,
+        q,
+        kv_data,
+        lse.cpu(),
+        qo_indptr,
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        qo_segment_ids=qo_segment_ids,
+        kv_segment_ids=kv_segment_ids,
+    )
+    torch.testing.assert_close(mass, mass_ref, rtol=1e-4, atol=1e-4)
+
+
+@pytest.mark.parametrize("backend", backends)
+@pytest.mark.parametrize("per_token", [False, True])
+def test_batch_prefill_attention_mass_prefix_lm(backend, per_token):
+    # the keys of the prefix are visible to all the queries of the request
+    torch.manual_seed(42)
+    num_qo_heads, num_kv_heads, head_dim, page_size = 4, 2, 32, 4
+    qo_lens = torch.tensor([6, 17, 3])
+    kv_lens = torch.tensor([10, 17, 20])
+    prefix_len = torch.tensor([8, 5, 0], dtype=torch.int32)
+    qo_indptr = get_indptr(qo_lens)
+    kv_data, kv_indptr, kv_indices, kv_last_page_len = make_paged_kv(
+        kv_lens, page_size, num_kv_heads, head_dim
+    )
+    q = torch.randn(qo_indptr[-1].item(), num_qo_heads, head_dim)
+    masses_ref = []
+    for i in range(len(kv_lens)):
+        qo_len, kv_len = qo_lens[i].item(), kv_lens[i].item()
+        q_pos = torch.arange(kv_len - qo_len, kv_len)[:, None]
+        kv_pos = torch.arange(kv_len)[None, :]
+        mask = (kv_pos <= q_pos) | (kv_pos < prefix_len[i])
+        masses_ref.append(
+            masked_attention_mass_ref(
+                q[qo_indptr[i] : qo_indptr[i + 1]],
+                _get_request_kv(kv_data, kv_indptr, kv_indices, kv_lens, i),
+                mask,
+            )
+        )
+    mass_ref = scatter_page_mass(
+        masses_ref, kv_indptr, kv_indices, page_size, kv_data.shape[0]
+    )
+    if not per_token:
+        mass_ref = mass_ref.sum(dim=1)
+
+    wrapper = flashinfer.BatchPrefillWithPagedKVCacheWrapper(
+        torch.empty(32 * 1024 * 1024, dtype=torch.uint8, device=device),
+        backend=backend,
+    )
+    wrapper.plan(
+        qo_indptr.to(device),
+        kv_indptr.to(device),
+        kv_indices.to(device),
+        kv_last_page_len.to(device),
+        num_qo_heads,
+        num_kv_heads,
+        head_dim,
+        page_size,
+        causal=True,
+        q_data_type=torch.float32,
+        prefix_len=prefix_len,
+    )
+    attention_mass = torch.zeros(mass_ref.shape, device=device)
+    _, lse = wrapper.run(
+        q.to(device), kv_data.to(device), attention_mass=attention_mass, return_lse=True
+    )
+    torch.testing.assert_close(attention_mass.cpu(), mass_ref, rtol=1e-4, atol=1e-4)
+    # the torch reference with the prefix lengths
+    mass = torch.zeros(mass_ref.shape)
+    accumulate_attention_mass_torch(
+        mass,
+        q,
+        kv_data,
+        lse.cpu(),
+        qo_indptr,
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        prefix_len=prefix_len,
+    )
+    torch.testing.assert_close(mass, mass_ref, rtol=1e-4, atol=1e-4)
+
+
+@pytest.mark.parametrize("backend", backends)
+@pytest.mark.parametrize("use_window", [False, True])
+@pytest.mark.parametrize("per_token", [False, True])
+def test_batch_decode_attention_mass(backend, use_window, per_token):
+    torch.manual_seed(42)
+    num_qo_heads, num_kv_heads, head_dim, page_size = 8, 2, 32, 4
+    kv_lens = torch.tensor([7, 33, 100])
+    kv_data, kv_indptr, kv_indices, kv_last_page_len = make_paged_kv(
+        kv_lens, page_size, num_kv_heads, head_dim
+    )
+    q = torch.randn(len(kv_lens), num_qo_heads, head_dim)
+    window_left = torch.tensor([-1, 5, 20], dtype=torch.int32)
+    masses_ref = []
+    for i in range(len(kv_lens)):
+        mask = torch.ones(1, kv_lens[i].item(), dtype=torch.bool)
+        if use_window and window_left[i] >= 0:
+            mask[:, : kv_lens[i] - 1 - window_left[i]] = False
+        masses_ref.append(
+            masked_attention_mass_ref(
+                q[i : i + 1],
+                _get_request_kv(kv_data, kv_indptr, kv_indices, kv_lens, i),
+                mask,
+            )
+        )
+    mass_ref = scatter_page_mass(
+        masses_ref, kv_indptr, kv_indices, page_size, kv_data.shape[0]
+    )
+    if not per_token:
+        mass_ref = mass_ref.sum(dim=1)
+
+    wrapper = flashinfer.BatchDecodeWithPagedKVCacheWrapper(
+        torch.empty(32 * 1024 * 1024, dtype=torch.uint8, device=device),
+        backend=backend,
+    )
+    wrapper.plan(
+        kv_indptr.to(device),
+        kv_indices.to(device),
+        kv_last_page_len.to(device),
+        num_qo_heads,
+        num_kv_heads,
+        head_dim,
+        page_size,
+        window_left=window_left if use_window else -1,
+        q_data_type=torch.float32,
+    )
+    attention_mass = torch.zeros(mass_ref.shape, device=device)
+    wrapper.run(q.to(device), kv_data.to(device), attention_mass=attention_mass)
+    torch.testing.assert_close(attention_mass.cpu(), mass_ref, rtol=1e-4, atol=1e-4)
+
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason="requires CUDA")
+def test_batch_decode_attention_mass_cuda_backend():
+    # the CUDA kernels do not accumulate the mass, it is not recomputed after them
+    num_qo_heads, num_kv_heads, head_dim, page_size = 8, 2, 128, 16
+    kv_lens = torch.tensor([7, 33])
+    kv_data, kv_indptr, kv_indices, kv_last_page_len = make_paged_kv(
+        kv_lens, page_size, num_kv_heads, head_dim, device="cuda:0"
+    )
+    wrapper = flashinfer.BatchDecodeWithPagedKVCacheWrapper(
+        torch.empty(32 * 1024 * 1024, dtype=torch.uint8, device="cuda:0"), "NHD"
+    )
+    wrapper.plan(
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        num_qo_heads,
+        num_kv_heads,
+        head_dim,
+        page_size,
+        data_type=torch.float16,
+    )
+    q = torch.randn(len(kv_lens), num_qo_heads, head_dim, device="cuda:0").half()
+    attention_mass = torch.zeros(kv_data.shape[0], num_kv_heads, device="cuda:0")
+    with pytest.raises(ValueError, match="torch and triton"):
+        wrapper.run(q, kv_data.half(), attention_mass=attention_mass)
+
+
+@pytest.mark.parametrize("kv_layout", ["NHD", "HND"])
+def test_batch_decode_torch_backend_attention_mass_page_scale(kv_layout):
+    torch.manual_seed(42)
+    num_qo_heads, num_kv_heads, head_dim, page_size = 4, 2, 32, 4
+    kv_lens = torch.tensor([3, 17, 9])
+    kv_data, kv_indptr, kv_indices, kv_last_page_len = make_paged_kv(
+        kv_lens, page_size, num_kv_heads, head_dim, kv_layout, "cpu"
+    )
+    kv_int8 = (kv_data * 40).round().clamp(-127, 127).to(torch.int8)
+    k_scale = torch.rand(kv_data.shape[0], num_kv_heads) / 40 + 0.01
+    v_scale = torch.rand(kv_data.shape[0], num_kv_heads) / 40 + 0.01
+    k_ref, v_ref = flashinfer.page._dequantize_paged_kv_cache(
+        kv_int8[:, 0],
+        kv_int8[:, 1],
+        k_scale,
+        v_scale,
+        torch.arange(kv_data.shape[0]),
+        kv_layout,
+        torch.float32,
+    )[:2]
+    q = torch.randn(len(kv_lens), num_qo_heads, head_dim)
+    masses = []
+    # the quantized cache with per-page scales and its dequantized copy
+    for kv_cache, kv_data_type, scales in [
+        (kv_int8, torch.int8, dict(k_scale=k_scale, v_scale=v_scale)),
+        ((k_ref, v_ref), torch.float32, dict()),
+    ]:
+        wrapper = flashinfer.BatchDecodeWithPagedKVCacheWrapper(
+            torch.empty(0, dtype=torch.uint8), kv_layout=kv_layout, backend="torch"
+        )
+        wrapper.plan(
+            kv_indptr,
+            kv_indices,
+            kv_last_page_len,
+            num_qo_heads,
+            num_kv_heads,
+            head_dim,
+            page_size,
+            q_data_type=torch.float32,
+            kv_data_type=kv_data_type,
+        )
+        mass = torch.zeros(kv_data.shape[0], num_kv_heads)
+        wrapper.run(q, kv_cache, attention_mass=mass, **scales)
+        masses.append(mass)
+    torch.testing.assert_close(masses[0], masses[1], rtol=1e-4, atol=1e-4)
+    assert masses[0].sum() > 0
@@ -0,0 +1,71 @@
+"""
+Copyright (c) 2025 by FlashInfer team.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import pytest
+import torch
+
+import flashinfer
+from flashinfer.prefill import _compute_page_mask_indptr
+
+
+@pytest.mark.parametrize("page_size", [1, 4, 16])
+@pytest.mark.parametrize("device", ["cpu", "cuda:0"])
+def test_batch_metadata(page_size, device):
+    if device != "cpu" and not torch.cuda.is_available():
+        pytest.skip("cuda is not available")
+    qo_lens = torch.tensor([3, 1, 0, 17, 5])
+    kv_lens = torch.tensor([7, 1, 9, 17, 64])
+    metadata = flashinfer.BatchMetadata(qo_lens, kv_lens, page_size=page_size)
+
+    qo_indptr = torch.zeros(len(qo_lens) + 1, dtype=torch.int32)
+    qo_indptr[1:] = torch.cumsum(qo_lens, 0)
+    kv_page_indptr = torch.zeros(len(kv_lens) + 1, dtype=torch.int32)
+    kv_page_indptr[1:] = torch.cumsum((kv_lens + page_size - 1) // page_size, 0)
+    kv_last_page_len = (kv_lens - 1) % page_size + 1
+    kv_last_page_len_d, kv_page_indptr_d = metadata.get_tensors(
+        ["kv_last_page_len", "kv_page_indptr"], device
+    )
+    assert kv_page_indptr_d.device == torch.device(device)
+    assert torch.equal(kv_page_indptr_d.cpu(), kv_page_indptr)
+    assert torch.equal(kv_last_page_len_d.cpu(), kv_last_page_len.int())
+    assert torch.equal(metadata.get("qo_indptr", device).cpu(), qo_indptr)
+    assert torch.equal(
+        flashinfer.get_seq_lens(kv_page_indptr, kv_last_page_len, page_size),
+        kv_lens,
+    )
+    assert torch.equal(
+        metadata.get("mask_indptr", device).cpu(),
+        _compute_page_mask_indptr(
+            qo_indptr, kv_page_indptr, kv_last_page_len, page_size
+        ),
+    )
+    # device tensors are cached
+    assert metadata.get("qo_indptr", device) is metadata.get("qo_indptr", device)
+
+    batch_indices, positions = metadata.batch_indices_positions(device)
+    ref_batch_indices, ref_positions = flashinfer.get_batch_indices_positions(
+        qo_indptr, kv_lens, metadata.nnz_qo
+    )
+    assert torch.equal(batch_indices.cpu(), ref_batch_indices)
+    assert torch.equal(positions.cpu(), ref_positions)
+
+
+def test_batch_metadata_invalid():
+    with pytest.raises(ValueError):
+        flashinfer.BatchMetadata([1, 2], [3])
+    metadata = flashinfer.BatchMetadata([1, 2], [3, 4])
+    with pytest.raises(KeyError):
+        metadata.get("kv_indices")
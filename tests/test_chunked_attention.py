@@ -0,0 +1,398 @@
+"""
+Copyright (c) 2025 by FlashInfer team.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import math
+
+import pytest
+import torch
+from attention_reference import get_indptr, make_paged_kv, masked_attention_ref
+
+import flashinfer
+from flashinfer.page import _drop_unread_pages, _split_chunked_paged_kv
+from flashinfer.prefill import _get_per_request_window_mask, _split_chunked_ragged_kv
+from flashinfer.torch_attention import paged_attention_torch
+
+
+def _chunked_mask(qo_len, kv_len, chunk_size, causal):
+    q_pos = torch.arange(kv_len - qo_len, kv_len)[:, None]
+    kv_pos = torch.arange(kv_len)[None, :]
+    mask = kv_pos // chunk_size == q_pos // chunk_size
+    if causal:
+        mask &= kv_pos <= q_pos
+    return mask
+
+
+@pytest.mark.parametrize("causal", [False, True])
+def test_paged_attention_torch_chunked(causal):
+    torch.manual_seed(42)
+    qo_len, kv_len, num_heads, head_dim, chunk_size = 20, 45, 2, 32, 16
+    q = torch.randn(qo_len, num_heads, head_dim)
+    kv_data = torch.randn(kv_len, 2, 1, num_heads, head_dim)
+    o = paged_attention_torch(
+        q,
+        kv_data,
+        torch.tensor([0, qo_len]),
+        torch.tensor([0, kv_len]),
+        torch.arange(kv_len),
+        torch.tensor([1]),
+        causal=causal,
+        chunk_size=chunk_size,
+    )
+    mask = _chunked_mask(qo_len, kv_len, chunk_size, causal)
+    k = kv_data[:, 0, 0].float()
+    v = kv_data[:, 1, 0].float()
+    logits = torch.einsum("qhd,khd->hqk", q, k) / math.sqrt(head_dim)
+    p = torch.softmax(logits.masked_fill(~mask[None], float("-inf")), dim=-1)
+    o_ref = torch.einsum("hqk,khd->qhd", p, v)
+    torch.testing.assert_close(o, o_ref, rtol=1e-4, atol=1e-4)
+
+
+def test_drop_unread_chunk_pages():
+    kv_lens = torch.tensor([40, 7, 64, 65])
+    qo_lens = torch.tensor([1, 7, 10, 33])
+    page_size, chunk_size = 4, 16
+    num_pages = (kv_lens + page_size - 1) // page_size
+    kv_indptr = get_indptr(num_pages)
+    kv_indices = torch.arange(kv_indptr[-1].item(), dtype=torch.int32)
+    kv_last_page_len = ((kv_lens - 1) % page_size + 1).int()
+    new_indptr, new_indices, kv_offsets = _drop_unread_pages(
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        page_size,
+        qo_lens,
+        chunk_size=chunk_size,
+    )
+    # the chunks of the first queries begin at 32, 0, 48 and 32
+    assert kv_offsets.tolist() == [32, 0, 48, 32]
+    num_dropped = (kv_offsets // page_size).long()
+    assert torch.equal(new_indptr, get_indptr(num_pages - num_dropped))
+    expected = torch.cat(
+        [
+            kv_indices[kv_indptr[i] + num_dropped[i] : kv_indptr[i + 1]]
+            for i in range(len(kv_lens))
+        ]
+    )
+    assert torch.equal(new_indices, expected)
+
+
+def test_chunked_window_mask():
+    qo_lens = torch.tensor([5, 12])
+    kv_lens = torch.tensor([20, 30])
+    chunk_offset = torch.tensor([8, 0])
+    mask = _get_per_request_window_mask(
+        qo_lens,
+        kv_lens,
+        -1,
+        True,
+        None,
+        torch.device("cpu"),
+        chunk_size=12,
+        chunk_offset=chunk_offset,
+    )
+    expected = []
+    for qo_len, kv_len, offset in zip(qo_lens.tolist(), kv_lens.tolist(), [8, 0]):
+        full = _chunked_mask(qo_len, kv_len + offset, 12, True)
+        expected.append(full[:, offset:].flatten())
+    assert torch.equal(mask, torch.cat(expected))
+
+
+@pytest.mark.parametrize("page_size", [1, 5, 16])
+@pytest.mark.parametrize("chunk_size", [8, 12, 64])
+@pytest.mark.parametrize("causal", [False, True])
+def test_split_chunked_paged_kv(page_size, chunk_size, causal):
+    torch.manual_seed(42)
+    num_kv_heads, num_qo_heads, head_dim = 2, 4, 16
+    qo_lens = torch.tensor([30, 1, 17, 64, 5])
+    kv_lens = torch.tensor([30, 100, 77, 130, 5])
+    qo_indptr = get_indptr(qo_lens)
+    kv_data, kv_indptr, kv_indices, kv_last_page_len = make_paged_kv(
+        kv_lens, page_size, num_kv_heads, head_dim
+    )
+    q = torch.randn(qo_indptr[-1].item(), num_qo_heads, head_dim)
+    o_ref = paged_attention_torch(
+        q,
+        kv_data,
+        qo_indptr,
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        causal=causal,
+        chunk_size=chunk_size,
+    )
+    (
+        sub_qo_indptr,
+        sub_kv_indptr,
+        sub_kv_indices,
+        sub_last_page_len,
+        chunk_offset,
+        request,
+    ) = _split_chunked_paged_kv(
+        qo_indptr, kv_indptr, kv_indices, kv_last_page_len, page_size, chunk_size
+    )
+    assert torch.equal(sub_qo_indptr[-1], qo_indptr[-1])
+    assert torch.equal(torch.unique(request), torch.arange(len(qo_lens)))
+    sub_qo_lens = sub_qo_indptr[1:] - sub_qo_indptr[:-1]
+    sub_kv_lens = (
+        sub_kv_indptr[1:] - sub_kv_indptr[:-1] - 1
+    ) * page_size + sub_last_page_len
+    # sub-requests read at most the pages of their chunk
+    assert (sub_kv_lens <= chunk_size + page_size - 1).all()
+    if chunk_size % page_size == 0:
+        o = paged_attention_torch(
+            q,
+            kv_data,
+            sub_qo_indptr,
+            sub_kv_indptr,
+            sub_kv_indices,
+            sub_last_page_len,
+            causal=causal,
+        )
+    else:
+        # the head of the first page of each sub-request is masked
+        mask = _get_per_request_window_mask(
+            sub_qo_lens,
+            sub_kv_lens,
+            -1,
+            causal,
+            None,
+            torch.device("cpu"),
+            chunk_size=chunk_size,
+            chunk_offset=chunk_offset,
+        )
+        o, mask_offset = [], 0
+        for i in range(len(sub_qo_lens)):
+            qo_len, kv_len = sub_qo_lens[i].item(), sub_kv_lens[i].item()
+            pages = sub_kv_indices[sub_kv_indptr[i] : sub_kv_indptr[i + 1]].long()
+            k = kv_data[pages, 0].reshape(-1, num_kv_heads, head_dim)[:kv_len]
+            v = kv_data[pages, 1].reshape(-1, num_kv_heads, head_dim)[:kv_len]
+            m = mask[mask_offset : mask_offset + qo_len * kv_len]
+            mask_offset += qo_len * kv_len
+            o_i, _ = masked_attention_ref(
+                q[sub_qo_indptr[i] : sub_qo_indptr[i + 1]],
+                k,
+                v,
+                m.view(qo_len, kv_len),
+            )
+            o.append(o_i)
+        o = torch.cat(o)
+    torch.testing.assert_close(o, o_ref, rtol=1e-4, atol=1e-4)
+
+
+@pytest.mark.parametrize("chunk_size", [8, 12, 64])
+@pytest.mark.parametrize("causal", [False, True])
+def test_split_chunked_ragged_kv(chunk_size, causal):
+    torch.manual_seed(42)
+    num_kv_heads, num_qo_heads, head_dim = 2, 4, 16
+    qo_lens = torch.tensor([30, 1, 17, 64, 5])
+    kv_lens = torch.tensor([30, 100, 77, 130, 5])
+    qo_indptr = get_indptr(qo_lens)
+    kv_indptr = get_indptr(kv_lens)
+    num_tokens = kv_indptr[-1].item()
+    # a ragged kv is a paged kv with page_size 1 and identity page table
+    kv_data = torch.randn(num_tokens, 2, 1, num_kv_heads, head_dim)
+    kv_indices = torch.arange(num_tokens, dtype=torch.int32)
+    q = torch.randn(qo_indptr[-1].item(), num_qo_heads, head_dim)
+    o_ref = paged_attention_torch(
+        q,
+        kv_data,
+        qo_indptr,
+        kv_indptr,
+        kv_indices,
+        torch.ones(len(qo_lens), dtype=torch.int32),
+        causal=causal,
+        chunk_size=chunk_size,
+    )
+    sub_qo_indptr, sub_kv_indptr, request = _split_chunked_ragged_kv(
+        qo_indptr, kv_indptr, chunk_size
+    )
+    assert torch.equal(torch.unique(request), torch.arange(len(qo_lens)))
+    # sub-requests with queries read only their chunk, the others are fillers
+    has_qo = sub_qo_indptr[1:] > sub_qo_indptr[:-1]
+    assert (sub_kv_indptr[1:] - sub_kv_indptr[:-1] <= chunk_size)[has_qo].all()
+    o = paged_attention_torch(
+        q,
+        kv_data,
+        sub_qo_indptr,
+        sub_kv_indptr,
+        kv_indices,
+        torch.ones(len(request), dtype=torch.int32),
+        causal=causal,
+    )
+    torch.testing.assert_close(o, o_ref, rtol=1e-4, atol=1e-4)
+
+
+@pytest.mark.parametrize("page_size", [1, 16])
+@pytest.mark.parametrize("chunk_size", [8, 24, 64])
+@pytest.mark.parametrize("causal", [False, True])
+@pytest.mark.parametrize("pos_encoding_mode", ["NONE", "ROPE_LLAMA", "ALIBI"])
+def test_batch_prefill_torch_backend_chunked(
+    page_size, chunk_size, causal, pos_encoding_mode
+):
+    torch.manual_seed(42)
+    num_qo_heads, num_kv_heads, head_dim = 4, 2, 32
+    qo_lens = torch.tensor([30, 1, 17, 64])
+    kv_lens = torch.tensor([30, 100, 77, 130])
+    qo_indptr = get_indptr(qo_lens)
+    kv_data, kv_indptr, kv_indices, kv_last_page_len = make_paged_kv(
+        kv_lens, page_size, num_kv_heads, head_dim
+    )
+    q = torch.randn(qo_indptr[-1].item(), num_qo_heads, head_dim)
+    wrapper = flashinfer.BatchPrefillWithPagedKVCacheWrapper(
+        torch.empty(0, dtype=torch.uint8), backend="torch"
+    )
+    wrapper.plan(
+        qo_indptr,
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        num_qo_heads,
+        num_kv_heads,
+        head_dim,
+        page_size,
+        causal=causal,
+        pos_encoding_mode=pos_encoding_mode,
+        q_data_type=torch.float32,
+        chunk_size=chunk_size,
+    )
+    # the pages before the chunk of the first query are dropped
+    first_pos = kv_lens - qo_lens
+    num_dropped = first_pos // chunk_size * chunk_size // page_size
+    assert torch.equal(
+        wrapper._paged_kv_indptr_buf.cpu(),
+        get_indptr((kv_indptr[1:] - kv_indptr[:-1]) - num_dropped),
+    )
+    o, lse = wrapper.run(q, kv_data, return_lse=True)
+    o_ref, lse_ref = paged_attention_torch(
+        q,
+        kv_data,
+        qo_indptr,
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        causal=causal,
+        pos_encoding_mode=pos_encoding_mode,
+        chunk_size=chunk_size,
+        return_lse=True,
+    )
+    torch.testing.assert_close(o, o_ref, rtol=1e-4, atol=1e-4)
+    torch.testing.assert_close(lse, lse_ref, rtol=1e-4, atol=1e-4)
+
+
+def test_batch_prefill_ragged_torch_backend_chunked():
+    torch.manual_seed(42)
+    num_qo_heads, num_kv_heads, head_dim, chunk_size = 4, 4, 32, 16
+    qo_lens = torch.tensor([30, 1, 17])
+    kv_lens = torch.tensor([30, 100, 77])
+    qo_indptr = get_indptr(qo_lens)
+    kv_indptr = get_indptr(kv_lens)
+    q = torch.randn(qo_indptr[-1].item(), num_qo_heads, head_dim)
+    kv_data = torch.randn(kv_indptr[-1].item(), 2, 1, num_kv_heads, head_dim)
+    wrapper = flashinfer.BatchPrefillWithRaggedKVCacheWrapper(
+        torch.empty(0, dtype=torch.uint8), backend="torch"
+    )
+    wrapper.plan(
+        qo_indptr,
+        kv_indptr,
+        num_qo_heads,
+        num_kv_heads,
+        head_dim,
+        causal=True,
+        q_data_type=torch.float32,
+        chunk_size=chunk_size,
+    )
+    o = wrapper.run(q, kv_data[:, 0, 0], kv_data[:, 1, 0])
+    o_ref = paged_attention_torch(
+        q,
+        kv_data,
+        qo_indptr,
+        kv_indptr,
+        torch.arange(kv_indptr[-1].item()),
+        torch.ones(len(kv_lens), dtype=torch.int32),
+        chunk_size=chunk_size,
+    )
+    torch.testing.assert_close(o, o_ref, rtol=1e-4, atol=1e-4)
+
+
+@pytest.mark.parametrize("page_size", [1, 16])
+@pytest.mark.parametrize("chunk_size", [8, 24, 64])
+@pytest.mark.parametrize("window_left", [-1, 5])
+def test_batch_decode_torch_backend_chunked(page_size, chunk_size, window_left):
+    torch.manual_seed(42)
+    num_qo_heads, num_kv_heads, head_dim = 4, 2, 32
+    kv_lens = torch.tensor([1, 24, 25, 100, 130])
+    kv_data, kv_indptr, kv_indices, kv_last_page_len = make_paged_kv(
+        kv_lens, page_size, num_kv_heads, head_dim
+    )
+    q = torch.randn(len(kv_lens), num_qo_heads, head_dim)
+    wrapper = flashinfer.BatchDecodeWithPagedKVCacheWrapper(
+        torch.empty(0, dtype=torch.uint8), backend="torch"
+    )
+    wrapper.plan(
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        num_qo_heads,
+        num_kv_heads,
+        head_dim,
+        page_size,
+        window_left=window_left,
+        q_data_type=torch.float32,
+        chunk_size=chunk_size,
+    )
+    num_dropped = (kv_lens - 1) // chunk_size * chunk_size // page_size
+    assert len(wrapper._paged_kv_indices_buf) == len(kv_indices) - num_dropped.sum()
+    o, lse = wrapper.run(q, kv_data, return_lse=True)
+    o_ref, lse_ref = paged_attention_torch(
+        q,
+        kv_data,
+        torch.arange(len(kv_lens) + 1),
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        causal=False,
+        window_left=window_left,
+        chunk_size=chunk_size,
+        return_lse=True,
+    )
+    torch.testing.assert_close(o, o_ref, rtol=1e-4, atol=1e-4)
+    torch.testing.assert_close(lse, lse_ref, rtol=1e-4, atol=1e-4)
+
+
+def test_chunked_attention_invalid_args():
+    wrapper = flashinfer.BatchPrefillWithPagedKVCacheWrapper(
+        torch.empty(0, dtype=torch.uint8), backend="torch"
+    )
+    args = (
+        torch.tensor([0, 4], dtype=torch.int32),
+        torch.tensor([0, 1], dtype=torch.int32),
+        torch.tensor([0], dtype=torch.int32),
+        torch.tensor([4], dtype=torch.int32),
+        4,
+        4,
+        64,
+        16,
+    )
+    with pytest.raises(ValueError):
+        wrapper.plan(*args, causal=True, chunk_size=-1)
+    with pytest.raises(ValueError):
+        wrapper.plan(*args, causal=True, chunk_size=8, prefix_len=2)
+    with pytest.raises(ValueError):
+        wrapper.plan(
+            *args,
+            custom_mask=torch.ones(16, dtype=torch.bool),
+            chunk_size=8,
+        )
@@ -0,0 +1,102 @@
+"""
+Copyright (c) 2025 by FlashInfer team.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import math
+
+import pytest
+import torch
+
+import flashinfer
+from flashinfer.torch_attention import headwise_paged_decode_attention_torch
+
+
+def _make_headwise_paged_kv(kv_lens, page_size, head_dim, device):
+    # kv_lens: [batch_size, num_kv_heads]
+    kv_lens = kv_lens.view(-1)
+    num_pages = (kv_lens + page_size - 1) // page_size
+    kv_indptr = torch.zeros(len(kv_lens) + 1, dtype=torch.int32)
+    kv_indptr[1:] = torch.cumsum(num_pages, 0)
+    max_num_pages = kv_indptr[-1].item()
+    kv_indices = torch.randperm(max_num_pages).int()
+    kv_last_page_len = ((kv_lens - 1) % page_size + 1).int()
+    kv_data = torch.randn(max_num_pages, 2, page_size, 1, head_dim, device=device)
+    return kv_data, kv_indptr, kv_indices, kv_last_page_len
+
+
+@pytest.mark.parametrize("page_size", [1, 6])
+@pytest.mark.parametrize("num_kv_heads", [1, 4])
+def test_headwise_paged_decode_attention_torch(page_size, num_kv_heads):
+    torch.manual_seed(42)
+    batch_size, group_size, head_dim = 3, 2, 16
+    num_qo_heads = num_kv_heads * group_size
+    kv_lens = torch.randint(1, 40, (batch_size, num_kv_heads))
+    kv_data, kv_indptr, kv_indices, kv_last_page_len = _make_headwise_paged_kv(
+        kv_lens, page_size, head_dim, "cpu"
+    )
+    q = torch.randn(batch_size, num_qo_heads, head_dim)
+    o, lse = headwise_paged_decode_attention_torch(
+        q, kv_data, kv_indptr, kv_indices, kv_last_page_len, return_lse=True
+    )
+    for i in range(batch_size):
+        for h in range(num_qo_heads):
+            pair = i * num_kv_heads + h // group_size
+            pages = kv_indices[kv_indptr[pair] : kv_indptr[pair + 1]].long()
+            kv_len = kv_lens[i, h // group_size].item()
+            k = kv_data[pages, 0, :, 0].reshape(-1, head_dim)[:kv_len]
+            v = kv_data[pages, 1, :, 0].reshape(-1, head_dim)[:kv_len]
+            logits = k @ q[i, h] / math.sqrt(head_dim)
+            o_ref = torch.softmax(logits, dim=0) @ v
+            torch.testing.assert_close(o[i, h], o_ref, rtol=1e-4, atol=1e-4)
+            torch.testing.assert_close(
+                lse[i, h],
+                torch.logsumexp(logits, dim=0) * math.log2(math.e),
+                rtol=1e-4,
+                atol=1e-4,
+            )
+
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason="requires CUDA")
+@pytest.mark.parametrize("page_size", [1, 16])
+@pytest.mark.parametrize("use_tensor_cores", [False, True])
+def test_batch_decode_headwise(page_size, use_tensor_cores):
+    torch.manual_seed(42)
+    batch_size, num_kv_heads, group_size, head_dim = 5, 4, 4, 128
+    num_qo_heads = num_kv_heads * group_size
+    kv_lens = torch.randint(1, 300, (batch_size, num_kv_heads))
+    kv_data, kv_indptr, kv_indices, kv_last_page_len = _make_headwise_paged_kv(
+        kv_lens, page_size, head_dim, "cuda:0"
+    )
+    kv_data = kv_data.half()
+    q = torch.randn(batch_size, num_qo_heads, head_dim, device="cuda:0").half()
+    wrapper = flashinfer.BatchDecodeWithHeadwisePagedKVCacheWrapper(
+        torch.empty(128 * 1024 * 1024, dtype=torch.uint8, device="cuda:0"),
+        use_tensor_cores=use_tensor_cores,
+    )
+    wrapper.plan(
+        kv_indptr.to(0),
+        kv_indices.to(0),
+        kv_last_page_len.to(0),
+        num_qo_heads,
+        num_kv_heads,
+        head_dim,
+        page_size,
+    )
+    o, lse = wrapper.run(q, kv_data, return_lse=True)
+    o_ref, lse_ref = headwise_paged_decode_attention_torch(
+        q, kv_data, kv_indptr, kv_indices, kv_last_page_len, return_lse=True
+    )
+    torch.testing.assert_close(o, o_ref, rtol=1e-3, atol=1e-3)
+    torch.testing.assert_close(lse, lse_ref, rtol=1e-3, atol=1e-3)
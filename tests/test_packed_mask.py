@@ -0,0 +1,201 @@
+"""
+Copyright (c) 2025 by FlashInfer team.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+
+import pytest
+import torch
+from attention_reference import get_indptr
+
+import flashinfer
+from flashinfer.torch_attention import _segment_packbits_torch
+from flashinfer.triton.mask import (
+    segment_packed_mask_apply_window as segment_packed_mask_apply_window_triton,
+)
+
+
+def _random_masks(qo_lens, kv_lens):
+    masks = [
+        torch.rand(qo_len, kv_len) > 0.5 for qo_len, kv_len in zip(qo_lens, kv_lens)
+    ]
+    packed, mask_indptr = _segment_packbits_torch(
+        torch.cat([m.flatten() for m in masks]),
+        get_indptr([m.numel() for m in masks]),
+        bitorder="little",
+    )
+    return masks, packed, mask_indptr
+
+
+def _pack(masks):
+    return _segment_packbits_torch(
+        torch.cat([m.flatten() for m in masks]),
+        get_indptr([m.numel() for m in masks]),
+        bitorder="little",
+    )[0]
+
+
+def _window_mask(qo_len, kv_len, window_left, causal):
+    q_pos = torch.arange(kv_len - qo_len, kv_len)[:, None]
+    kv_pos = torch.arange(kv_len)[None, :]
+    mask = torch.ones(qo_len, kv_len, dtype=torch.bool)
+    if causal:
+        mask &= kv_pos <= q_pos
+    if window_left >= 0:
+        mask &= kv_pos >= q_pos - window_left
+    return mask
+
+
+QO_LENS = [1, 7, 3, 16, 5]
+KV_LENS = [1, 9, 40, 16, 5]
+
+
+def test_packed_mask_and_or():
+    torch.manual_seed(42)
+    masks_x, packed_x, _ = _random_masks(QO_LENS, KV_LENS)
+    masks_y, packed_y, _ = _random_masks(QO_LENS, KV_LENS)
+    assert torch.equal(
+        flashinfer.packed_mask_and(packed_x, packed_y),
+        _pack([x & y for x, y in zip(masks_x, masks_y)]),
+    )
+    assert torch.equal(
+        flashinfer.packed_mask_or(packed_x, packed_y),
+        _pack([x | y for x, y in zip(masks_x, masks_y)]),
+    )
+    with pytest.raises(ValueError):
+        flashinfer.packed_mask_and(packed_x, packed_y[1:])
+
+
+def test_segment_packed_mask_not():
+    torch.manual_seed(42)
+    masks, packed, mask_indptr = _random_masks(QO_LENS, KV_LENS)
+    out = flashinfer.segment_packed_mask_not(
+        packed, mask_indptr, torch.tensor(QO_LENS), torch.tensor(KV_LENS)
+    )
+    assert torch.equal(out, _pack([~m for m in masks]))
+    # the complement of the complement is the mask, the padding bits stay cleared
+    out = flashinfer.segment_packed_mask_not(
+        out, mask_indptr, torch.tensor(QO_LENS), torch.tensor(KV_LENS)
+    )
+    assert torch.equal(out, packed)
+    with pytest.raises(ValueError):
+        flashinfer.segment_packed_mask_not(
+            packed, mask_indptr, torch.tensor(QO_LENS), torch.tensor(QO_LENS)
+        )
+
+
+def test_packed_mask_not():
+    torch.manual_seed(42)
+    mask = torch.rand(5, 11) > 0.5
+    packed = _pack([mask])
+    assert torch.equal(flashinfer.packed_mask_not(packed, 5, 11), _pack([~mask]))
+
+
+@pytest.mark.parametrize("window_left", [-1, 0, 3, [2, -1, 10, 0, 4]])
+@pytest.mark.parametrize("causal", [True, False])
+def test_segment_packed_mask_apply_window(window_left, causal):
+    torch.manual_seed(42)
+    masks, packed, mask_indptr = _random_masks(QO_LENS, KV_LENS)
+    windows = window_left if isinstance(window_left, list) else [window_left] * 5
+    expected = _pack(
+        [
+            m & _window_mask(qo_len, kv_len, w, causal)
+            for m, qo_len, kv_len, w in zip(masks, QO_LENS, KV_LENS, windows)
+        ]
+    )
+    out = flashinfer.segment_packed_mask_apply_window(
+        packed,
+        mask_indptr,
+        torch.tensor(QO_LENS),
+        torch.tensor(KV_LENS),
+        window_left=(
+            torch.tensor(window_left) if isinstance(window_left, list) else window_left
+        ),
+        causal=causal,
+    )
+    assert torch.equal(out, expected)
+
+
+def test_packed_mask_apply_window():
+    mask = torch.ones(2, 4, dtype=torch.bool)
+    out = flashinfer.packed_mask_apply_window(_pack([mask]), 2, 4, window_left=1)
+    assert torch.equal(out, _pack([_window_mask(2, 4, 1, True)]))
+
+
+@pytest.mark.skipif(
+    not torch.cuda.is_available() and os.environ.get("TRITON_INTERPRET") != "1",
+    reason="requires CUDA or the Triton interpreter (TRITON_INTERPRET=1)",
+)
+@pytest.mark.parametrize("window_left", [None, [2, -1, 10, 0, 4]])
+@pytest.mark.parametrize("causal", [True, False])
+def test_segment_packed_mask_apply_window_triton(window_left, causal):
+    torch.manual_seed(42)
+    device = "cuda:0" if torch.cuda.is_available() else "cpu"
+    masks, packed, mask_indptr = _random_masks(QO_LENS, KV_LENS)
+    windows = window_left if window_left is not None else [-1] * 5
+    expected = _pack(
+        [
+            m & _window_mask(qo_len, kv_len, w, causal)
+            for m, qo_len, kv_len, w in zip(masks, QO_LENS, KV_LENS, windows)
+        ]
+    )
+    out = segment_packed_mask_apply_window_triton(
+        packed.to(device),
+        mask_indptr.to(device),
+        torch.tensor(QO_LENS, dtype=torch.int32, device=device),
+        torch.tensor(KV_LENS, dtype=torch.int32, device=device),
+        (
+            torch.tensor(window_left, dtype=torch.int32, device=device)
+            if window_left is not None
+            else None
+        ),
+        causal,
+    )
+    assert torch.equal(out.cpu(), expected)
+
+
+@pytest.mark.skipif(
+    not torch.cuda.is_available() and os.environ.get("TRITON_INTERPRET") != "1",
+    reason="requires CUDA or the Triton interpreter (TRITON_INTERPRET=1)",
+)
+def test_segment_packed_mask_apply_window_triton_padded_buffer():
+    # the segments start at a non-zero offset of a larger buffer, the bytes outside
+    # the segments should be kept by both implementations
+    torch.manual_seed(42)
+    device = "cuda:0" if torch.cuda.is_available() else "cpu"
+    _, packed, mask_indptr = _random_masks(QO_LENS, KV_LENS)
+    padded = torch.randint(0, 256, (len(packed) + 8,), dtype=torch.uint8)
+    padded[3 : 3 + len(packed)] = packed
+    mask_indptr = mask_indptr + 3
+    window_left = torch.tensor([2, -1, 10, 0, 4], dtype=torch.int32)
+    expected = flashinfer.segment_packed_mask_apply_window(
+        padded,
+        mask_indptr,
+        torch.tensor(QO_LENS),
+        torch.tensor(KV_LENS),
+        window_left=window_left,
+        causal=True,
+    )
+    out = segment_packed_mask_apply_window_triton(
+        padded.to(device),
+        mask_indptr.to(device),
+        torch.tensor(QO_LENS, dtype=torch.int32, device=device),
+        torch.tensor(KV_LENS, dtype=torch.int32, device=device),
+        window_left.to(device),
+        True,
+    )
+    assert torch.equal(out.cpu(), expected)
+    assert torch.equal(expected[:3], padded[:3])
+    assert torch.equal(expected[-5:], padded[-5:])
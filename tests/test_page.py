@@ -55,3 +55,502 @@ def test_append_paged_kv_cache(contiguous):
         kv_page_indptr,
         kv_last_page_len,
     )
+
+
+@pytest.mark.parametrize("kv_layout", ["NHD", "HND"])
+@pytest.mark.parametrize("use_tuple", [False, True])
+def test_append_paged_kv_cache_cpu(kv_layout, use_tuple):
+    torch.manual_seed(42)
+    num_kv_heads = 4
+    head_dim = 16
+    page_size = 16
+    max_num_pages = 32
+    kv_append_length = torch.tensor([45, 8, 25, 22], dtype=torch.int32)
+    kv_append_indptr = torch.cat(
+        [torch.zeros(1).int(), torch.cumsum(kv_append_length, dim=0)]
+    ).int()
+    nnz_kv = kv_append_indptr[-1].item()
+    k_append = torch.randn(nnz_kv, num_kv_heads, head_dim).half()
+    v_append = torch.randn(nnz_kv, num_kv_heads, head_dim).half()
+
+    if kv_layout == "NHD":
+        page_shape = (page_size, num_kv_heads, head_dim)
+    else:
+        page_shape = (num_kv_heads, page_size, head_dim)
+    if use_tuple:
+        k_cache = torch.zeros(max_num_pages, *page_shape).half()
+        v_cache = torch.zeros(max_num_pages, *page_shape).half()
+        paged_kv_cache = (k_cache, v_cache)
+    else:
+        paged_kv_cache = torch.zeros(max_num_pages, 2, *page_shape).half()
+        k_cache, v_cache = paged_kv_cache[:, 0], paged_kv_cache[:, 1]
+
+    # the second and third request already have 5 and 16 entries in the kv-cache
+    num_pages_per_req = torch.tensor([3, 1, 3, 2], dtype=torch.int32)
+    kv_page_indptr = torch.cat(
+        [torch.zeros(1).int(), torch.cumsum(num_pages_per_req, dim=0)]
+    ).int()
+    kv_page_indices = torch.randperm(max_num_pages)[: kv_page_indptr[-1]].int()
+    kv_last_page_len = torch.tensor([13, 13, 9, 6], dtype=torch.int32)
+    seq_lens = flashinfer.get_seq_lens(kv_page_indptr, kv_last_page_len, page_size)
+    batch_indices, positions = flashinfer.get_batch_indices_positions(
+        kv_append_indptr, seq_lens, nnz_kv
+    )
+
+    flashinfer.append_paged_kv_cache(
+        k_append,
+        v_append,
+        batch_indices,
+        positions,
+        paged_kv_cache,
+        kv_page_indices,
+        kv_page_indptr,
+        kv_last_page_len,
+        kv_layout=kv_layout,
+    )
+
+    for i in range(len(kv_append_length)):
+        for j in range(kv_append_indptr[i], kv_append_indptr[i + 1]):
+            pos = seq_lens[i] - kv_append_indptr[i + 1] + j
+            assert batch_indices[j] == i
+            assert positions[j] == pos
+            page = kv_page_indices[kv_page_indptr[i] + pos // page_size]
+            entry = pos % page_size
+            if kv_layout == "NHD":
+                k, v = k_cache[page, entry], v_cache[page, entry]
+            else:
+                k, v = k_cache[page, :, entry], v_cache[page, :, entry]
+            assert torch.equal(k, k_append[j])
+            assert torch.equal(v, v_append[j])
+
+
+@pytest.mark.parametrize("kv_layout", ["NHD", "HND"])
+@pytest.mark.parametrize("per_head", [False, True])
+@pytest.mark.parametrize("kv_dtype", [torch.int8, torch.float8_e4m3fn])
+def test_append_paged_kv_cache_quantized(kv_layout, per_head, kv_dtype):
+    torch.manual_seed(42)
+    num_kv_heads = 4
+    head_dim = 32
+    page_size = 8
+    max_num_pages = 16
+    if kv_layout == "NHD":
+        page_shape = (page_size, num_kv_heads, head_dim)
+    else:
+        page_shape = (num_kv_heads, page_size, head_dim)
+    # fill the cache and scales with garbage, the pages are freshly allocated
+    paged_kv_cache = torch.randn(max_num_pages, 2, *page_shape).to(kv_dtype)
+    scale_shape = (max_num_pages, num_kv_heads) if per_head else (max_num_pages,)
+    k_scale = torch.rand(scale_shape) * 100
+    v_scale = torch.rand(scale_shape) * 100
+
+    kv_indptr = torch.tensor([0, 3, 5], dtype=torch.int32)
+    kv_indices = torch.tensor([7, 1, 12, 3, 9], dtype=torch.int32)
+    seq_lens = torch.tensor([20, 11], dtype=torch.int32)
+    k_ref = [torch.randn(int(n), num_kv_heads, head_dim) for n in seq_lens]
+    v_ref = [torch.randn(int(n), num_kv_heads, head_dim) for n in seq_lens]
+    # make the appended values of the second step larger, so that pages get requantized
+    for i in range(len(seq_lens)):
+        k_ref[i][-5:] *= 4
+        v_ref[i][-5:] *= 4
+
+    # prefill all but the last 5 tokens, then append the last 5 tokens
+    for begin, end in [(0, -5), (-5, None)]:
+        k_append = torch.cat([k[begin:end] for k in k_ref]).half()
+        v_append = torch.cat([v[begin:end] for v in v_ref]).half()
+        cur_seq_lens = seq_lens if end is None else seq_lens - 5
+        append_indptr = torch.zeros(len(seq_lens) + 1, dtype=torch.int32)
+        append_indptr[1:] = torch.cumsum(
+            torch.tensor([len(k[begin:end]) for k in k_ref]), 0
+        )
+        kv_last_page_len = (cur_seq_lens - 1) % page_size + 1
+        batch_indices, positions = flashinfer.get_batch_indices_positions(
+            append_indptr, cur_seq_lens, len(k_append)
+        )
+        flashinfer.append_paged_kv_cache_quantized(
+            k_append,
+            v_append,
+            batch_indices,
+            positions,
+            paged_kv_cache,
+            k_scale,
+            v_scale,
+            kv_indices,
+            kv_indptr,
+            kv_last_page_len,
+            kv_layout=kv_layout,
+        )
+
+    k_cache, v_cache, indices = flashinfer.page._dequantize_paged_kv_cache(
+        paged_kv_cache[:, 0],
+        paged_kv_cache[:, 1],
+        k_scale,
+        v_scale,
+        kv_indices,
+        kv_layout,
+        torch.float32,
+    )
+    # each referenced page is dequantized once
+    assert len(k_cache) == len(torch.unique(kv_indices))
+    if kv_layout == "HND":
+        k_cache = k_cache.transpose(1, 2)
+        v_cache = v_cache.transpose(1, 2)
+    for i in range(len(seq_lens)):
+        pages = indices[kv_indptr[i] : kv_indptr[i + 1]].long()
+        k = k_cache[pages].reshape(-1, num_kv_heads, head_dim)[: seq_lens[i]]
+        v = v_cache[pages].reshape(-1, num_kv_heads, head_dim)[: seq_lens[i]]
+        # the quantization error is bounded by the scale of the page
+        tol = 0.13 if kv_dtype != torch.int8 else 0.02
+        for x, x_ref in [(k, k_ref[i]), (v, v_ref[i])]:
+            x_ref = x_ref.half().float()
+            for j in range(len(x_ref)):
+                amax = x_ref[j // page_size * page_size :][:page_size].abs().max()
+                assert (x[j] - x_ref[j]).abs().max() <= tol * amax
+
+
+@pytest.mark.parametrize("kv_layout", ["NHD", "HND"])
+@pytest.mark.parametrize("cache_format", ["stacked", "stacked_tuple", "list"])
+def test_append_paged_kv_cache_multi_layer(kv_layout, cache_format):
+    torch.manual_seed(42)
+    num_layers = 3
+    num_kv_heads = 4
+    head_dim = 16
+    page_size = 8
+    max_num_pages = 16
+    if kv_layout == "NHD":
+        page_shape = (page_size, num_kv_heads, head_dim)
+    else:
+        page_shape = (num_kv_heads, page_size, head_dim)
+    kv_data = torch.zeros(num_layers, max_num_pages, 2, *page_shape).half()
+    ref_kv_data = kv_data.clone()
+    if cache_format == "stacked":
+        paged_kv_cache = kv_data
+    elif cache_format == "stacked_tuple":
+        paged_kv_cache = (kv_data[:, :, 0], kv_data[:, :, 1])
+    else:
+        paged_kv_cache = [kv_data[i] for i in range(num_layers)]
+
+    kv_indptr = torch.tensor([0, 3, 5], dtype=torch.int32)
+    kv_indices = torch.tensor([7, 1, 12, 3, 9], dtype=torch.int32)
+    kv_last_page_len = torch.tensor([4, 3], dtype=torch.int32)
+    append_indptr = torch.tensor([0, 13, 14], dtype=torch.int32)
+    nnz = append_indptr[-1].item()
+    batch_indices, positions = flashinfer.get_batch_indices_positions(
+        append_indptr,
+        flashinfer.get_seq_lens(kv_indptr, kv_last_page_len, page_size),
+        nnz,
+    )
+    k_append = torch.randn(num_layers, nnz, num_kv_heads, head_dim).half()
+    v_append = torch.randn(num_layers, nnz, num_kv_heads, head_dim).half()
+
+    flashinfer.append_paged_kv_cache_multi_layer(
+        k_append,
+        v_append,
+        batch_indices,
+        positions,
+        paged_kv_cache,
+        kv_indices,
+        kv_indptr,
+        kv_last_page_len,
+        kv_layout=kv_layout,
+    )
+    for i in range(num_layers):
+        flashinfer.append_paged_kv_cache(
+            k_append[i],
+            v_append[i],
+            batch_indices,
+            positions,
+            ref_kv_data[i],
+            kv_indices,
+            kv_indptr,
+            kv_last_page_len,
+            kv_layout=kv_layout,
+        )
+    assert torch.equal(kv_data, ref_kv_data)
+
+
+@pytest.mark.parametrize("kv_layout", ["NHD", "HND"])
+def test_append_paged_kv_cache_with_slot_mapping(kv_layout):
+    torch.manual_seed(42)
+    num_kv_heads = 4
+    head_dim = 16
+    page_size = 8
+    max_num_pages = 16
+    if kv_layout == "NHD":
+        page_shape = (page_size, num_kv_heads, head_dim)
+    else:
+        page_shape = (num_kv_heads, page_size, head_dim)
+    paged_kv_cache = torch.zeros(max_num_pages, 2, *page_shape).half()
+    ref_paged_kv_cache = paged_kv_cache.clone()
+
+    kv_indptr = torch.tensor([0, 3, 5], dtype=torch.int32)
+    kv_indices = torch.tensor([7, 1, 12, 3, 9], dtype=torch.int32)
+    kv_last_page_len = torch.tensor([4, 3], dtype=torch.int32)
+    append_indptr = torch.tensor([0, 13, 14], dtype=torch.int32)
+    nnz = append_indptr[-1].item()
+    batch_indices, positions = flashinfer.get_batch_indices_positions(
+        append_indptr,
+        flashinfer.get_seq_lens(kv_indptr, kv_last_page_len, page_size),
+        nnz,
+    )
+    k_append = torch.randn(nnz, num_kv_heads, head_dim).half()
+    v_append = torch.randn(nnz, num_kv_heads, head_dim).half()
+
+    slot_mapping = flashinfer.get_slot_mapping(
+        batch_indices, positions, kv_indices, kv_indptr, page_size
+    )
+    flashinfer.append_paged_kv_cache_with_slot_mapping(
+        k_append, v_append, slot_mapping, paged_kv_cache, kv_layout=kv_layout
+    )
+    flashinfer.append_paged_kv_cache(
+        k_append,
+        v_append,
+        batch_indices,
+        positions,
+        ref_paged_kv_cache,
+        kv_indices,
+        kv_indptr,
+        kv_last_page_len,
+        kv_layout=kv_layout,
+    )
+    assert torch.equal(paged_kv_cache, ref_paged_kv_cache)
+
+
+def test_run_length_page_indices():
+    kv_indices = torch.tensor([4, 5, 6, 0, 1, 9, 3, 4, 5, 6], dtype=torch.int32)
+    rle = flashinfer.RunLengthPageIndices.encode(kv_indices)
+    assert rle.starts.tolist() == [4, 0, 9, 3]
+    assert rle.lengths.tolist() == [3, 2, 1, 4]
+    assert rle.num_pages == len(kv_indices)
+    assert torch.equal(rle.expand(), kv_indices)
+    offsets = torch.tensor([9, 0, 3, 5, 2, 6])
+    assert torch.equal(rle.lookup(offsets), kv_indices[offsets].long())
+
+    empty = flashinfer.RunLengthPageIndices.encode(kv_indices[:0])
+    assert empty.num_pages == 0 and len(empty.expand()) == 0
+
+
+@pytest.mark.parametrize("kv_layout", ["NHD", "HND"])
+def test_append_paged_kv_cache_run_length_indices(kv_layout):
+    torch.manual_seed(42)
+    num_kv_heads = 4
+    head_dim = 16
+    page_size = 8
+    max_num_pages = 16
+    if kv_layout == "NHD":
+        page_shape = (page_size, num_kv_heads, head_dim)
+    else:
+        page_shape = (num_kv_heads, page_size, head_dim)
+    paged_kv_cache = torch.zeros(max_num_pages, 2, *page_shape).half()
+    ref_paged_kv_cache = paged_kv_cache.clone()
+
+    kv_indptr = torch.tensor([0, 3, 7], dtype=torch.int32)
+    kv_indices = torch.tensor([2, 3, 4, 10, 11, 12, 13], dtype=torch.int32)
+    kv_last_page_len = torch.tensor([4, 3], dtype=torch.int32)
+    append_indptr = torch.tensor([0, 20, 27], dtype=torch.int32)
+    nnz = append_indptr[-1].item()
+    batch_indices, positions = flashinfer.get_batch_indices_positions(
+        append_indptr,
+        flashinfer.get_seq_lens(kv_indptr, kv_last_page_len, page_size),
+        nnz,
+    )
+    k_append = torch.randn(nnz, num_kv_heads, head_dim).half()
+    v_append = torch.randn(nnz, num_kv_heads, head_dim).half()
+
+    for cache, indices in [
+        (paged_kv_cache, flashinfer.RunLengthPageIndices.encode(kv_indices)),
+        (ref_paged_kv_cache, kv_indices),
+    ]:
+        flashinfer.append_paged_kv_cache(
+            k_append,
+            v_append,
+            batch_indices,
+            positions,
+            cache,
+            indices,
+            kv_indptr,
+            kv_last_page_len,
+            kv_layout=kv_layout,
+        )
+    assert torch.equal(paged_kv_cache, ref_paged_kv_cache)
+
+
+@pytest.mark.parametrize("kv_layout", ["NHD", "HND"])
+@pytest.mark.parametrize("pool_layout", ["layer_major", "page_major"])
+def test_allocate_paged_kv_cache_pool(kv_layout, pool_layout):
+    torch.manual_seed(42)
+    num_layers = 3
+    num_kv_heads = 4
+    head_dim = 16
+    page_size = 8
+    max_num_pages = 16
+    kv_pool, kv_caches = flashinfer.allocate_paged_kv_cache_pool(
+        num_layers,
+        max_num_pages,
+        page_size,
+        num_kv_heads,
+        head_dim,
+        device="cpu",
+        kv_layout=kv_layout,
+        pool_layout=pool_layout,
+    )
+    kv_pool.zero_()
+    ref_kv_data = torch.zeros(num_layers, *kv_caches[0].shape).half()
+    assert len(kv_caches) == num_layers
+
+    kv_indptr = torch.tensor([0, 3, 5], dtype=torch.int32)
+    kv_indices = torch.tensor([7, 1, 12, 3, 9], dtype=torch.int32)
+    kv_last_page_len = torch.tensor([4, 3], dtype=torch.int32)
+    append_indptr = torch.tensor([0, 13, 14], dtype=torch.int32)
+    nnz = append_indptr[-1].item()
+    batch_indices, positions = flashinfer.get_batch_indices_positions(
+        append_indptr,
+        flashinfer.get_seq_lens(kv_indptr, kv_last_page_len, page_size),
+        nnz,
+    )
+    k_append = torch.randn(num_layers, nnz, num_kv_heads, head_dim).half()
+    v_append = torch.randn(num_layers, nnz, num_kv_heads, head_dim).half()
+    for i in range(num_layers):
+        for paged_kv_cache in [kv_caches[i], ref_kv_data[i]]:
+            flashinfer.append_paged_kv_cache(
+                k_append[i],
+                v_append[i],
+                batch_indices,
+                positions,
+                paged_kv_cache,
+                kv_indices,
+                kv_indptr,
+                kv_last_page_len,
+                kv_layout=kv_layout,
+            )
+    if pool_layout == "layer_major":
+        assert torch.equal(kv_pool, ref_kv_data)
+    else:
+        assert torch.equal(kv_pool, ref_kv_data.transpose(0, 1))
+        # all layers of a page are contiguous
+        assert kv_pool[kv_indices[0]].is_contiguous()
+
+
+@pytest.mark.parametrize("page_size", [1, 4, 16])
+@pytest.mark.parametrize("window_left", [-1, 0, 7, 64])
+def test_reclaim_sliding_window_pages(page_size, window_left):
+    torch.manual_seed(42)
+    batch_size = 7
+    kv_lens = torch.randint(1, 100, (batch_size,))
+    qo_lens = torch.clamp(torch.randint(1, 10, (batch_size,)), max=kv_lens)
+    num_pages = (kv_lens + page_size - 1) // page_size
+    kv_indptr = torch.zeros(batch_size + 1, dtype=torch.int32)
+    kv_indptr[1:] = torch.cumsum(num_pages, 0)
+    kv_indices = torch.randperm(kv_indptr[-1].item()).int()
+    kv_last_page_len = ((kv_lens - 1) % page_size + 1).int()
+
+    new_kv_indptr, new_kv_indices, new_kv_last_page_len, released, kv_offsets = (
+        flashinfer.reclaim_sliding_window_pages(
+            kv_indptr, kv_indices, kv_last_page_len, page_size, window_left, qo_lens
+        )
+    )
+    assert torch.equal(new_kv_last_page_len, kv_last_page_len)
+    new_kv_lens = flashinfer.get_seq_lens(
+        new_kv_indptr, new_kv_last_page_len, page_size
+    )
+    ref_released = []
+    for i in range(batch_size):
+        pages = kv_indices[kv_indptr[i] : kv_indptr[i + 1]]
+        new_pages = new_kv_indices[new_kv_indptr[i] : new_kv_indptr[i + 1]]
+        num_dropped = len(pages) - len(new_pages)
+        assert torch.equal(pages[num_dropped:], new_pages)
+        assert kv_offsets[i] == num_dropped * page_size
+        assert new_kv_lens[i] == kv_lens[i] - kv_offsets[i]
+        if window_left >= 0:
+            # the window of the first query is kept, no full page before it is
+            first_pos = max(kv_lens[i].item() - qo_lens[i].item() - window_left, 0)
+            assert kv_offsets[i] <= first_pos < kv_offsets[i] + page_size
+        else:
+            assert num_dropped == 0
+        ref_released.append(pages[:num_dropped])
+    assert torch.equal(released, torch.cat(ref_released))
+
+
+@pytest.mark.parametrize("kv_layout", ["NHD", "HND"])
+def test_page_key_summary(kv_layout):
+    torch.manual_seed(42)
+    num_kv_heads = 4
+    head_dim = 16
+    page_size = 8
+    max_num_pages = 16
+    if kv_layout == "NHD":
+        page_shape = (page_size, num_kv_heads, head_dim)
+    else:
+        page_shape = (num_kv_heads, page_size, head_dim)
+    paged_kv_cache = torch.zeros(max_num_pages, 2, *page_shape)
+    page_key_summary = torch.empty(max_num_pages, 2, num_kv_heads, head_dim)
+
+    kv_indices = torch.tensor([7, 1, 12, 3, 9], dtype=torch.int32)
+    # append 10 + 3 tokens, then 3 + 6 tokens
+    for kv_indptr, kv_last_page_len, append_indptr in [
+        ([0, 2, 3], [2, 3], [0, 10, 13]),
+        ([0, 2, 4], [5, 1], [0, 3, 9]),
+    ]:
+        kv_indptr = torch.tensor(kv_indptr, dtype=torch.int32)
+        kv_last_page_len = torch.tensor(kv_last_page_len, dtype=torch.int32)
+        append_indptr = torch.tensor(append_indptr, dtype=torch.int32)
+        nnz = append_indptr[-1].item()
+        batch_indices, positions = flashinfer.get_batch_indices_positions(
+            append_indptr,
+            flashinfer.get_seq_lens(kv_indptr, kv_last_page_len, page_size),
+            nnz,
+        )
+        flashinfer.append_paged_kv_cache(
+            torch.randn(nnz, num_kv_heads, head_dim),
+            torch.randn(nnz, num_kv_heads, head_dim),
+            batch_indices,
+            positions,
+            paged_kv_cache,
+            kv_indices,
+            kv_indptr,
+            kv_last_page_len,
+            kv_layout=kv_layout,
+            page_key_summary=page_key_summary,
+        )
+    ref_summary = flashinfer.compute_page_key_summary(
+        paged_kv_cache, kv_indices, kv_indptr, kv_last_page_len, kv_layout
+    )
+    page_ids = kv_indices[: kv_indptr[-1]].long()
+    torch.testing.assert_close(page_key_summary[page_ids], ref_summary[page_ids])
+
+
+@pytest.mark.parametrize("page_budget", [1, 3, 8])
+def test_select_top_k_pages(page_budget):
+    torch.manual_seed(42)
+    num_qo_heads, num_kv_heads, head_dim = 8, 2, 16
+    max_num_pages = 64
+    num_pages = torch.tensor([1, 5, 12, 0, 7])
+    batch_size = len(num_pages)
+    kv_indptr = torch.zeros(batch_size + 1, dtype=torch.int32)
+    kv_indptr[1:] = torch.cumsum(num_pages, 0)
+    kv_indices = torch.randperm(max_num_pages)[: kv_indptr[-1]].int()
+    kv_last_page_len = torch.randint(1, 16, (batch_size,)).int()
+    page_key_summary = torch.randn(max_num_pages, 2, num_kv_heads, head_dim)
+    page_key_summary = torch.stack(
+        [page_key_summary.amin(1), page_key_summary.amax(1)], dim=1
+    )
+    q = torch.randn(batch_size, num_qo_heads, head_dim)
+
+    new_kv_indptr, new_kv_indices, new_kv_last_page_len = flashinfer.select_top_k_pages(
+        q, page_key_summary, kv_indptr, kv_indices, kv_last_page_len, page_budget
+    )
+    assert torch.equal(new_kv_last_page_len, kv_last_page_len)
+    group_size = num_qo_heads // num_kv_heads
+    for i in range(batch_size):
+        pages = kv_indices[kv_indptr[i] : kv_indptr[i + 1]].tolist()
+        scores = []
+        for page in pages:
+            s = 0.0
+            for h in range(num_qo_heads):
+                kv_min, kv_max = page_key_summary[page, :, h // group_size]
+                s += torch.maximum(q[i, h] * kv_min, q[i, h] * kv_max).sum().item()
+            scores.append(s)
+        if pages:
+            scores[-1] = float("inf")
+        top = sorted(range(len(pages)), key=lambda j: -scores[j])[:page_budget]
+        ref = [pages[j] for j in sorted(top)]
+        assert new_kv_indices[new_kv_indptr[i] : new_kv_indptr[i + 1]].tolist() == ref
@@ -0,0 +1,238 @@
+"""
+Copyright (c) 2025 by FlashInfer team.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import pytest
+import torch
+from attention_reference import get_indptr, make_paged_kv
+
+import flashinfer
+from flashinfer.page import _drop_unread_pages
+from flashinfer.prefill import _get_per_request_window_mask
+from flashinfer.torch_attention import paged_attention_torch
+from flashinfer.utils import _canonicalize_per_request_param
+
+
+def test_canonicalize_per_request_param():
+    assert _canonicalize_per_request_param(-1, 3, "window_left") == -1
+    assert _canonicalize_per_request_param(torch.tensor([4, 4]), 2, "w") == 4
+    x = _canonicalize_per_request_param(torch.tensor([4, -1]), 2, "w")
+    assert torch.is_tensor(x) and x.tolist() == [4, -1]
+    with pytest.raises(ValueError):
+        _canonicalize_per_request_param(torch.tensor([4, -1]), 3, "w")
+
+
+@pytest.mark.parametrize("causal", [False, True])
+@pytest.mark.parametrize("use_custom_mask", [False, True])
+def test_per_request_window_mask(causal, use_custom_mask):
+    torch.manual_seed(42)
+    qo_lens = torch.tensor([1, 5, 3])
+    kv_lens = torch.tensor([9, 5, 12])
+    window_left = torch.tensor([2, -1, 0])
+    custom_mask = None
+    if use_custom_mask:
+        custom_mask = torch.rand(int((qo_lens * kv_lens).sum())) > 0.3
+    mask = _get_per_request_window_mask(
+        qo_lens, kv_lens, window_left, causal, custom_mask, torch.device("cpu")
+    )
+    offset = 0
+    for qo_len, kv_len, w in zip(qo_lens.tolist(), kv_lens.tolist(), window_left):
+        for i in range(qo_len):
+            q_pos = kv_len - qo_len + i
+            for j in range(kv_len):
+                expected = w < 0 or j >= q_pos - w
+                if use_custom_mask:
+                    expected = expected and bool(custom_mask[offset])
+                elif causal:
+                    expected = expected and j <= q_pos
+                assert bool(mask[offset]) == expected
+                offset += 1
+    assert offset == len(mask)
+
+
+@pytest.mark.parametrize("page_size", [1, 7])
+def test_paged_attention_torch_per_request_params(page_size):
+    torch.manual_seed(42)
+    num_qo_heads, num_kv_heads, head_dim = 4, 2, 32
+    kv_lens = torch.tensor([13, 1, 40])
+    qo_lens = torch.tensor([3, 1, 6])
+    qo_indptr = torch.zeros(len(qo_lens) + 1, dtype=torch.int32)
+    qo_indptr[1:] = torch.cumsum(qo_lens, 0)
+    kv_data, kv_indptr, kv_indices, kv_last_page_len = make_paged_kv(
+        kv_lens, page_size, num_kv_heads, head_dim, device="cpu"
+    )
+    q = torch.randn(qo_indptr[-1].item(), num_qo_heads, head_dim)
+    window_left = torch.tensor([4, -1, 9], dtype=torch.int32)
+    logits_soft_cap = torch.tensor([0.0, 30.0, 5.0])
+    o, lse = paged_attention_torch(
+        q,
+        kv_data,
+        qo_indptr,
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        window_left=window_left,
+        logits_soft_cap=logits_soft_cap,
+        return_lse=True,
+    )
+    for i in range(len(kv_lens)):
+        o_i, lse_i = paged_attention_torch(
+            q[qo_indptr[i] : qo_indptr[i + 1]],
+            kv_data,
+            torch.tensor([0, qo_lens[i]]),
+            torch.tensor([0, kv_indptr[i + 1] - kv_indptr[i]]),
+            kv_indices[kv_indptr[i] : kv_indptr[i + 1]],
+            kv_last_page_len[i : i + 1],
+            window_left=window_left[i].item(),
+            logits_soft_cap=logits_soft_cap[i].item(),
+            return_lse=True,
+        )
+        torch.testing.assert_close(o[qo_indptr[i] : qo_indptr[i + 1]], o_i)
+        torch.testing.assert_close(lse[qo_indptr[i] : qo_indptr[i + 1]], lse_i)
+
+
+@pytest.mark.parametrize("page_size", [1, 7])
+def test_drop_unread_window_pages(page_size):
+    # the pages before the windows are dropped before the window mask of the CUDA
+    # kernels is built, the attention is unchanged
+    torch.manual_seed(42)
+    num_qo_heads, num_kv_heads, head_dim = 4, 2, 32
+    kv_lens = torch.tensor([13, 30, 40, 25])
+    qo_lens = torch.tensor([3, 1, 6, 2])
+    qo_indptr = get_indptr(qo_lens)
+    kv_data, kv_indptr, kv_indices, kv_last_page_len = make_paged_kv(
+        kv_lens, page_size, num_kv_heads, head_dim
+    )
+    q = torch.randn(qo_indptr[-1].item(), num_qo_heads, head_dim)
+    window_left = torch.tensor([4, -1, 9, 0], dtype=torch.int32)
+    new_kv_indptr, new_kv_indices, kv_offsets = _drop_unread_pages(
+        kv_indptr, kv_indices, kv_last_page_len, page_size, qo_lens, window_left
+    )
+    first_pos = torch.clamp(kv_lens - qo_lens - window_left, min=0)
+    expected_offsets = torch.where(
+        window_left >= 0, first_pos // page_size * page_size, 0
+    )
+    assert torch.equal(kv_offsets.long(), expected_offsets)
+    o_ref, lse_ref = paged_attention_torch(
+        q,
+        kv_data,
+        qo_indptr,
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        window_left=window_left,
+        return_lse=True,
+    )
+    o, lse = paged_attention_torch(
+        q,
+        kv_data,
+        qo_indptr,
+        new_kv_indptr,
+        new_kv_indices,
+        kv_last_page_len,
+        window_left=window_left,
+        return_lse=True,
+    )
+    torch.testing.assert_close(o, o_ref)
+    torch.testing.assert_close(lse, lse_ref)
+
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason="requires CUDA")
+@pytest.mark.parametrize("page_size", [1, 16])
+@pytest.mark.parametrize("causal", [False, True])
+def test_batch_prefill_per_request_window(page_size, causal):
+    torch.manual_seed(42)
+    num_qo_heads, num_kv_heads, head_dim = 8, 2, 128
+    kv_lens = torch.tensor([33, 100, 7])
+    qo_lens = torch.tensor([5, 17, 7])
+    qo_indptr = torch.zeros(len(qo_lens) + 1, dtype=torch.int32)
+    qo_indptr[1:] = torch.cumsum(qo_lens, 0)
+    kv_data, kv_indptr, kv_indices, kv_last_page_len = make_paged_kv(
+        kv_lens, page_size, num_kv_heads, head_dim, device="cuda:0"
+    )
+    kv_data = kv_data.half()
+    q = torch.randn(qo_indptr[-1].item(), num_qo_heads, head_dim, device="cuda:0")
+    q = q.half()
+    window_left = torch.tensor([3, -1, 20], dtype=torch.int32)
+    wrapper = flashinfer.BatchPrefillWithPagedKVCacheWrapper(
+        torch.empty(128 * 1024 * 1024, dtype=torch.uint8, device="cuda:0")
+    )
+    wrapper.plan(
+        qo_indptr.to(0),
+        kv_indptr.to(0),
+        kv_indices.to(0),
+        kv_last_page_len.to(0),
+        num_qo_heads,
+        num_kv_heads,
+        head_dim,
+        page_size,
+        causal=causal,
+        window_left=window_left,
+    )
+    o = wrapper.run(q, kv_data)
+    o_ref = paged_attention_torch(
+        q,
+        kv_data,
+        qo_indptr,
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        causal=causal,
+        window_left=window_left,
+    )
+    torch.testing.assert_close(o, o_ref, rtol=1e-3, atol=1e-3)
+
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason="requires CUDA")
+@pytest.mark.parametrize("use_tensor_cores", [False, True])
+def test_batch_decode_per_request_window(use_tensor_cores):
+    torch.manual_seed(42)
+    num_qo_heads, num_kv_heads, head_dim, page_size = 8, 2, 128, 16
+    kv_lens = torch.tensor([33, 100, 7, 64])
+    kv_data, kv_indptr, kv_indices, kv_last_page_len = make_paged_kv(
+        kv_lens, page_size, num_kv_heads, head_dim, device="cuda:0"
+    )
+    kv_data = kv_data.half()
+    q = torch.randn(len(kv_lens), num_qo_heads, head_dim, device="cuda:0").half()
+    window_left = torch.tensor([3, -1, 20, 0], dtype=torch.int32)
+    logits_soft_cap = torch.tensor([0.0, 30.0, 5.0, 0.0])
+    wrapper = flashinfer.BatchDecodeWithPagedKVCacheWrapper(
+        torch.empty(128 * 1024 * 1024, dtype=torch.uint8, device="cuda:0"),
+        use_tensor_cores=use_tensor_cores,
+    )
+    wrapper.plan(
+        kv_indptr.to(0),
+        kv_indices.to(0),
+        kv_last_page_len.to(0),
+        num_qo_heads,
+        num_kv_heads,
+        head_dim,
+        page_size,
+        window_left=window_left,
+        logits_soft_cap=logits_soft_cap,
+    )
+    o = wrapper.run(q, kv_data)
+    o_ref = paged_attention_torch(
+        q,
+        kv_data,
+        torch.arange(len(kv_lens) + 1),
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        causal=False,
+        window_left=window_left,
+        logits_soft_cap=logits_soft_cap,
+    )
+    torch.testing.assert_close(o, o_ref, rtol=1e-3, atol=1e-3)
@@ -0,0 +1,269 @@
+"""
+Copyright (c) 2025 by FlashInfer team.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import functools
+
+import pytest
+import torch
+from attention_reference import get_indptr, make_paged_kv, masked_attention_ref
+
+import flashinfer
+from flashinfer.page import _truncate_paged_kv
+from flashinfer.prefill import (
+    _get_per_request_window_mask,
+    _get_prefix_lm_ragged_indptr,
+    _single_prefill_prefix_lm,
+    _split_prefix_lm_queries,
+)
+from flashinfer.torch_attention import paged_attention_torch
+
+
+def _prefix_lm_mask(qo_len, kv_len, prefix_len):
+    q_pos = torch.arange(kv_len - qo_len, kv_len)[:, None]
+    kv_pos = torch.arange(kv_len)[None, :]
+    return (kv_pos <= q_pos) | (kv_pos < prefix_len)
+
+
+def test_prefix_lm_window_mask():
+    qo_lens = torch.tensor([4, 6, 1])
+    kv_lens = torch.tensor([10, 6, 8])
+    prefix_len = torch.tensor([3, 4, 0])
+    mask = _get_per_request_window_mask(
+        qo_lens, kv_lens, 5, True, None, torch.device("cpu"), prefix_len=prefix_len
+    )
+    expected = []
+    for qo_len, kv_len, p in zip(qo_lens.tolist(), kv_lens.tolist(), prefix_len):
+        q_pos = torch.arange(kv_len - qo_len, kv_len)[:, None]
+        window = torch.arange(kv_len)[None, :] >= q_pos - 5
+        expected.append((_prefix_lm_mask(qo_len, kv_len, p) & window).flatten())
+    assert torch.equal(mask, torch.cat(expected))
+
+
+@pytest.mark.parametrize("prefix_len", [0, 5, 30, 1000])
+def test_paged_attention_torch_prefix_lm(prefix_len):
+    torch.manual_seed(42)
+    qo_len, kv_len, num_heads, head_dim = 20, 40, 4, 32
+    q = torch.randn(qo_len, num_heads, head_dim)
+    kv_data = torch.randn(kv_len, 2, 1, num_heads, head_dim)
+    o, lse = paged_attention_torch(
+        q,
+        kv_data,
+        torch.tensor([0, qo_len]),
+        torch.tensor([0, kv_len]),
+        torch.arange(kv_len),
+        torch.tensor([1]),
+        prefix_len=prefix_len,
+        return_lse=True,
+    )
+    o_ref, lse_ref = masked_attention_ref(
+        q,
+        kv_data[:, 0, 0],
+        kv_data[:, 1, 0],
+        _prefix_lm_mask(qo_len, kv_len, prefix_len),
+    )
+    torch.testing.assert_close(o, o_ref, rtol=1e-4, atol=1e-4)
+    torch.testing.assert_close(lse, lse_ref, rtol=1e-4, atol=1e-4)
+
+
+@pytest.mark.parametrize("page_size", [1, 16])
+@pytest.mark.parametrize("window_left", [-1, 7])
+def test_batch_prefill_torch_backend_prefix_lm(page_size, window_left):
+    torch.manual_seed(42)
+    num_qo_heads, num_kv_heads, head_dim = 4, 2, 32
+    qo_lens = torch.tensor([30, 1, 17, 64])
+    kv_lens = torch.tensor([30, 20, 40, 64])
+    prefix_len = torch.tensor([12, 5, 0, 64], dtype=torch.int32)
+    qo_indptr = get_indptr(qo_lens)
+    num_pages = (kv_lens + page_size - 1) // page_size
+    kv_indptr = get_indptr(num_pages)
+    kv_indices = torch.randperm(kv_indptr[-1].item()).int()
+    kv_last_page_len = ((kv_lens - 1) % page_size + 1).int()
+    kv_data = torch.randn(kv_indptr[-1].item(), 2, page_size, num_kv_heads, head_dim)
+    q = torch.randn(qo_indptr[-1].item(), num_qo_heads, head_dim)
+    wrapper = flashinfer.BatchPrefillWithPagedKVCacheWrapper(
+        torch.empty(0, dtype=torch.uint8), backend="torch"
+    )
+    wrapper.plan(
+        qo_indptr,
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        num_qo_heads,
+        num_kv_heads,
+        head_dim,
+        page_size,
+        causal=True,
+        window_left=window_left,
+        q_data_type=torch.float32,
+        prefix_len=prefix_len,
+    )
+    o, lse = wrapper.run(q, kv_data, return_lse=True)
+    o_ref, lse_ref = paged_attention_torch(
+        q,
+        kv_data,
+        qo_indptr,
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        window_left=window_left,
+        prefix_len=prefix_len,
+        return_lse=True,
+    )
+    torch.testing.assert_close(o, o_ref, rtol=1e-4, atol=1e-4)
+    torch.testing.assert_close(lse, lse_ref, rtol=1e-4, atol=1e-4)
+
+
+@pytest.mark.parametrize("page_size", [1, 5, 16])
+@pytest.mark.parametrize("window_left", [-1, 7])
+@pytest.mark.parametrize("pos_encoding_mode", ["NONE", "ALIBI"])
+def test_split_prefix_lm_queries(page_size, window_left, pos_encoding_mode):
+    torch.manual_seed(42)
+    num_qo_heads, num_kv_heads, head_dim = 4, 2, 32
+    qo_lens = torch.tensor([30, 1, 17, 64, 20])
+    kv_lens = torch.tensor([30, 20, 40, 64, 60])
+    prefix_len = torch.tensor([12, 5, 0, 100, 50], dtype=torch.int32)
+    qo_indptr = get_indptr(qo_lens)
+    kv_data, kv_indptr, kv_indices, kv_last_page_len = make_paged_kv(
+        kv_lens, page_size, num_kv_heads, head_dim
+    )
+    q = torch.randn(qo_indptr[-1].item(), num_qo_heads, head_dim)
+    attention = functools.partial(
+        paged_attention_torch,
+        pos_encoding_mode=pos_encoding_mode,
+        window_left=window_left,
+        return_lse=True,
+    )
+    o_ref, lse_ref = attention(
+        q,
+        kv_data,
+        qo_indptr,
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        prefix_len=prefix_len,
+    )
+    (
+        prefix_qo_indptr,
+        suffix_qo_indptr,
+        prefix_rows,
+        suffix_rows,
+        prefix_kv_lens,
+    ) = _split_prefix_lm_queries(qo_indptr, kv_lens, prefix_len)
+    # the queries inside the prefixes are the first 12, 0, 0, 64 and 10 of each request
+    assert (prefix_qo_indptr[1:] - prefix_qo_indptr[:-1]).tolist() == [12, 0, 0, 64, 10]
+    assert prefix_kv_lens.tolist() == [12, 5, 0, 64, 50]
+    o, lse = torch.empty_like(o_ref), torch.empty_like(lse_ref)
+
+    # paged kv: a non-causal launch on the prefix pages and a causal launch
+    o[prefix_rows], lse[prefix_rows] = attention(
+        q[prefix_rows],
+        kv_data,
+        prefix_qo_indptr,
+        *_truncate_paged_kv(kv_indptr, kv_indices, page_size, prefix_kv_lens),
+        causal=False,
+    )
+    o[suffix_rows], lse[suffix_rows] = attention(
+        q[suffix_rows],
+        kv_data,
+        suffix_qo_indptr,
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        causal=True,
+    )
+    torch.testing.assert_close(o, o_ref, rtol=1e-4, atol=1e-4)
+    torch.testing.assert_close(lse, lse_ref, rtol=1e-4, atol=1e-4)
+
+    # ragged kv: the kv after each prefix is covered by a sub-request without queries
+    ragged_kv_indptr = get_indptr(kv_lens)
+    ragged_kv_data = torch.cat(
+        [
+            kv_data[kv_indices[kv_indptr[i] : kv_indptr[i + 1]].long()]
+            .transpose(1, 2)
+            .flatten(0, 1)[:kv_len]
+            for i, kv_len in enumerate(kv_lens.tolist())
+        ]
+    )[:, :, None]
+    ragged_attention = functools.partial(
+        attention,
+        paged_kv_cache=ragged_kv_data,
+        kv_indices=torch.arange(ragged_kv_indptr[-1].item()),
+    )
+    sub_qo_indptr, sub_kv_indptr = _get_prefix_lm_ragged_indptr(
+        prefix_qo_indptr, ragged_kv_indptr, prefix_kv_lens
+    )
+    o[prefix_rows], lse[prefix_rows] = ragged_attention(
+        q=q[prefix_rows],
+        qo_indptr=sub_qo_indptr,
+        kv_indptr=sub_kv_indptr,
+        kv_last_page_len=torch.ones(len(sub_qo_indptr) - 1, dtype=torch.int32),
+        causal=False,
+    )
+    o[suffix_rows], lse[suffix_rows] = ragged_attention(
+        q=q[suffix_rows],
+        qo_indptr=suffix_qo_indptr,
+        kv_indptr=ragged_kv_indptr,
+        kv_last_page_len=torch.ones(len(kv_lens), dtype=torch.int32),
+        causal=True,
+    )
+    torch.testing.assert_close(o, o_ref, rtol=1e-4, atol=1e-4)
+    torch.testing.assert_close(lse, lse_ref, rtol=1e-4, atol=1e-4)
+
+
+@pytest.mark.parametrize("kv_layout", ["NHD", "HND"])
+@pytest.mark.parametrize("prefix_len", [1, 25, 60, 100])
+def test_single_prefill_prefix_lm(kv_layout, prefix_len):
+    torch.manual_seed(42)
+    qo_len, kv_len, num_qo_heads, num_kv_heads, head_dim = 40, 60, 4, 2, 32
+    q = torch.randn(qo_len, num_qo_heads, head_dim)
+    k = torch.randn(kv_len, num_kv_heads, head_dim)
+    v = torch.randn(kv_len, num_kv_heads, head_dim)
+    if kv_layout == "HND":
+        k_in, v_in = k.transpose(0, 1).contiguous(), v.transpose(0, 1).contiguous()
+    else:
+        k_in, v_in = k, v
+    o_ref, lse_ref = masked_attention_ref(
+        q, k, v, _prefix_lm_mask(qo_len, kv_len, prefix_len)
+    )
+    o, lse = flashinfer.single_prefill_with_kv_cache(
+        q,
+        k_in,
+        v_in,
+        causal=True,
+        kv_layout=kv_layout,
+        prefix_len=prefix_len,
+        return_lse=True,
+    )
+    torch.testing.assert_close(o, o_ref, rtol=1e-4, atol=1e-4)
+    torch.testing.assert_close(lse, lse_ref, rtol=1e-4, atol=1e-4)
+
+    # the two-launch decomposition of the CUDA backends
+    o, lse = _single_prefill_prefix_lm(
+        functools.partial(
+            flashinfer.single_prefill_with_kv_cache,
+            kv_layout=kv_layout,
+            return_lse=True,
+            backend="torch",
+        ),
+        q,
+        k_in,
+        v_in,
+        kv_layout,
+        prefix_len,
+        True,
+    )
+    torch.testing.assert_close(o, o_ref, rtol=1e-4, atol=1e-4)
+    torch.testing.assert_close(lse, lse_ref, rtol=1e-4, atol=1e-4)
@@ -0,0 +1,128 @@
+"""
+Copyright (c) 2025 by FlashInfer team.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import pytest
+import torch
+
+import flashinfer
+
+
+@pytest.mark.parametrize("kv_layout", ["NHD", "HND"])
+@pytest.mark.parametrize("use_tuple", [False, True])
+@pytest.mark.parametrize("dtype", [torch.float16, torch.bfloat16, torch.float8_e4m3fn])
+def test_paged_kv_cache_snapshot(tmp_path, kv_layout, use_tuple, dtype):
+    torch.manual_seed(42)
+    max_num_pages = 64
+    page_size = 4
+    num_kv_heads = 2
+    head_dim = 16
+    page_shape = (
+        (page_size, num_kv_heads, head_dim)
+        if kv_layout == "NHD"
+        else (num_kv_heads, page_size, head_dim)
+    )
+    kv_data = torch.randn(max_num_pages, 2, *page_shape).to(dtype)
+    if use_tuple:
+        kv_cache = (kv_data[:, 0].clone(), kv_data[:, 1].clone())
+    else:
+        kv_cache = kv_data
+    # the third request shares its first page with the first one
+    kv_indptr = torch.tensor([0, 3, 4, 8], dtype=torch.int32)
+    kv_indices = torch.tensor([5, 2, 9, 40, 5, 11, 12, 63], dtype=torch.int32)
+    kv_last_page_len = torch.tensor([4, 1, 3], dtype=torch.int32)
+
+    path = tmp_path / "kv.snapshot"
+    flashinfer.save_paged_kv_cache_snapshot(
+        path,
+        kv_cache,
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        kv_layout=kv_layout,
+        chunk_pages=3,
+    )
+
+    with flashinfer.load_paged_kv_cache_snapshot(path) as snapshot:
+        assert snapshot.kv_layout == kv_layout
+        assert snapshot.dtype == dtype
+        assert snapshot.page_size == page_size
+        assert snapshot.num_kv_heads == num_kv_heads
+        assert snapshot.head_dim == head_dim
+        assert snapshot.batch_size == 3
+        assert snapshot.num_pages == 7
+        assert torch.equal(snapshot.kv_indptr, kv_indptr)
+        assert torch.equal(snapshot.kv_indices, kv_indices)
+        assert torch.equal(snapshot.kv_last_page_len, kv_last_page_len)
+
+        # selective restore of a single request into different page slots
+        new_kv_data = torch.zeros_like(kv_data)
+        new_kv_cache = (
+            (new_kv_data[:, 0], new_kv_data[:, 1]) if use_tuple else new_kv_data
+        )
+        src_pages = snapshot.request_page_ids(2)
+        dst_pages = torch.tensor([0, 1, 2, 3], dtype=torch.int32)
+        snapshot.restore(new_kv_cache, src_pages, dst_pages)
+        assert torch.equal(
+            new_kv_data[:4].view(torch.uint8),
+            kv_data[src_pages.long()].view(torch.uint8),
+        )
+        assert not new_kv_data[4:].view(torch.uint8).any()
+
+        # full restore to the original page slots
+        new_kv_data.zero_()
+        snapshot.restore(new_kv_cache)
+        used = torch.unique(kv_indices).long()
+        assert torch.equal(
+            new_kv_data[used].view(torch.uint8), kv_data[used].view(torch.uint8)
+        )
+
+        with pytest.raises(ValueError):
+            snapshot.pages(torch.tensor([1], dtype=torch.int32))
+
+
+def test_paged_kv_cache_snapshot_after_close(tmp_path):
+    torch.manual_seed(42)
+    kv_data = torch.randn(16, 2, 4, 2, 8).half()
+    kv_indptr = torch.tensor([0, 2, 5], dtype=torch.int32)
+    kv_indices = torch.tensor([3, 1, 7, 8, 9], dtype=torch.int32)
+    kv_last_page_len = torch.tensor([3, 4], dtype=torch.int32)
+    path = tmp_path / "kv.snapshot"
+    flashinfer.save_paged_kv_cache_snapshot(
+        path, kv_data, kv_indptr, kv_indices, kv_last_page_len
+    )
+
+    with flashinfer.load_paged_kv_cache_snapshot(path) as snapshot:
+        ids = snapshot.request_page_ids(1)
+        pages = snapshot.pages()
+        some_pages = snapshot.pages(ids)
+    # the page tables are copies, the views of the pages keep the file mapped
+    assert torch.equal(ids, kv_indices[2:])
+    assert torch.equal(snapshot.kv_indptr, kv_indptr)
+    assert torch.equal(pages, kv_data[snapshot.page_ids.long()])
+    assert torch.equal(some_pages, kv_data[kv_indices[2:].long()])
+    with pytest.raises(ValueError):
+        snapshot.pages()
+    snapshot.close()
+    del pages
+
+
+if __name__ == "__main__":
+    import pathlib
+    import tempfile
+
+    test_paged_kv_cache_snapshot(
+        pathlib.Path(tempfile.mkdtemp()), "NHD", False, torch.float16
+    )
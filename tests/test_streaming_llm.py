@@ -0,0 +1,102 @@
+"""
+Copyright (c) 2025 by FlashInfer team.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import math
+
+import pytest
+import torch
+from rope_reference import apply_rotary_pos_emb, generate_cos_sin_f32_cache
+
+import flashinfer
+from flashinfer.torch_attention import paged_attention_torch
+
+
+@pytest.mark.parametrize("page_size", [1, 4, 16])
+@pytest.mark.parametrize("num_sink_tokens", [0, 4])
+@pytest.mark.parametrize("window_left", [8, 31])
+@pytest.mark.parametrize("kv_layout", ["NHD", "HND"])
+def test_streaming_llm_retained_cache(
+    page_size, num_sink_tokens, window_left, kv_layout
+):
+    torch.manual_seed(42)
+    num_qo_heads, num_kv_heads, head_dim = 4, 2, 32
+    kv_lens = torch.tensor([3, 45, 100, 129])
+    batch_size = len(kv_lens)
+    num_pages = (kv_lens + page_size - 1) // page_size
+    kv_indptr = torch.zeros(batch_size + 1, dtype=torch.int32)
+    kv_indptr[1:] = torch.cumsum(num_pages, 0)
+    max_num_pages = kv_indptr[-1].item()
+    kv_indices = torch.randperm(max_num_pages).int()
+    kv_last_page_len = ((kv_lens - 1) % page_size + 1).int()
+    if kv_layout == "NHD":
+        kv_data = torch.randn(max_num_pages, 2, page_size, num_kv_heads, head_dim)
+    else:
+        kv_data = torch.randn(max_num_pages, 2, num_kv_heads, page_size, head_dim)
+    q = torch.randn(batch_size, num_qo_heads, head_dim)
+
+    kv_indptr, kv_indices, kv_last_page_len, released, kv_offsets = (
+        flashinfer.retain_sink_and_window_pages(
+            kv_indptr,
+            kv_indices,
+            kv_last_page_len,
+            page_size,
+            num_sink_tokens,
+            window_left,
+        )
+    )
+    retained_kv_lens = flashinfer.get_seq_lens(kv_indptr, kv_last_page_len, page_size)
+    assert torch.equal(retained_kv_lens, kv_lens - kv_offsets)
+    assert len(released) + len(kv_indices) == max_num_pages
+    num_sink_pages = -(-num_sink_tokens // page_size)
+    # memory is bounded by the sink and the window
+    assert torch.all(
+        kv_indptr[1:] - kv_indptr[:-1]
+        <= num_sink_pages + -(-(window_left + 1) // page_size) + 1
+    )
+
+    o = paged_attention_torch(
+        q,
+        kv_data,
+        torch.arange(batch_size + 1),
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        kv_layout=kv_layout,
+        pos_encoding_mode="ROPE_LLAMA",
+    )
+
+    # explicitly apply rope with positions re-based to the retained cache
+    cos, sin = generate_cos_sin_f32_cache(256, head_dim)
+    for i in range(batch_size):
+        pages = kv_indices[kv_indptr[i] : kv_indptr[i + 1]].long()
+        kv = kv_data[pages] if kv_layout == "NHD" else kv_data[pages].transpose(2, 3)
+        k, v = kv[:, 0].flatten(0, 1), kv[:, 1].flatten(0, 1)
+        kv_len = retained_kv_lens[i].item()
+        k, v = k[:kv_len], v[:kv_len]
+        q_i, _ = apply_rotary_pos_emb(
+            q[i : i + 1],
+            q[i : i + 1],
+            cos[kv_len - 1 : kv_len],
+            sin[kv_len - 1 : kv_len],
+        )
+        k, _ = apply_rotary_pos_emb(k, k, cos[:kv_len], sin[:kv_len])
+        k = k.repeat_interleave(num_qo_heads // num_kv_heads, dim=1)
+        v = v.repeat_interleave(num_qo_heads // num_kv_heads, dim=1)
+        p = torch.softmax(
+            torch.einsum("qhd,khd->hqk", q_i, k) / math.sqrt(head_dim), dim=-1
+        )
+        o_ref = torch.einsum("hqk,khd->qhd", p, v)
+        torch.testing.assert_close(o[i : i + 1], o_ref, rtol=1e-4, atol=1e-4)
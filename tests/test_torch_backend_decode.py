@@ -0,0 +1,222 @@
+"""
+Copyright (c) 2025 by FlashInfer team.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import pytest
+import torch
+from attention_reference import make_paged_kv
+
+import flashinfer
+from flashinfer.torch_attention import (
+    _batch_decode_torch,
+    _partition_requests,
+    paged_attention_torch,
+)
+
+
+@pytest.mark.parametrize("page_size", [1, 5, 16])
+@pytest.mark.parametrize("kv_layout", ["NHD", "HND"])
+@pytest.mark.parametrize("pos_encoding_mode", ["NONE", "ROPE_LLAMA", "ALIBI"])
+@pytest.mark.parametrize("window_left", [-1, 7])
+@pytest.mark.parametrize("logits_soft_cap", [0.0, 8.0])
+def test_batch_decode_torch_backend(
+    page_size, kv_layout, pos_encoding_mode, window_left, logits_soft_cap
+):
+    torch.manual_seed(42)
+    num_qo_heads, num_kv_heads, head_dim = 8, 2, 32
+    kv_lens = torch.tensor([1, 17, 64, 33, 120])
+    kv_data, kv_indptr, kv_indices, kv_last_page_len = make_paged_kv(
+        kv_lens, page_size, num_kv_heads, head_dim, kv_layout
+    )
+    q = torch.randn(len(kv_lens), num_qo_heads, head_dim)
+    wrapper = flashinfer.BatchDecodeWithPagedKVCacheWrapper(
+        torch.empty(0, dtype=torch.uint8), kv_layout, backend="torch"
+    )
+    wrapper.plan(
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        num_qo_heads,
+        num_kv_heads,
+        head_dim,
+        page_size,
+        pos_encoding_mode=pos_encoding_mode,
+        window_left=window_left,
+        logits_soft_cap=logits_soft_cap,
+        q_data_type=torch.float32,
+    )
+    o, lse = wrapper.run(q, kv_data, return_lse=True)
+    o_ref, lse_ref = paged_attention_torch(
+        q,
+        kv_data,
+        torch.arange(len(kv_lens) + 1),
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        kv_layout=kv_layout,
+        causal=False,
+        pos_encoding_mode=pos_encoding_mode,
+        window_left=window_left,
+        logits_soft_cap=logits_soft_cap,
+        return_lse=True,
+    )
+    torch.testing.assert_close(o, o_ref, rtol=1e-4, atol=1e-4)
+    torch.testing.assert_close(lse, lse_ref, rtol=1e-4, atol=1e-4)
+
+
+def test_batch_decode_torch_backend_per_request_params():
+    torch.manual_seed(42)
+    num_qo_heads, num_kv_heads, head_dim, page_size = 4, 4, 64, 8
+    kv_lens = torch.tensor([50, 3, 77, 20])
+    kv_data, kv_indptr, kv_indices, kv_last_page_len = make_paged_kv(
+        kv_lens, page_size, num_kv_heads, head_dim, "NHD"
+    )
+    q = torch.randn(len(kv_lens), num_qo_heads, head_dim).half()
+    kv_data = kv_data.half()
+    window_left = torch.tensor([9, -1, 30, 0], dtype=torch.int32)
+    logits_soft_cap = torch.tensor([0.0, 5.0, 30.0, 0.0])
+    wrapper = flashinfer.BatchDecodeWithPagedKVCacheWrapper(
+        torch.empty(0, dtype=torch.uint8), backend="torch"
+    )
+    wrapper.plan(
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        num_qo_heads,
+        num_kv_heads,
+        head_dim,
+        page_size,
+        window_left=window_left,
+        logits_soft_cap=logits_soft_cap,
+    )
+    o = wrapper.run(q, kv_data)
+    o_ref = paged_attention_torch(
+        q,
+        kv_data,
+        torch.arange(len(kv_lens) + 1),
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        causal=False,
+        window_left=window_left,
+        logits_soft_cap=logits_soft_cap,
+    )
+    torch.testing.assert_close(o, o_ref, rtol=1e-3, atol=1e-3)
+
+
+@pytest.mark.parametrize("per_page_scale", [False, True])
+def test_batch_decode_torch_backend_fp8(per_page_scale):
+    torch.manual_seed(42)
+    num_qo_heads, num_kv_heads, head_dim, page_size = 8, 2, 64, 4
+    kv_lens = torch.tensor([9, 30, 1])
+    kv_data, kv_indptr, kv_indices, kv_last_page_len = make_paged_kv(
+        kv_lens, page_size, num_kv_heads, head_dim, "NHD"
+    )
+    q = torch.randn(len(kv_lens), num_qo_heads, head_dim)
+    kv_fp8 = kv_data.to(torch.float8_e4m3fn)
+    if per_page_scale:
+        k_scale = torch.rand(kv_data.shape[0]) + 0.5
+        v_scale = torch.rand(kv_data.shape[0]) + 0.5
+        kv_ref = kv_fp8.float()
+        kv_ref[:, 0] *= k_scale[:, None, None, None]
+        kv_ref[:, 1] *= v_scale[:, None, None, None]
+    else:
+        k_scale, v_scale = 0.5, 2.0
+        kv_ref = kv_fp8.float()
+        kv_ref[:, 0] *= k_scale
+        kv_ref[:, 1] *= v_scale
+    wrapper = flashinfer.BatchDecodeWithPagedKVCacheWrapper(
+        torch.empty(0, dtype=torch.uint8), backend="torch"
+    )
+    wrapper.plan(
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        num_qo_heads,
+        num_kv_heads,
+        head_dim,
+        page_size,
+        q_data_type=torch.float32,
+        kv_data_type=torch.float8_e4m3fn,
+    )
+    o = wrapper.run(q, kv_fp8, k_scale=k_scale, v_scale=v_scale)
+    o_ref = paged_attention_torch(
+        q,
+        kv_ref,
+        torch.arange(len(kv_lens) + 1),
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        causal=False,
+    )
+    torch.testing.assert_close(o, o_ref, rtol=1e-4, atol=1e-4)
+
+
+def test_batch_decode_torch_backend_invalid_args():
+    with pytest.raises(KeyError):
+        flashinfer.BatchDecodeWithPagedKVCacheWrapper(
+            torch.empty(0, dtype=torch.uint8), backend="fa3"
+        )
+    with pytest.raises(ValueError):
+        flashinfer.BatchDecodeWithPagedKVCacheWrapper(
+            torch.empty(0, dtype=torch.uint8),
+            use_cuda_graph=True,
+            backend="torch",
+        )
+
+
+@pytest.mark.parametrize("num_workers", [2, 3, 8])
+def test_batch_decode_torch_thread_pool(num_workers):
+    torch.manual_seed(42)
+    num_qo_heads, num_kv_heads, head_dim, page_size = 4, 2, 32, 4
+    kv_lens = torch.tensor([3, 90, 1, 17, 40, 6, 60])
+    kv_data, kv_indptr, kv_indices, kv_last_page_len = make_paged_kv(
+        kv_lens, page_size, num_kv_heads, head_dim, "NHD"
+    )
+    q = torch.randn(len(kv_lens), num_qo_heads, head_dim)
+    assert _partition_requests([5, 1, 1, 5], 2) == [(0, 2), (2, 4)]
+    k_cache, v_cache = kv_data.unbind(1)
+    out = torch.empty_like(q)
+    lse = torch.empty(q.shape[:2])
+    _batch_decode_torch(
+        q,
+        k_cache,
+        v_cache,
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        "NHD",
+        "NONE",
+        -1,
+        0.0,
+        head_dim**-0.5,
+        1.0,
+        1e4,
+        out,
+        lse,
+        num_workers=num_workers,
+    )
+    o_ref, lse_ref = paged_attention_torch(
+        q,
+        kv_data,
+        torch.arange(len(kv_lens) + 1),
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        causal=False,
+        return_lse=True,
+    )
+    torch.testing.assert_close(out, o_ref, rtol=1e-4, atol=1e-4)
+    torch.testing.assert_close(lse, lse_ref, rtol=1e-4, atol=1e-4)
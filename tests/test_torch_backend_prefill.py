@@ -0,0 +1,737 @@
+"""
+Copyright (c) 2025 by FlashInfer team.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import math
+
+import pytest
+import torch
+from attention_reference import get_indptr, make_paged_kv, masked_attention_ref
+
+import flashinfer
+from flashinfer.prefill import _get_segment_mask
+from flashinfer.torch_attention import (
+    _batch_prefill_torch,
+    _segment_packbits_torch,
+    _single_prefill_torch,
+    paged_attention_torch,
+)
+
+
+@pytest.mark.parametrize("page_size", [1, 5, 16])
+@pytest.mark.parametrize("kv_layout", ["NHD", "HND"])
+@pytest.mark.parametrize("causal", [False, True])
+@pytest.mark.parametrize("pos_encoding_mode", ["NONE", "ROPE_LLAMA", "ALIBI"])
+@pytest.mark.parametrize("window_left", [-1, 9])
+@pytest.mark.parametrize("logits_soft_cap", [0.0, 8.0])
+def test_batch_prefill_paged_torch_backend(
+    page_size, kv_layout, causal, pos_encoding_mode, window_left, logits_soft_cap
+):
+    torch.manual_seed(42)
+    num_qo_heads, num_kv_heads, head_dim = 8, 2, 32
+    qo_lens = torch.tensor([1, 17, 40, 5])
+    kv_lens = torch.tensor([1, 30, 40, 77])
+    qo_indptr = get_indptr(qo_lens)
+    kv_data, kv_indptr, kv_indices, kv_last_page_len = make_paged_kv(
+        kv_lens, page_size, num_kv_heads, head_dim, kv_layout
+    )
+    q = torch.randn(qo_indptr[-1].item(), num_qo_heads, head_dim)
+    wrapper = flashinfer.BatchPrefillWithPagedKVCacheWrapper(
+        torch.empty(0, dtype=torch.uint8), kv_layout, backend="torch"
+    )
+    wrapper.plan(
+        qo_indptr,
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        num_qo_heads,
+        num_kv_heads,
+        head_dim,
+        page_size,
+        causal=causal,
+        pos_encoding_mode=pos_encoding_mode,
+        window_left=window_left,
+        logits_soft_cap=logits_soft_cap,
+        q_data_type=torch.float32,
+    )
+    o, lse = wrapper.run(q, kv_data, return_lse=True)
+    o_ref, lse_ref = paged_attention_torch(
+        q,
+        kv_data,
+        qo_indptr,
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        kv_layout=kv_layout,
+        causal=causal,
+        pos_encoding_mode=pos_encoding_mode,
+        window_left=window_left,
+        logits_soft_cap=logits_soft_cap,
+        return_lse=True,
+    )
+    torch.testing.assert_close(o, o_ref, rtol=1e-4, atol=1e-4)
+    torch.testing.assert_close(lse, lse_ref, rtol=1e-4, atol=1e-4)
+
+
+def test_batch_prefill_paged_torch_backend_custom_mask():
+    torch.manual_seed(42)
+    num_qo_heads, num_kv_heads, head_dim, page_size = 4, 4, 64, 4
+    qo_lens = torch.tensor([7, 1, 20])
+    kv_lens = torch.tensor([13, 9, 20])
+    qo_indptr = get_indptr(qo_lens)
+    kv_data, kv_indptr, kv_indices, kv_last_page_len = make_paged_kv(
+        kv_lens, page_size, num_kv_heads, head_dim, "NHD"
+    )
+    q = torch.randn(qo_indptr[-1].item(), num_qo_heads, head_dim)
+    masks = [
+        torch.rand(qo_len, kv_len) > 0.3 for qo_len, kv_len in zip(qo_lens, kv_lens)
+    ]
+    # a query row without any visible kv
+    masks[0][3] = False
+    wrapper = flashinfer.BatchPrefillWithPagedKVCacheWrapper(
+        torch.empty(0, dtype=torch.uint8), backend="torch"
+    )
+    wrapper.plan(
+        qo_indptr,
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        num_qo_heads,
+        num_kv_heads,
+        head_dim,
+        page_size,
+        custom_mask=torch.cat([mask.flatten() for mask in masks]),
+        causal=True,  # overridden by the custom mask
+        q_data_type=torch.float32,
+    )
+    o, lse = wrapper.run(q, kv_data, return_lse=True)
+    k_cache, v_cache = kv_data[:, 0], kv_data[:, 1]
+    for i in range(len(qo_lens)):
+        pages = kv_indices[kv_indptr[i] : kv_indptr[i + 1]].long()
+        k = k_cache[pages].flatten(0, 1)[: kv_lens[i]]
+        v = v_cache[pages].flatten(0, 1)[: kv_lens[i]]
+        o_ref, lse_ref = masked_attention_ref(
+            q[qo_indptr[i] : qo_indptr[i + 1]], k, v, masks[i]
+        )
+        torch.testing.assert_close(
+            o[qo_indptr[i] : qo_indptr[i + 1]], o_ref, rtol=1e-4, atol=1e-4
+        )
+        torch.testing.assert_close(
+            lse[qo_indptr[i] : qo_indptr[i + 1]], lse_ref, rtol=1e-4, atol=1e-4
+        )
+
+
+def test_batch_prefill_paged_torch_backend_per_request_params():
+    torch.manual_seed(42)
+    num_qo_heads, num_kv_heads, head_dim, page_size = 4, 2, 32, 8
+    qo_lens = torch.tensor([5, 12, 1])
+    kv_lens = torch.tensor([50, 12, 33])
+    qo_indptr = get_indptr(qo_lens)
+    kv_data, kv_indptr, kv_indices, kv_last_page_len = make_paged_kv(
+        kv_lens, page_size, num_kv_heads, head_dim, "NHD"
+    )
+    q = torch.randn(qo_indptr[-1].item(), num_qo_heads, head_dim)
+    window_left = torch.tensor([4, -1, 10], dtype=torch.int32)
+    logits_soft_cap = torch.tensor([0.0, 5.0, 30.0])
+    wrapper = flashinfer.BatchPrefillWithPagedKVCacheWrapper(
+        torch.empty(0, dtype=torch.uint8), backend="torch"
+    )
+    wrapper.plan(
+        qo_indptr,
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        num_qo_heads,
+        num_kv_heads,
+        head_dim,
+        page_size,
+        causal=True,
+        window_left=window_left,
+        logits_soft_cap=logits_soft_cap,
+        q_data_type=torch.float32,
+    )
+    o = wrapper.run(q, kv_data)
+    o_ref = paged_attention_torch(
+        q,
+        kv_data,
+        qo_indptr,
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        window_left=window_left,
+        logits_soft_cap=logits_soft_cap,
+    )
+    torch.testing.assert_close(o, o_ref, rtol=1e-4, atol=1e-4)
+
+
+@pytest.mark.parametrize("causal", [False, True])
+@pytest.mark.parametrize("use_custom_mask", [False, True])
+@pytest.mark.parametrize("kv_layout", ["NHD", "HND"])
+def test_batch_prefill_ragged_torch_backend(causal, use_custom_mask, kv_layout):
+    torch.manual_seed(42)
+    num_qo_heads, num_kv_heads, head_dim_qk, head_dim_vo = 8, 4, 64, 32
+    qo_lens = torch.tensor([3, 33, 1, 16])
+    kv_lens = torch.tensor([10, 33, 65, 16])
+    qo_indptr = get_indptr(qo_lens)
+    kv_indptr = get_indptr(kv_lens)
+    q = torch.randn(qo_indptr[-1].item(), num_qo_heads, head_dim_qk).half()
+    k = torch.randn(kv_indptr[-1].item(), num_kv_heads, head_dim_qk).half()
+    v = torch.randn(kv_indptr[-1].item(), num_kv_heads, head_dim_vo).half()
+    masks = []
+    for qo_len, kv_len in zip(qo_lens.tolist(), kv_lens.tolist()):
+        if use_custom_mask:
+            masks.append(torch.rand(qo_len, kv_len) > 0.5)
+        elif causal:
+            q_pos = torch.arange(kv_len - qo_len, kv_len)
+            masks.append(torch.arange(kv_len)[None, :] <= q_pos[:, None])
+        else:
+            masks.append(torch.ones(qo_len, kv_len, dtype=torch.bool))
+    wrapper = flashinfer.BatchPrefillWithRaggedKVCacheWrapper(
+        torch.empty(0, dtype=torch.uint8), kv_layout=kv_layout, backend="torch"
+    )
+    wrapper.plan(
+        qo_indptr,
+        kv_indptr,
+        num_qo_heads,
+        num_kv_heads,
+        head_dim_qk,
+        head_dim_vo=head_dim_vo,
+        custom_mask=(
+            torch.cat([mask.flatten() for mask in masks]) if use_custom_mask else None
+        ),
+        causal=causal,
+        q_data_type=torch.float16,
+    )
+    if kv_layout == "HND":
+        k_in, v_in = k.transpose(0, 1).contiguous(), v.transpose(0, 1).contiguous()
+    else:
+        k_in, v_in = k, v
+    o, lse = wrapper.run(q, k_in, v_in, return_lse=True)
+    for i in range(len(qo_lens)):
+        o_ref, lse_ref = masked_attention_ref(
+            q[qo_indptr[i] : qo_indptr[i + 1]],
+            k[kv_indptr[i] : kv_indptr[i + 1]],
+            v[kv_indptr[i] : kv_indptr[i + 1]],
+            masks[i],
+        )
+        torch.testing.assert_close(
+            o[qo_indptr[i] : qo_indptr[i + 1]].float(), o_ref, rtol=2e-3, atol=2e-3
+        )
+        torch.testing.assert_close(
+            lse[qo_indptr[i] : qo_indptr[i + 1]], lse_ref, rtol=1e-3, atol=1e-3
+        )
+
+
+@pytest.mark.parametrize("qo_tile_size", [1, 7, 128])
+@pytest.mark.parametrize("kv_tile_size", [1, 16, 512])
+@pytest.mark.parametrize("num_workers", [1, 4])
+def test_batch_prefill_torch_tiling(qo_tile_size, kv_tile_size, num_workers):
+    torch.manual_seed(42)
+    num_qo_heads, num_kv_heads, head_dim = 4, 2, 32
+    qo_lens = torch.tensor([20, 1, 45])
+    kv_lens = torch.tensor([60, 7, 45])
+    qo_indptr = get_indptr(qo_lens)
+    kv_indptr = get_indptr(kv_lens)
+    q = torch.randn(qo_indptr[-1].item(), num_qo_heads, head_dim)
+    k = torch.randn(kv_indptr[-1].item(), num_kv_heads, head_dim)
+    v = torch.randn(kv_indptr[-1].item(), num_kv_heads, head_dim)
+    masks = [
+        torch.rand(qo_len, kv_len) > 0.2 for qo_len, kv_len in zip(qo_lens, kv_lens)
+    ]
+    mask_indptr = get_indptr(qo_lens * kv_lens)
+    packed_mask, packed_mask_indptr = _segment_packbits_torch(
+        torch.cat([mask.flatten() for mask in masks]), mask_indptr, bitorder="little"
+    )
+    out = torch.empty_like(q)
+    lse = torch.empty(q.shape[:2])
+    kv_indptr_list = kv_indptr.tolist()
+    _batch_prefill_torch(
+        q,
+        qo_indptr,
+        kv_lens.tolist(),
+        lambda i, begin, end: (
+            k[kv_indptr_list[i] + begin : kv_indptr_list[i] + end],
+            v[kv_indptr_list[i] + begin : kv_indptr_list[i] + end],
+        ),
+        False,
+        packed_mask,
+        packed_mask_indptr,
+        "NONE",
+        -1,
+        0.0,
+        1.0 / math.sqrt(head_dim),
+        1.0,
+        1e4,
+        out,
+        lse,
+        qo_tile_size=qo_tile_size,
+        kv_tile_size=kv_tile_size,
+        num_workers=num_workers,
+    )
+    for i in range(len(qo_lens)):
+        o_ref, lse_ref = masked_attention_ref(
+            q[qo_indptr[i] : qo_indptr[i + 1]],
+            k[kv_indptr[i] : kv_indptr[i + 1]],
+            v[kv_indptr[i] : kv_indptr[i + 1]],
+            masks[i],
+        )
+        torch.testing.assert_close(
+            out[qo_indptr[i] : qo_indptr[i + 1]], o_ref, rtol=1e-4, atol=1e-4
+        )
+        torch.testing.assert_close(
+            lse[qo_indptr[i] : qo_indptr[i + 1]], lse_ref, rtol=1e-4, atol=1e-4
+        )
+
+
+@pytest.mark.parametrize("kv_layout", ["NHD", "HND"])
+@pytest.mark.parametrize("causal", [False, True])
+@pytest.mark.parametrize("pos_encoding_mode", ["NONE", "ROPE_LLAMA", "ALIBI"])
+@pytest.mark.parametrize("window_left", [-1, 9])
+@pytest.mark.parametrize("logits_soft_cap", [0.0, 8.0])
+def test_single_prefill_torch_backend(
+    kv_layout, causal, pos_encoding_mode, window_left, logits_soft_cap
+):
+    torch.manual_seed(42)
+    qo_len, kv_len, num_qo_heads, num_kv_heads, head_dim = 37, 150, 8, 2, 32
+    q = torch.randn(qo_len, num_qo_heads, head_dim)
+    k = torch.randn(kv_len, num_kv_heads, head_dim)
+    v = torch.randn(kv_len, num_kv_heads, head_dim)
+    o, lse = flashinfer.single_prefill_with_kv_cache(
+        q,
+        k if kv_layout == "NHD" else k.transpose(0, 1).contiguous(),
+        v if kv_layout == "NHD" else v.transpose(0, 1).contiguous(),
+        causal=causal,
+        kv_layout=kv_layout,
+        pos_encoding_mode=pos_encoding_mode,
+        window_left=window_left,
+        logits_soft_cap=logits_soft_cap,
+        return_lse=True,
+    )
+    o_ref, lse_ref = paged_attention_torch(
+        q,
+        torch.stack([k, v], dim=1)[:, :, None],
+        torch.tensor([0, qo_len]),
+        torch.tensor([0, kv_len]),
+        torch.arange(kv_len),
+        torch.tensor([1]),
+        causal=causal,
+        pos_encoding_mode=pos_encoding_mode,
+        window_left=window_left,
+        logits_soft_cap=logits_soft_cap,
+        return_lse=True,
+    )
+    torch.testing.assert_close(o, o_ref, rtol=1e-4, atol=1e-4)
+    torch.testing.assert_close(lse, lse_ref, rtol=1e-4, atol=1e-4)
+
+
+@pytest.mark.parametrize("qo_tile_size", [1, 16, 128])
+@pytest.mark.parametrize("kv_tile_size", [7, 512])
+@pytest.mark.parametrize("num_workers", [1, 4])
+@pytest.mark.parametrize("use_packed_mask", [False, True])
+def test_single_prefill_torch_tiling(
+    qo_tile_size, kv_tile_size, num_workers, use_packed_mask
+):
+    torch.manual_seed(42)
+    qo_len, kv_len, num_qo_heads, num_kv_heads, head_dim = 50, 90, 6, 3, 16
+    q = torch.randn(qo_len, num_qo_heads, head_dim)
+    k = torch.randn(kv_len, num_kv_heads, head_dim)
+    v = torch.randn(kv_len, num_kv_heads, 24)
+    mask = torch.rand(qo_len, kv_len) > 0.3
+    mask[3] = False
+    if use_packed_mask:
+        o = flashinfer.single_prefill_with_kv_cache(
+            q,
+            k,
+            v,
+            packed_custom_mask=_segment_packbits_torch(
+                mask.flatten(), get_indptr(torch.tensor([mask.numel()])), "little"
+            )[0],
+            backend="torch",
+        )
+        o_ref, _ = masked_attention_ref(q, k, v, mask)
+        torch.testing.assert_close(o, o_ref, rtol=1e-4, atol=1e-4)
+        return
+    out = torch.empty(qo_len, num_qo_heads, 24)
+    lse = torch.empty(qo_len, num_qo_heads)
+    _single_prefill_torch(
+        q,
+        k,
+        v,
+        True,
+        None,
+        "NHD",
+        "NONE",
+        -1,
+        0.0,
+        1.0 / math.sqrt(head_dim),
+        1.0,
+        1e4,
+        out,
+        lse,
+        qo_tile_size=qo_tile_size,
+        kv_tile_size=kv_tile_size,
+        num_workers=num_workers,
+    )
+    causal_mask = (
+        torch.arange(kv_len)[None, :] <= torch.arange(kv_len - qo_len, kv_len)[:, None]
+    )
+    o_ref, lse_ref = masked_attention_ref(q, k, v, causal_mask)
+    torch.testing.assert_close(out, o_ref, rtol=1e-4, atol=1e-4)
+    torch.testing.assert_close(lse, lse_ref, rtol=1e-4, atol=1e-4)
+
+
+def test_single_prefill_torch_backend_custom_mask():
+    torch.manual_seed(42)
+    qo_len, kv_len, num_heads, head_dim = 20, 33, 4, 32
+    q = torch.randn(qo_len, num_heads, head_dim)
+    k = torch.randn(kv_len, num_heads, head_dim)
+    v = torch.randn(kv_len, num_heads, head_dim)
+    mask = torch.rand(qo_len, kv_len) > 0.5
+    # the custom mask overrides causal
+    o = flashinfer.single_prefill_with_kv_cache(q, k, v, custom_mask=mask, causal=True)
+    o_ref, _ = masked_attention_ref(q, k, v, mask)
+    torch.testing.assert_close(o, o_ref, rtol=1e-4, atol=1e-4)
+
+
+def _make_segment_ids(qo_lens, kv_lens):
+    # documents packed into each request, the queries are the last tokens of the kv
+    qo_segment_ids, kv_segment_ids = [], []
+    for qo_len, kv_len in zip(qo_lens.tolist(), kv_lens.tolist()):
+        seg = torch.sort(torch.randint(0, 4, (kv_len,), dtype=torch.int32)).values
+        kv_segment_ids.append(seg)
+        qo_segment_ids.append(seg[kv_len - qo_len :])
+    return torch.cat(qo_segment_ids), torch.cat(kv_segment_ids)
+
+
+@pytest.mark.parametrize("paged", [False, True])
+@pytest.mark.parametrize("causal", [False, True])
+def test_batch_prefill_torch_backend_segment_ids(paged, causal):
+    torch.manual_seed(42)
+    num_qo_heads, num_kv_heads, head_dim, page_size = 4, 2, 32, 8
+    qo_lens = torch.tensor([13, 1, 40])
+    kv_lens = torch.tensor([30, 9, 40])
+    qo_indptr = get_indptr(qo_lens)
+    kv_indptr = get_indptr(kv_lens)
+    q = torch.randn(qo_indptr[-1].item(), num_qo_heads, head_dim)
+    k = torch.randn(kv_indptr[-1].item(), num_kv_heads, head_dim)
+    v = torch.randn(kv_indptr[-1].item(), num_kv_heads, head_dim)
+    qo_segment_ids, kv_segment_ids = _make_segment_ids(qo_lens, kv_lens)
+    workspace = torch.empty(0, dtype=torch.uint8)
+    if paged:
+        kv_data, page_indptr, kv_indices, kv_last_page_len = make_paged_kv(
+            kv_lens, page_size, num_kv_heads, head_dim, "NHD"
+        )
+        # the reference reads the kv of the requests from the pages
+        k = torch.cat(
+            [
+                kv_data[kv_indices[page_indptr[i] : page_indptr[i + 1]], 0].flatten(
+                    0, 1
+                )[:kv_len]
+                for i, kv_len in enumerate(kv_lens.tolist())
+            ]
+        )
+        v = torch.cat(
+            [
+                kv_data[kv_indices[page_indptr[i] : page_indptr[i + 1]], 1].flatten(
+                    0, 1
+                )[:kv_len]
+                for i, kv_len in enumerate(kv_lens.tolist())
+            ]
+        )
+        wrapper = flashinfer.BatchPrefillWithPagedKVCacheWrapper(
+            workspace, backend="torch"
+        )
+        wrapper.plan(
+            qo_indptr,
+            page_indptr,
+            kv_indices,
+            kv_last_page_len,
+            num_qo_heads,
+            num_kv_heads,
+            head_dim,
+            page_size,
+            causal=causal,
+            q_data_type=torch.float32,
+            qo_segment_ids=qo_segment_ids,
+            kv_segment_ids=kv_segment_ids,
+        )
+        o, lse = wrapper.run(q, kv_data, return_lse=True)
+    else:
+        wrapper = flashinfer.BatchPrefillWithRaggedKVCacheWrapper(
+            workspace, backend="torch"
+        )
+        wrapper.plan(
+            qo_indptr,
+            kv_indptr,
+            num_qo_heads,
+            num_kv_heads,
+            head_dim,
+            causal=causal,
+            q_data_type=torch.float32,
+            qo_segment_ids=qo_segment_ids,
+            kv_segment_ids=kv_segment_ids,
+        )
+        o, lse = wrapper.run(q, k, v, return_lse=True)
+
+    masks = []
+    for i in range(len(qo_lens)):
+        qo_len, kv_len = qo_lens[i].item(), kv_lens[i].item()
+        mask = (
+            qo_segment_ids[qo_indptr[i] : qo_indptr[i + 1], None]
+            == kv_segment_ids[None, kv_indptr[i] : kv_indptr[i + 1]]
+        )
+        if causal:
+            mask &= (
+                torch.arange(kv_len)[None, :]
+                <= torch.arange(kv_len - qo_len, kv_len)[:, None]
+            )
+        masks.append(mask)
+        o_ref, lse_ref = masked_attention_ref(
+            q[qo_indptr[i] : qo_indptr[i + 1]],
+            k[kv_indptr[i] : kv_indptr[i + 1]],
+            v[kv_indptr[i] : kv_indptr[i + 1]],
+            mask,
+        )
+        torch.testing.assert_close(
+            o[qo_indptr[i] : qo_indptr[i + 1]], o_ref, rtol=1e-4, atol=1e-4
+        )
+        torch.testing.assert_close(
+            lse[qo_indptr[i] : qo_indptr[i + 1]], lse_ref, rtol=1e-4, atol=1e-4
+        )
+
+    # the expanded mask of the CUDA kernels
+    mask = _get_segment_mask(
+        qo_lens, kv_lens, qo_segment_ids, kv_segment_ids, causal, None
+    )
+    assert torch.equal(mask, torch.cat([mask.flatten() for mask in masks]))
+
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason="requires CUDA")
+@pytest.mark.parametrize("paged", [False, True])
+@pytest.mark.parametrize("causal", [False, True])
+def test_batch_prefill_fa2_segment_ids(paged, causal):
+    # the fa2 kernels compare the segment ids in the SegmentAttention variant, without
+    # the expanded custom mask
+    torch.manual_seed(42)
+    num_qo_heads, num_kv_heads, head_dim, page_size = 4, 2, 64, 8
+    qo_lens = torch.tensor([13, 1, 40])
+    kv_lens = torch.tensor([30, 9, 40])
+    qo_indptr = get_indptr(qo_lens)
+    kv_indptr = get_indptr(kv_lens)
+    q = torch.randn(qo_indptr[-1].item(), num_qo_heads, head_dim).half()
+    qo_segment_ids, kv_segment_ids = _make_segment_ids(qo_lens, kv_lens)
+    outputs = []
+    for backend in ["torch", "fa2"]:
+        # the reference runs the torch backend in float32 on the fp16 inputs
+        device = "cpu" if backend == "torch" else "cuda"
+        dtype = torch.float32 if backend == "torch" else torch.float16
+        workspace = torch.empty(128 * 1024 * 1024, dtype=torch.uint8, device=device)
+        plan_kwargs = dict(
+            causal=causal,
+            q_data_type=dtype,
+            qo_segment_ids=qo_segment_ids.to(device),
+            kv_segment_ids=kv_segment_ids.to(device),
+        )
+        if paged:
+            torch.manual_seed(0)
+            kv_data, page_indptr, kv_indices, kv_last_page_len = make_paged_kv(
+                kv_lens, page_size, num_kv_heads, head_dim, "NHD"
+            )
+            wrapper = flashinfer.BatchPrefillWithPagedKVCacheWrapper(
+                workspace, backend=backend
+            )
+            wrapper.plan(
+                qo_indptr.to(device),
+                page_indptr.to(device),
+                kv_indices.to(device),
+                kv_last_page_len.to(device),
+                num_qo_heads,
+                num_kv_heads,
+                head_dim,
+                page_size,
+                **plan_kwargs,
+            )
+            o = wrapper.run(q.to(device, dtype), kv_data.half().to(device, dtype))
+        else:
+            torch.manual_seed(0)
+            k = torch.randn(kv_indptr[-1].item(), num_kv_heads, head_dim).half()
+            v = torch.randn(kv_indptr[-1].item(), num_kv_heads, head_dim).half()
+            wrapper = flashinfer.BatchPrefillWithRaggedKVCacheWrapper(
+                workspace, backend=backend
+            )
+            wrapper.plan(
+                qo_indptr.to(device),
+                kv_indptr.to(device),
+                num_qo_heads,
+                num_kv_heads,
+                head_dim,
+                **plan_kwargs,
+            )
+            o = wrapper.run(
+                q.to(device, dtype), k.to(device, dtype), v.to(device, dtype)
+            )
+        if backend == "fa2":
+            assert wrapper._use_segment_kernel
+            assert wrapper._custom_mask_buf is None
+        outputs.append(o.float().cpu())
+    torch.testing.assert_close(outputs[1], outputs[0], rtol=1e-3, atol=1e-3)
+
+
+def test_single_prefill_torch_backend_segment_ids():
+    torch.manual_seed(42)
+    qo_len, kv_len, num_heads, head_dim = 48, 64, 4, 32
+    q = torch.randn(qo_len, num_heads, head_dim)
+    k = torch.randn(kv_len, num_heads, head_dim)
+    v = torch.randn(kv_len, num_heads, head_dim)
+    qo_segment_ids, kv_segment_ids = _make_segment_ids(
+        torch.tensor([qo_len]), torch.tensor([kv_len])
+    )
+    custom_mask = torch.rand(qo_len, kv_len) > 0.3
+    o = flashinfer.single_prefill_with_kv_cache(
+        q,
+        k,
+        v,
+        custom_mask=custom_mask,
+        qo_segment_ids=qo_segment_ids,
+        kv_segment_ids=kv_segment_ids,
+    )
+    mask = custom_mask & (qo_segment_ids[:, None] == kv_segment_ids[None, :])
+    o_ref, _ = masked_attention_ref(q, k, v, mask)
+    torch.testing.assert_close(o, o_ref, rtol=1e-4, atol=1e-4)
+    with pytest.raises(ValueError):
+        flashinfer.single_prefill_with_kv_cache(q, k, v, qo_segment_ids=qo_segment_ids)
+    with pytest.raises(ValueError):
+        flashinfer.single_prefill_with_kv_cache(
+            q,
+            k,
+            v,
+            qo_segment_ids=qo_segment_ids,
+            kv_segment_ids=kv_segment_ids[1:],
+        )
+
+
+def test_segment_packbits_torch():
+    torch.manual_seed(42)
+    indptr = torch.tensor([0, 3, 3, 20, 36], dtype=torch.int32)
+    x = torch.rand(36) > 0.5
+    for bitorder in ["big", "little"]:
+        packed, new_indptr = _segment_packbits_torch(x, indptr, bitorder=bitorder)
+        assert new_indptr.tolist() == [0, 1, 1, 4, 6]
+        for i in range(4):
+            bits = x[indptr[i] : indptr[i + 1]]
+            bits = torch.nn.functional.pad(bits.int(), (0, -len(bits) % 8)).view(-1, 8)
+            if bitorder == "little":
+                bits = bits.flip(-1)
+            ref = (bits * 2 ** torch.arange(7, -1, -1)).sum(-1).to(torch.uint8)
+            assert torch.equal(packed[new_indptr[i] : new_indptr[i + 1]], ref)
+
+
+def test_batch_prefill_torch_backend_invalid_args():
+    with pytest.raises(KeyError):
+        flashinfer.BatchPrefillWithPagedKVCacheWrapper(
+            torch.empty(0, dtype=torch.uint8), backend="cpu"
+        )
+    with pytest.raises(ValueError):
+        flashinfer.BatchPrefillWithRaggedKVCacheWrapper(
+            torch.empty(0, dtype=torch.uint8),
+            use_cuda_graph=True,
+            backend="torch",
+        )
+
+
+@pytest.mark.parametrize("kv_layout", ["NHD", "HND"])
+@pytest.mark.parametrize("per_head", [False, True])
+def test_batch_prefill_torch_backend_page_scale(kv_layout, per_head):
+    torch.manual_seed(42)
+    num_qo_heads, num_kv_heads, head_dim, page_size = 4, 2, 32, 16
+    qo_lens = torch.tensor([7, 1, 40])
+    kv_lens = torch.tensor([30, 20, 40])
+    qo_indptr = get_indptr(qo_lens)
+    kv_data, kv_indptr, kv_indices, kv_last_page_len = make_paged_kv(
+        kv_lens, page_size, num_kv_heads, head_dim, kv_layout
+    )
+    kv_int8 = (kv_data * 40).round().clamp(-127, 127).to(torch.int8)
+    scale_shape = (kv_data.shape[0], num_kv_heads) if per_head else kv_data.shape[:1]
+    k_scale = torch.rand(scale_shape) / 40 + 0.01
+    v_scale = torch.rand(scale_shape) / 40 + 0.01
+    k_ref, v_ref = flashinfer.page._dequantize_paged_kv_cache(
+        kv_int8[:, 0],
+        kv_int8[:, 1],
+        k_scale,
+        v_scale,
+        torch.arange(kv_data.shape[0]),
+        kv_layout,
+        torch.float32,
+    )[:2]
+    q = torch.randn(qo_indptr[-1].item(), num_qo_heads, head_dim)
+    wrapper = flashinfer.BatchPrefillWithPagedKVCacheWrapper(
+        torch.empty(0, dtype=torch.uint8), kv_layout=kv_layout, backend="torch"
+    )
+    wrapper.plan(
+        qo_indptr,
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        num_qo_heads,
+        num_kv_heads,
+        head_dim,
+        page_size,
+        causal=True,
+        q_data_type=torch.float32,
+        kv_data_type=torch.int8,
+    )
+    o = wrapper.run(q, kv_int8, k_scale=k_scale, v_scale=v_scale)
+    o_ref = paged_attention_torch(
+        q,
+        (k_ref, v_ref),
+        qo_indptr,
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        kv_layout=kv_layout,
+    )
+    torch.testing.assert_close(o, o_ref, rtol=1e-4, atol=1e-4)
+
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason="requires CUDA")
+def test_batch_prefill_page_scale_cuda_backend():
+    # the CUDA kernels take float scales, per-page scales are rejected instead of
+    # dequantizing a copy of the pages on every run
+    num_qo_heads, num_kv_heads, head_dim, page_size = 4, 2, 64, 16
+    kv_lens = torch.tensor([30, 20])
+    qo_indptr = get_indptr(torch.tensor([3, 1])).cuda()
+    kv_data, kv_indptr, kv_indices, kv_last_page_len = make_paged_kv(
+        kv_lens, page_size, num_kv_heads, head_dim
+    )
+    wrapper = flashinfer.BatchPrefillWithPagedKVCacheWrapper(
+        torch.empty(128 * 1024 * 1024, dtype=torch.uint8, device="cuda"),
+        backend="fa2",
+    )
+    wrapper.plan(
+        qo_indptr,
+        kv_indptr.cuda(),
+        kv_indices.cuda(),
+        kv_last_page_len.cuda(),
+        num_qo_heads,
+        num_kv_heads,
+        head_dim,
+        page_size,
+        causal=True,
+        q_data_type=torch.float16,
+    )
+    q = torch.randn(4, num_qo_heads, head_dim, dtype=torch.float16, device="cuda")
+    scale = torch.ones(kv_data.shape[0], device="cuda")
+    with pytest.raises(ValueError, match="torch and triton"):
+        wrapper.run(q, kv_data.half().cuda(), k_scale=scale, v_scale=scale)
@@ -0,0 +1,105 @@
+"""
+Copyright (c) 2025 by FlashInfer team.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import socket
+import threading
+
+import pytest
+import torch
+
+import flashinfer
+
+
+def _make_cache(num_pages, kv_layout, cache_format, page_size=4, num_kv_heads=2):
+    head_dim = 8
+    if kv_layout == "NHD":
+        page_shape = (page_size, num_kv_heads, head_dim)
+    else:
+        page_shape = (num_kv_heads, page_size, head_dim)
+    kv_data = torch.randn(num_pages, 2, *page_shape).half()
+    if cache_format == "tuple":
+        return kv_data, (kv_data[:, 0], kv_data[:, 1])
+    return kv_data, kv_data
+
+
+@pytest.mark.parametrize("kv_layout", ["NHD", "HND"])
+@pytest.mark.parametrize("cache_format", ["tensor", "tuple"])
+def test_export_import_request_kv(kv_layout, cache_format):
+    torch.manual_seed(42)
+    src_data, src_cache = _make_cache(16, kv_layout, cache_format)
+    dst_data, dst_cache = _make_cache(32, kv_layout, cache_format)
+    src_indices = torch.tensor([7, 1, 12, 3, 9], dtype=torch.int32)
+    dst_indices = torch.tensor([30, 2, 3, 4, 17], dtype=torch.int32)
+
+    kv_buffer = flashinfer.export_request_kv(src_cache, src_indices, kv_layout)
+    assert kv_buffer.is_contiguous()
+    assert torch.equal(kv_buffer, src_data[src_indices.long()])
+    flashinfer.import_request_kv(
+        kv_buffer,
+        dst_cache,
+        flashinfer.RunLengthPageIndices.encode(dst_indices),
+        kv_layout,
+    )
+    assert torch.equal(dst_data[dst_indices.long()], src_data[src_indices.long()])
+
+    # multiple layers into a preallocated (e.g. shared memory) buffer
+    src_layers = [_make_cache(16, kv_layout, cache_format)[1] for _ in range(3)]
+    dst_layers = [_make_cache(32, kv_layout, cache_format)[1] for _ in range(3)]
+    out = torch.empty(3, *kv_buffer.shape, dtype=kv_buffer.dtype).share_memory_()
+    flashinfer.export_request_kv(src_layers, src_indices, kv_layout, out=out)
+    flashinfer.import_request_kv(out, dst_layers, dst_indices, kv_layout)
+    for src, dst in zip(src_layers, dst_layers):
+        assert torch.equal(
+            flashinfer.export_request_kv(src, src_indices, kv_layout),
+            flashinfer.export_request_kv(dst, dst_indices, kv_layout),
+        )
+
+
+@pytest.mark.parametrize("kv_layout", ["NHD", "HND"])
+@pytest.mark.parametrize("chunk_pages", [1, 3, 64])
+def test_export_import_request_kv_chunked_socket(kv_layout, chunk_pages):
+    torch.manual_seed(42)
+    num_layers = 2
+    src_layers = [_make_cache(16, kv_layout, "tensor")[1] for _ in range(num_layers)]
+    dst_layers = [_make_cache(32, kv_layout, "tensor")[1] for _ in range(num_layers)]
+    src_indices = torch.tensor([7, 1, 12, 3, 9, 10, 11], dtype=torch.int32)
+    dst_indices = torch.tensor([30, 2, 3, 4, 17, 0, 31], dtype=torch.int32)
+    sender, receiver = socket.socketpair()
+
+    def _send():
+        with sender, sender.makefile("wb") as f:
+            for layer, cache in enumerate(src_layers):
+                for chunk in flashinfer.export_request_kv_chunked(
+                    cache, src_indices, layer, kv_layout, chunk_pages=chunk_pages
+                ):
+                    flashinfer.write_kv_chunk(f, chunk)
+
+    thread = threading.Thread(target=_send)
+    thread.start()
+    with receiver, receiver.makefile("rb") as f:
+        chunks = iter(
+            lambda: flashinfer.read_kv_chunk(
+                f, dst_layers[0].shape[1:], dst_layers[0].dtype
+            ),
+            None,
+        )
+        num_chunks = flashinfer.import_request_kv_chunked(
+            chunks, dst_layers, dst_indices, kv_layout
+        )
+    thread.join()
+    assert num_chunks == num_layers * -(-len(src_indices) // chunk_pages)
+    for src, dst in zip(src_layers, dst_layers):
+        assert torch.equal(src[src_indices.long()], dst[dst_indices.long()])
@@ -0,0 +1,153 @@
+"""
+Copyright (c) 2025 by FlashInfer team.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import numpy as np
+import pytest
+import torch
+from attention_reference import get_indptr
+
+import flashinfer
+
+
+def _random_trees(num_drafts):
+    # the parent of a draft token precedes it, as produced by the draft models
+    return torch.cat(
+        [
+            torch.tensor([torch.randint(-1, i, ()).item() for i in range(n)])
+            for n in num_drafts
+        ]
+    ).int()
+
+
+def _tree_mask_ref(parents, num_drafts, prefix_lens):
+    masks = []
+    offset = 0
+    for n, prefix_len in zip(num_drafts, prefix_lens):
+        mask = torch.zeros(n, prefix_len + n, dtype=torch.bool)
+        mask[:, :prefix_len] = True
+        for i in range(n):
+            j = i
+            while j >= 0:
+                mask[i, prefix_len + j] = True
+                j = parents[offset + j].item()
+        masks.append(mask)
+        offset += n
+    return masks
+
+
+def _unpack(packed, mask_indptr, shapes):
+    packed = packed.cpu().numpy()
+    masks = []
+    for i, (rows, cols) in enumerate(shapes):
+        bits = np.unpackbits(
+            packed[mask_indptr[i] : mask_indptr[i + 1]], bitorder="little"
+        )
+        masks.append(torch.from_numpy(bits[: rows * cols].reshape(rows, cols) == 1))
+    return masks
+
+
+@pytest.mark.parametrize("num_drafts", [[1], [3, 5], [8, 1, 16, 7]])
+@pytest.mark.parametrize("max_prefix_len", [1, 13, 64])
+def test_build_tree_attention_mask(num_drafts, max_prefix_len):
+    torch.manual_seed(42)
+    prefix_lens = torch.randint(0, max_prefix_len + 1, (len(num_drafts),))
+    parents = _random_trees(num_drafts)
+    packed, mask_indptr = flashinfer.build_tree_attention_mask(
+        parents, get_indptr(num_drafts), prefix_lens
+    )
+    expected = _tree_mask_ref(parents, num_drafts, prefix_lens.tolist())
+    masks = _unpack(packed, mask_indptr, [tuple(m.shape) for m in expected])
+    for mask, mask_ref in zip(masks, expected):
+        assert torch.equal(mask, mask_ref)
+
+
+def test_build_tree_attention_mask_unordered_parents():
+    # the parents may follow their children
+    parents = torch.tensor([2, -1, 1, 0], dtype=torch.int32)
+    packed, mask_indptr = flashinfer.build_tree_attention_mask(
+        parents, get_indptr([4]), torch.tensor([1])
+    )
+    (mask,) = _unpack(packed, mask_indptr, [(4, 5)])
+    assert torch.equal(mask, _tree_mask_ref(parents, [4], [1])[0])
+
+
+def test_build_tree_attention_mask_invalid():
+    with pytest.raises(ValueError):
+        flashinfer.build_tree_attention_mask(
+            torch.tensor([-1, 2], dtype=torch.int32),
+            get_indptr([2]),
+            torch.tensor([3]),
+        )
+    with pytest.raises(ValueError):
+        flashinfer.build_tree_attention_mask(
+            torch.tensor([-1, 2, 1], dtype=torch.int32),
+            get_indptr([3]),
+            torch.tensor([3]),
+        )
+    with pytest.raises(ValueError):
+        flashinfer.build_tree_attention_mask(
+            torch.tensor([-1], dtype=torch.int32),
+            get_indptr([1]),
+            torch.tensor([3, 4]),
+        )
+
+
+@pytest.mark.parametrize("page_size", [1, 16])
+def test_batch_prefill_torch_backend_tree_mask(page_size):
+    torch.manual_seed(42)
+    num_qo_heads, num_kv_heads, head_dim = 4, 2, 32
+    num_drafts = [6, 1, 11]
+    prefix_lens = torch.tensor([20, 3, 40])
+    parents = _random_trees(num_drafts)
+    qo_indptr = get_indptr(num_drafts)
+    kv_lens = prefix_lens + torch.tensor(num_drafts)
+    num_pages = (kv_lens + page_size - 1) // page_size
+    kv_indptr = get_indptr(num_pages)
+    kv_indices = torch.randperm(kv_indptr[-1].item()).int()
+    kv_last_page_len = ((kv_lens - 1) % page_size + 1).int()
+    kv_data = torch.randn(kv_indptr[-1].item(), 2, page_size, num_kv_heads, head_dim)
+    q = torch.randn(qo_indptr[-1].item(), num_qo_heads, head_dim)
+    packed, mask_indptr = flashinfer.build_tree_attention_mask(
+        parents, qo_indptr, prefix_lens
+    )
+    custom_mask = torch.cat(
+        [m.flatten() for m in _tree_mask_ref(parents, num_drafts, prefix_lens)]
+    )
+
+    outputs = []
+    for mask_kwargs in [
+        dict(packed_custom_mask=packed, mask_indptr=mask_indptr),
+        dict(custom_mask=custom_mask),
+    ]:
+        wrapper = flashinfer.BatchPrefillWithPagedKVCacheWrapper(
+            torch.empty(0, dtype=torch.uint8), backend="torch"
+        )
+        wrapper.plan(
+            qo_indptr,
+            kv_indptr,
+            kv_indices,
+            kv_last_page_len,
+            num_qo_heads,
+            num_kv_heads,
+            head_dim,
+            page_size,
+            q_data_type=torch.float32,
+            **mask_kwargs,
+        )
+        outputs.append(wrapper.run(q, kv_data, return_lse=True))
+    (o, lse), (o_ref, lse_ref) = outputs
+    torch.testing.assert_close(o, o_ref, rtol=1e-4, atol=1e-4)
+    torch.testing.assert_close(lse, lse_ref, rtol=1e-4, atol=1e-4)
@@ -0,0 +1,242 @@
+import math
+import os
+
+import pytest
+import torch
+from attention_reference import make_paged_kv
+
+import flashinfer
+from flashinfer.torch_attention import paged_attention_torch
+from flashinfer.triton.decode import batch_decode_with_paged_kv_cache, plan_split_kv
+
+if torch.cuda.is_available():
+    device = "cuda:0"
+elif os.environ.get("TRITON_INTERPRET") == "1":
+    device = "cpu"
+else:
+    pytest.skip(
+        "requires CUDA or the Triton interpreter (TRITON_INTERPRET=1)",
+        allow_module_level=True,
+    )
+
+
+@pytest.mark.parametrize("page_size", [1, 16])
+@pytest.mark.parametrize("kv_layout", ["NHD", "HND"])
+@pytest.mark.parametrize("pages_per_split", [1, 3, 1000])
+@pytest.mark.parametrize("group_size", [1, 4])
+def test_batch_decode_triton_split_kv(
+    page_size, kv_layout, pages_per_split, group_size
+):
+    torch.manual_seed(42)
+    num_kv_heads, head_dim = 2, 64
+    num_qo_heads = num_kv_heads * group_size
+    kv_lens = torch.tensor([1, 40, 130])
+    kv_data, kv_indptr, kv_indices, kv_last_page_len = make_paged_kv(
+        kv_lens, page_size, num_kv_heads, head_dim, kv_layout, device=device
+    )
+    q = torch.randn(len(kv_lens), num_qo_heads, head_dim, device=device)
+    max_num_pages = int((kv_indptr[1:] - kv_indptr[:-1]).max())
+    max_num_splits = math.ceil(max_num_pages / pages_per_split)
+    workspace = torch.empty(16 * 1024 * 1024, dtype=torch.uint8, device=device)
+    window_left = torch.tensor([-1, 5, 70], dtype=torch.int32, device=device)
+    logits_soft_cap = torch.tensor([0.0, 8.0, 30.0], device=device)
+    o, lse = batch_decode_with_paged_kv_cache(
+        q,
+        kv_data[:, 0],
+        kv_data[:, 1],
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        kv_layout,
+        pages_per_split,
+        max_num_splits,
+        1.0 / math.sqrt(head_dim),
+        window_left=window_left,
+        logits_soft_cap=logits_soft_cap,
+        workspace_buffer=workspace,
+    )
+    o_ref, lse_ref = paged_attention_torch(
+        q,
+        kv_data,
+        torch.arange(len(kv_lens) + 1, device=device),
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        kv_layout=kv_layout,
+        causal=False,
+        window_left=window_left,
+        logits_soft_cap=logits_soft_cap,
+        return_lse=True,
+    )
+    torch.testing.assert_close(o, o_ref, rtol=1e-4, atol=1e-4)
+    torch.testing.assert_close(lse, lse_ref, rtol=1e-4, atol=1e-4)
+
+
+@pytest.mark.parametrize("pos_encoding_mode", ["NONE", "ALIBI"])
+@pytest.mark.parametrize("window_left", [-1, 20])
+@pytest.mark.parametrize("logits_soft_cap", [0.0, 8.0])
+def test_batch_decode_triton_backend(pos_encoding_mode, window_left, logits_soft_cap):
+    torch.manual_seed(42)
+    num_qo_heads, num_kv_heads, head_dim, page_size = 8, 2, 128, 16
+    kv_lens = torch.tensor([3, 100, 257, 16])
+    kv_data, kv_indptr, kv_indices, kv_last_page_len = make_paged_kv(
+        kv_lens, page_size, num_kv_heads, head_dim, "NHD", device=device
+    )
+    q = torch.randn(len(kv_lens), num_qo_heads, head_dim, device=device).half()
+    kv_data = kv_data.half()
+    wrapper = flashinfer.BatchDecodeWithPagedKVCacheWrapper(
+        torch.empty(32 * 1024 * 1024, dtype=torch.uint8, device=device),
+        backend="triton",
+    )
+    wrapper.plan(
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        num_qo_heads,
+        num_kv_heads,
+        head_dim,
+        page_size,
+        pos_encoding_mode=pos_encoding_mode,
+        window_left=window_left,
+        logits_soft_cap=logits_soft_cap,
+    )
+    o, lse = wrapper.run(q, kv_data, return_lse=True)
+    o_ref, lse_ref = paged_attention_torch(
+        q,
+        kv_data,
+        torch.arange(len(kv_lens) + 1, device=device),
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        causal=False,
+        pos_encoding_mode=pos_encoding_mode,
+        window_left=window_left,
+        logits_soft_cap=logits_soft_cap,
+        return_lse=True,
+    )
+    torch.testing.assert_close(o, o_ref, rtol=1e-3, atol=1e-3)
+    torch.testing.assert_close(lse, lse_ref, rtol=1e-3, atol=1e-3)
+
+
+def test_plan_split_kv():
+    kv_indptr = torch.tensor([0, 1, 40, 41], dtype=torch.int32)
+    pages_per_split, max_num_splits = plan_split_kv(
+        kv_indptr, 16, 32, 8, 128, 128 * 1024 * 1024, torch.device(device)
+    )
+    assert pages_per_split * max_num_splits >= 39
+    assert pages_per_split * (max_num_splits - 1) < 39
+    # no room for the partial states in the workspace
+    assert plan_split_kv(kv_indptr, 16, 32, 8, 128, 0, torch.device(device)) == (39, 1)
+
+
+def test_batch_decode_triton_backend_invalid_args():
+    workspace = torch.empty(1024, dtype=torch.uint8, device=device)
+    with pytest.raises(ValueError):
+        flashinfer.BatchDecodeWithPagedKVCacheWrapper(
+            workspace, use_cuda_graph=True, backend="triton"
+        )
+    wrapper = flashinfer.BatchDecodeWithPagedKVCacheWrapper(workspace, backend="triton")
+    with pytest.raises(ValueError):
+        wrapper.plan(
+            torch.tensor([0, 1], dtype=torch.int32, device=device),
+            torch.tensor([0], dtype=torch.int32, device=device),
+            torch.tensor([1], dtype=torch.int32, device=device),
+            4,
+            4,
+            64,
+            16,
+            pos_encoding_mode="ROPE_LLAMA",
+        )
+
+
+@pytest.mark.parametrize("chunk_size", [16, 24])
+def test_batch_decode_triton_backend_chunked(chunk_size):
+    torch.manual_seed(42)
+    num_qo_heads, num_kv_heads, head_dim, page_size = 8, 2, 64, 16
+    kv_lens = torch.tensor([3, 100, 257, 16])
+    kv_data, kv_indptr, kv_indices, kv_last_page_len = make_paged_kv(
+        kv_lens, page_size, num_kv_heads, head_dim, "NHD", device=device
+    )
+    q = torch.randn(len(kv_lens), num_qo_heads, head_dim, device=device)
+    wrapper = flashinfer.BatchDecodeWithPagedKVCacheWrapper(
+        torch.empty(32 * 1024 * 1024, dtype=torch.uint8, device=device),
+        backend="triton",
+    )
+    wrapper.plan(
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        num_qo_heads,
+        num_kv_heads,
+        head_dim,
+        page_size,
+        q_data_type=torch.float32,
+        chunk_size=chunk_size,
+    )
+    o, lse = wrapper.run(q, kv_data, return_lse=True)
+    o_ref, lse_ref = paged_attention_torch(
+        q,
+        kv_data,
+        torch.arange(len(kv_lens) + 1, device=device),
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        causal=False,
+        chunk_size=chunk_size,
+        return_lse=True,
+    )
+    torch.testing.assert_close(o, o_ref, rtol=1e-4, atol=1e-4)
+    torch.testing.assert_close(lse, lse_ref, rtol=1e-4, atol=1e-4)
+
+
+@pytest.mark.parametrize("kv_layout", ["NHD", "HND"])
+@pytest.mark.parametrize("per_head", [False, True])
+def test_batch_decode_triton_backend_page_scale(kv_layout, per_head):
+    torch.manual_seed(42)
+    num_qo_heads, num_kv_heads, head_dim, page_size = 8, 2, 64, 16
+    kv_lens = torch.tensor([3, 100, 257])
+    kv_data, kv_indptr, kv_indices, kv_last_page_len = make_paged_kv(
+        kv_lens, page_size, num_kv_heads, head_dim, kv_layout, device=device
+    )
+    kv_int8 = (kv_data * 40).round().clamp(-127, 127).to(torch.int8)
+    scale_shape = (kv_data.shape[0], num_kv_heads) if per_head else kv_data.shape[:1]
+    k_scale = torch.rand(scale_shape, device=device) / 40 + 0.01
+    v_scale = torch.rand(scale_shape, device=device) / 40 + 0.01
+    k_ref, v_ref = flashinfer.page._dequantize_paged_kv_cache(
+        kv_int8[:, 0],
+        kv_int8[:, 1],
+        k_scale,
+        v_scale,
+        torch.arange(kv_data.shape[0], device=device),
+        kv_layout,
+        torch.float32,
+    )[:2]
+    q = torch.randn(len(kv_lens), num_qo_heads, head_dim, device=device)
+    wrapper = flashinfer.BatchDecodeWithPagedKVCacheWrapper(
+        torch.empty(32 * 1024 * 1024, dtype=torch.uint8, device=device),
+        kv_layout=kv_layout,
+        backend="triton",
+    )
+    wrapper.plan(
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        num_qo_heads,
+        num_kv_heads,
+        head_dim,
+        page_size,
+        q_data_type=torch.float32,
+        kv_data_type=torch.int8,
+    )
+    o = wrapper.run(q, kv_int8, k_scale=k_scale, v_scale=v_scale)
+    o_ref = paged_attention_torch(
+        q,
+        (k_ref, v_ref),
+        torch.arange(len(kv_lens) + 1, device=device),
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        kv_layout=kv_layout,
+        causal=False,
+    )
+    torch.testing.assert_close(o, o_ref, rtol=1e-4, atol=1e-4)
@@ -0,0 +1,483 @@
+import os
+
+import pytest
+import torch
+from attention_reference import get_indptr, make_paged_kv, masked_attention_ref
+
+import flashinfer
+from flashinfer.torch_attention import paged_attention_torch
+from flashinfer.triton.kernels.prefill import batch_prefill_kernel
+
+if torch.cuda.is_available():
+    device = "cuda:0"
+elif os.environ.get("TRITON_INTERPRET") == "1":
+    device = "cpu"
+else:
+    pytest.skip(
+        "requires CUDA or the Triton interpreter (TRITON_INTERPRET=1)",
+        allow_module_level=True,
+    )
+
+
+@pytest.mark.parametrize("page_size", [1, 16])
+@pytest.mark.parametrize("kv_layout", ["NHD", "HND"])
+@pytest.mark.parametrize("causal", [False, True])
+@pytest.mark.parametrize("pos_encoding_mode", ["NONE", "ALIBI"])
+@pytest.mark.parametrize("window_left", [-1, 9])
+@pytest.mark.parametrize("logits_soft_cap", [0.0, 8.0])
+def test_batch_prefill_paged_triton_backend(
+    page_size, kv_layout, causal, pos_encoding_mode, window_left, logits_soft_cap
+):
+    torch.manual_seed(42)
+    num_qo_heads, num_kv_heads, head_dim = 4, 2, 32
+    qo_lens = torch.tensor([1, 17, 80])
+    kv_lens = torch.tensor([1, 30, 100])
+    qo_indptr = get_indptr(qo_lens, device=device)
+    kv_data, kv_indptr, kv_indices, kv_last_page_len = make_paged_kv(
+        kv_lens, page_size, num_kv_heads, head_dim, kv_layout, device=device
+    )
+    q = torch.randn(qo_indptr[-1].item(), num_qo_heads, head_dim, device=device)
+    wrapper = flashinfer.BatchPrefillWithPagedKVCacheWrapper(
+        torch.empty(0, dtype=torch.uint8, device=device), kv_layout, backend="triton"
+    )
+    wrapper.plan(
+        qo_indptr,
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        num_qo_heads,
+        num_kv_heads,
+        head_dim,
+        page_size,
+        causal=causal,
+        pos_encoding_mode=pos_encoding_mode,
+        window_left=window_left,
+        logits_soft_cap=logits_soft_cap,
+        q_data_type=torch.float32,
+    )
+    o, lse = wrapper.run(q, kv_data, return_lse=True)
+    o_ref, lse_ref = paged_attention_torch(
+        q,
+        kv_data,
+        qo_indptr,
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        kv_layout=kv_layout,
+        causal=causal,
+        pos_encoding_mode=pos_encoding_mode,
+        window_left=window_left,
+        logits_soft_cap=logits_soft_cap,
+        return_lse=True,
+    )
+    torch.testing.assert_close(o, o_ref, rtol=1e-4, atol=1e-4)
+    torch.testing.assert_close(lse, lse_ref, rtol=1e-4, atol=1e-4)
+
+
+def test_batch_prefill_paged_triton_backend_per_request_params():
+    torch.manual_seed(42)
+    num_qo_heads, num_kv_heads, head_dim, page_size = 4, 4, 64, 8
+    qo_lens = torch.tensor([5, 12, 1])
+    kv_lens = torch.tensor([50, 12, 33])
+    qo_indptr = get_indptr(qo_lens, device=device)
+    kv_data, kv_indptr, kv_indices, kv_last_page_len = make_paged_kv(
+        kv_lens, page_size, num_kv_heads, head_dim, "NHD", device=device
+    )
+    q = torch.randn(qo_indptr[-1].item(), num_qo_heads, head_dim, device=device)
+    window_left = torch.tensor([4, -1, 10], dtype=torch.int32)
+    logits_soft_cap = torch.tensor([0.0, 5.0, 30.0])
+    wrapper = flashinfer.BatchPrefillWithPagedKVCacheWrapper(
+        torch.empty(0, dtype=torch.uint8, device=device), backend="triton"
+    )
+    wrapper.plan(
+        qo_indptr,
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        num_qo_heads,
+        num_kv_heads,
+        head_dim,
+        page_size,
+        causal=True,
+        window_left=window_left,
+        logits_soft_cap=logits_soft_cap,
+        q_data_type=torch.float32,
+    )
+    o = wrapper.run(q, kv_data)
+    o_ref = paged_attention_torch(
+        q,
+        kv_data,
+        qo_indptr,
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        window_left=window_left,
+        logits_soft_cap=logits_soft_cap,
+    )
+    torch.testing.assert_close(o, o_ref, rtol=1e-4, atol=1e-4)
+
+
+@pytest.mark.parametrize("kv_layout", ["NHD", "HND"])
+@pytest.mark.parametrize("causal", [False, True])
+@pytest.mark.parametrize("use_custom_mask", [False, True])
+def test_batch_prefill_ragged_triton_backend(kv_layout, causal, use_custom_mask):
+    torch.manual_seed(42)
+    num_qo_heads, num_kv_heads, head_dim_qk, head_dim_vo = 8, 4, 64, 32
+    qo_lens = torch.tensor([3, 70, 1, 16])
+    kv_lens = torch.tensor([10, 70, 65, 16])
+    qo_indptr = get_indptr(qo_lens, device=device)
+    kv_indptr = get_indptr(kv_lens, device=device)
+    q = torch.randn(qo_indptr[-1].item(), num_qo_heads, head_dim_qk, device=device)
+    k = torch.randn(kv_indptr[-1].item(), num_kv_heads, head_dim_qk, device=device)
+    v = torch.randn(kv_indptr[-1].item(), num_kv_heads, head_dim_vo, device=device)
+    masks = []
+    for qo_len, kv_len in zip(qo_lens.tolist(), kv_lens.tolist()):
+        if use_custom_mask:
+            mask = torch.rand(qo_len, kv_len, device=device) > 0.5
+            # a query row without any visible kv
+            mask[0] = False
+        elif causal:
+            q_pos = torch.arange(kv_len - qo_len, kv_len, device=device)
+            mask = torch.arange(kv_len, device=device)[None, :] <= q_pos[:, None]
+        else:
+            mask = torch.ones(qo_len, kv_len, dtype=torch.bool, device=device)
+        masks.append(mask)
+    wrapper = flashinfer.BatchPrefillWithRaggedKVCacheWrapper(
+        torch.empty(0, dtype=torch.uint8, device=device), kv_layout, backend="triton"
+    )
+    wrapper.plan(
+        qo_indptr,
+        kv_indptr,
+        num_qo_heads,
+        num_kv_heads,
+        head_dim_qk,
+        head_dim_vo=head_dim_vo,
+        custom_mask=(
+            torch.cat([mask.flatten() for mask in masks]) if use_custom_mask else None
+        ),
+        causal=causal,
+        q_data_type=torch.float32,
+    )
+    if kv_layout == "HND":
+        o, lse = wrapper.run(
+            q,
+            k.transpose(0, 1).contiguous(),
+            v.transpose(0, 1).contiguous(),
+            return_lse=True,
+        )
+    else:
+        o, lse = wrapper.run(q, k, v, return_lse=True)
+    for i in range(len(qo_lens)):
+        o_ref, lse_ref = masked_attention_ref(
+            q[qo_indptr[i] : qo_indptr[i + 1]],
+            k[kv_indptr[i] : kv_indptr[i + 1]],
+            v[kv_indptr[i] : kv_indptr[i + 1]],
+            masks[i],
+        )
+        torch.testing.assert_close(
+            o[qo_indptr[i] : qo_indptr[i + 1]], o_ref, rtol=1e-4, atol=1e-4
+        )
+        torch.testing.assert_close(
+            lse[qo_indptr[i] : qo_indptr[i + 1]], lse_ref, rtol=1e-4, atol=1e-4
+        )
+
+
+@pytest.mark.parametrize("paged", [False, True])
+@pytest.mark.parametrize("causal", [False, True])
+def test_batch_prefill_triton_backend_segment_ids(paged, causal):
+    torch.manual_seed(42)
+    num_qo_heads, num_kv_heads, head_dim, page_size = 4, 2, 32, 4
+    qo_lens = torch.tensor([13, 1, 70])
+    kv_lens = torch.tensor([30, 9, 70])
+    qo_indptr = get_indptr(qo_lens, device=device)
+    q = torch.randn(qo_indptr[-1].item(), num_qo_heads, head_dim, device=device)
+    qo_segment_ids, kv_segment_ids = [], []
+    for qo_len, kv_len in zip(qo_lens.tolist(), kv_lens.tolist()):
+        seg = torch.sort(torch.randint(0, 4, (kv_len,), dtype=torch.int32)).values
+        kv_segment_ids.append(seg)
+        qo_segment_ids.append(seg[kv_len - qo_len :])
+    qo_segment_ids = torch.cat(qo_segment_ids).to(device)
+    kv_segment_ids = torch.cat(kv_segment_ids).to(device)
+    workspace = torch.empty(0, dtype=torch.uint8, device=device)
+    if paged:
+        kv_data, kv_indptr, kv_indices, kv_last_page_len = make_paged_kv(
+            kv_lens, page_size, num_kv_heads, head_dim, "NHD", device=device
+        )
+        wrapper = flashinfer.BatchPrefillWithPagedKVCacheWrapper(
+            workspace, backend="triton"
+        )
+        wrapper.plan(
+            qo_indptr,
+            kv_indptr,
+            kv_indices,
+            kv_last_page_len,
+            num_qo_heads,
+            num_kv_heads,
+            head_dim,
+            page_size,
+            causal=causal,
+            q_data_type=torch.float32,
+            qo_segment_ids=qo_segment_ids,
+            kv_segment_ids=kv_segment_ids,
+        )
+        o = wrapper.run(q, kv_data)
+        ref_wrapper = flashinfer.BatchPrefillWithPagedKVCacheWrapper(
+            workspace, backend="torch"
+        )
+        ref_wrapper.plan(
+            qo_indptr,
+            kv_indptr,
+            kv_indices,
+            kv_last_page_len,
+            num_qo_heads,
+            num_kv_heads,
+            head_dim,
+            page_size,
+            causal=causal,
+            q_data_type=torch.float32,
+            qo_segment_ids=qo_segment_ids,
+            kv_segment_ids=kv_segment_ids,
+        )
+        o_ref = ref_wrapper.run(q, kv_data)
+    else:
+        kv_indptr = get_indptr(kv_lens, device=device)
+        k = torch.randn(kv_indptr[-1].item(), num_kv_heads, head_dim, device=device)
+        v = torch.randn(kv_indptr[-1].item(), num_kv_heads, head_dim, device=device)
+        o, o_ref = [], []
+        for backend in ["triton", "torch"]:
+            wrapper = flashinfer.BatchPrefillWithRaggedKVCacheWrapper(
+                workspace, backend=backend
+            )
+            wrapper.plan(
+                qo_indptr,
+                kv_indptr,
+                num_qo_heads,
+                num_kv_heads,
+                head_dim,
+                causal=causal,
+                q_data_type=torch.float32,
+                qo_segment_ids=qo_segment_ids,
+                kv_segment_ids=kv_segment_ids,
+            )
+            (o if backend == "triton" else o_ref).append(wrapper.run(q, k, v))
+        o, o_ref = o[0], o_ref[0]
+    torch.testing.assert_close(o, o_ref, rtol=1e-4, atol=1e-4)
+
+
+def test_batch_prefill_triton_config_cache():
+    torch.manual_seed(42)
+    num_qo_heads, num_kv_heads, head_dim = 4, 4, 48
+    qo_indptr = get_indptr(torch.tensor([20, 3]), device=device)
+    kv_indptr = get_indptr(torch.tensor([20, 9]), device=device)
+    q = torch.randn(23, num_qo_heads, head_dim, device=device)
+    k = torch.randn(29, num_kv_heads, head_dim, device=device)
+    v = torch.randn(29, num_kv_heads, head_dim, device=device)
+    wrapper = flashinfer.BatchPrefillWithRaggedKVCacheWrapper(
+        torch.empty(0, dtype=torch.uint8, device=device), backend="triton"
+    )
+    wrapper.plan(
+        qo_indptr,
+        kv_indptr,
+        num_qo_heads,
+        num_kv_heads,
+        head_dim,
+        causal=True,
+        q_data_type=torch.float32,
+    )
+    num_configs = len(batch_prefill_kernel.cache)
+    o = wrapper.run(q, k, v)
+    assert len(batch_prefill_kernel.cache) == num_configs + 1
+    # the tuned config of the shape is reused
+    torch.testing.assert_close(wrapper.run(q, k, v), o)
+    assert len(batch_prefill_kernel.cache) == num_configs + 1
+
+
+def test_batch_prefill_triton_backend_invalid_args():
+    workspace = torch.empty(0, dtype=torch.uint8, device=device)
+    with pytest.raises(ValueError):
+        flashinfer.BatchPrefillWithPagedKVCacheWrapper(
+            workspace, use_cuda_graph=True, backend="triton"
+        )
+    wrapper = flashinfer.BatchPrefillWithRaggedKVCacheWrapper(
+        workspace, backend="triton"
+    )
+    with pytest.raises(ValueError):
+        wrapper.plan(
+            get_indptr(torch.tensor([4]), device=device),
+            get_indptr(torch.tensor([4]), device=device),
+            4,
+            4,
+            64,
+            pos_encoding_mode="ROPE_LLAMA",
+        )
+
+
+@pytest.mark.parametrize("paged", [False, True])
+def test_batch_prefill_triton_backend_prefix_lm(paged):
+    torch.manual_seed(42)
+    num_qo_heads, num_kv_heads, head_dim, page_size = 4, 2, 64, 16
+    qo_lens = torch.tensor([30, 1, 100, 64])
+    kv_lens = torch.tensor([30, 20, 140, 64])
+    prefix_len = torch.tensor([12, 5, 90, 64], dtype=torch.int32)
+    qo_indptr = get_indptr(qo_lens, device=device)
+    kv_data, kv_indptr, kv_indices, kv_last_page_len = make_paged_kv(
+        kv_lens, page_size, num_kv_heads, head_dim, "NHD", device=device
+    )
+    q = torch.randn(qo_indptr[-1].item(), num_qo_heads, head_dim, device=device)
+    o_ref, lse_ref = paged_attention_torch(
+        q,
+        kv_data,
+        qo_indptr,
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        prefix_len=prefix_len,
+        return_lse=True,
+    )
+    workspace = torch.empty(0, dtype=torch.uint8, device=device)
+    if paged:
+        wrapper = flashinfer.BatchPrefillWithPagedKVCacheWrapper(
+            workspace, backend="triton"
+        )
+        wrapper.plan(
+            qo_indptr,
+            kv_indptr,
+            kv_indices,
+            kv_last_page_len,
+            num_qo_heads,
+            num_kv_heads,
+            head_dim,
+            page_size,
+            causal=True,
+            q_data_type=torch.float32,
+            prefix_len=prefix_len,
+        )
+        o, lse = wrapper.run(q, kv_data, return_lse=True)
+    else:
+        pages = [
+            kv_indices[kv_indptr[i] : kv_indptr[i + 1]].long()
+            for i in range(len(kv_lens))
+        ]
+        k = torch.cat(
+            [kv_data[p, 0].flatten(0, 1)[:n] for p, n in zip(pages, kv_lens.tolist())]
+        )
+        v = torch.cat(
+            [kv_data[p, 1].flatten(0, 1)[:n] for p, n in zip(pages, kv_lens.tolist())]
+        )
+        wrapper = flashinfer.BatchPrefillWithRaggedKVCacheWrapper(
+            workspace, backend="triton"
+        )
+        wrapper.plan(
+            qo_indptr,
+            get_indptr(kv_lens, device=device),
+            num_qo_heads,
+            num_kv_heads,
+            head_dim,
+            causal=True,
+            q_data_type=torch.float32,
+            prefix_len=prefix_len,
+        )
+        o, lse = wrapper.run(q, k, v, return_lse=True)
+    torch.testing.assert_close(o, o_ref, rtol=1e-4, atol=1e-4)
+    torch.testing.assert_close(lse, lse_ref, rtol=1e-4, atol=1e-4)
+
+
+@pytest.mark.parametrize("page_size", [1, 16])
+@pytest.mark.parametrize("chunk_size", [8, 24, 64])
+@pytest.mark.parametrize("causal", [False, True])
+def test_batch_prefill_triton_backend_chunked(page_size, chunk_size, causal):
+    torch.manual_seed(42)
+    num_qo_heads, num_kv_heads, head_dim = 4, 2, 64
+    qo_lens = torch.tensor([30, 1, 100, 64])
+    kv_lens = torch.tensor([30, 20, 140, 130])
+    qo_indptr = get_indptr(qo_lens, device=device)
+    kv_data, kv_indptr, kv_indices, kv_last_page_len = make_paged_kv(
+        kv_lens, page_size, num_kv_heads, head_dim, "NHD", device=device
+    )
+    q = torch.randn(qo_indptr[-1].item(), num_qo_heads, head_dim, device=device)
+    wrapper = flashinfer.BatchPrefillWithPagedKVCacheWrapper(
+        torch.empty(0, dtype=torch.uint8, device=device), backend="triton"
+    )
+    wrapper.plan(
+        qo_indptr,
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        num_qo_heads,
+        num_kv_heads,
+        head_dim,
+        page_size,
+        causal=causal,
+        q_data_type=torch.float32,
+        chunk_size=chunk_size,
+    )
+    o, lse = wrapper.run(q, kv_data, return_lse=True)
+    o_ref, lse_ref = paged_attention_torch(
+        q,
+        kv_data,
+        qo_indptr,
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        causal=causal,
+        chunk_size=chunk_size,
+        return_lse=True,
+    )
+    torch.testing.assert_close(o, o_ref, rtol=1e-4, atol=1e-4)
+    torch.testing.assert_close(lse, lse_ref, rtol=1e-4, atol=1e-4)
+
+
+@pytest.mark.parametrize("kv_layout", ["NHD", "HND"])
+@pytest.mark.parametrize("per_head", [False, True])
+def test_batch_prefill_triton_backend_page_scale(kv_layout, per_head):
+    torch.manual_seed(42)
+    num_qo_heads, num_kv_heads, head_dim, page_size = 4, 2, 32, 16
+    qo_lens = torch.tensor([7, 1, 40])
+    kv_lens = torch.tensor([30, 20, 40])
+    qo_indptr = get_indptr(qo_lens, device=device)
+    kv_data, kv_indptr, kv_indices, kv_last_page_len = make_paged_kv(
+        kv_lens, page_size, num_kv_heads, head_dim, kv_layout, device=device
+    )
+    kv_int8 = (kv_data * 40).round().clamp(-127, 127).to(torch.int8)
+    scale_shape = (kv_data.shape[0], num_kv_heads) if per_head else kv_data.shape[:1]
+    k_scale = torch.rand(scale_shape, device=device) / 40 + 0.01
+    v_scale = torch.rand(scale_shape, device=device) / 40 + 0.01
+    k_ref, v_ref = flashinfer.page._dequantize_paged_kv_cache(
+        kv_int8[:, 0],
+        kv_int8[:, 1],
+        k_scale,
+        v_scale,
+        torch.arange(kv_data.shape[0], device=device),
+        kv_layout,
+        torch.float32,
+    )[:2]
+    q = torch.randn(qo_indptr[-1].item(), num_qo_heads, head_dim, device=device)
+    wrapper = flashinfer.BatchPrefillWithPagedKVCacheWrapper(
+        torch.empty(0, dtype=torch.uint8, device=device),
+        kv_layout=kv_layout,
+        backend="triton",
+    )
+    wrapper.plan(
+        qo_indptr,
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        num_qo_heads,
+        num_kv_heads,
+        head_dim,
+        page_size,
+        causal=True,
+        q_data_type=torch.float32,
+        kv_data_type=torch.int8,
+    )
+    o = wrapper.run(q, kv_int8, k_scale=k_scale, v_scale=v_scale)
+    o_ref = paged_attention_torch(
+        q,
+        (k_ref, v_ref),
+        qo_indptr,
+        kv_indptr,
+        kv_indices,
+        kv_last_page_len,
+        kv_layout=kv_layout,
+    )
+    torch.testing.assert_close(o, o_ref, rtol=1e-4, atol=1e-4)